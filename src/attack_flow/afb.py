@@ -0,0 +1,1596 @@
+"""
+Read Attack Flow Builder (``.afb``) files and export them as STIX bundles.
+
+The Builder saves a flow as a diagram: a list of objects such as blocks, anchors, and
+lines, each created from a template and carrying a list of ``[key, value]`` property
+entries. Its ``AttackFlowPublisher`` turns a diagram into an Attack Flow STIX bundle.
+This module does the same in Python, producing the same objects with the same
+properties in the same order, so that flows can be validated and visualized without
+building and running the Builder's command line tool.
+
+Both file formats are accepted. Attack Flow v3 files are exported directly; legacy v2
+files, which have a top-level ``version``, are first converted to the v3 object model
+the way the Builder does when it opens them.
+
+Objects are generated one at a time by :func:`iter_stix_objects`, and
+:func:`write_bundle` writes them as they are generated, so the whole bundle does not
+have to be built in memory before it is written.
+
+:func:`upgrade_v2` converts a legacy v2 file to the current format, layout included, so
+that it can be saved and opened without being converted again.
+
+A few things necessarily differ from the Builder's output:
+
+* IDs that the Builder generates at random, such as the bundle ID and the IDs of
+  relationships, are random here too, and timestamps are the time of the export.
+* The Builder gives the bundle a ``spec_version`` and timestamps, which STIX 2.1 bundles
+  do not have and which make the STIX library read the bundle as STIX 2.0. They are
+  left out.
+* The Builder looks up the STIX IDs of ATT&CK tactics and techniques in a table that is
+  compiled into it. The same table is read from the Builder's source, in
+  :data:`BUILDER_ATTACK_TABLE`, if the library is run from a checkout of the repository,
+  and otherwise from a copy of it that is packaged with the library, in
+  :data:`PACKAGED_STIX_IDS` (``make stix-ids`` updates the copy). Entries in a mapping
+  passed to ``stix_ids`` take precedence over it, and IDs that v2 of the Builder
+  recorded in a file fill in those that neither of them has.
+"""
+
+from datetime import datetime, timezone
+import functools
+import json
+import logging
+import math
+from pathlib import Path
+import re
+import uuid
+import zoneinfo
+
+import attack_flow.jsonio
+import attack_flow.profiling
+
+logger = logging.getLogger(__name__)
+
+AFB_SUFFIX = ".afb"
+EXTENSION_ID = "fb9c968a-745b-4ade-9b25-c324172197f4"
+EXTENSION_CREATED = "2022-08-02T19:34:35.143Z"
+SCHEMA_URL = (
+    "https://center-for-threat-informed-defense.github.io/attack-flow/stix/"
+    "attack-flow-schema-2.0.0.json"
+)
+# The Builder's table of ATT&CK objects, which includes their STIX IDs.
+BUILDER_ATTACK_TABLE = (
+    Path(__file__).resolve().parents[1]
+    / "attack_flow_builder"
+    / "src"
+    / "assets"
+    / "configuration"
+    / "AttackFlowTemplates"
+    / "MitreAttack.ts"
+)
+# A copy of the Builder's STIX IDs that is packaged with the library.
+PACKAGED_STIX_IDS = Path(__file__).resolve().parent / "attack_stix_ids.json"
+ATTACK_FLOW_SDOS = frozenset(
+    (
+        "attack-flow",
+        "attack-action",
+        "attack-asset",
+        "attack-condition",
+        "attack-operator",
+    )
+)
+TEMPLATE_TYPES = {
+    "flow": "attack-flow",
+    "action": "attack-action",
+    "asset": "attack-asset",
+    "condition": "attack-condition",
+    "OR_operator": "attack-operator",
+    "AND_operator": "attack-operator",
+    "email_address": "email-addr",
+}
+
+# Property descriptors, which mirror the Builder's templates. Each is a tuple whose
+# first item is the kind of property.
+_STRING = ("string",)
+_DATE = ("date",)
+_TTP = ("tuple", ("tactic", "technique", "subtechnique"))
+_INT = ("int", -math.inf, math.inf)
+_COUNT = ("int", 0, math.inf)
+_PORT = ("int", 0, 65535)
+_FLOAT = ("float", -math.inf, math.inf)
+_LATITUDE = ("float", -90, 90)
+_LONGITUDE = ("float", -180, 180)
+_BOOL = ("enum", ("true", "false"))
+_STRINGS = ("list", _STRING)
+_AUTHOR = (
+    "dict",
+    (
+        ("name", _STRING),
+        (
+            "identity_class",
+            (
+                "enum",
+                ("individual", "group", "system", "organization", "class", "unknown"),
+            ),
+        ),
+        ("contact_information", _STRING),
+    ),
+    "name",
+)
+_SCOPE = (
+    "enum",
+    (
+        "incident",
+        "campaign",
+        "threat-actor",
+        "malware",
+        "emulation-plan",
+        "attack-tree",
+        "other",
+    ),
+)
+_EXTERNAL_REFERENCES = (
+    "list",
+    (
+        "dict",
+        (("source_name", _STRING), ("description", _STRING), ("url", _STRING)),
+        "source_name",
+    ),
+)
+_CONFIDENCE_VALUES = {
+    "speculative": 0,
+    "very-doubtful": 10,
+    "doubtful": 30,
+    "even-odds": 50,
+    "probable": 70,
+    "very-probable": 90,
+    "certain": 100,
+}
+_CONFIDENCE = ("enum", tuple(_CONFIDENCE_VALUES))
+_RESULT = ("enum", ("malicious", "suspicious", "benign", "unknown"))
+_OPINION = (
+    "enum",
+    ("strongly-disagree", "disagree", "neutral", "agree", "strongly-agree"),
+)
+_DEFINITION_TYPE = ("enum", ("TLP", "TLP:CLEAR", "statement"))
+_DEFINITION = ("dict", (("statement", _STRING), ("tlp", _STRING)), None)
+_ENCRYPTION_ALGORITHM = (
+    "enum",
+    ("AES-256-GCM", "ChaCha20-Poly1305", "mime-type-indicated"),
+)
+_HASHES = (
+    "list",
+    (
+        "dict",
+        (
+            (
+                "hash_type",
+                (
+                    "enum",
+                    (
+                        "custom",
+                        "md5",
+                        "sha-1",
+                        "sha-256",
+                        "sha-512",
+                        "sha3-256",
+                        "ssdeep",
+                        "tlsh",
+                    ),
+                ),
+            ),
+            ("hash_value", _STRING),
+        ),
+        "hash_value",
+    ),
+)
+_REGISTRY_VALUES = (
+    "list",
+    (
+        "dict",
+        (
+            ("name", _STRING),
+            ("data", _STRING),
+            (
+                "data_type",
+                (
+                    "enum",
+                    (
+                        "REG_NONE",
+                        "REG_SZ",
+                        "REG_EXPAND_SZ",
+                        "REG_BINARY",
+                        "REG_DWORD",
+                        "REG_DWORD_BIG_ENDIAN",
+                        "REG_DWORD_LITTLE_ENDIAN",
+                        "REG_LINK",
+                        "REG_MULTI_SZ",
+                        "REG_RESOURCE_LIST",
+                        "REG_FULL_RESOURCE_DESCRIPTION",
+                        "REG_RESOURCE_REQUIREMENTS_LIST",
+                        "REG_QWORD",
+                        "REG_INVALID_TYPE",
+                    ),
+                ),
+            ),
+        ),
+        "data",
+    ),
+)
+
+#: The properties of each template, in the order the Builder exports them.
+TEMPLATES = {
+    "flow": (
+        ("name", _STRING),
+        ("description", _STRING),
+        ("author", _AUTHOR),
+        ("scope", _SCOPE),
+        ("external_references", _EXTERNAL_REFERENCES),
+        ("created", _DATE),
+    ),
+    "action": (
+        ("name", _STRING),
+        ("ttp", _TTP),
+        ("description", _STRING),
+        ("confidence", _CONFIDENCE),
+        ("execution_start", _DATE),
+        ("execution_end", _DATE),
+    ),
+    "asset": (
+        ("name", _STRING),
+        ("description", _STRING),
+    ),
+    "condition": (
+        ("description", _STRING),
+        ("pattern", _STRING),
+        ("pattern_type", _STRING),
+        ("pattern_version", _STRING),
+        ("date", _DATE),
+    ),
+    "OR_operator": (("operator", _STRING),),
+    "AND_operator": (("operator", _STRING),),
+    "attack_pattern": (
+        ("name", _STRING),
+        ("description", _STRING),
+        ("aliases", _STRINGS),
+        ("kill_chain_phases", _STRINGS),
+    ),
+    "campaign": (
+        ("name", _STRING),
+        ("description", _STRING),
+        ("aliases", _STRINGS),
+        ("first_seen", _DATE),
+        ("last_seen", _DATE),
+        ("objective", _STRING),
+    ),
+    "course_of_action": (
+        ("name", _STRING),
+        ("description", _STRING),
+        ("action_type", _STRING),
+        ("os_execution_envs", _STRINGS),
+        ("action_bin", _STRING),
+    ),
+    "grouping": (
+        ("name", _STRING),
+        ("description", _STRING),
+        ("context", _STRING),
+    ),
+    "identity": (
+        ("name", _STRING),
+        ("description", _STRING),
+        ("roles", _STRINGS),
+        ("identity_class", _STRING),
+        ("sectors", _STRINGS),
+        ("contact_information", _STRING),
+    ),
+    "indicator": (
+        ("name", _STRING),
+        ("description", _STRING),
+        ("indicator_types", _STRINGS),
+        ("pattern", _STRING),
+        ("pattern_type", _STRING),
+        ("pattern_version", _STRING),
+        ("valid_from", _DATE),
+        ("valid_until", _DATE),
+        ("kill_chain_phases", _STRINGS),
+    ),
+    "infrastructure": (
+        ("name", _STRING),
+        ("description", _STRING),
+        ("infrastructure_types", _STRINGS),
+        ("aliases", _STRINGS),
+        ("kill_chain_phases", _STRINGS),
+        ("first_seen", _DATE),
+        ("last_seen", _DATE),
+    ),
+    "intrusion_set": (
+        ("name", _STRING),
+        ("description", _STRING),
+        ("aliases", _STRINGS),
+        ("first_seen", _DATE),
+        ("last_seen", _DATE),
+        ("goals", _STRINGS),
+        ("resource_level", _STRING),
+        ("primary_motivation", _STRING),
+        ("secondary_motivations", _STRINGS),
+    ),
+    "location": (
+        ("name", _STRING),
+        ("description", _STRING),
+        ("latitude", _LATITUDE),
+        ("longitude", _LONGITUDE),
+        ("precision", _FLOAT),
+        ("region", _STRING),
+        ("country", _STRING),
+        ("administrative_area", _STRING),
+        ("city", _STRING),
+        ("street_address", _STRING),
+        ("postal_code", _STRING),
+    ),
+    "malware": (
+        ("name", _STRING),
+        ("description", _STRING),
+        ("malware_types", _STRINGS),
+        ("is_family", _BOOL),
+        ("aliases", _STRINGS),
+        ("kill_chain_phases", _STRINGS),
+        ("first_seen", _DATE),
+        ("last_seen", _DATE),
+        ("os_execution_envs", _STRINGS),
+        ("architecture_execution_envs", _STRINGS),
+        ("implementation_languages", _STRINGS),
+        ("capabilities", _STRINGS),
+    ),
+    "malware_analysis": (
+        ("product", _STRING),
+        ("version", _STRING),
+        ("configuration_version", _STRING),
+        ("modules", _STRINGS),
+        ("analysis_engine_version", _STRING),
+        ("analysis_definition_version", _STRING),
+        ("submitted", _DATE),
+        ("analysis_started", _DATE),
+        ("analysis_ended", _DATE),
+        ("result", _RESULT),
+    ),
+    "note": (
+        ("abstract", _STRING),
+        ("content", _STRING),
+        ("authors", _STRINGS),
+    ),
+    "observed_data": (
+        ("first_observed", _DATE),
+        ("last_observed", _DATE),
+        ("number_observed", _COUNT),
+    ),
+    "opinion": (
+        ("explanation", _STRING),
+        ("authors", _STRINGS),
+        ("opinion", _OPINION),
+    ),
+    "report": (
+        ("name", _STRING),
+        ("description", _STRING),
+        ("report_types", _STRINGS),
+        ("published", _DATE),
+    ),
+    "threat_actor": (
+        ("name", _STRING),
+        ("description", _STRING),
+        ("threat_actor_types", _STRINGS),
+        ("aliases", _STRINGS),
+        ("first_seen", _DATE),
+        ("last_seen", _DATE),
+        ("roles", _STRINGS),
+        ("goals", _STRINGS),
+        ("sophistication", _STRING),
+        ("resource_level", _STRING),
+        ("primary_motivation", _STRING),
+        ("secondary_motivations", _STRINGS),
+        ("personal_motivations", _STRINGS),
+    ),
+    "tool": (
+        ("name", _STRING),
+        ("description", _STRING),
+        ("tool_types", _STRINGS),
+        ("aliases", _STRINGS),
+        ("kill_chain_phases", _STRINGS),
+        ("tool_version", _STRING),
+    ),
+    "vulnerability": (
+        ("name", _STRING),
+        ("description", _STRING),
+    ),
+    "marking_definition": (
+        ("name", _STRING),
+        ("definition_type", _DEFINITION_TYPE),
+        ("definition", _DEFINITION),
+    ),
+    "artifact": (
+        ("mime_type", _STRING),
+        ("payload_bin", _STRING),
+        ("url", _STRING),
+        ("hashes", _HASHES),
+        ("encryption_algorithm", _ENCRYPTION_ALGORITHM),
+        ("decryption_key", _STRING),
+    ),
+    "autonomous_system": (
+        ("number", _INT),
+        ("name", _STRING),
+        ("rir", _STRING),
+    ),
+    "directory": (
+        ("path", _STRING),
+        ("path_enc", _STRING),
+        ("ctime", _DATE),
+        ("mtime", _DATE),
+        ("atime", _DATE),
+    ),
+    "domain_name": (("value", _STRING),),
+    "email_address": (
+        ("value", _STRING),
+        ("display_name", _STRING),
+    ),
+    "email_message": (
+        ("is_multipart", _BOOL),
+        ("date", _STRING),
+        ("content_type", _STRING),
+        ("message_name", _STRING),
+        ("subject", _STRING),
+        ("received_lines", _STRING),
+        ("additional_header_fields", _STRING),
+        ("body", _STRING),
+        ("body_multipart", _STRING),
+    ),
+    "file": (
+        ("name", _STRING),
+        ("name_enc", _STRING),
+        ("size", _INT),
+        ("hashes", _HASHES),
+        ("magic_number_hex", _STRING),
+        ("mime_type", _STRING),
+        ("ctime", _DATE),
+        ("mtime", _DATE),
+        ("atime", _DATE),
+    ),
+    "ipv4_addr": (("value", _STRING),),
+    "ipv6_addr": (("value", _STRING),),
+    "mac_addr": (("value", _STRING),),
+    "mutex": (("name", _STRING),),
+    "network_traffic": (
+        ("start", _DATE),
+        ("end", _DATE),
+        ("is_active", _BOOL),
+        ("src_port", _PORT),
+        ("dst_port", _PORT),
+        ("protocols", _STRINGS),
+        ("src_byte_count", _COUNT),
+        ("dst_byte_count", _COUNT),
+        ("src_packets", _COUNT),
+        ("dst_packets", _COUNT),
+        ("ipfix", _STRING),
+    ),
+    "process": (
+        ("is_hidden", _BOOL),
+        ("pname", _COUNT),
+        ("created_time", _DATE),
+        ("cwd", _STRING),
+        ("command_line", _STRING),
+        ("environment_variables", _STRING),
+    ),
+    "software": (
+        ("name", _STRING),
+        ("cpe", _STRING),
+        ("languages", _STRINGS),
+        ("vendor", _STRING),
+        ("version", _STRING),
+    ),
+    "url": (("value", _STRING),),
+    "user_account": (
+        ("user_name", _STRING),
+        ("credential", _STRING),
+        ("account_login", _STRING),
+        ("account_type", _STRING),
+        ("display_name", _STRING),
+        ("is_service_account", _BOOL),
+        ("is_privileged", _BOOL),
+        ("can_escalate_privs", _BOOL),
+        ("is_disabled", _BOOL),
+        ("account_created", _DATE),
+        ("account_expires", _DATE),
+        ("credential_last_changed", _DATE),
+        ("account_first_login", _DATE),
+        ("account_last_login", _DATE),
+    ),
+    "windows_registry_key": (
+        ("key", _STRING),
+        ("values", _REGISTRY_VALUES),
+        ("modified_time", _DATE),
+        ("number_of_subkeys", _COUNT),
+    ),
+    "x509_certificate": (
+        ("subject", _STRING),
+        ("is_self_signed", _BOOL),
+        ("hashes", _HASHES),
+        ("version", _STRING),
+        ("serial_number", _STRING),
+        ("signature_algorithm", _STRING),
+        ("issuer", _STRING),
+        ("validity_not_before", _DATE),
+        ("validity_not_after", _DATE),
+        ("subject_public_key_algorithm", _STRING),
+        ("subject_public_key_modulus", _STRING),
+        ("subject_public_key_exponent", _COUNT),
+    ),
+}
+
+# Values that a template fills in when a file does not have the property at all.
+_NOW = object()
+_DEFAULTS = {
+    "flow": {"name": "Untitled Document", "scope": "incident", "created": _NOW},
+    "OR_operator": {"operator": "OR"},
+    "AND_operator": {"operator": "AND"},
+}
+
+# A property that is set to a value that cannot be represented, such as an invalid date.
+# The Builder exports it as null.
+_INVALID = object()
+
+# Anchor positions in the order that blocks list them.
+_BLOCK_ANCHORS = (
+    "0",
+    "30",
+    "60",
+    "90",
+    "120",
+    "150",
+    "180",
+    "210",
+    "240",
+    "270",
+    "300",
+    "330",
+)
+_CONDITION_ANCHORS = (
+    "0",
+    "30",
+    "60",
+    "90",
+    "120",
+    "150",
+    "180",
+    "210",
+    "330",
+    "branch:True",
+    "branch:False",
+)
+
+# Legacy v2 files list a block's anchors in a fixed order rather than by position.
+_V2_BLOCK_ANCHORS = (
+    "120",
+    "90",
+    "60",
+    "30",
+    "0",
+    "330",
+    "300",
+    "270",
+    "240",
+    "210",
+    "180",
+    "150",
+)
+_V2_CONDITION_ANCHORS = (
+    "210",
+    "180",
+    "150",
+    "120",
+    "90",
+    "60",
+    "30",
+    "0",
+    "330",
+    "branch:True",
+    "branch:False",
+)
+_V2_TEMPLATES = {"and": "AND_operator", "or": "OR_operator"}
+_V2_POSITION_SET_BY_USER = 0b100000000
+# The grid that the Builder's dark theme snaps positions to.
+_GRID = 5
+
+# The anchor template for each anchor position. Branch anchors are vertical.
+_ANCHOR_TEMPLATES = {
+    "0": "horizontal_anchor",
+    "30": "horizontal_anchor",
+    "60": "vertical_anchor",
+    "90": "vertical_anchor",
+    "120": "vertical_anchor",
+    "150": "horizontal_anchor",
+    "180": "horizontal_anchor",
+    "210": "horizontal_anchor",
+    "240": "vertical_anchor",
+    "270": "vertical_anchor",
+    "300": "vertical_anchor",
+    "330": "horizontal_anchor",
+}
+_V2_ANCHORS = frozenset(("@__builtin__anchor", "true_anchor", "false_anchor"))
+_V2_LATCHES = frozenset(("@__builtin__line_source", "@__builtin__line_target"))
+_V2_LINES = frozenset(
+    ("@__builtin__line_horizontal_elbow", "@__builtin__line_vertical_elbow")
+)
+
+# The characters that JavaScript's String.prototype.trim() removes.
+_JS_WHITESPACE = (
+    "\t\n\v\f\r \xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008"
+    "\u2009\u200a\u2028\u2029\u202f\u205f\u3000\ufeff"
+)
+_JS_INT = re.compile(r"[\s\ufeff]*([+-]?)(0[xX][0-9a-fA-F]+|[0-9]+)")
+_JS_FLOAT = re.compile(
+    r"[\s\ufeff]*[+-]?(Infinity|(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?)"
+)
+
+
+class Node:
+    """
+    A block in a diagram.
+
+    :param str template: the name of the block's template, such as ``action``
+    :param str instance: the block's ID
+    :param properties: the block's property entries, as saved in the file
+    """
+
+    __slots__ = ("template", "instance", "properties", "next")
+
+    def __init__(self, template, instance, properties):
+        self.template = template
+        self.instance = instance
+        self.properties = properties
+        #: The nodes that this node's outgoing lines point to, in anchor order.
+        self.next = list()
+
+    def __repr__(self):
+        return f"Node({self.template!r}, {self.instance!r})"
+
+    @property
+    def stix_type(self):
+        """
+        The type of the STIX object that the node is exported as.
+
+        :rtype: str
+        """
+        return TEMPLATE_TYPES.get(self.template, self.template).replace("_", "-")
+
+    @property
+    def stix_id(self):
+        """
+        The ID of the STIX object that the node is exported as.
+
+        :rtype: str
+        """
+        return f"{self.stix_type}--{self.instance}"
+
+
+class Diagram:
+    """
+    The graph that a Builder file describes.
+
+    :param Node page: the canvas, which holds the flow's own properties
+    :param list[Node] nodes: the blocks on the canvas, in the order they are listed
+    :param list[tuple] edges: ``(source, via, target)`` for each line that connects two
+        blocks, in the order the lines are listed, where ``via`` is the position of the
+        source block's anchor
+    :param dict stix_ids: STIX IDs of ATT&CK tactics and techniques recorded in the file
+    """
+
+    __slots__ = ("page", "nodes", "edges", "stix_ids")
+
+    def __init__(self, page, nodes, edges, stix_ids=None):
+        self.page = page
+        self.nodes = nodes
+        self.edges = edges
+        self.stix_ids = stix_ids or dict()
+
+
+def load_afb(path):
+    """
+    Decode a Builder file.
+
+    :param pathlib.Path path:
+    :rtype: dict
+    """
+    with attack_flow.profiling.span("json.decode"):
+        return attack_flow.jsonio.load_path(path)
+
+
+def is_legacy_v2(doc):
+    """
+    Check whether a decoded Builder file is in the legacy v2 format.
+
+    :param dict doc:
+    :rtype: bool
+    """
+    return "version" in doc
+
+
+def load_afb_bundle(path, stix_ids=None):
+    """
+    Load a Builder file and export it as a STIX bundle.
+
+    :param pathlib.Path path:
+    :param dict stix_ids: STIX IDs of ATT&CK tactics and techniques, by ATT&CK ID
+    :returns: the bundle, as it would be decoded from JSON
+    :rtype: dict
+    :raises ValueError: if the file cannot be exported
+    """
+    doc = load_afb(path)
+    with attack_flow.profiling.span("afb.export"):
+        return afb_to_stix(doc, stix_ids)
+
+
+def afb_to_stix(doc, stix_ids=None):
+    """
+    Export a decoded Builder file as a STIX bundle.
+
+    :param dict doc:
+    :param dict stix_ids: STIX IDs of ATT&CK tactics and techniques, by ATT&CK ID
+    :rtype: dict
+    :raises ValueError: if the file cannot be exported
+    """
+    bundle = _new_bundle()
+    bundle["objects"] = list(iter_stix_objects(doc, stix_ids))
+    return bundle
+
+
+def export_stix(path, output_path=None, stix_ids=None):
+    """
+    Export a Builder file to a STIX bundle file, like the Builder's ``export-stix``
+    command.
+
+    :param pathlib.Path path:
+    :param pathlib.Path output_path: where to write the bundle; by default, next to the
+        Builder file with a ``.json`` suffix
+    :param dict stix_ids: STIX IDs of ATT&CK tactics and techniques, by ATT&CK ID
+    :returns: the path of the bundle file
+    :rtype: pathlib.Path
+    :raises ValueError: if the file cannot be exported
+    """
+    if output_path is None:
+        output_path = path.with_suffix(".json")
+    doc = load_afb(path)
+    with attack_flow.profiling.span("afb.export"):
+        objects = iter_stix_objects(doc, stix_ids)
+        # Export the first object before opening the output, so that a file that
+        # cannot be exported does not leave an empty bundle behind.
+        first = next(objects)
+        with output_path.open("w", encoding="utf8") as out:
+            write_bundle(_chain(first, objects), out)
+    return output_path
+
+
+def write_bundle(objects, out):
+    """
+    Write STIX objects to a file as a bundle, one object at a time.
+
+    The output is formatted like the Builder's, with two spaces of indentation.
+
+    :param objects: iterable of STIX objects, such as from :func:`iter_stix_objects`
+    :param out: a text file
+    """
+    bundle = _new_bundle()
+    out.write("{\n")
+    for key, value in bundle.items():
+        encoded = attack_flow.jsonio.dumps(value)
+        out.write(f"  {attack_flow.jsonio.dumps(key)}: {encoded},\n")
+    out.write('  "objects": [')
+    separator = "\n"
+    for obj in objects:
+        out.write(separator)
+        encoded = attack_flow.jsonio.dumps(obj, indent=2)
+        out.write("    " + encoded.replace("\n", "\n    "))
+        separator = ",\n"
+    out.write("\n  ]\n}" if separator == ",\n" else "]\n}")
+
+
+def iter_stix_objects(doc, stix_ids=None, now=None):
+    """
+    Export a decoded Builder file as STIX objects.
+
+    The objects are generated in the same order as the Builder's: the Attack Flow
+    extension and its author, the flow and its author, one object for each block, and
+    then any relationships.
+
+    :param dict doc:
+    :param dict stix_ids: STIX IDs of ATT&CK tactics and techniques, by ATT&CK ID
+    :param str now: the timestamp for new objects; by default, the current time
+    :returns: generator of dict
+    :raises ValueError: if the file cannot be exported
+    """
+    now = now or _now()
+    diagram = read_diagram(doc)
+    stix_ids = {**diagram.stix_ids, **get_builder_stix_ids(), **(stix_ids or {})}
+    page = diagram.page
+    page_properties = _read_properties(page.template, page.properties)
+    start_refs = _get_start_refs(diagram)
+    embedded, relationships = _embed_references(diagram, now)
+
+    yield _new_extension()
+    yield _new_extension_author()
+    author = _new_object("identity", str(uuid.uuid4()), now)
+    for key, value in page_properties["author"].items():
+        if value is not None:
+            author[key] = value if key == "identity_class" else _trim(value)
+    yield _new_flow(page, page_properties, author["id"], start_refs, now)
+    yield author
+    for node in diagram.nodes:
+        obj = _new_object(node.stix_type, node.instance, now)
+        properties = _read_properties(node.template, node.properties)
+        if obj["type"] == "attack-action":
+            _merge_action(obj, properties, stix_ids)
+        else:
+            _merge_properties(obj, TEMPLATES[node.template], properties)
+        obj.update(embedded[node.instance])
+        yield obj
+    yield from relationships
+
+
+@functools.lru_cache(maxsize=None)
+def get_builder_stix_ids():
+    """
+    Read the STIX IDs of ATT&CK tactics and techniques from the Builder's table.
+
+    The result is cached. If the Builder's source is not available, such as when the
+    library is installed from a package, the copy in :data:`PACKAGED_STIX_IDS` is read
+    instead. If neither is available, a warning is logged and the result is empty.
+
+    :returns: STIX IDs by ATT&CK ID
+    :rtype: dict
+    :raises ValueError: if the table cannot be read
+    """
+    try:
+        source = BUILDER_ATTACK_TABLE.read_text(encoding="utf8")
+    except FileNotFoundError:
+        try:
+            return attack_flow.jsonio.load_path(PACKAGED_STIX_IDS)
+        except FileNotFoundError:
+            logger.warning(
+                "The STIX IDs of ATT&CK tactics and techniques were not found in %s or "
+                "%s; exported actions will not reference them.",
+                BUILDER_ATTACK_TABLE,
+                PACKAGED_STIX_IDS,
+            )
+            return dict()
+    match = re.search(r"\bstixIds\s*:\s*(\{[^}]*\})", source)
+    if match is None:
+        raise ValueError(f"No stixIds table in {BUILDER_ATTACK_TABLE}")
+    return json.loads(match.group(1))
+
+
+def read_diagram(doc):
+    """
+    Read the graph out of a decoded Builder file.
+
+    :param dict doc:
+    :rtype: Diagram
+    :raises ValueError: if the file is malformed
+    """
+    try:
+        objects = _upgrade_v2(doc)["objects"] if is_legacy_v2(doc) else doc["objects"]
+        return _read_objects(objects, _get_recorded_stix_ids(objects))
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Malformed Attack Flow Builder file: {e!r}") from e
+
+
+def _read_objects(objects, stix_ids):
+    """
+    Build a diagram from objects in the v3 format, the way the Builder connects blocks
+    through their anchors, latches, and lines.
+
+    :param list[dict] objects:
+    :param dict stix_ids:
+    :rtype: Diagram
+    """
+    by_instance = {obj["instance"]: obj for obj in objects}
+    children = set()
+    for obj in objects:
+        children.update(obj.get("objects", ()))
+        children.update(obj.get("anchors", dict()).values())
+        children.update(obj.get("latches", ()))
+        children.update(obj.get("handles", ()))
+        children.update((obj.get("source"), obj.get("target")))
+    roots = [obj for obj in objects if obj["instance"] not in children]
+    if not roots or "objects" not in roots[0]:
+        raise ValueError("Page object missing from export.")
+    canvas = roots[0]
+    page = Node(canvas["id"], canvas["instance"], canvas.get("properties"))
+
+    blocks = list()
+    lines = list()
+    for instance in canvas["objects"]:
+        obj = by_instance[instance]
+        if "anchors" in obj:
+            if obj["id"] not in TEMPLATES:
+                raise ValueError(f"Unknown template '{obj['id']}'.")
+            blocks.append(obj)
+        elif "source" in obj or "target" in obj:
+            lines.append(obj)
+
+    nodes = dict()
+    anchors = dict()
+    anchor_of_latch = dict()
+    for block in blocks:
+        nodes[block["instance"]] = Node(
+            block["id"], block["instance"], block.get("properties")
+        )
+        positions = _CONDITION_ANCHORS if block["id"] == "condition" else _BLOCK_ANCHORS
+        block_anchors = anchors[block["instance"]] = list()
+        for position in positions:
+            anchor = by_instance.get(block["anchors"].get(position))
+            if anchor is None:
+                continue
+            latches = anchor.get("latches", ())
+            block_anchors.append((position, anchor["instance"], latches))
+            for latch in latches:
+                anchor_of_latch[latch] = anchor["instance"]
+
+    line_of_latch = dict()
+    edges = dict()
+    for line in lines:
+        line_of_latch[line.get("source")] = line
+        line_of_latch[line.get("target")] = line
+        edges[line["instance"]] = [None, None, None]
+    line_of_latch.pop(None, None)
+    next_edges = {instance: list() for instance in nodes}
+    for block in blocks:
+        node = nodes[block["instance"]]
+        for position, anchor, latches in anchors[node.instance]:
+            for latch in latches:
+                line = line_of_latch.get(latch)
+                if line is None:
+                    continue
+                edge = edges[line["instance"]]
+                if anchor_of_latch.get(line.get("source")) == anchor:
+                    next_edges[node.instance].append(edge)
+                    edge[0] = node
+                    edge[1] = position
+                if anchor_of_latch.get(line.get("target")) == anchor:
+                    edge[2] = node
+    for instance, node in nodes.items():
+        node.next = [edge[2] for edge in next_edges[instance] if edge[2] is not None]
+
+    return Diagram(
+        page,
+        list(nodes.values()),
+        [tuple(edge) for edge in edges.values() if edge[0] and edge[2]],
+        stix_ids,
+    )
+
+
+def upgrade_v2(doc):
+    """
+    Convert a decoded legacy v2 Builder file to the current file format, like the
+    Builder does when it opens one.
+
+    Blocks keep their anchors, which are assigned positions in the v2 order; ``and``
+    and ``or`` blocks become operators; actions get a ``ttp`` property made from their
+    tactic and technique IDs; and positions are rounded to the grid. Only handles that
+    the user moved keep their position. The file's camera location is kept.
+
+    :param dict doc:
+    :returns: the upgraded file, as it would be decoded from JSON
+    :rtype: dict
+    :raises ValueError: if the file is malformed
+    """
+    try:
+        return _upgrade_v2(doc)
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Malformed Attack Flow V2 file: {e!r}") from e
+
+
+def _upgrade_v2(doc):
+    objects = doc["objects"]
+    layout = dict()
+    upgraded = {
+        "schema": "attack_flow_v2",
+        "theme": "dark_theme",
+        "objects": [],
+        "layout": layout,
+        "camera": doc["location"],
+    }
+    by_id = {obj["id"]: obj for obj in objects}
+    by_instance = dict()
+    for obj in objects:
+        template = obj["template"]
+        if template == "flow":
+            new_obj = {
+                "id": template,
+                "instance": obj["id"],
+                "properties": obj["properties"],
+                "objects": obj["children"],
+            }
+            layout[obj["id"]] = _snap_to_grid(obj)
+        elif template in _V2_ANCHORS:
+            # The anchor's ID depends on its position, which is set below.
+            new_obj = {"id": "", "instance": obj["id"], "latches": obj["children"]}
+        elif template in _V2_LATCHES:
+            new_obj = {"id": "generic_latch", "instance": obj["id"]}
+            layout[obj["id"]] = _snap_to_grid(obj)
+        elif template == "@__builtin__line_handle":
+            new_obj = {"id": "generic_handle", "instance": obj["id"]}
+            if obj.get("attrs", 0) & _V2_POSITION_SET_BY_USER:
+                layout[obj["id"]] = _snap_to_grid(obj)
+        elif template in _V2_LINES:
+            new_obj = {
+                "id": "dynamic_line",
+                "instance": obj["id"],
+                "source": "",
+                "target": "",
+                "handles": [],
+            }
+            for child_id in obj["children"]:
+                child_template = by_id.get(child_id, dict()).get("template")
+                if child_template == "@__builtin__line_source":
+                    new_obj["source"] = child_id
+                elif child_template == "@__builtin__line_target":
+                    new_obj["target"] = child_id
+                elif child_template == "@__builtin__line_handle":
+                    new_obj["handles"].append(child_id)
+                else:
+                    raise ValueError("Malformed Attack Flow V2 file.")
+        else:
+            properties = obj["properties"]
+            if template == "action":
+                legacy = dict(properties)
+                ttp = [
+                    [part, legacy.get(f"{part}_id")]
+                    for part in ("tactic", "technique", "subtechnique")
+                ]
+                properties = properties + [["ttp", ttp]]
+            for child_id in obj["children"]:
+                if by_id.get(child_id, dict()).get("template") not in _V2_ANCHORS:
+                    raise ValueError("Malformed Attack Flow V2 file.")
+            if template == "condition":
+                v2_positions, positions = _V2_CONDITION_ANCHORS, _CONDITION_ANCHORS
+            else:
+                v2_positions, positions = _V2_BLOCK_ANCHORS, _BLOCK_ANCHORS
+            anchors = dict(zip(v2_positions, obj["children"]))
+            new_obj = {
+                "id": _V2_TEMPLATES.get(template, template),
+                "instance": obj["id"],
+                "properties": properties,
+                # JavaScript lists numeric keys first, in numeric order.
+                "anchors": {p: anchors[p] for p in positions if p in anchors},
+            }
+            layout[obj["id"]] = _snap_to_grid(obj)
+        by_instance[new_obj["instance"]] = new_obj
+
+    for new_obj in by_instance.values():
+        for position, anchor_id in new_obj.get("anchors", dict()).items():
+            by_instance[anchor_id]["id"] = _ANCHOR_TEMPLATES.get(
+                position, "vertical_anchor"
+            )
+    upgraded["objects"] = list(by_instance.values())
+    return upgraded
+
+
+def _snap_to_grid(obj):
+    """
+    Round a v2 object's position to the nearest point on the grid, rounding halves away
+    from zero.
+
+    :param dict obj:
+    :rtype: list[int]
+    """
+    snapped = list()
+    for axis in ("x", "y"):
+        value = obj[axis]
+        multiple = int(math.floor(abs(value) / _GRID + 0.5)) * _GRID
+        snapped.append(-multiple if value < 0 else multiple)
+    return snapped
+
+
+def _get_recorded_stix_ids(objects):
+    """
+    Collect the STIX IDs of ATT&CK tactics and techniques from actions that were
+    created in v2 of the Builder, which recorded them next to the ATT&CK IDs. The
+    properties are kept when a v2 file is upgraded.
+
+    :param list[dict] objects: objects in the v3 format
+    :returns: STIX IDs by ATT&CK ID
+    :rtype: dict
+    """
+    stix_ids = dict()
+    for obj in objects:
+        if obj["id"] != "action":
+            continue
+        properties = dict(_entries(obj.get("properties")))
+        for part in ("tactic", "technique", "subtechnique"):
+            attack_id = properties.get(f"{part}_id")
+            stix_id = properties.get(f"{part}_ref")
+            if isinstance(attack_id, str) and isinstance(stix_id, str) and stix_id:
+                stix_ids[attack_id] = stix_id
+    return stix_ids
+
+
+def _get_start_refs(diagram):
+    """
+    Find the actions and conditions that no other action or condition leads to.
+
+    :param Diagram diagram:
+    :rtype: list[str]
+    :raises ValueError: if there are none
+    """
+    reachable = dict()
+    for node in diagram.nodes:
+        if node.template not in ("action", "condition"):
+            continue
+        found = reachable[node.stix_id] = list()
+        stack = list(node.next)
+        visited = set()
+        while stack:
+            descendant = stack.pop()
+            if descendant.instance in visited:
+                continue
+            visited.add(descendant.instance)
+            if descendant.template in ("action", "condition"):
+                found.append(descendant.stix_id)
+            else:
+                stack.extend(descendant.next)
+
+    start_refs = dict.fromkeys(reachable)
+    for found in reachable.values():
+        for stix_id in found:
+            start_refs.pop(stix_id, None)
+    if not start_refs:
+        raise ValueError(
+            "Unable to compute start refs -- does the flow contain a cycle?"
+        )
+    return list(start_refs)
+
+
+def _embed_references(diagram, now):
+    """
+    Turn the lines between blocks into references, where the parent's type has a
+    suitable property, and into relationships otherwise.
+
+    :param Diagram diagram:
+    :param str now:
+    :returns: a tuple of the references to add to each node's object, by node
+        instance, and a list of relationships
+    """
+    embedded = {node.instance: dict() for node in diagram.nodes}
+    relationships = list()
+
+    def relate(parent, child):
+        relationships.append(
+            {
+                "type": "relationship",
+                "id": f"relationship--{uuid.uuid4()}",
+                "spec_version": "2.1",
+                "created": now,
+                "modified": now,
+                "relationship_type": "related-to",
+                "source_ref": parent.stix_id,
+                "target_ref": child.stix_id,
+            }
+        )
+
+    def append(refs, key, child):
+        refs.setdefault(key, list()).append(child.stix_id)
+
+    def embed_in_network_traffic(parent, child):
+        parent_refs = embedded[parent.instance]
+        child_refs = embedded[child.instance]
+        if parent.stix_type == "network-traffic" and not parent_refs.get("dst_ref"):
+            parent_refs["dst_ref"] = child.stix_id
+        elif child.stix_type == "network-traffic" and not child_refs.get("src_ref"):
+            child_refs["src_ref"] = parent.stix_id
+        else:
+            relate(parent, child)
+
+    children = {node.instance: list() for node in diagram.nodes}
+    for source, via, target in diagram.edges:
+        children[source.instance].append((target, via))
+
+    effects = ("attack-action", "attack-operator", "attack-condition")
+    containers = ("grouping", "note", "observed-data", "opinion", "report")
+    for parent in diagram.nodes:
+        parent_type = parent.stix_type
+        refs = embedded[parent.instance]
+        for child, via in children[parent.instance]:
+            child_type = child.stix_type
+            if parent_type == "attack-action":
+                if child_type == "process":
+                    if refs.get("command_ref"):
+                        relate(parent, child)
+                    else:
+                        refs["command_ref"] = child.stix_id
+                elif child_type == "attack-asset":
+                    append(refs, "asset_refs", child)
+                elif child_type in effects:
+                    append(refs, "effect_refs", child)
+                else:
+                    relate(parent, child)
+            elif parent_type == "attack-asset":
+                if refs.get("object_ref"):
+                    relate(parent, child)
+                else:
+                    refs["object_ref"] = child.stix_id
+            elif parent_type == "attack-condition":
+                # The Builder only embeds branches under these legacy anchor names, so
+                # the branch:True and branch:False anchors of v3 files become
+                # relationships, as they do there.
+                if child_type in effects and via == "true_anchor":
+                    append(refs, "on_true_refs", child)
+                elif child_type in effects and via == "false_anchor":
+                    append(refs, "on_false_refs", child)
+                else:
+                    relate(parent, child)
+            elif parent_type == "attack-operator":
+                if child_type in effects:
+                    append(refs, "effect_refs", child)
+                else:
+                    relate(parent, child)
+            elif parent_type in ("ipv4-addr", "ipv6-addr", "mac-addr", "domain-name"):
+                if child_type == "network-traffic":
+                    embed_in_network_traffic(parent, child)
+                else:
+                    relate(parent, child)
+            elif parent_type in containers:
+                append(refs, "object_refs", child)
+            elif parent_type == "malware-analysis":
+                append(refs, "analysis_sco_refs", child)
+            elif parent_type == "network-traffic":
+                embed_in_network_traffic(parent, child)
+            else:
+                relate(parent, child)
+    return embedded, relationships
+
+
+def _new_bundle():
+    return {"type": "bundle", "id": f"bundle--{uuid.uuid4()}"}
+
+
+def _new_object(stix_type, instance, now):
+    obj = {
+        "type": stix_type,
+        "id": f"{stix_type}--{instance}",
+        "spec_version": "2.1",
+        "created": now,
+        "modified": now,
+    }
+    if stix_type in ATTACK_FLOW_SDOS:
+        obj["extensions"] = {
+            f"extension-definition--{EXTENSION_ID}": {"extension_type": "new-sdo"}
+        }
+    return obj
+
+
+def _new_extension():
+    obj = _new_object("extension-definition", EXTENSION_ID, EXTENSION_CREATED)
+    obj.update(
+        name="Attack Flow",
+        description="Extends STIX 2.1 with features to create Attack Flows.",
+        created_by_ref=f"identity--{EXTENSION_ID}",
+        schema=SCHEMA_URL,
+        version="2.0.0",
+        extension_types=["new-sdo"],
+        external_references=[
+            {
+                "source_name": "Documentation",
+                "description": "Documentation for Attack Flow",
+                "url": (
+                    "https://center-for-threat-informed-defense.github.io/attack-flow"
+                ),
+            },
+            {
+                "source_name": "GitHub",
+                "description": "Source code repository for Attack Flow",
+                "url": (
+                    "https://github.com/center-for-threat-informed-defense/attack-flow"
+                ),
+            },
+        ],
+    )
+    return obj
+
+
+def _new_extension_author():
+    obj = _new_object("identity", EXTENSION_ID, EXTENSION_CREATED)
+    obj.update(
+        created_by_ref=obj["id"],
+        name="MITRE Center for Threat-Informed Defense",
+        identity_class="organization",
+    )
+    return obj
+
+
+def _new_flow(page, properties, author_id, start_refs, now):
+    flow = _new_object("attack-flow", page.instance, now)
+    flow["created_by_ref"] = author_id
+    flow["start_refs"] = start_refs
+    for key, descriptor in TEMPLATES[page.template]:
+        value = properties[key]
+        if key == "author":
+            continue
+        elif key == "external_references":
+            external_references = [
+                {k: v for k, v in reference.items() if v is not None}
+                for reference in value
+            ]
+            if external_references:
+                flow[key] = external_references
+        elif _is_defined(descriptor, value):
+            flow[key] = _to_stix_value(value)
+    return flow
+
+
+def _merge_action(obj, properties, stix_ids):
+    for key, descriptor in TEMPLATES["action"]:
+        value = properties[key]
+        if key == "ttp":
+            for part, attack_id in value.items():
+                if attack_id:
+                    obj[f"{part}_id"] = attack_id
+                    if attack_id in stix_ids:
+                        obj[f"{part}_ref"] = stix_ids[attack_id]
+        elif not _is_defined(descriptor, value):
+            continue
+        elif key == "confidence":
+            obj[key] = _CONFIDENCE_VALUES[value]
+        elif isinstance(value, str) and descriptor is _STRING:
+            obj[key] = _trim(value)
+        else:
+            obj[key] = _to_stix_value(value)
+
+
+def _merge_properties(obj, descriptors, properties):
+    for key, descriptor in descriptors:
+        value = properties[key]
+        if not _is_defined(descriptor, value):
+            continue
+        kind = descriptor[0]
+        if kind == "dict":
+            raise ValueError("Basic dictionaries cannot contain dictionaries.")
+        elif kind == "enum":
+            obj[key] = value == "true" if value in ("true", "false") else value
+        elif kind == "list" and key == "hashes":
+            hashes = dict()
+            for item in value:
+                if _is_defined(descriptor[1], item):
+                    hash_type = item["hash_type"]
+                    if hash_type is None:
+                        hash_type = "null"
+                    hashes[hash_type] = item["hash_value"]
+            if hashes:
+                obj[key] = hashes
+            # The Builder stops merging a block's properties after its hashes.
+            break
+        elif kind == "list":
+            form = descriptor[1]
+            merged = obj[key] = list()
+            for item in value:
+                if not _is_defined(form, item):
+                    continue
+                elif form[0] == "dict":
+                    merged_item = dict()
+                    _merge_properties(merged_item, form[1], item)
+                    merged.append(merged_item)
+                elif form[0] in ("list", "enum"):
+                    raise ValueError(f"Basic lists cannot contain {form[0]}s.")
+                elif form[0] == "string":
+                    merged.append(_trim(item))
+                else:
+                    merged.append(_to_stix_value(item))
+        elif kind == "string":
+            obj[key] = _trim(value)
+        else:
+            obj[key] = _to_stix_value(value)
+
+
+def _read_properties(template, entries):
+    """
+    Read a block's property entries the way its template does: properties that the
+    template does not define are dropped, missing ones get the template's defaults,
+    and values are converted to the property's type.
+
+    :param str template:
+    :param entries: the property entries saved in the file
+    :returns: values by key, in template order
+    :rtype: dict
+    """
+    try:
+        descriptors = TEMPLATES[template]
+    except KeyError:
+        raise ValueError(f"Unknown template '{template}'.") from None
+    values = dict(_entries(entries))
+    defaults = _DEFAULTS.get(template, dict())
+    return {
+        key: _read_value(descriptor, values.get(key, defaults.get(key)))
+        for key, descriptor in descriptors
+    }
+
+
+def _read_value(descriptor, value):
+    kind = descriptor[0]
+    if kind == "string":
+        return None if value is None else _to_js_string(value)
+    elif kind == "enum":
+        return value if isinstance(value, str) and value in descriptor[1] else None
+    elif kind == "date":
+        return _read_date(value)
+    elif kind in ("int", "float"):
+        return _read_number(value, kind, descriptor[1], descriptor[2])
+    elif kind == "list":
+        return [_read_value(descriptor[1], item) for _, item in _entries(value)]
+    elif kind == "dict":
+        items = dict(_entries(value))
+        return {key: _read_value(form, items.get(key)) for key, form in descriptor[1]}
+    elif kind == "tuple":
+        items = dict(_entries(value))
+        return {
+            key: None if items.get(key) is None else _to_js_string(items[key])
+            for key in descriptor[1]
+        }
+    raise ValueError(f"Unknown property type '{kind}'.")
+
+
+def _is_defined(descriptor, value):
+    kind = descriptor[0]
+    if kind == "list":
+        return len(value) > 0
+    elif kind == "dict":
+        representative = descriptor[2]
+        if representative is None:
+            return False
+        return _is_defined(dict(descriptor[1])[representative], value[representative])
+    elif kind == "tuple":
+        return any(item is not None for item in value.values())
+    return value is not None
+
+
+def _to_stix_value(value):
+    return None if value is _INVALID else value
+
+
+def _entries(value):
+    """
+    Get the ``[key, value]`` entries of a collection property, which may also be saved
+    as an object.
+
+    :param value:
+    :rtype: list[tuple]
+    """
+    if value is None:
+        return []
+    elif isinstance(value, dict):
+        return list(value.items())
+    elif isinstance(value, list):
+        try:
+            return [(key, item) for key, item in value]
+        except (TypeError, ValueError):
+            pass
+    raise ValueError(f"Invalid JSON entries: {value!r}.")
+
+
+def _to_js_string(value):
+    """
+    Convert a value to a string the way JavaScript's template literals do.
+
+    :param value: a decoded JSON value other than null
+    :rtype: str
+    """
+    if isinstance(value, str):
+        return value
+    elif isinstance(value, bool):
+        return "true" if value else "false"
+    elif isinstance(value, int):
+        return str(value)
+    elif isinstance(value, float):
+        if math.isnan(value):
+            return "NaN"
+        elif math.isinf(value):
+            return "Infinity" if value > 0 else "-Infinity"
+        elif value.is_integer() and abs(value) < 1e21:
+            return str(int(value))
+        return repr(value)
+    elif isinstance(value, dict):
+        return "[object Object]"
+    raise ValueError(f"Invalid JSON primitive: {value!r}.")
+
+
+def _read_number(value, kind, low, high):
+    """
+    Read an integer or float property, which the Builder clamps and then rounds to an
+    integer.
+
+    :param value:
+    :param str kind: ``int`` or ``float``, which determines how strings are parsed
+    :param low: the smallest allowed value
+    :param high: the largest allowed value
+    :returns: an int, None, or ``_INVALID``
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        if kind == "int":
+            match = _JS_INT.match(value)
+            number = int(match.group(1) + match.group(2), 0) if match else math.nan
+        else:
+            match = _JS_FLOAT.match(value)
+            number = float(match.group(0).strip(_JS_WHITESPACE)) if match else math.nan
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        number = value
+    else:
+        number = math.nan
+    if isinstance(number, float) and math.isnan(number):
+        return _INVALID
+    number = min(max(number, low), high)
+    if isinstance(number, int):
+        return number
+    if math.isinf(number):
+        return _INVALID
+    return math.floor(number + 0.5)
+
+
+def _read_date(value):
+    """
+    Read a date property, which is saved either as an ISO 8601 string or as an object
+    with a ``time`` and a time ``zone``.
+
+    :param value:
+    :returns: the date in UTC as a STIX timestamp, None, or ``_INVALID``
+    """
+    if value is None:
+        return None
+    elif isinstance(value, str):
+        return _to_timestamp(_parse_iso(value))
+    elif isinstance(value, dict) and "time" in value and "zone" in value:
+        moment = _parse_iso(value["time"])
+        if moment is not None and value["zone"] is not None:
+            # Like the Builder, keep the local time and change the time zone.
+            try:
+                zone = zoneinfo.ZoneInfo(value["zone"])
+            except (zoneinfo.ZoneInfoNotFoundError, TypeError, ValueError):
+                return _INVALID
+            moment = moment.astimezone().replace(tzinfo=zone)
+        return _to_timestamp(moment)
+    return _now()
+
+
+def _parse_iso(text):
+    """
+    :param str text: an ISO 8601 date, which is in the local time zone if it has no
+        offset
+    :returns: an aware datetime, or None if the text is not a date
+    """
+    if not isinstance(text, str):
+        return None
+    try:
+        moment = datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.astimezone()
+    return moment
+
+
+def _to_timestamp(moment):
+    if moment is None:
+        return _INVALID
+    moment = moment.astimezone(timezone.utc)
+    return (
+        f"{moment.year:04d}-{moment.month:02d}-{moment.day:02d}T{moment.hour:02d}:"
+        f"{moment.minute:02d}:{moment.second:02d}.{moment.microsecond // 1000:03d}Z"
+    )
+
+
+def _now():
+    return _to_timestamp(datetime.now(timezone.utc))
+
+
+def _trim(text):
+    return text.strip(_JS_WHITESPACE)
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
@@ -0,0 +1,475 @@
+"""
+Technique statistics across a corpus of Attack Flows.
+
+:class:`TechniqueStats` counts how often each technique follows another in the flows'
+action graphs, and how many flows each pair of techniques appears in together. From
+these it estimates ``P(next technique | current technique)`` and the pointwise mutual
+information (PMI) of two techniques, which can be used to decide which detections to
+build first.
+
+Transitions are counted along the edges of :func:`attack_flow.graph.build_action_graph`,
+like every other per-flow analysis in this library. These are the edges of
+:func:`attack_flow.graph.induce_action_graph` except for those that pass through an
+asset, e.g. an action that targets an asset that a relationship links to a later action.
+An asset is something that actions act on rather than a step of the attack, so those
+edges are not counted as transitions.
+
+The statistics are computed from a :class:`attack_flow.corpus.CorpusStore`, where every
+action graph edge and every action's technique already records the flows that contain it
+as a bitset. Counting the flows that contain a transition, or a pair of techniques, is a
+bitwise AND and a population count over all flows at once instead of a loop over the
+flows. The counts are kept in :class:`SparseMatrix`, which stores only the non-zero
+entries in the compressed sparse row layout that SciPy uses, so that statistics for a
+large corpus can be saved and loaded again quickly.
+"""
+
+from array import array
+import bisect
+import math
+
+import attack_flow.jsonio
+import attack_flow.profiling
+
+# Increment when the format of saved statistics changes.
+STATS_FORMAT = 1
+LEVELS = ("technique", "parent", "tactic")
+
+
+class SparseMatrix:
+    """
+    A square matrix indexed by labels, which stores only its non-zero entries.
+
+    The entries of row ``i`` are at positions ``offsets[i]`` to ``offsets[i + 1]`` of
+    ``columns`` and ``values``, sorted by column. Create one with :meth:`from_dict`.
+
+    :param list[str] labels: the row and column labels, sorted
+    :param array offsets:
+    :param array columns:
+    :param array values: integers or floats
+    """
+
+    def __init__(self, labels, offsets, columns, values):
+        self.labels = labels
+        self.offsets = offsets
+        self.columns = columns
+        self.values = values
+        self._index = {label: i for i, label in enumerate(labels)}
+
+    @classmethod
+    def from_dict(cls, entries, labels=()):
+        """
+        Create a matrix from its entries.
+
+        :param dict entries: maps ``(row_label, column_label)`` to a number; zeros are
+            left out
+        :param labels: labels to include even if they have no entries
+        :rtype: SparseMatrix
+        """
+        label_set = set(labels)
+        for row, column in entries:
+            label_set.add(row)
+            label_set.add(column)
+        labels = sorted(label_set)
+        index = {label: i for i, label in enumerate(labels)}
+
+        cells = sorted(
+            (index[row], index[column], value)
+            for (row, column), value in entries.items()
+            if value
+        )
+        typecode = "q" if all(isinstance(cell[2], int) for cell in cells) else "d"
+        offsets = array("q", bytes(8 * (len(labels) + 1)))
+        for row, _, _ in cells:
+            offsets[row + 1] += 1
+        for i in range(len(labels)):
+            offsets[i + 1] += offsets[i]
+        columns = array("l", (cell[1] for cell in cells))
+        values = array(typecode, (cell[2] for cell in cells))
+        return cls(labels, offsets, columns, values)
+
+    @classmethod
+    def from_json(cls, matrix_json):
+        """
+        :param dict matrix_json: the result of :meth:`to_json`
+        :rtype: SparseMatrix
+        """
+        return cls(
+            matrix_json["labels"],
+            array("q", matrix_json["offsets"]),
+            array("l", matrix_json["columns"]),
+            array(matrix_json["typecode"], matrix_json["values"]),
+        )
+
+    def to_json(self):
+        """
+        :returns: a JSON-serializable dict
+        :rtype: dict
+        """
+        return {
+            "labels": self.labels,
+            "typecode": self.values.typecode,
+            "offsets": self.offsets.tolist(),
+            "columns": self.columns.tolist(),
+            "values": self.values.tolist(),
+        }
+
+    def __contains__(self, label):
+        return label in self._index
+
+    @property
+    def nnz(self):
+        """
+        The number of non-zero entries.
+
+        :rtype: int
+        """
+        return len(self.values)
+
+    def get(self, row, column, default=0):
+        """
+        :param str row: a label
+        :param str column: a label
+        :param default: the value to return for an entry that is not stored
+        :returns: the entry
+        """
+        row_index = self._index.get(row)
+        column_index = self._index.get(column)
+        if row_index is None or column_index is None:
+            return default
+        start, end = self.offsets[row_index], self.offsets[row_index + 1]
+        position = bisect.bisect_left(self.columns, column_index, start, end)
+        if position < end and self.columns[position] == column_index:
+            return self.values[position]
+        return default
+
+    def row(self, label):
+        """
+        :param str label:
+        :returns: the non-zero entries of the row, by column label
+        :rtype: dict
+        """
+        row_index = self._index.get(label)
+        if row_index is None:
+            return {}
+        start, end = self.offsets[row_index], self.offsets[row_index + 1]
+        return {
+            self.labels[self.columns[position]]: self.values[position]
+            for position in range(start, end)
+        }
+
+    def row_sum(self, label):
+        """
+        :param str label:
+        :returns: the sum of the row's entries
+        """
+        row_index = self._index.get(label)
+        if row_index is None:
+            return 0
+        start, end = self.offsets[row_index], self.offsets[row_index + 1]
+        return sum(self.values[start:end])
+
+    def items(self):
+        """
+        :returns: generator of ``(row_label, column_label, value)`` tuples for the
+            non-zero entries, by row and then column
+        """
+        labels = self.labels
+        for row_index, row in enumerate(labels):
+            for position in range(self.offsets[row_index], self.offsets[row_index + 1]):
+                yield row, labels[self.columns[position]], self.values[position]
+
+    def to_dict(self):
+        """
+        :returns: the non-zero entries, keyed by ``(row_label, column_label)``
+        :rtype: dict
+        """
+        return {(row, column): value for row, column, value in self.items()}
+
+    def to_scipy(self):
+        """
+        Convert the matrix to a SciPy sparse array, whose rows and columns are in the
+        order of :attr:`labels`. This requires NumPy and SciPy, which are not
+        dependencies of this library.
+
+        :rtype: scipy.sparse.csr_array
+        """
+        import numpy
+        import scipy.sparse
+
+        size = len(self.labels)
+        return scipy.sparse.csr_array(
+            (
+                numpy.asarray(self.values),
+                numpy.asarray(self.columns),
+                numpy.asarray(self.offsets),
+            ),
+            shape=(size, size),
+        )
+
+
+class TechniqueStats:
+    """
+    Transition and co-occurrence counts for the techniques in a corpus of flows.
+
+    Actions are labeled by their technique, by their parent technique (so that
+    subtechniques count towards the technique they belong to), or by their tactic,
+    according to ``level``. Actions without a label are left out.
+
+    :param str level: one of :data:`LEVELS`
+    :param int flow_count: the number of flows in the corpus
+    :param SparseMatrix transitions: entry ``(a, b)`` is the number of action graph
+        edges from an action labeled ``a`` to an action labeled ``b``, summed over the
+        flows
+    :param SparseMatrix cooccurrence: entry ``(a, b)`` is the number of flows that
+        contain both ``a`` and ``b``; entry ``(a, a)`` is the number of flows that
+        contain ``a``
+    """
+
+    def __init__(self, level, flow_count, transitions, cooccurrence):
+        self.level = level
+        self.flow_count = flow_count
+        self.transitions = transitions
+        self.cooccurrence = cooccurrence
+
+    @classmethod
+    def from_store(cls, store, level="technique"):
+        """
+        Compute the statistics for the flows in a store.
+
+        :param attack_flow.corpus.CorpusStore store:
+        :param str level: one of :data:`LEVELS`
+        :rtype: TechniqueStats
+        """
+        property_name, get_label = _get_labeler(level)
+        with attack_flow.profiling.span("analytics.stats"):
+            # Flows can disagree about a shared action's technique, so each action's
+            # labels are kept with the bitset of the flows that give it each label.
+            actions = {
+                node_id: flows
+                for node_type, node_id, flows in store.iter_labels("node_type")
+                if node_type == "attack-action"
+            }
+            node_labels = dict()
+            label_flows = dict()
+            for value, node_id, flows in store.iter_labels(property_name):
+                flows &= actions.get(node_id, 0)
+                if not flows:
+                    continue
+                label = get_label(value)
+                labels = node_labels.setdefault(node_id, dict())
+                labels[label] = labels.get(label, 0) | flows
+                label_flows[label] = label_flows.get(label, 0) | flows
+
+            transitions = dict()
+            for source, target, flows in store.iter_action_edges():
+                source_labels = node_labels.get(source)
+                target_labels = node_labels.get(target)
+                if source_labels is None or target_labels is None:
+                    continue
+                for source_label, source_flows in source_labels.items():
+                    for target_label, target_flows in target_labels.items():
+                        count = (flows & source_flows & target_flows).bit_count()
+                        if count:
+                            key = (source_label, target_label)
+                            transitions[key] = transitions.get(key, 0) + count
+
+            cooccurrence = dict()
+            sorted_labels = sorted(label_flows)
+            for i, label in enumerate(sorted_labels):
+                flows = label_flows[label]
+                cooccurrence[label, label] = flows.bit_count()
+                for other in sorted_labels[i + 1 :]:
+                    count = (flows & label_flows[other]).bit_count()
+                    if count:
+                        cooccurrence[label, other] = count
+                        cooccurrence[other, label] = count
+
+            stats = cls(
+                level,
+                len(store),
+                SparseMatrix.from_dict(transitions, sorted_labels),
+                SparseMatrix.from_dict(cooccurrence, sorted_labels),
+            )
+        attack_flow.profiling.count("analytics.labels", len(sorted_labels))
+        return stats
+
+    @classmethod
+    def from_files(cls, paths, level="technique"):
+        """
+        Compute the statistics for some Attack Flow files.
+
+        :param list[Path] paths: ``.json`` or ``.afb`` files
+        :param str level: one of :data:`LEVELS`
+        :rtype: TechniqueStats
+        """
+        import attack_flow.corpus
+
+        store = attack_flow.corpus.CorpusStore()
+        for path in paths:
+            store.add_file(path)
+        return cls.from_store(store, level)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load statistics that were saved with :meth:`save`.
+
+        :param Path path:
+        :rtype: TechniqueStats
+        :raises ValueError: if the file was saved in a different format
+        """
+        stats_json = attack_flow.jsonio.load_path(path)
+        if not isinstance(stats_json, dict) or stats_json.get("format") != STATS_FORMAT:
+            raise ValueError(
+                f"Not technique statistics in format {STATS_FORMAT}: {path}"
+            )
+        return cls(
+            stats_json["level"],
+            stats_json["flow_count"],
+            SparseMatrix.from_json(stats_json["transitions"]),
+            SparseMatrix.from_json(stats_json["cooccurrence"]),
+        )
+
+    def save(self, path):
+        """
+        Save the statistics to a JSON file.
+
+        :param Path path:
+        """
+        stats_json = {
+            "format": STATS_FORMAT,
+            "level": self.level,
+            "flow_count": self.flow_count,
+            "transitions": self.transitions.to_json(),
+            "cooccurrence": self.cooccurrence.to_json(),
+        }
+        attack_flow.jsonio.dump_path(stats_json, path)
+
+    def flow_frequency(self, label):
+        """
+        :param str label:
+        :returns: the number of flows that contain the label
+        :rtype: int
+        """
+        return self.cooccurrence.get(label, label)
+
+    def transition_probability(self, current, following):
+        """
+        Estimate the probability that an action labeled ``current`` is followed by an
+        action labeled ``following``, from the share of the transitions out of
+        ``current`` that go to ``following``.
+
+        :param str current:
+        :param str following:
+        :returns: a probability, or 0.0 if ``current`` is never followed by anything
+        :rtype: float
+        """
+        total = self.transitions.row_sum(current)
+        if not total:
+            return 0.0
+        return self.transitions.get(current, following) / total
+
+    def next_labels(self, current, limit=None):
+        """
+        List what follows a label, most likely first.
+
+        :param str current:
+        :param int limit: the maximum number of labels to return
+        :returns: a list of ``(label, probability)`` tuples; ties are sorted by label
+        :rtype: list[tuple[str, float]]
+        """
+        row = self.transitions.row(current)
+        total = sum(row.values())
+        ranked = sorted(row.items(), key=lambda item: (-item[1], item[0]))
+        return [(label, count / total) for label, count in ranked[:limit]]
+
+    def pmi(self, label, other, normalized=False):
+        """
+        Compute the pointwise mutual information of two labels appearing in the same
+        flow: ``log(P(a, b) / (P(a) * P(b)))``, where each probability is a share of the
+        flows.
+
+        :param str label:
+        :param str other:
+        :param bool normalized: divide by ``-log(P(a, b))``, which scales the result to
+            the range -1 to 1
+        :returns: the PMI, or negative infinity if the labels never appear together
+        :rtype: float
+        """
+        return _pmi(
+            self.cooccurrence.get(label, other),
+            self.flow_frequency(label),
+            self.flow_frequency(other),
+            self.flow_count,
+            normalized,
+        )
+
+    def pmi_matrix(self, normalized=False):
+        """
+        Compute the PMI of every pair of different labels that appear together in at
+        least one flow.
+
+        :param bool normalized: see :meth:`pmi`
+        :rtype: SparseMatrix
+        """
+        entries = dict()
+        for label, other, count in self.cooccurrence.items():
+            if label == other:
+                continue
+            entries[label, other] = _pmi(
+                count,
+                self.flow_frequency(label),
+                self.flow_frequency(other),
+                self.flow_count,
+                normalized,
+            )
+        # A PMI of exactly zero is not stored, and reads back as zero.
+        return SparseMatrix.from_dict(
+            {key: float(value) for key, value in entries.items()},
+            self.cooccurrence.labels,
+        )
+
+
+def parent_technique(technique_id):
+    """
+    :param str technique_id: a technique or subtechnique ID, such as ``T1059.001``
+    :returns: the ID of the technique, such as ``T1059``
+    :rtype: str
+    """
+    return technique_id.split(".", 1)[0]
+
+
+def _get_labeler(level):
+    """
+    :param str level: one of :data:`LEVELS`
+    :returns: the name of the node property that the labels are made from, and a
+        function that makes a label from a value of that property
+    :rtype: tuple
+    :raises ValueError: for an unknown level
+    """
+    if level == "technique":
+        return "technique_id", lambda value: value
+    if level == "parent":
+        return "technique_id", parent_technique
+    if level == "tactic":
+        return "tactic_id", lambda value: value
+    raise ValueError(f"Unknown level: {level} (expected one of {', '.join(LEVELS)})")
+
+
+def _pmi(count, label_count, other_count, flow_count, normalized):
+    """
+    :param int count: the number of flows with both labels
+    :param int label_count: the number of flows with the first label
+    :param int other_count: the number of flows with the second label
+    :param int flow_count: the number of flows
+    :param bool normalized:
+    :rtype: float
+    """
+    if not count:
+        return -math.inf
+    pmi = math.log(count * flow_count / (label_count * other_count))
+    if normalized:
+        joint = count / flow_count
+        # Labels that are in every flow are independent of everything.
+        return pmi / -math.log(joint) if joint < 1 else 0.0
+    return pmi
@@ -0,0 +1,570 @@
+"""
+Evaluate attack trees.
+
+An attack tree is a flow in the ``attack-tree`` scope. Its leaves are the actions that
+nothing leads to, and every other action or operator is a goal that its inputs, the
+actions and operators with effect edges to it, achieve. An ``AND`` operator needs all of
+its inputs and an ``OR`` operator needs one of them. An action with inputs is achieved
+by any one of them, so an action with a single operator as its input works like that
+operator. The root is the goal that leads nowhere. Only the leaves' properties, such as
+their ``confidence``, are used.
+
+Trees often share subtrees, so they are really directed acyclic graphs, and evaluating
+every subtree independently would count a shared leaf more than once and take time
+exponential in the number of shared subtrees. Instead, the goals are evaluated once
+each, from the leaves up, into decision diagrams over the leaves that share equal
+subexpressions:
+
+* a reduced ordered binary decision diagram (BDD) of the root's boolean function, which
+  gives the exact probability that the root is achieved when the leaves succeed
+  independently, and
+* a zero-suppressed decision diagram (ZDD) of the root's minimal cut sets, the minimal
+  sets of leaves that achieve the root, built from the BDD with Rauzy's algorithm. The
+  number of cut sets can grow exponentially, but the ZDD usually stays small, and the
+  cheapest cut set and the number of cut sets are computed from it without listing them.
+
+Every diagram operation is memoized and runs on an explicit stack, so trees with
+thousands of leaves do not hit Python's recursion limit.
+"""
+
+import math
+
+import attack_flow.flowgraph
+import attack_flow.profiling
+from attack_flow.paths import DEFAULT_CONFIDENCE
+
+OPERATORS = ("AND", "OR")
+TREE_NODE_TYPES = ("attack-action", "attack-operator")
+# The terminal nodes of both kinds of decision diagram: false or the empty family, and
+# true or the family that holds only the empty set.
+_FALSE = 0
+_TRUE = 1
+
+
+def confidence_probability(obj):
+    """
+    The probability that a leaf succeeds: its confidence, on the 0 to 100 scale of
+    :func:`attack_flow.model.confidence_num_to_label`, divided by 100.
+
+    :param dict obj: a STIX object, or None for an object that is not defined
+    :rtype: float
+    :raises ValueError: if the confidence is not between 0 and 100
+    """
+    if obj is None:
+        return DEFAULT_CONFIDENCE / 100
+    confidence = obj.get("confidence", DEFAULT_CONFIDENCE)
+    if not 0 <= confidence <= 100:
+        raise ValueError("Confidence number must be between 0 and 100 inclusive.")
+    return confidence / 100
+
+
+def unit_cost(obj):
+    """
+    The cost of a leaf when costs are not known: every leaf costs 1, so the cheapest cut
+    set is the smallest one.
+
+    :param dict obj: a STIX object, or None for an object that is not defined
+    :rtype: int
+    """
+    return 1
+
+
+class AttackTree:
+    """
+    Evaluate the root of one attack tree.
+
+    The tree's diagrams are built when it is created, so create one for each tree and
+    reuse it for every query. Their size depends on the tree's shape: trees and shared
+    subtrees take about one node for each leaf, but leaves that are shared by distant
+    parts of a tree can make them much larger, since the exact probability of such a
+    tree is hard to compute.
+
+    :param attack_flow.flowgraph.FlowGraph flow_graph:
+    :param str root: the ID of the goal to evaluate; by default, the only action or
+        operator that leads nowhere
+    :param probability: a function that takes a leaf's STIX object, or None for an
+        object that is not defined, and returns the probability that it succeeds; by
+        default, :func:`confidence_probability`
+    :param cost: a function that takes a leaf's STIX object, or None, and returns the
+        non-negative cost of carrying it out; by default, :func:`unit_cost`
+    :raises ValueError: if the root is ambiguous or not in the tree, if the tree has a
+        cycle, or if an operator is not ``AND`` or ``OR``
+    """
+
+    def __init__(
+        self, flow_graph, root=None, probability=confidence_probability, cost=unit_cost
+    ):
+        with attack_flow.profiling.span("attacktree.index"):
+            self._graph = flow_graph
+            inputs, operators = _tree_inputs(flow_graph)
+            self._root = _find_root(flow_graph, inputs, root)
+            order = _topological_order(self._root, inputs)
+            # Number the leaves nearest the root first. Goals are built after their
+            # inputs, so their leaves' decisions go above the diagrams that are
+            # already built instead of rebuilding them below.
+            self._leaves = [node for node in order if not inputs[node]]
+            self._leaves.reverse()
+            objects = [flow_graph.node(flow_graph.node_id(n)) for n in self._leaves]
+            self._probabilities = [probability(obj) for obj in objects]
+            for p in self._probabilities:
+                if not 0 <= p <= 1:
+                    raise ValueError("Probability must be between 0 and 1 inclusive.")
+            self._costs = [cost(obj) for obj in objects]
+            if any(c < 0 for c in self._costs):
+                raise ValueError("Cost must not be negative.")
+
+        with attack_flow.profiling.span("attacktree.bdd"):
+            self._bdd = _BDD(len(self._leaves))
+            variables = {leaf: i for i, leaf in enumerate(self._leaves)}
+            functions = dict()
+            for node in order:
+                if not inputs[node]:
+                    functions[node] = self._bdd.variable(variables[node])
+                    continue
+                combine = self._bdd.conjoin
+                if operators.get(node) != "AND":
+                    combine = self._bdd.disjoin
+                function = functions[inputs[node][0]]
+                for child in inputs[node][1:]:
+                    function = combine(function, functions[child])
+                functions[node] = function
+            self._function = functions[self._root]
+
+        with attack_flow.profiling.span("attacktree.zdd"):
+            self._zdd = _ZDD(len(self._leaves))
+            self._cut_sets = _minimal_solutions(self._bdd, self._zdd, self._function)
+
+    @classmethod
+    def from_bundle(
+        cls, flow_bundle, root=None, probability=confidence_probability, cost=unit_cost
+    ):
+        """
+        Create an evaluator for a STIX bundle.
+
+        :param stix2.Bundle flow_bundle: or a decoded bundle, or a record bundle
+        :param str root: see :class:`AttackTree`
+        :param probability: see :class:`AttackTree`
+        :param cost: see :class:`AttackTree`
+        :rtype: AttackTree
+        """
+        flow_graph = attack_flow.flowgraph.FlowGraph.from_bundle(flow_bundle)
+        return cls(flow_graph, root, probability, cost)
+
+    @property
+    def root_ref(self):
+        """
+        The ID of the goal that is evaluated.
+
+        :rtype: str
+        """
+        return self._graph.node_id(self._root)
+
+    @property
+    def leaf_refs(self):
+        """
+        The IDs of the leaves below the root, in the order of the diagrams' variables.
+
+        :rtype: list[str]
+        """
+        return [self._graph.node_id(leaf) for leaf in self._leaves]
+
+    def probability(self):
+        """
+        The exact probability that the root is achieved, if every leaf succeeds
+        independently with its own probability. A leaf below several goals is only
+        counted once.
+
+        :rtype: float
+        """
+        probabilities = self._probabilities
+
+        def visit(node):
+            var, low, high = self._bdd.node(node)
+            p = probabilities[var]
+            return (1 - p) * (yield low) + p * (yield high)
+
+        memo = {_FALSE: 0.0, _TRUE: 1.0}
+        return _evaluate(visit, self._function, memo)
+
+    def min_cost(self):
+        """
+        Find the cheapest way to achieve the root.
+
+        :returns: a tuple of the lowest total cost of a cut set and the IDs of the
+            leaves in a cut set with that cost
+        :rtype: tuple
+        """
+        costs = self._costs
+
+        def visit(node):
+            var, low, high = self._zdd.node(node)
+            return min((yield low), costs[var] + (yield high))
+
+        memo = {_FALSE: math.inf, _TRUE: 0}
+        total = _evaluate(visit, self._cut_sets, memo)
+        leaves = list()
+        node = self._cut_sets
+        while node != _TRUE:
+            var, low, high = self._zdd.node(node)
+            if memo[low] == memo[node]:
+                node = low
+            else:
+                leaves.append(var)
+                node = high
+        return total, [self._graph.node_id(self._leaves[var]) for var in leaves]
+
+    def count_cut_sets(self):
+        """
+        Count the minimal cut sets without listing them.
+
+        :rtype: int
+        """
+
+        def visit(node):
+            _, low, high = self._zdd.node(node)
+            return (yield low) + (yield high)
+
+        return _evaluate(visit, self._cut_sets, {_FALSE: 0, _TRUE: 1})
+
+    def iter_cut_sets(self, max_size=None):
+        """
+        Generate the minimal cut sets: the sets of leaves that achieve the root when
+        they all succeed, and none of whose subsets do.
+
+        :param int max_size: if given, skip the cut sets with more leaves than this
+        :returns: generator of lists of leaf IDs, in the order of :attr:`leaf_refs`
+        """
+        names = [self._graph.node_id(leaf) for leaf in self._leaves]
+        work = [(self._cut_sets, ())]
+        while work:
+            node, chosen = work.pop()
+            if node == _TRUE:
+                yield [names[var] for var in chosen]
+                continue
+            if node == _FALSE:
+                continue
+            var, low, high = self._zdd.node(node)
+            work.append((low, chosen))
+            if max_size is None or len(chosen) < max_size:
+                work.append((high, chosen + (var,)))
+
+    def diagram_sizes(self):
+        """
+        The number of decision nodes in the BDD of the root and the ZDD of its cut sets,
+        which bound the work that queries do.
+
+        :rtype: tuple[int, int]
+        """
+        return _reachable(self._bdd, self._function), _reachable(
+            self._zdd, self._cut_sets
+        )
+
+
+def _tree_inputs(flow_graph):
+    """
+    Find the inputs of every action and operator.
+
+    :param attack_flow.flowgraph.FlowGraph flow_graph:
+    :returns: a tuple of a dict from the index of every action and operator to the
+        indexes of its inputs, without duplicates, and a dict from the index of every
+        operator to its operator
+    :rtype: tuple[dict[int, list[int]], dict[int, str]]
+    """
+    inputs = dict()
+    operators = dict()
+    for node_type in TREE_NODE_TYPES:
+        for node_id in flow_graph.nodes_of_type(node_type):
+            node = flow_graph.index(node_id)
+            inputs[node] = list()
+            if node_type == "attack-operator":
+                operator = flow_graph.node(node_id).get("operator")
+                if operator not in OPERATORS:
+                    raise ValueError(f"Unknown operator {operator!r} on {node_id}.")
+                operators[node] = operator
+
+    effect = flow_graph.edge_type_code("effect")
+    for source in sorted(inputs):
+        targets = flow_graph.successor_indices(source)
+        codes = flow_graph.edge_type_indices(source)
+        for target, code in zip(targets, codes):
+            if code == effect and target in inputs and source not in inputs[target]:
+                inputs[target].append(source)
+    return inputs, operators
+
+
+def _find_root(flow_graph, inputs, root):
+    """
+    :returns: the index of the root
+    :rtype: int
+    """
+    if root is not None:
+        if root not in flow_graph or flow_graph.index(root) not in inputs:
+            raise ValueError(f"The root {root} is not an action or operator.")
+        return flow_graph.index(root)
+    has_output = {child for children in inputs.values() for child in children}
+    roots = [node for node in sorted(inputs) if node not in has_output]
+    if len(roots) != 1:
+        raise ValueError(
+            f"The tree has {len(roots)} goals that lead nowhere; choose a root."
+        )
+    return roots[0]
+
+
+def _topological_order(root, inputs):
+    """
+    Order the nodes below the root so that every node comes after its inputs.
+
+    The nodes come in the order that a depth-first search from the root finishes them,
+    so the leaves of a subtree are next to each other, which keeps the diagrams small.
+
+    :returns: the indexes of the nodes
+    :rtype: list[int]
+    :raises ValueError: if the nodes below the root have a cycle
+    """
+    order = list()
+    state = {root: False}
+    work = [(root, iter(inputs[root]))]
+    while work:
+        node, children = work[-1]
+        for child in children:
+            if child not in state:
+                state[child] = False
+                work.append((child, iter(inputs[child])))
+                break
+            if not state[child]:
+                raise ValueError("The tree has a cycle.")
+        else:
+            work.pop()
+            state[node] = True
+            order.append(node)
+    return order
+
+
+def _evaluate(visit, node, memo):
+    """
+    Evaluate a recursive function of a diagram node without recursion.
+
+    ``visit`` is a generator function that yields the nodes whose values it needs and
+    returns the node's value. Values are memoized, so each node is visited once.
+
+    :param visit: a generator function that takes a node
+    :param node: the node to evaluate
+    :param dict memo: values that are already known, such as those of the terminals
+    :returns: the value of ``node``
+    """
+    if node in memo:
+        return memo[node]
+    work = [(node, visit(node))]
+    value = None
+    while work:
+        key, frame = work[-1]
+        try:
+            request = frame.send(value)
+        except StopIteration as stop:
+            memo[key] = value = stop.value
+            work.pop()
+            continue
+        if request in memo:
+            value = memo[request]
+        else:
+            work.append((request, visit(request)))
+            value = None
+    return memo[node]
+
+
+def _reachable(diagram, node):
+    """
+    :returns: the number of decision nodes reachable from ``node``
+    :rtype: int
+    """
+    seen = set()
+    work = [node]
+    while work:
+        node = work.pop()
+        if node in seen or node in (_FALSE, _TRUE):
+            continue
+        seen.add(node)
+        _, low, high = diagram.node(node)
+        work.extend((low, high))
+    return len(seen)
+
+
+class _Diagram:
+    """
+    The nodes of a decision diagram, shared between all of the functions that it
+    stores.
+
+    Nodes are integers. ``0`` and ``1`` are the terminals, and every other node is a
+    decision on a variable with a ``low`` child for when the variable is false or absent
+    and a ``high`` child for when it is true or present. A unique table makes equal
+    nodes the same integer, so equal subexpressions are stored once and can be
+    memoized by node.
+
+    :param int variable_count: variables are numbered from 0, in the order that they
+        are decided on
+    """
+
+    __slots__ = ("variable_count", "_vars", "_lows", "_highs", "_unique")
+
+    def __init__(self, variable_count):
+        self.variable_count = variable_count
+        # The terminals decide on no variable, so they sort after every variable.
+        self._vars = [variable_count, variable_count]
+        self._lows = [_FALSE, _TRUE]
+        self._highs = [_FALSE, _TRUE]
+        self._unique = dict()
+
+    def node(self, node):
+        """
+        :returns: a tuple of the node's variable, low child, and high child
+        :rtype: tuple[int, int, int]
+        """
+        return self._vars[node], self._lows[node], self._highs[node]
+
+    def _make(self, var, low, high):
+        key = (var, low, high)
+        node = self._unique.get(key)
+        if node is None:
+            node = self._unique[key] = len(self._vars)
+            self._vars.append(var)
+            self._lows.append(low)
+            self._highs.append(high)
+        return node
+
+    def _cofactors(self, node, var):
+        """
+        :returns: the node's low and high children if it decides on ``var``, or the
+            node itself twice if it doesn't depend on ``var``
+        """
+        if self._vars[node] == var:
+            return self._lows[node], self._highs[node]
+        return node, node
+
+
+class _BDD(_Diagram):
+    """
+    A reduced ordered binary decision diagram: a node that has equal children is
+    skipped.
+    """
+
+    __slots__ = ("_and_memo", "_or_memo")
+
+    def __init__(self, variable_count):
+        super().__init__(variable_count)
+        self._and_memo = dict()
+        self._or_memo = dict()
+
+    def make(self, var, low, high):
+        if low == high:
+            return low
+        return self._make(var, low, high)
+
+    def variable(self, var):
+        """
+        :returns: the function that is true when ``var`` is
+        """
+        return self.make(var, _FALSE, _TRUE)
+
+    def conjoin(self, f, g):
+        """
+        :returns: the function that is true when ``f`` and ``g`` are
+        """
+        return self._apply(f, g, _FALSE, _TRUE, self._and_memo)
+
+    def disjoin(self, f, g):
+        """
+        :returns: the function that is true when ``f`` or ``g`` is
+        """
+        return self._apply(f, g, _TRUE, _FALSE, self._or_memo)
+
+    def _apply(self, f, g, absorbing, identity, memo):
+        def visit(pair):
+            f, g = pair
+            if f == absorbing or g == absorbing:
+                return absorbing
+            if f == identity or f == g:
+                return g
+            if g == identity:
+                return f
+            var = min(self._vars[f], self._vars[g])
+            f_low, f_high = self._cofactors(f, var)
+            g_low, g_high = self._cofactors(g, var)
+            low = yield _ordered(f_low, g_low)
+            high = yield _ordered(f_high, g_high)
+            return self.make(var, low, high)
+
+        return _evaluate(visit, _ordered(f, g), memo)
+
+
+class _ZDD(_Diagram):
+    """
+    A zero-suppressed decision diagram of a family of sets: a node whose high child is
+    the empty family is skipped, so a family of small sets over many variables has few
+    nodes. ``0`` is the empty family and ``1`` is the family that holds only the empty
+    set.
+    """
+
+    __slots__ = ("_without_memo",)
+
+    def __init__(self, variable_count):
+        super().__init__(variable_count)
+        self._without_memo = dict()
+
+    def make(self, var, low, high):
+        if high == _FALSE:
+            return low
+        return self._make(var, low, high)
+
+    def without(self, p, q):
+        """
+        :returns: the sets in ``p`` that are not a superset of any set in ``q``
+        """
+
+        def visit(pair):
+            p, q = pair
+            if p == _FALSE or q == _TRUE or p == q:
+                return _FALSE
+            if q == _FALSE:
+                return p
+            p_var, q_var = self._vars[p], self._vars[q]
+            if q_var < p_var:
+                # No set in p holds q_var, so it has no superset of q's sets that do.
+                return (yield (p, self._lows[q]))
+            if p_var < q_var:
+                low = yield (self._lows[p], q)
+                high = yield (self._highs[p], q)
+                return self.make(p_var, low, high)
+            low = yield (self._lows[p], self._lows[q])
+            high = yield (self._highs[p], self._lows[q])
+            high = yield (high, self._highs[q])
+            return self.make(p_var, low, high)
+
+        return _evaluate(visit, (p, q), self._without_memo)
+
+
+def _minimal_solutions(bdd, zdd, function):
+    """
+    Find the minimal sets of true variables that make a monotone function true, with
+    Rauzy's algorithm: the minimal solutions without a node's variable are those of its
+    low child, and the ones with it are the minimal solutions of its high child that are
+    not a superset of one without it.
+
+    :param _BDD bdd:
+    :param _ZDD zdd: a diagram over the same variables
+    :param int function: a node of ``bdd`` for a function that only gets truer as its
+        variables do, like every AND/OR tree
+    :returns: the node of ``zdd`` for the minimal solutions
+    :rtype: int
+    """
+
+    def visit(node):
+        var, low, high = bdd.node(node)
+        without_var = yield low
+        with_var = yield high
+        return zdd.make(var, without_var, zdd.without(with_var, without_var))
+
+    return _evaluate(visit, function, {_FALSE: _FALSE, _TRUE: _TRUE})
+
+
+def _ordered(f, g):
+    return (f, g) if f <= g else (g, f)
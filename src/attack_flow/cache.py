@@ -0,0 +1,630 @@
+"""
+Persistent caches of validation results and parsed bundles.
+
+Validating a document is deterministic: the result depends only on the document's
+contents, the schema files, and the code that does the validating. The cache stores each
+result under a key derived from all three, so an unchanged document can skip validation
+entirely, and any change to the schemas or the library invalidates every stored result.
+
+Parsing a bundle into stix2 objects is deterministic in the same way, and for large
+bundles it costs much more than rendering them. :class:`BundleCache` stores parsed
+bundles in a binary format so that loading an unchanged bundle skips both JSON decoding
+and stix2 object construction. :class:`FeatureCache` does the same for features that
+are computed from a bundle.
+"""
+
+import abc
+import functools
+import hashlib
+import importlib.metadata
+import json
+import logging
+import os
+from pathlib import Path
+import pickle
+import platform
+
+import attack_flow.profiling
+import attack_flow.storage
+
+# Increment when the format of cache entries changes.
+CACHE_FORMAT = 1
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+DEFAULT_BUNDLE_CACHE_SIZE = 1024 * 1024 * 1024
+# When a cache grows larger than its maximum size, it is shrunk to this fraction of it,
+# so that it is not scanned again on the very next write.
+EVICT_TO = 0.75
+# The files of this library that are hashed into fingerprints: its code, and data files
+# such as the table of ATT&CK STIX IDs.
+SOURCE_SUFFIXES = (".py", ".json")
+
+logger = logging.getLogger(__name__)
+
+
+def validate_doc(flow_path, cache_dir, max_size=DEFAULT_MAX_SIZE, **kwargs):
+    """
+    Validate an Attack Flow document, reusing a stored result if one exists.
+
+    :param Path flow_path: path to attack flow doc
+    :param Path cache_dir: directory where results are stored
+    :param int max_size: the maximum size of the cache in bytes
+    :param kwargs: passed to :func:`attack_flow.schema.validate_doc`
+    :rtype: attack_flow.schema.ValidationResult
+    """
+    import attack_flow.schema
+
+    cache = ResultCache.shared(cache_dir, max_size)
+    key = cache.key_for_file(flow_path)
+    result = cache.get(key)
+    if result is None:
+        result = attack_flow.schema.validate_doc(flow_path, **kwargs)
+        cache.put(key, result)
+    return result
+
+
+class _DirectoryCache(abc.ABC):
+    """
+    Store entries in a directory, one file per key.
+
+    Files are written atomically, so several processes can share a cache directory.
+    Reading an entry updates its modification time, and when the cache grows larger
+    than ``max_size`` the least recently used entries are deleted first.
+
+    The directory is only scanned when the cache might be too big. Each cache object
+    scans it once to find its size and then adds the size of each entry that it
+    writes, so entries written by other processes are only counted the next time it
+    scans. Use :meth:`shared` to reuse one cache object for every document in a
+    process.
+
+    :param Path cache_dir: the directory is created if it does not exist
+    :param int max_size: the maximum size of the cache in bytes
+    """
+
+    #: The file name suffixes of the entries that count towards ``max_size``.
+    suffixes = ()
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        # The size of the directory in bytes, or None until it has been scanned.
+        self._size = None
+
+    @classmethod
+    def shared(cls, cache_dir, max_size):
+        """
+        Get the cache object for a directory that is shared by this process.
+
+        :param Path cache_dir:
+        :param int max_size: the maximum size of the cache in bytes
+        :rtype: _DirectoryCache
+        """
+        return _get_shared_cache(cls, Path(cache_dir), max_size)
+
+    def key_for_hash(self, content_hash):
+        """
+        Compute the cache key for a document with the given content hash.
+
+        :param str content_hash: the SHA-256 hash of the document, as hex
+        :rtype: str
+        """
+        digest = hashlib.sha256()
+        digest.update(content_hash.encode("ascii"))
+        digest.update(self.get_fingerprint().encode("ascii"))
+        return digest.hexdigest()
+
+    @abc.abstractmethod
+    def get_fingerprint(self):
+        """
+        Compute a hash of everything other than the document that affects the entries.
+
+        :rtype: str
+        """
+
+    def evict(self):
+        """
+        Scan the directory, and if the cache is larger than ``max_size``, delete the
+        least recently used entries until it is no larger than ``EVICT_TO`` of it.
+        """
+        entries = list()
+        total_size = 0
+        for suffix in self.suffixes:
+            for entry_path in self.cache_dir.glob(f"*{suffix}"):
+                try:
+                    stat = entry_path.stat()
+                except FileNotFoundError:
+                    # Another process evicted it.
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+                total_size += stat.st_size
+
+        if total_size > self.max_size:
+            target_size = self.max_size * EVICT_TO
+            entries.sort()
+            for _, size, entry_path in entries:
+                if total_size <= target_size:
+                    break
+                entry_path.unlink(missing_ok=True)
+                total_size -= size
+        self._size = total_size
+
+    def _count_write(self, path):
+        """
+        Add a file that was just written to the size of the cache, and evict old
+        entries if the cache might be too big.
+
+        :param Path path:
+        """
+        if self._size is not None:
+            try:
+                self._size += path.stat().st_size
+            except FileNotFoundError:
+                # Another process evicted it.
+                return
+        if self._size is None or self._size > self.max_size:
+            self.evict()
+
+    def _write_atomic(self, path, write):
+        """
+        Write a file by writing a temporary file and then renaming it.
+
+        :param Path path:
+        :param write: a function that is called with a binary file object
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        attack_flow.storage.write_atomic(path, write)
+
+
+class ResultCache(_DirectoryCache):
+    """
+    Store validation results in a directory.
+
+    Each result is a JSON file named after its key. Files are written atomically, so
+    several processes can share a cache directory. Reading a result updates its
+    modification time, and when the cache grows larger than ``max_size`` the least
+    recently used results are deleted first.
+
+    :param Path cache_dir: the directory is created if it does not exist
+    :param int max_size: the maximum size of the cache in bytes
+    """
+
+    suffixes = (".json",)
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        super().__init__(cache_dir, max_size)
+
+    def key_for_file(self, path):
+        """
+        Compute the cache key for a document on disk.
+
+        :param Path path:
+        :rtype: str
+        """
+        return self.key_for_hash(_hash_file(path))
+
+    def get_fingerprint(self):
+        return get_environment_fingerprint()
+
+    def get(self, key):
+        """
+        Look up a stored result.
+
+        :param str key:
+        :returns: the stored result, or None if there isn't one
+        :rtype: attack_flow.schema.ValidationResult
+        """
+        import attack_flow.schema
+
+        entry_path = self._entry_path(key)
+        try:
+            with entry_path.open() as entry_file:
+                entry = json.load(entry_file)
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable cache entry: %s", entry_path)
+            return None
+        if not isinstance(entry, dict) or entry.get("format") != CACHE_FORMAT:
+            return None
+        result = entry.get("result")
+        if result is None:
+            logger.warning("Ignoring cache entry without a result: %s", entry_path)
+            return None
+        return attack_flow.schema.ValidationResult.from_dict(result)
+
+    def put(self, key, result):
+        """
+        Store a result, then evict old results if the cache is too big.
+
+        :param str key:
+        :param attack_flow.schema.ValidationResult result:
+        """
+        entry = {"format": CACHE_FORMAT, "result": result.to_dict()}
+        entry_path = self._entry_path(key)
+        self._write_atomic(
+            entry_path, lambda f: f.write(json.dumps(entry).encode("utf8"))
+        )
+        self._count_write(entry_path)
+
+    def _entry_path(self, key):
+        return self.cache_dir / f"{key}.json"
+
+
+class BundleCache(_DirectoryCache):
+    """
+    Store parsed bundles in a directory.
+
+    Each bundle is pickled into a file named after its key. Like :class:`ResultCache`,
+    the key is derived from the document's SHA-256 hash. To avoid hashing a large
+    document every time it is loaded, the hash is also recorded in a small file named
+    after the document's path, along with the document's size and modification time;
+    the hash is reused for as long as those do not change. Using a pointer updates its
+    modification time, like reading an entry does.
+
+    Loading an entry runs :mod:`pickle`, so only use a cache directory that is as
+    trustworthy as the code that reads it.
+
+    :param Path cache_dir: the directory is created if it does not exist
+    :param int max_size: the maximum size of the cache in bytes
+    """
+
+    suffixes = (".pickle", ".path")
+
+    def __init__(self, cache_dir, max_size=DEFAULT_BUNDLE_CACHE_SIZE):
+        super().__init__(cache_dir, max_size)
+
+    def key_for_file(self, path):
+        """
+        Compute the cache key for a document on disk.
+
+        :param Path path:
+        :rtype: str
+        """
+        stat = path.stat()
+        path_hash = hashlib.sha256(str(path.resolve()).encode("utf8")).hexdigest()
+        pointer_path = self.cache_dir / f"{path_hash}.path"
+        try:
+            pointer = json.loads(pointer_path.read_bytes())
+            recorded = (pointer["mtime_ns"], pointer["size"])
+            if recorded == (stat.st_mtime_ns, stat.st_size):
+                # Like an entry, a pointer that is used is kept from being evicted.
+                os.utime(pointer_path)
+                return self.key_for_hash(pointer["sha256"])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError):
+            logger.warning("Ignoring unreadable cache entry: %s", pointer_path)
+
+        # The file is hashed after it is stat'ed, so if it changes in between, the
+        # pointer has the old modification time and is not used again.
+        content_hash = _hash_file(path)
+        pointer = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": content_hash,
+        }
+        self._write_atomic(
+            pointer_path, lambda f: f.write(json.dumps(pointer).encode("utf8"))
+        )
+        self._count_write(pointer_path)
+        return self.key_for_hash(content_hash)
+
+    def get_fingerprint(self):
+        return get_bundle_fingerprint()
+
+    def get(self, key):
+        """
+        Look up a stored bundle.
+
+        :param str key:
+        :returns: the stored bundle, or None if there isn't one
+        :rtype: stix2.Bundle
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with entry_path.open("rb") as entry_file:
+                with attack_flow.profiling.span("bundle_cache.load"):
+                    bundle = pickle.load(entry_file)
+            os.utime(entry_path)
+        except FileNotFoundError:
+            attack_flow.profiling.count("bundle_cache.misses")
+            return None
+        except Exception:
+            # Unpickling a damaged file can raise almost anything.
+            logger.warning("Ignoring unreadable cache entry: %s", entry_path)
+            attack_flow.profiling.count("bundle_cache.misses")
+            return None
+        attack_flow.profiling.count("bundle_cache.hits")
+        return bundle
+
+    def put(self, key, bundle):
+        """
+        Store a bundle, then evict old entries if the cache is too big.
+
+        :param str key:
+        :param stix2.Bundle bundle:
+        """
+        entry_path = self._entry_path(key)
+        with attack_flow.profiling.span("bundle_cache.store"):
+            self._write_atomic(
+                entry_path,
+                lambda f: _BundlePickler(f, pickle.HIGHEST_PROTOCOL).dump(bundle),
+            )
+        self._count_write(entry_path)
+
+    def _entry_path(self, key):
+        return self.cache_dir / f"{key}.pickle"
+
+
+class FeatureCache(_DirectoryCache):
+    """
+    Store features computed from documents in a directory, such as the graph features
+    of :mod:`attack_flow.kernels`.
+
+    Each entry is a JSON file named after its key. Like :class:`ResultCache`, the key is
+    derived from the document's SHA-256 hash and a fingerprint of this library, and
+    also from a variant that names the kind of features and their parameters.
+
+    :param Path cache_dir: the directory is created if it does not exist
+    :param int max_size: the maximum size of the cache in bytes
+    """
+
+    suffixes = (".features.json",)
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        super().__init__(cache_dir, max_size)
+
+    def key_for_file(self, path, variant):
+        """
+        Compute the cache key for the features of a document on disk.
+
+        :param Path path:
+        :param str variant: the kind of features and their parameters
+        :rtype: str
+        """
+        return self.key_for_hash(f"{_hash_file(path)}:{variant}")
+
+    def get_fingerprint(self):
+        return get_feature_fingerprint()
+
+    def get(self, key):
+        """
+        Look up stored features.
+
+        :param str key:
+        :returns: the stored features, or None if there are none
+        :rtype: dict
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with entry_path.open("rb") as entry_file:
+                entry = json.loads(entry_file.read())
+            os.utime(entry_path)
+        except FileNotFoundError:
+            attack_flow.profiling.count("feature_cache.misses")
+            return None
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable cache entry: %s", entry_path)
+            attack_flow.profiling.count("feature_cache.misses")
+            return None
+        if not isinstance(entry, dict) or entry.get("format") != CACHE_FORMAT:
+            return None
+        attack_flow.profiling.count("feature_cache.hits")
+        return entry["features"]
+
+    def put(self, key, features):
+        """
+        Store features, then evict old entries if the cache is too big.
+
+        :param str key:
+        :param dict features: a JSON-serializable dict
+        """
+        entry = {"format": CACHE_FORMAT, "features": features}
+        entry_path = self._entry_path(key)
+        self._write_atomic(
+            entry_path, lambda f: f.write(json.dumps(entry).encode("utf8"))
+        )
+        self._count_write(entry_path)
+
+    def _entry_path(self, key):
+        return self.cache_dir / f"{key}.features.json"
+
+
+@functools.lru_cache(maxsize=None)
+def _get_shared_cache(cls, cache_dir, max_size):
+    return cls(cache_dir, max_size)
+
+
+class _BundlePickler(pickle.Pickler):
+    """
+    Pickle stix2 objects, including the Attack Flow SDOs.
+
+    stix2 objects are pickled as their attributes, so they are restored without running
+    the constructor and its checks. The classes that stix2 creates for custom objects
+    cannot be found by name, so they are pickled as their STIX type instead and looked
+    up in the stix2 registry when they are restored. stix2 timestamps are pickled with
+    their precision, which a plain datetime would not keep.
+    """
+
+    def reducer_override(self, obj):
+        reduce = _get_reducers().get(type(obj))
+        if reduce is None:
+            return NotImplemented
+        return reduce(obj)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_reducers():
+    """
+    Find the stix2 classes that :class:`_BundlePickler` pickles specially.
+
+    :returns: a map from each class to a function that reduces its instances for pickle
+    :rtype: dict
+    """
+    import stix2.registry
+    import stix2.utils
+
+    reducers = {stix2.utils.STIXdatetime: _reduce_stix_datetime}
+    for version, categories in stix2.registry.STIX2_OBJ_MAPS.items():
+        for category, types in categories.items():
+            for type_name, cls in types.items():
+                if "<locals>" in cls.__qualname__:
+                    location = (version, category, type_name)
+                    reducers[cls] = functools.partial(_reduce_custom_object, location)
+    return reducers
+
+
+def _reduce_custom_object(location, obj):
+    return _new_stix_object, location, obj.__dict__
+
+
+def _new_stix_object(version, category, type_name):
+    """
+    Create an uninitialized stix2 object so that unpickling can set its attributes.
+
+    :param str version:
+    :param str category:
+    :param str type_name:
+    """
+    import stix2.registry
+
+    import attack_flow.model  # noqa: F401 (registers the Attack Flow SDOs)
+
+    cls = stix2.registry.STIX2_OBJ_MAPS[version][category][type_name]
+    return cls.__new__(cls)
+
+
+def _reduce_stix_datetime(value):
+    fields = (
+        value.year,
+        value.month,
+        value.day,
+        value.hour,
+        value.minute,
+        value.second,
+        value.microsecond,
+        value.tzinfo,
+    )
+    return _new_stix_datetime, (fields, value.precision, value.precision_constraint)
+
+
+def _new_stix_datetime(fields, precision, precision_constraint):
+    """
+    :param tuple fields: the arguments to the ``datetime`` constructor
+    :param stix2.utils.Precision precision:
+    :param stix2.utils.PrecisionConstraint precision_constraint:
+    :rtype: stix2.utils.STIXdatetime
+    """
+    import stix2.utils
+
+    return stix2.utils.STIXdatetime(
+        *fields, precision=precision, precision_constraint=precision_constraint
+    )
+
+
+def _hash_file(path):
+    """
+    :param Path path:
+    :returns: the SHA-256 hash of the file, as hex
+    :rtype: str
+    """
+    with path.open("rb") as file:
+        return hashlib.file_digest(file, "sha256").hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def get_environment_fingerprint():
+    """
+    Compute a hash of everything other than the document that affects validation.
+
+    This includes the schema files, the version of this library, and the versions of
+    the libraries that it uses for validation.
+
+    :rtype: str
+    """
+    import attack_flow.schema
+
+    digest = hashlib.sha256()
+    digest.update(f"format={CACHE_FORMAT}\0".encode("utf8"))
+    digest.update(
+        f"schema={attack_flow.schema.get_schema_fingerprint()}\0".encode("utf8")
+    )
+    for package in ("attack-flow", "jsonschema", "stix2"):
+        digest.update(f"{package}={_get_package_version(package)}\0".encode("utf8"))
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def get_bundle_fingerprint():
+    """
+    Compute a hash of everything other than the document that affects a parsed bundle.
+
+    This includes the versions of this library, of stix2, and of Python, since pickled
+    objects depend on the layout of their classes.
+
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    digest.update(f"format={CACHE_FORMAT}\0".encode("utf8"))
+    digest.update(f"python={platform.python_version()}\0".encode("utf8"))
+    for package in ("attack-flow", "stix2"):
+        digest.update(f"{package}={_get_package_version(package)}\0".encode("utf8"))
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def get_feature_fingerprint():
+    """
+    Compute a hash of everything other than the document that affects stored features.
+
+    Features are computed by this library from parsed bundles, so this includes the
+    versions of this library and of stix2.
+
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    digest.update(f"format={CACHE_FORMAT}\0".encode("utf8"))
+    for package in ("attack-flow", "stix2"):
+        digest.update(f"{package}={_get_package_version(package)}\0".encode("utf8"))
+    return digest.hexdigest()
+
+
+def _get_package_version(package):
+    """
+    Return the installed version of a package.
+
+    For this library, a hash of its source code is included as well, so that stored
+    results are invalidated when the code changes without a new version, as it does in
+    a source checkout or an editable install.
+
+    :param str package:
+    :rtype: str
+    """
+    try:
+        version = importlib.metadata.version(package)
+    except importlib.metadata.PackageNotFoundError:
+        version = "unknown"
+    if package == "attack-flow":
+        version = f"{version}+source-{_get_source_hash()}"
+    return version
+
+
+@functools.lru_cache(maxsize=None)
+def _get_source_hash():
+    """
+    Compute a hash of this library's source code and data files.
+
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    package_dir = Path(__file__).parent
+    source_paths = [
+        path
+        for suffix in SOURCE_SUFFIXES
+        for path in package_dir.rglob(f"*{suffix}")
+        if path.is_file()
+    ]
+    for source_path in sorted(source_paths):
+        digest.update(source_path.relative_to(package_dir).as_posix().encode("utf8"))
+        digest.update(source_path.read_bytes())
+    return digest.hexdigest()
@@ -3,36 +3,60 @@ Attack Flow command line tool for validation and visualization.
 """
 
 import argparse
+import concurrent.futures
+import functools
 from pathlib import Path
-import json
 import logging
+import os
 import sys
+import time
 
 import importlib.metadata
 
-import attack_flow.docs
-import attack_flow.graphviz
-import attack_flow.matrix
-import attack_flow.mermaid
-import attack_flow.model
-import attack_flow.schema
+import attack_flow.profiling
+
+# The other attack_flow modules are imported by the subcommands that use them, rather
+# than at the top of this file. Several of them import large libraries such as stix2,
+# jsonschema, NetworkX, and GraphViz, and a subcommand should not pay to load libraries
+# it never uses.
 
 
 def main():
     """Main entry point for `af` command line."""
     args = _parse_args()
     _setup_logging(args.log_level)
+    profile_format = args.profile or ("text" if args.profile_memory else None)
+    if profile_format:
+        attack_flow.profiling.start(memory=args.profile_memory)
     try:
-        result = args.command(args)
+        with attack_flow.profiling.span(args.command.__name__.replace("_", "-")):
+            result = args.command(args)
     except RuntimeError as e:
         if args.log_level == "debug":
             raise
         else:
             sys.stderr.write(f"error: {str(e)}\n")
             result = 1
+    finally:
+        if profile_format:
+            _write_profile(attack_flow.profiling.stop(), profile_format)
     sys.exit(result)
 
 
+def _write_profile(profile, profile_format):
+    """
+    Write a profile to stderr, so that it is not mixed up with a command's output.
+
+    :param attack_flow.profiling.Profile profile:
+    :param str profile_format: ``text`` or ``json``
+    """
+    if profile_format == "json":
+        for line in profile.iter_json_lines():
+            sys.stderr.write(line + "\n")
+    else:
+        sys.stderr.write(profile.to_text())
+
+
 def version(args):
     """
     Display Attack Flow library version.
@@ -49,16 +73,45 @@ def validate(args):
     """
     Validate Attack Flow JSON files.
 
+    When ``--jobs`` is greater than one, documents are validated in a pool of worker
+    processes. Results are still printed in the order the documents were given on the
+    command line, and each result is printed as soon as it and all of its predecessors
+    have finished.
+
+    When ``--cache-dir`` is given, documents that have not changed since they were last
+    validated are not validated again; their stored results are printed instead.
+
     :param args: argparse arguments
     :returns: exit code
     """
+    import attack_flow.schema
+
     exit_code = 0
     suggest_verbose = False
+    flow_paths = [Path(flow_path) for flow_path in args.attack_flow_docs]
+    jobs = args.jobs or os.cpu_count() or 1
+
+    validate_doc = attack_flow.schema.validate_doc
+    options = dict()
+    if args.compiled:
+        options["compiled"] = True
+    if args.stream:
+        options["streaming"] = True
+    if args.cache_dir:
+        import attack_flow.cache
+
+        validate_doc = functools.partial(
+            attack_flow.cache.validate_doc, cache_dir=Path(args.cache_dir), **options
+        )
+    elif options:
+        validate_doc = functools.partial(validate_doc, **options)
 
-    for flow_path in args.attack_flow_docs:
-        sys.stdout.write(f"{flow_path}: ")
-        sys.stdout.flush()
-        result = attack_flow.schema.validate_doc(Path(flow_path))
+    if jobs > 1 and len(flow_paths) > 1:
+        results = _validate_parallel(validate_doc, flow_paths, jobs, args.compiled)
+    else:
+        results = _validate_serial(validate_doc, flow_paths)
+
+    for flow_path, result in results:
         if result.success:
             status = "OK" + (" (with warnings)" if result.messages else "")
         else:
@@ -83,6 +136,155 @@ def validate(args):
     return exit_code
 
 
+def _validate_serial(validate_doc, flow_paths):
+    """
+    Validate documents one at a time in this process.
+
+    The document path is written before validation starts so that a slow document
+    is easy to spot.
+
+    :param validate_doc: function that validates one document
+    :param list[Path] flow_paths:
+    :returns: generator of ``(path, ValidationResult)`` tuples
+    """
+    for flow_path in flow_paths:
+        sys.stdout.write(f"{flow_path}: ")
+        sys.stdout.flush()
+        yield flow_path, validate_doc(flow_path)
+
+
+def _validate_parallel(validate_doc, flow_paths, jobs, compiled):
+    """
+    Validate documents in a pool of worker processes.
+
+    Each worker builds its validators once when it starts, so the cost of loading
+    schemas is paid once per worker rather than once per document.
+
+    :param validate_doc: function that validates one document; must be picklable
+    :param list[Path] flow_paths:
+    :param int jobs: number of worker processes
+    :param bool compiled: whether workers should build compiled validators
+    :returns: generator of ``(path, ValidationResult)`` tuples, in input order
+    """
+    import attack_flow.schema
+
+    workers = min(jobs, len(flow_paths))
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=attack_flow.schema.warm_validators,
+        initargs=(compiled,),
+    ) as executor:
+        results = executor.map(
+            functools.partial(attack_flow.schema.validate_doc_to_dict, validate_doc),
+            flow_paths,
+        )
+        for flow_path in flow_paths:
+            sys.stdout.write(f"{flow_path}: ")
+            sys.stdout.flush()
+            yield flow_path, attack_flow.schema.ValidationResult.from_dict(
+                next(results)
+            )
+
+
+def export_stix(args):
+    """
+    Export Attack Flow Builder files to STIX bundles.
+
+    Each bundle is written next to its Builder file with a ``.json`` suffix. Files are
+    exported in this process, or in a pool of worker processes when ``--jobs`` is
+    greater than one; either way, no Builder has to be built or started.
+
+    :param args: argparse arguments
+    :returns: exit code
+    """
+    import attack_flow.afb
+
+    exit_code = 0
+    afb_paths = list()
+    for afb_path in map(Path, args.afb_files):
+        if afb_path.suffix == attack_flow.afb.AFB_SUFFIX:
+            afb_paths.append(afb_path)
+        else:
+            logging.warning("Skipping %s: not an Attack Flow Builder file", afb_path)
+    jobs = args.jobs or os.cpu_count() or 1
+
+    if jobs > 1 and len(afb_paths) > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(jobs, len(afb_paths))
+        )
+        export = functools.partial(executor.submit, attack_flow.afb.export_stix)
+    else:
+        executor = None
+        export = functools.partial(_run_now, attack_flow.afb.export_stix)
+
+    try:
+        futures = [export(afb_path) for afb_path in afb_paths]
+        for afb_path, future in zip(afb_paths, futures):
+            try:
+                output_path = future.result()
+            except ValueError as e:
+                exit_code = 1
+                print(f"{afb_path}: FAIL - {e}")
+            else:
+                if args.verbose:
+                    print(f"Exporting {afb_path} -> {output_path}")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return exit_code
+
+
+def _run_now(fn, *args):
+    """
+    Call a function and wrap its outcome in a future, so that work done in this
+    process can be handled like work done in a pool.
+
+    :param fn:
+    :returns: a completed future
+    :rtype: concurrent.futures.Future
+    """
+    future = concurrent.futures.Future()
+    try:
+        future.set_result(fn(*args))
+    except ValueError as e:
+        future.set_exception(e)
+    return future
+
+
+def upgrade_v2(args):
+    """
+    Upgrade legacy v2 Attack Flow Builder files to the current file format.
+
+    Directories are searched for ``.afb`` files. A line is printed for each file, with
+    how long it took, followed by a summary.
+
+    :param args: argparse arguments
+    :returns: exit code
+    """
+    import attack_flow.migrate
+
+    paths = attack_flow.migrate.find_files([Path(path) for path in args.paths])
+    jobs = args.jobs or os.cpu_count() or 1
+    counts = {"upgraded": 0, "skipped": 0, "failed": 0}
+    start = time.perf_counter()
+    for result in attack_flow.migrate.upgrade_files(
+        paths, jobs=jobs, backup=not args.no_backup
+    ):
+        counts[result.status] += 1
+        timing = f"({result.seconds * 1000:.1f} ms)"
+        if result.status == "upgraded":
+            print(f"{result.path} -> {result.output_path} {timing}")
+        elif result.status == "failed":
+            print(f"{result.path}: FAIL - {result.error} {timing}")
+        elif args.verbose:
+            print(f"{result.path}: skipped, not a v2 file {timing}")
+    print(
+        f"Upgraded {counts['upgraded']} files in {time.perf_counter() - start:.2f} s "
+        f"({counts['skipped']} skipped, {counts['failed']} failed)"
+    )
+    return 1 if counts["failed"] else 0
+
+
 def graphviz(args):
     """
     Convert Attack Flow JSON file to GraphViz format.
@@ -90,18 +292,15 @@ def graphviz(args):
     :param args: argparse arguments
     :returns: exit code
     """
+    import attack_flow.graphviz
+    import attack_flow.model
+
+    _set_bundle_cache(args)
     path = Path(args.attack_flow)
     flow_bundle = attack_flow.model.load_attack_flow_bundle(path)
+    converted = attack_flow.graphviz.convert(flow_bundle)
 
-    if (
-        flow_bundle.get("objects", "")
-        and attack_flow.model.get_flow_object(flow_bundle).scope == "attack-tree"
-    ):
-        converted = attack_flow.graphviz.convert_attack_tree(flow_bundle)
-    else:
-        converted = attack_flow.graphviz.convert_attack_flow(flow_bundle)
-
-    with open(args.output, "w") as out:
+    with open(args.output, "w") as out, attack_flow.profiling.span("output.write"):
         out.write(converted)
     return 0
 
@@ -113,17 +312,15 @@ def mermaid(args):
     :param args: argparse arguments
     :returns: exit code
     """
+    import attack_flow.mermaid
+    import attack_flow.model
+
+    _set_bundle_cache(args)
     path = Path(args.attack_flow)
     flow_bundle = attack_flow.model.load_attack_flow_bundle(path)
-    if (
-        flow_bundle.get("objects", "")
-        and attack_flow.model.get_flow_object(flow_bundle).scope == "attack-tree"
-    ):
-        converted = attack_flow.mermaid.convert_attack_tree(flow_bundle)
-    else:
-        converted = attack_flow.mermaid.convert_attack_flow(flow_bundle)
+    converted = attack_flow.mermaid.convert(flow_bundle)
 
-    with open(args.output, "w") as out:
+    with open(args.output, "w") as out, attack_flow.profiling.span("output.write"):
         out.write(converted)
     return 0
 
@@ -135,6 +332,10 @@ def matrix(args):
     :param args: argparse arguments
     :returns: exit code
     """
+    import attack_flow.matrix
+    import attack_flow.model
+
+    _set_bundle_cache(args)
     path = Path(args.attack_flow)
     flow_bundle = attack_flow.model.load_attack_flow_bundle(path)
     debug = logging.getLogger().level == logging.DEBUG
@@ -148,6 +349,151 @@ def matrix(args):
     return 0
 
 
+def corpus(args):
+    """
+    Update a corpus store from Attack Flow files and query it.
+
+    :param args: argparse arguments
+    :returns: exit code
+    """
+    import attack_flow.corpus
+
+    _set_bundle_cache(args)
+    store_path = Path(args.store)
+    if store_path.exists():
+        try:
+            store = attack_flow.corpus.CorpusStore.load(store_path)
+        except ValueError as e:
+            raise RuntimeError(str(e)) from e
+    else:
+        store = attack_flow.corpus.CorpusStore()
+
+    summary = f"{len(store)} flows"
+    if args.attack_flow_docs:
+        paths = [Path(p) for p in args.attack_flow_docs]
+        added, removed = list(), list()
+        if args.remove:
+            removed = store.remove_files(paths)
+        elif args.sync:
+            added, removed = store.sync_files(paths)
+        else:
+            added = store.update_files(paths)
+        if added or removed or not store_path.exists():
+            store.save(store_path)
+        summary = f"{len(store)} flows ({len(added)} added, {len(removed)} removed)"
+
+    if not (args.technique or args.transition):
+        print(
+            f"{summary}, {store.number_of_nodes()} nodes, "
+            f"{store.number_of_edges()} edges"
+        )
+
+    if args.technique or args.transition:
+        matches = None
+        results = [store.flows_with_all(args.technique)] if args.technique else []
+        for source, target in args.transition or ():
+            results.append(store.flows_with_transition(source, target))
+        for result in results:
+            matches = set(result) if matches is None else matches & set(result)
+        for flow_name in store:
+            if flow_name in matches:
+                print(flow_name)
+    return 0
+
+
+def similar(args):
+    """
+    Update a similarity index from Attack Flow files and find similar flows.
+
+    :param args: argparse arguments
+    :returns: exit code
+    """
+    import attack_flow.similarity
+
+    _set_bundle_cache(args)
+    index_path = Path(args.index)
+    if index_path.exists():
+        try:
+            index = attack_flow.similarity.SimilarityIndex.load(index_path)
+        except ValueError as e:
+            raise RuntimeError(str(e)) from e
+    else:
+        index = attack_flow.similarity.SimilarityIndex()
+
+    if args.attack_flow_docs:
+        added, removed = index.sync_files([Path(p) for p in args.attack_flow_docs])
+        if added or removed or not index_path.exists():
+            index.save(index_path)
+        if not args.query:
+            print(f"{len(index)} flows ({len(added)} added, {len(removed)} removed)")
+
+    if args.query:
+        import attack_flow.model
+
+        flow_bundle = attack_flow.model.load_attack_flow_bundle(Path(args.query))
+        for flow_name, similarity in index.query(flow_bundle, args.top):
+            print(f"{similarity:.3f} {flow_name}")
+    return 0
+
+
+def _set_bundle_cache(args):
+    """
+    Use a cache of parsed bundles if ``--cache-dir`` was given.
+
+    :param args: argparse arguments
+    """
+    if args.cache_dir:
+        import attack_flow.cache
+        import attack_flow.model
+
+        bundle_cache = attack_flow.cache.BundleCache(Path(args.cache_dir))
+        attack_flow.model.set_bundle_cache(bundle_cache)
+
+
+def serve(args):
+    """
+    Validate and convert Attack Flow documents in a long-running server.
+
+    :param args: argparse arguments
+    :returns: exit code
+    """
+    import attack_flow.server
+
+    matrix_svg = None
+    if args.matrix_svg:
+        with open(args.matrix_svg) as matrix_file:
+            matrix_svg = matrix_file.read()
+
+    service = attack_flow.server.AttackFlowService(
+        workers=args.workers or None,
+        compiled=args.compiled,
+        matrix_svg=matrix_svg,
+        max_body_size=args.max_body_size or None,
+    )
+    try:
+        service.start()
+        server = attack_flow.server.make_server(
+            service, args.host, args.port, args.socket
+        )
+        if args.socket:
+            print(f"Serving on unix:{args.socket}")
+        else:
+            host, port = server.server_address[:2]
+            print(f"Serving on http://{host}:{port}")
+        sys.stdout.flush()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if args.socket:
+                Path(args.socket).unlink(missing_ok=True)
+    finally:
+        service.close()
+    return 0
+
+
 def doc_schema(args):
     """
     Generate schema documentation for Attack Flow.
@@ -155,12 +501,12 @@ def doc_schema(args):
     :param args: argparse arguments
     :returns: exit code
     """
-    with open(args.schema_doc) as schema_file:
-        schema_json = json.load(schema_file)
+    import attack_flow.docs
+    import attack_flow.jsonio
 
-    with open(args.example_doc) as example_file:
-        example_json = json.load(example_file)
-        examples = {obj["id"]: obj for obj in example_json["objects"]}
+    schema_json = attack_flow.jsonio.load_path(Path(args.schema_doc))
+    example_json = attack_flow.jsonio.load_path(Path(args.example_doc))
+    examples = {obj["id"]: obj for obj in example_json["objects"]}
 
     schema_lines = list()
     for name, subschema in schema_json["$defs"].items():
@@ -186,6 +532,8 @@ def doc_examples(args):
     :param args: argparse arguments
     :returns: exit code
     """
+    import attack_flow.docs
+
     corpus_path = Path(args.corpus_path)
     if not corpus_path.is_dir():
         raise RuntimeError("corpus_path must be a directory")
@@ -211,6 +559,16 @@ def _parse_args():
         metavar="LEVEL",
         choices=["debug", "info", "warning", "error", "critical"],
     )
+    parser.add_argument(
+        "--profile",
+        choices=["text", "json"],
+        help="Report how long each stage took on stderr, as a table or as JSON lines.",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="Also report the peak memory used by each stage. This is slower.",
+    )
 
     # Version subcommand
     version_cmd = subparsers.add_parser(
@@ -220,21 +578,96 @@ def _parse_args():
 
     # Validate subcommand
     validate_cmd = subparsers.add_parser(
-        "validate", help="Validate Attack Flow JSON files"
+        "validate", help="Validate Attack Flow JSON or Attack Flow Builder files"
     )
     validate_cmd.set_defaults(command=validate)
     validate_cmd.add_argument(
         "--verbose", action="store_true", help="Display detailed validation errors."
     )
+    validate_cmd.add_argument(
+        "--compiled",
+        action="store_true",
+        help="Validate Attack Flow objects with compiled schema validators.",
+    )
+    validate_cmd.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read each document incrementally instead of loading it into memory.",
+    )
+    validate_cmd.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        help="Store validation results in DIR and reuse them for unchanged documents.",
+    )
+    validate_cmd.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Validate using N worker processes; 0 uses all CPUs (default: 1).",
+    )
     validate_cmd.add_argument(
         "attack_flow_docs", nargs="+", help="The Attack Flow document(s) to validate."
     )
 
+    # Export STIX subcommand
+    export_stix_cmd = subparsers.add_parser(
+        "export-stix", help="Export Attack Flow Builder files to STIX bundles."
+    )
+    export_stix_cmd.set_defaults(command=export_stix)
+    export_stix_cmd.add_argument(
+        "--verbose", action="store_true", help="Display each file as it is exported."
+    )
+    export_stix_cmd.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Export using N worker processes; 0 uses all CPUs (default: 1).",
+    )
+    export_stix_cmd.add_argument(
+        "afb_files", nargs="+", help="The Attack Flow Builder file(s) to export."
+    )
+
+    # Upgrade v2 subcommand
+    upgrade_v2_cmd = subparsers.add_parser(
+        "upgrade-v2", help="Upgrade legacy v2 Attack Flow Builder files."
+    )
+    upgrade_v2_cmd.set_defaults(command=upgrade_v2)
+    upgrade_v2_cmd.add_argument(
+        "--verbose", action="store_true", help="Also list files that are not v2 files."
+    )
+    upgrade_v2_cmd.add_argument(
+        "--no-backup",
+        action="store_true",
+        help="Do not keep a copy of each original file with an .afb-v2 suffix.",
+    )
+    upgrade_v2_cmd.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Upgrade using N worker processes; 0 uses all CPUs (default: 1).",
+    )
+    upgrade_v2_cmd.add_argument(
+        "paths",
+        nargs="+",
+        help="The Attack Flow Builder files or directories to upgrade.",
+    )
+
     # GraphViz subcommand
     graphviz_cmd = subparsers.add_parser(
-        "graphviz", help="Convert JSON file to GraphViz format."
+        "graphviz", help="Convert JSON or .afb file to GraphViz format."
     )
     graphviz_cmd.set_defaults(command=graphviz)
+    graphviz_cmd.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        help="Store parsed documents in DIR and reuse them for unchanged documents.",
+    )
     graphviz_cmd.add_argument(
         "attack_flow", help="The Attack Flow document to convert."
     )
@@ -242,9 +675,14 @@ def _parse_args():
 
     # Mermaid subcommand
     mermaid_cmd = subparsers.add_parser(
-        "mermaid", help="Convert JSON file to Mermaid format."
+        "mermaid", help="Convert JSON or .afb file to Mermaid format."
     )
     mermaid_cmd.set_defaults(command=mermaid)
+    mermaid_cmd.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        help="Store parsed documents in DIR and reuse them for unchanged documents.",
+    )
     mermaid_cmd.add_argument("attack_flow", help="The Attack Flow document to convert.")
     mermaid_cmd.add_argument("output", help="The path to write the converted file to.")
 
@@ -253,12 +691,138 @@ def _parse_args():
         "matrix", help="Draw a flow on top of an ATT&CK matrix SVG."
     )
     matrix_cmd.set_defaults(command=matrix)
+    matrix_cmd.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        help="Store parsed documents in DIR and reuse them for unchanged documents.",
+    )
     matrix_cmd.add_argument(
         "matrix_svg", help="The ATT&CK matrix SVG to use as a base."
     )
     matrix_cmd.add_argument("attack_flow", help="The Attack Flow document to render.")
     matrix_cmd.add_argument("output", help="The path to write the output SVG to.")
 
+    # Corpus subcommand
+    corpus_cmd = subparsers.add_parser(
+        "corpus", help="Index many flows in one store and find flows by technique."
+    )
+    corpus_cmd.set_defaults(command=corpus)
+    corpus_cmd.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        help="Store parsed documents in DIR and reuse them for unchanged documents.",
+    )
+    corpus_cmd.add_argument(
+        "--technique",
+        action="append",
+        metavar="TECHNIQUE_ID",
+        help="List the flows that use this technique. May be repeated.",
+    )
+    corpus_cmd.add_argument(
+        "--transition",
+        action="append",
+        nargs=2,
+        metavar=("FROM", "TO"),
+        help="List the flows where technique FROM is followed by technique TO.",
+    )
+    corpus_update = corpus_cmd.add_mutually_exclusive_group()
+    corpus_update.add_argument(
+        "--sync",
+        action="store_true",
+        help="Remove the flows read from any other files, so that the store holds "
+        "exactly the listed documents.",
+    )
+    corpus_update.add_argument(
+        "--remove",
+        action="store_true",
+        help="Remove the listed documents from the store instead of adding them.",
+    )
+    corpus_cmd.add_argument(
+        "store", help="The store file, which is created if it does not exist."
+    )
+    corpus_cmd.add_argument(
+        "attack_flow_docs",
+        nargs="*",
+        help="Attack Flow documents to add to the store, or to update if they have "
+        "changed.",
+    )
+
+    # Similar subcommand
+    similar_cmd = subparsers.add_parser(
+        "similar", help="Index many flows and find the flows most similar to a flow."
+    )
+    similar_cmd.set_defaults(command=similar)
+    similar_cmd.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        help="Store parsed documents in DIR and reuse them for unchanged documents.",
+    )
+    similar_cmd.add_argument(
+        "--query",
+        metavar="PATH",
+        help="List the indexed flows that are most similar to this Attack Flow "
+        "document, with their estimated similarity.",
+    )
+    similar_cmd.add_argument(
+        "--top",
+        type=int,
+        default=10,
+        metavar="K",
+        help="List at most K flows (default: 10).",
+    )
+    similar_cmd.add_argument(
+        "index", help="The index file, which is created if it does not exist."
+    )
+    similar_cmd.add_argument(
+        "attack_flow_docs",
+        nargs="*",
+        help="Update the index to hold exactly these Attack Flow documents.",
+    )
+
+    # Serve subcommand
+    serve_cmd = subparsers.add_parser(
+        "serve", help="Validate and convert documents in a long-running server."
+    )
+    serve_cmd.set_defaults(command=serve)
+    serve_cmd.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="The address to listen on (default: 127.0.0.1).",
+    )
+    serve_cmd.add_argument(
+        "--port", type=int, default=8470, help="The port to listen on (default: 8470)."
+    )
+    serve_cmd.add_argument(
+        "--socket", metavar="PATH", help="Listen on a Unix socket instead of a port."
+    )
+    serve_cmd.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Run N worker processes; 0 uses all CPUs (default: 0).",
+    )
+    serve_cmd.add_argument(
+        "--compiled",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Validate Attack Flow objects with compiled schema validators "
+        "(default: enabled).",
+    )
+    serve_cmd.add_argument(
+        "--matrix-svg",
+        metavar="PATH",
+        help="The ATT&CK matrix SVG to use as a base for matrix requests.",
+    )
+    serve_cmd.add_argument(
+        "--max-body-size",
+        type=int,
+        default=0,
+        metavar="BYTES",
+        help="Reject requests with a larger body (default: 64 MiB).",
+    )
+
     # Schema subcommand
     doc_schema_cmd = subparsers.add_parser(
         "doc-schema", help="Generate schema documentation."
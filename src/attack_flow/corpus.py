@@ -0,0 +1,555 @@
+"""
+Store many Attack Flows in one graph, with indexes for queries across flows.
+
+Everything in :mod:`attack_flow.graph` works on one bundle at a time, so finding the
+flows that use a technique means loading and converting every flow. A
+:class:`CorpusStore` merges the graphs of many flows into one graph where each object
+is a single node, no matter how many flows it appears in. Each node and edge records the
+flows that contain it as a bitset: an integer whose bit ``n`` is set if the flow in slot
+``n`` contains it. Indexes on technique ID, object type, edge type and technique
+transitions map each key to the nodes or edges that have it, so a query is a few index
+lookups and bitwise ORs instead of a scan of the corpus.
+
+Flows can be added, replaced, and removed one at a time, and the store can be saved to
+a file and loaded again, so a corpus only needs to be converted once.
+"""
+
+import attack_flow.flowgraph
+import attack_flow.graph
+import attack_flow.profiling
+import attack_flow.storage
+
+# Increment when the format of saved stores changes.
+STORE_FORMAT = 2
+#: The node properties that the store records, in the order of its property tuples.
+NODE_PROPERTIES = ("node_type", "technique_id", "tactic_id", "name")
+
+
+class StoreNode:
+    """
+    A node in a :class:`CorpusStore`.
+
+    Flows that were copied from each other can share object IDs but disagree about an
+    object's properties. The store's indexes keep track of the properties that each
+    flow gives a node, but a :class:`StoreNode` only shows the properties from one of
+    them, preferably the flow that was added last.
+
+    :param str node_type: the STIX type, or None if the object is referenced but not
+        defined
+    :param str technique_id: the ATT&CK technique ID of an action, if it has one
+    :param str tactic_id: the ATT&CK tactic ID of an action, if it has one
+    :param str name: the object's name, if it has one
+    :param int flows: the bitset of the flows that contain the node
+    :param int slot: the slot of the flow that the properties are from
+    """
+
+    __slots__ = ("node_type", "technique_id", "tactic_id", "name", "flows", "slot")
+
+    def __init__(
+        self, node_type, technique_id=None, tactic_id=None, name=None, flows=0, slot=0
+    ):
+        self.node_type = node_type
+        self.technique_id = technique_id
+        self.tactic_id = tactic_id
+        self.name = name
+        self.flows = flows
+        self.slot = slot
+
+    def __repr__(self):
+        return f"StoreNode({self.node_type!r}, {self.technique_id!r}, {self.name!r})"
+
+
+class _StoredFlow:
+    """
+    What the store knows about one flow, so that the flow can be removed again.
+
+    :param int slot: the flow's bit in the membership bitsets
+    :param dict nodes: maps the IDs of the flow's nodes to a tuple of their properties
+        in this flow, in the order of :data:`NODE_PROPERTIES`, or to None if the node is
+        referenced but not defined
+    :param list[tuple] edges: the keys of the flow's edges
+    :param list[tuple] action_edges: the keys of the flow's action graph edges
+    :param tuple source: the ``(mtime_ns, size)`` of the file that the flow was read
+        from, if it was
+    """
+
+    __slots__ = ("slot", "nodes", "edges", "action_edges", "source")
+
+    def __init__(self, slot, nodes, edges, action_edges, source=None):
+        self.slot = slot
+        self.nodes = nodes
+        self.edges = edges
+        self.action_edges = action_edges
+        self.source = source
+
+
+class CorpusStore(attack_flow.storage.FileFlows):
+    """
+    A deduplicated graph of many Attack Flows.
+
+    The graph has the nodes and edges of :func:`attack_flow.graph.bundle_to_flow_graph`
+    for each flow, and the action graph edges of
+    :func:`attack_flow.graph.build_action_graph`. Edges are keyed by
+    ``(source, target, edge_type)`` and action graph edges by ``(source, target)``.
+    Flows are identified by a name of the caller's choosing; flows that are read from
+    files are named after their absolute path.
+
+    The indexes map each object type, technique ID and tactic ID to the nodes that have
+    it and, for each node, the bitset of the flows in which it has it. Likewise, each
+    pair of technique IDs maps to the action graph edges between actions with those
+    techniques. Queries are exact even when flows disagree about a node's properties.
+    """
+
+    def __init__(self):
+        self._flows = dict()
+        self._slot_names = list()
+        self._free_slots = list()
+        self._nodes = dict()
+        self._edges = dict()
+        self._action_edges = dict()
+        self._build_indexes()
+
+    def __len__(self):
+        return len(self._flows)
+
+    def __contains__(self, flow_name):
+        return flow_name in self._flows
+
+    def __iter__(self):
+        return iter(self._flows)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a store that was saved with :meth:`save`.
+
+        Loading runs :mod:`pickle`, so only load files that are as trustworthy as the
+        code that reads them.
+
+        :param Path path:
+        :rtype: CorpusStore
+        :raises ValueError: if the file was saved in a different format
+        """
+        with attack_flow.profiling.span("corpus.load"):
+            state = attack_flow.storage.load_state(path, STORE_FORMAT, "corpus store")
+            store = cls.__new__(cls)
+            store._flows = state["flows"]
+            store._slot_names = state["slot_names"]
+            store._free_slots = state["free_slots"]
+            store._nodes = state["nodes"]
+            store._edges = state["edges"]
+            store._action_edges = state["action_edges"]
+            store._build_indexes()
+        return store
+
+    def save(self, path):
+        """
+        Save the store to a file. The file is written to a temporary file first and
+        then renamed, so a file is never left half written.
+
+        The indexes are not saved; :meth:`load` rebuilds them.
+
+        :param Path path:
+        """
+        state = {
+            "format": STORE_FORMAT,
+            "flows": self._flows,
+            "slot_names": self._slot_names,
+            "free_slots": self._free_slots,
+            "nodes": self._nodes,
+            "edges": self._edges,
+            "action_edges": self._action_edges,
+        }
+        with attack_flow.profiling.span("corpus.save"):
+            attack_flow.storage.save_state(path, state)
+
+    def add_flow(self, flow_name, flow_bundle, source=None):
+        """
+        Add a flow to the store, replacing any flow with the same name.
+
+        :param str flow_name:
+        :param stix2.Bundle flow_bundle: or a decoded bundle, or a record bundle
+        :param tuple source: see :meth:`attack_flow.storage.FileFlows.add_flow`
+        """
+        if flow_name in self._flows:
+            self.remove_flow(flow_name)
+
+        with attack_flow.profiling.span("corpus.add"):
+            flow_graph = attack_flow.flowgraph.FlowGraph.from_bundle(flow_bundle)
+            action_graph = attack_flow.graph.build_action_graph(flow_graph)
+
+            if self._free_slots:
+                slot = self._free_slots.pop()
+                self._slot_names[slot] = flow_name
+            else:
+                slot = len(self._slot_names)
+                self._slot_names.append(flow_name)
+            bit = 1 << slot
+
+            nodes = dict()
+            for node_id in flow_graph:
+                obj = flow_graph.node(node_id)
+                properties = None
+                if obj is not None:
+                    properties = (
+                        obj["type"],
+                        obj.get("technique_id"),
+                        obj.get("tactic_id"),
+                        obj.get("name"),
+                    )
+                nodes[node_id] = properties
+                self._add_node(node_id, properties, slot)
+
+            # Duplicate references are one edge, as in NetworkX.
+            edges = dict()
+            for node_id in nodes:
+                for target, edge_type, _ in flow_graph.out_edges(node_id):
+                    edges[node_id, target, edge_type] = None
+            for key in edges:
+                flows = self._edges.get(key)
+                if flows is None:
+                    self._edges[key] = bit
+                    self._edges_by_type.setdefault(key[2], set()).add(key)
+                else:
+                    self._edges[key] = flows | bit
+
+            action_edges = list(action_graph.edges)
+            for key in action_edges:
+                self._action_edges[key] = self._action_edges.get(key, 0) | bit
+
+            flow = _StoredFlow(slot, nodes, list(edges), action_edges, source)
+            self._flows[flow_name] = flow
+            self._index_flow(flow)
+        attack_flow.profiling.count("corpus.nodes", len(self._nodes))
+
+    def get_sources(self):
+        return {flow_name: flow.source for flow_name, flow in self._flows.items()}
+
+    def remove_flow(self, flow_name):
+        """
+        Remove a flow from the store. Nodes and edges that are in no other flow are
+        removed too.
+
+        :param str flow_name:
+        :raises KeyError: if there is no flow with that name
+        """
+        flow = self._flows.pop(flow_name)
+        mask = ~(1 << flow.slot)
+        with attack_flow.profiling.span("corpus.remove"):
+            self._unindex_flow(flow)
+            for key in flow.action_edges:
+                flows = self._action_edges[key] & mask
+                if flows:
+                    self._action_edges[key] = flows
+                else:
+                    del self._action_edges[key]
+            for key in flow.edges:
+                flows = self._edges[key] & mask
+                if flows:
+                    self._edges[key] = flows
+                else:
+                    del self._edges[key]
+                    _discard(self._edges_by_type, key[2], key)
+            self._slot_names[flow.slot] = None
+            self._free_slots.append(flow.slot)
+            for node_id in flow.nodes:
+                node = self._nodes[node_id]
+                node.flows &= mask
+                if not node.flows:
+                    del self._nodes[node_id]
+                elif node.slot == flow.slot:
+                    self._refresh_node(node_id, node)
+
+    def node(self, node_id):
+        """
+        :param str node_id: STIX ID
+        :rtype: StoreNode
+        :raises KeyError: if no flow contains the node
+        """
+        return self._nodes[node_id]
+
+    def iter_nodes(self):
+        """
+        :returns: iterator of ``(node_id, node)`` tuples, where ``node`` is a
+            :class:`StoreNode`
+        """
+        return iter(self._nodes.items())
+
+    def iter_labels(self, property_name):
+        """
+        List the values that flows give a node property.
+
+        :param str property_name: ``node_type``, ``technique_id`` or ``tactic_id``
+        :returns: generator of ``(value, node_id, flows)`` tuples, where ``flows`` is
+            the bitset of the flows in which the node has that value
+        """
+        for value, nodes in self._labels[property_name].items():
+            for node_id, flows in nodes.items():
+                yield value, node_id, flows
+
+    def iter_action_edges(self):
+        """
+        :returns: iterator of ``(source, target, flows)`` tuples for the edges of the
+            flows' action graphs, where ``flows`` is the bitset of the flows that have
+            the edge
+        """
+        return (
+            (source, target, flows)
+            for (source, target), flows in self._action_edges.items()
+        )
+
+    def number_of_nodes(self):
+        """
+        :rtype: int
+        """
+        return len(self._nodes)
+
+    def number_of_edges(self):
+        """
+        :rtype: int
+        """
+        return len(self._edges)
+
+    def nodes_of_type(self, node_type):
+        """
+        :param str node_type: a STIX type
+        :returns: the IDs of the nodes that have that type in any flow
+        :rtype: set[str]
+        """
+        return set(self._labels["node_type"].get(node_type, ()))
+
+    def nodes_with_technique(self, technique_id):
+        """
+        :param str technique_id: an ATT&CK technique ID, such as ``T1059``
+        :returns: the IDs of the actions that have that technique in any flow
+        :rtype: set[str]
+        """
+        return set(self._labels["technique_id"].get(technique_id, ()))
+
+    def edges_of_type(self, edge_type):
+        """
+        :param str edge_type: such as ``effect`` or ``relationship``
+        :returns: the ``(source, target, edge_type)`` keys of the edges of that type
+        :rtype: set[tuple]
+        """
+        return set(self._edges_by_type.get(edge_type, ()))
+
+    def flows_with_node(self, node_id):
+        """
+        :param str node_id: STIX ID
+        :returns: the names of the flows that contain the node
+        :rtype: list[str]
+        """
+        node = self._nodes.get(node_id)
+        return self._flow_names(node.flows if node else 0)
+
+    def flows_with_type(self, node_type):
+        """
+        :param str node_type: a STIX type
+        :returns: the names of the flows that contain an object of that type
+        :rtype: list[str]
+        """
+        return self._flow_names(self._label_flows("node_type", node_type))
+
+    def flows_with_technique(self, technique_id):
+        """
+        :param str technique_id: an ATT&CK technique ID, such as ``T1059``
+        :returns: the names of the flows that contain an action with that technique
+        :rtype: list[str]
+        """
+        return self._flow_names(self._label_flows("technique_id", technique_id))
+
+    def flows_with_edge_type(self, edge_type):
+        """
+        :param str edge_type: such as ``effect`` or ``relationship``
+        :returns: the names of the flows that contain an edge of that type
+        :rtype: list[str]
+        """
+        flows = 0
+        for key in self._edges_by_type.get(edge_type, ()):
+            flows |= self._edges[key]
+        return self._flow_names(flows)
+
+    def flows_with_transition(self, source_technique_id, target_technique_id):
+        """
+        Find the flows where an action with one technique is followed by an action with
+        another, i.e. where the action graph has an edge between them.
+
+        :param str source_technique_id:
+        :param str target_technique_id:
+        :returns: the names of the flows
+        :rtype: list[str]
+        """
+        transition = (source_technique_id, target_technique_id)
+        flows = 0
+        for edge_flows in self._transitions.get(transition, {}).values():
+            flows |= edge_flows
+        return self._flow_names(flows)
+
+    def flows_with_all(self, technique_ids):
+        """
+        :param technique_ids: iterable of ATT&CK technique IDs
+        :returns: the names of the flows that contain actions with all of the techniques
+        :rtype: list[str]
+        """
+        flows = -1
+        for technique_id in technique_ids:
+            flows &= self._label_flows("technique_id", technique_id)
+        return self._flow_names(flows if flows != -1 else 0)
+
+    def flow_nodes(self, flow_name):
+        """
+        :param str flow_name:
+        :returns: the IDs of the flow's nodes, in the order they were added
+        :rtype: list[str]
+        :raises KeyError: if there is no flow with that name
+        """
+        return list(self._flows[flow_name].nodes)
+
+    def flow_action_edges(self, flow_name):
+        """
+        :param str flow_name:
+        :returns: the ``(source, target)`` edges of the flow's action graph
+        :rtype: list[tuple[str, str]]
+        :raises KeyError: if there is no flow with that name
+        """
+        return list(self._flows[flow_name].action_edges)
+
+    def _add_node(self, node_id, properties, slot):
+        """
+        Add a flow's node, using its properties in that flow if it defines the node.
+
+        :param str node_id:
+        :param tuple properties: or None
+        :param int slot:
+        """
+        node = self._nodes.get(node_id)
+        if node is None:
+            node = self._nodes[node_id] = StoreNode(None)
+        node.flows |= 1 << slot
+        if properties is not None or node.node_type is None:
+            if properties is None:
+                properties = (None, None, None, None)
+            node.node_type, node.technique_id, node.tactic_id, node.name = properties
+            node.slot = slot
+
+    def _refresh_node(self, node_id, node):
+        """
+        Take a node's properties from another flow after the flow they were from is
+        removed, preferring a flow that defines the node.
+
+        :param str node_id:
+        :param StoreNode node:
+        """
+        flows = node.flows
+        while flows:
+            slot = flows.bit_length() - 1
+            properties = self._flows[self._slot_names[slot]].nodes[node_id]
+            if properties is not None or flows == 1 << slot:
+                self._add_node(node_id, properties, slot)
+                return
+            flows ^= 1 << slot
+
+    def _build_indexes(self):
+        """
+        Build the indexes from the flows.
+        """
+        self._labels = {name: dict() for name in NODE_PROPERTIES[:3]}
+        self._transitions = dict()
+        self._edges_by_type = dict()
+        for key in self._edges:
+            self._edges_by_type.setdefault(key[2], set()).add(key)
+        for flow in self._flows.values():
+            self._index_flow(flow)
+
+    def _index_flow(self, flow):
+        """
+        Add a flow's node labels and transitions to the indexes.
+
+        :param _StoredFlow flow:
+        """
+        bit = 1 << flow.slot
+        for node_id, key in self._iter_flow_labels(flow):
+            nodes = key[0].setdefault(key[1], dict())
+            nodes[node_id] = nodes.get(node_id, 0) | bit
+
+    def _unindex_flow(self, flow):
+        """
+        Remove a flow's node labels and transitions from the indexes.
+
+        :param _StoredFlow flow:
+        """
+        mask = ~(1 << flow.slot)
+        for node_id, key in self._iter_flow_labels(flow):
+            index, label = key
+            nodes = index[label]
+            flows = nodes[node_id] & mask
+            if flows:
+                nodes[node_id] = flows
+            else:
+                del nodes[node_id]
+                if not nodes:
+                    del index[label]
+
+    def _iter_flow_labels(self, flow):
+        """
+        List the index entries for a flow.
+
+        :param _StoredFlow flow:
+        :returns: generator of ``(key, (index, label))`` tuples, where ``key`` is a node
+            ID or an action graph edge
+        """
+        for node_id, properties in flow.nodes.items():
+            if properties is None:
+                continue
+            for name, value in zip(NODE_PROPERTIES[:3], properties):
+                if value is not None:
+                    yield node_id, (self._labels[name], value)
+        for source, target in flow.action_edges:
+            source_properties = flow.nodes[source]
+            target_properties = flow.nodes[target]
+            if source_properties is None or target_properties is None:
+                continue
+            source_technique = source_properties[1]
+            target_technique = target_properties[1]
+            if source_technique is not None and target_technique is not None:
+                transition = (source_technique, target_technique)
+                yield (source, target), (self._transitions, transition)
+
+    def _label_flows(self, property_name, value):
+        """
+        :returns: the bitset of the flows that have a node with a property value
+        :rtype: int
+        """
+        flows = 0
+        for node_flows in self._labels[property_name].get(value, {}).values():
+            flows |= node_flows
+        return flows
+
+    def _flow_names(self, flows):
+        """
+        :param int flows: a bitset of flow slots
+        :returns: the names of the flows, in slot order
+        :rtype: list[str]
+        """
+        names = list()
+        while flows:
+            low_bit = flows & -flows
+            names.append(self._slot_names[low_bit.bit_length() - 1])
+            flows ^= low_bit
+        return names
+
+
+def _discard(index, key, value):
+    """
+    Remove a value from an index, and the key too if it has no values left.
+
+    :param dict index: maps keys to sets of values
+    :param key:
+    :param value:
+    """
+    values = index.get(key)
+    if values is not None:
+        values.discard(value)
+        if not values:
+            del index[key]
@@ -12,7 +12,7 @@ import string
 import textwrap
 from urllib.parse import quote, urljoin
 
-from attack_flow.model import get_flow_object, load_attack_flow_bundle
+from attack_flow.model import get_flow_object, index_bundle, load_attack_flow_bundle
 
 
 NON_ALPHA = re.compile(r"[^a-zA-Z0-9]+")
@@ -281,7 +281,7 @@ def generate_example_flows(jsons, afds):
     """
     reports = list()
     for path in jsons:
-        flow_bundle = load_attack_flow_bundle(path)
+        flow_bundle = index_bundle(load_attack_flow_bundle(path))
         flow = get_flow_object(flow_bundle)
         author = flow_bundle.get_obj(flow["created_by_ref"])[0]
         author_name = author["name"]
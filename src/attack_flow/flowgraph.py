@@ -0,0 +1,625 @@
+"""
+A compact, array-backed graph of Attack Flow bundles.
+
+:func:`attack_flow.graph.bundle_to_networkx` copies every object's properties into the
+attributes of a NetworkX node and every relationship's properties onto an edge, and
+NetworkX stores several dictionaries for every node and edge on top of that. That is
+convenient for small flows, but graphs of merged corpora with millions of edges do not
+fit in memory.
+
+A :class:`FlowGraph` has the same nodes and edges, stored the way
+:class:`attack_flow.refgraph.ReferenceGraph` stores references: STIX IDs are interned as
+integers, and the edges are kept in compressed sparse row (CSR) arrays, once sorted by
+source and once by target, with a small integer code for each edge type. Nodes and
+relationships are not copied; the graph keeps a reference to the objects themselves.
+
+A FlowGraph cannot be modified once it is built. For code that needs NetworkX,
+:meth:`FlowGraph.to_networkx` returns a read-only :class:`NetworkXView` that reads the
+arrays directly instead of copying them.
+"""
+
+from array import array
+from collections.abc import Mapping
+from types import MappingProxyType
+
+import networkx as nx
+
+import attack_flow.profiling
+
+EXTENSION_PREFIX = "extension-definition--"
+
+# The edge type of relationships. Other edges are named after their reference property.
+RELATIONSHIP = "relationship"
+
+# The attributes of nodes that are referenced but not defined.
+_NO_ATTRS = MappingProxyType({})
+
+
+class FlowGraphBuilder:
+    """
+    Collect the nodes and edges of one or more bundles for a :class:`FlowGraph`.
+
+    Nodes are numbered in the order they are first seen. Like
+    :func:`attack_flow.graph.bundle_to_networkx`, the objects of each bundle are added
+    before its edges, so the nodes of a single bundle are in the same order as in
+    NetworkX.
+    """
+
+    def __init__(self):
+        self._index = dict()
+        self._names = list()
+        self._payloads = list()
+        self._node_types = array("H")
+        self._type_codes = {None: 0}
+        self._edge_type_codes = dict()
+        self._sources = array("i")
+        self._targets = array("i")
+        self._edge_types = array("H")
+        self._relationships = dict()
+        self._with_edges = set()
+
+    def add_bundle(self, flow_bundle):
+        """
+        Add the objects in a bundle.
+
+        :param stix2.Bundle flow_bundle: or a decoded bundle, or a record bundle
+        """
+        objects = flow_bundle.get("objects", [])
+        for obj in objects:
+            if obj["type"] != RELATIONSHIP:
+                self.add_node(obj)
+        for obj in objects:
+            self.add_edges(obj)
+
+    def add_node(self, obj):
+        """
+        Add a node for an object. Adding the same ID again replaces the payload.
+
+        :param obj: a STIX object other than a relationship
+        """
+        index = self._intern(obj["id"])
+        self._payloads[index] = obj
+        type_code = self._type_codes.setdefault(obj["type"], len(self._type_codes))
+        self._node_types[index] = type_code
+
+    def add_edges(self, obj):
+        """
+        Add the edges for an object: a relationship is an edge from its source to its
+        target, and any other object has an edge for each of its references. The edges
+        of an object are only added once, even if it is in several bundles.
+
+        :param obj: a STIX object
+        """
+        if obj["id"] in self._with_edges:
+            return
+        self._with_edges.add(obj["id"])
+        if obj["type"] == RELATIONSHIP:
+            self._relationships[len(self._sources)] = obj
+            self._add_edge(obj["source_ref"], obj["target_ref"], RELATIONSHIP)
+            return
+        source = obj["id"]
+        for property_name, value in obj.items():
+            if property_name.endswith("_ref"):
+                self._add_edge(source, value, property_name[:-4])
+            elif property_name.endswith("_refs"):
+                edge_type = property_name[:-5]
+                for target in value:
+                    self._add_edge(source, target, edge_type)
+
+    def build(self, remove_extensions=True):
+        """
+        Build the graph.
+
+        :param bool remove_extensions: remove extension definitions and their creators
+            if they are not attached to other nodes, like
+            :func:`attack_flow.graph.remove_extension_nodes`
+        :rtype: FlowGraph
+        """
+        graph = FlowGraph()
+        graph._index = self._index
+        graph._names = self._names
+        graph._payloads = self._payloads
+        graph._node_types = self._node_types
+        graph._type_names = list(self._type_codes)
+        graph._edge_type_names = list(self._edge_type_codes)
+        graph._removed = bytearray(len(self._names))
+        graph._removed_count = 0
+        graph._build_csr(
+            self._sources, self._targets, self._edge_types, self._relationships
+        )
+        if remove_extensions and graph._remove_extension_nodes():
+            graph._compact()
+        return graph
+
+    def _intern(self, node):
+        index = self._index.get(node)
+        if index is None:
+            index = len(self._names)
+            self._index[node] = index
+            self._names.append(node)
+            self._payloads.append(None)
+            self._node_types.append(0)
+        return index
+
+    def _add_edge(self, source, target, edge_type):
+        code = self._edge_type_codes.setdefault(edge_type, len(self._edge_type_codes))
+        self._sources.append(self._intern(source))
+        self._targets.append(self._intern(target))
+        self._edge_types.append(code)
+
+
+class FlowGraph:
+    """
+    A directed graph of STIX objects, stored in arrays.
+
+    The graph has the same nodes and edges as
+    :func:`attack_flow.graph.bundle_to_networkx`, except that an edge is kept for each
+    reference: an object that refers to another twice has two edges to it. Create one
+    with :meth:`from_bundle` or :class:`FlowGraphBuilder`.
+
+    Methods take and return STIX IDs. Methods whose names end in ``_indices`` work on
+    the integers that the IDs are interned as instead, which is faster for algorithms
+    that visit many nodes.
+    """
+
+    @classmethod
+    def from_bundle(cls, flow_bundle, remove_extensions=True):
+        """
+        Create a graph from a STIX bundle.
+
+        :param stix2.Bundle flow_bundle: or a decoded bundle, or a record bundle
+        :param bool remove_extensions: see :meth:`FlowGraphBuilder.build`
+        :rtype: FlowGraph
+        """
+        return cls.from_bundles([flow_bundle], remove_extensions)
+
+    @classmethod
+    def from_bundles(cls, flow_bundles, remove_extensions=True):
+        """
+        Create one graph from several STIX bundles. An object that appears in more than
+        one bundle is one node, and its references are only added once.
+
+        :param flow_bundles: iterable of bundles
+        :param bool remove_extensions: see :meth:`FlowGraphBuilder.build`
+        :rtype: FlowGraph
+        """
+        with attack_flow.profiling.span("graph.flowgraph"):
+            builder = FlowGraphBuilder()
+            for flow_bundle in flow_bundles:
+                builder.add_bundle(flow_bundle)
+            graph = builder.build(remove_extensions)
+        attack_flow.profiling.count("graph.nodes", len(graph))
+        attack_flow.profiling.count("graph.edges", graph.number_of_edges())
+        return graph
+
+    def __len__(self):
+        return len(self._names) - self._removed_count
+
+    def __contains__(self, node):
+        index = self._index.get(node)
+        return index is not None and not self._removed[index]
+
+    def __iter__(self):
+        removed = self._removed
+        return (name for index, name in enumerate(self._names) if not removed[index])
+
+    def number_of_edges(self):
+        """
+        :rtype: int
+        """
+        return len(self._targets)
+
+    def index(self, node):
+        """
+        Get the integer that a node's ID is interned as.
+
+        :param str node: STIX ID
+        :rtype: int
+        :raises KeyError: if the node is not in the graph
+        """
+        index = self._index[node]
+        if self._removed[index]:
+            raise KeyError(node)
+        return index
+
+    def node_id(self, index):
+        """
+        :param int index:
+        :returns: the STIX ID that ``index`` stands for
+        :rtype: str
+        """
+        return self._names[index]
+
+    def node(self, node):
+        """
+        Get the object for a node.
+
+        :param str node: STIX ID
+        :returns: the object, or None if the node is referenced but not defined
+        """
+        return self._payloads[self.index(node)]
+
+    def node_type(self, node):
+        """
+        :param str node: STIX ID
+        :returns: the node's STIX type, or None if it is not defined
+        :rtype: str
+        """
+        return self._type_names[self._node_types[self.index(node)]]
+
+    def nodes_of_type(self, node_type):
+        """
+        :param str node_type: a STIX type
+        :returns: the IDs of the defined nodes of that type, in node order
+        :rtype: list[str]
+        """
+        if node_type not in self._type_names:
+            return []
+        code = self._type_names.index(node_type)
+        removed = self._removed
+        return [
+            self._names[index]
+            for index, node_code in enumerate(self._node_types)
+            if node_code == code and not removed[index]
+        ]
+
+    def edge_type_code(self, edge_type):
+        """
+        :param str edge_type: such as ``effect`` or ``relationship``
+        :returns: the code that edges of this type are stored with, or None if there are
+            none
+        :rtype: int
+        """
+        try:
+            return self._edge_type_names.index(edge_type)
+        except ValueError:
+            return None
+
+    def successors(self, node):
+        """
+        :param str node: STIX ID
+        :returns: the IDs of the nodes that ``node`` has edges to, in edge order
+        :rtype: list[str]
+        """
+        names = self._names
+        return [names[i] for i in self.successor_indices(self.index(node))]
+
+    def predecessors(self, node):
+        """
+        :param str node: STIX ID
+        :returns: the IDs of the nodes that have edges to ``node``, in edge order
+        :rtype: list[str]
+        """
+        names = self._names
+        return [names[i] for i in self.predecessor_indices(self.index(node))]
+
+    def out_edges(self, node):
+        """
+        :param str node: STIX ID
+        :returns: generator of ``(target, edge_type, relationship)`` tuples, where
+            ``relationship`` is None unless the edge is a relationship
+        """
+        return self._iter_edges(self.index(node), outgoing=True)
+
+    def in_edges(self, node):
+        """
+        :param str node: STIX ID
+        :returns: generator of ``(source, edge_type, relationship)`` tuples, where
+            ``relationship`` is None unless the edge is a relationship
+        """
+        return self._iter_edges(self.index(node), outgoing=False)
+
+    def _iter_edges(self, index, outgoing):
+        names = self._names
+        edge_type_names = self._edge_type_names
+        relationships = self._relationships
+        for neighbor, edge in self._iter_edge_indices(index, outgoing):
+            yield (
+                names[neighbor],
+                edge_type_names[self._edge_types[edge]],
+                relationships.get(edge),
+            )
+
+    def _iter_edge_indices(self, index, outgoing):
+        """
+        :param int index:
+        :param bool outgoing: whether to list the node's outgoing or incoming edges
+        :returns: generator of ``(neighbor, edge)`` tuples, where ``edge`` is the
+            edge's position in the outgoing edge arrays
+        """
+        if outgoing:
+            for edge in range(self._offsets[index], self._offsets[index + 1]):
+                yield self._targets[edge], edge
+        else:
+            for position in range(self._in_offsets[index], self._in_offsets[index + 1]):
+                yield self._in_sources[position], self._in_edges[position]
+
+    def successor_indices(self, index):
+        """
+        :param int index:
+        :returns: the targets of the node's edges, as a view of the graph's arrays
+        :rtype: memoryview
+        """
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return memoryview(self._targets)[start:end]
+
+    def predecessor_indices(self, index):
+        """
+        :param int index:
+        :returns: the sources of the node's incoming edges, as a view of the graph's
+            arrays
+        :rtype: memoryview
+        """
+        start, end = self._in_offsets[index], self._in_offsets[index + 1]
+        return memoryview(self._in_sources)[start:end]
+
+    def edge_type_indices(self, index):
+        """
+        :param int index:
+        :returns: the type codes of the node's edges, in the same order as
+            :meth:`successor_indices`
+        :rtype: memoryview
+        """
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return memoryview(self._edge_types)[start:end]
+
+    def to_networkx(self):
+        """
+        Get a read-only NetworkX view of the graph, without copying it.
+
+        :rtype: NetworkXView
+        """
+        return NetworkXView(self)
+
+    def _build_csr(self, sources, targets, edge_types, relationships):
+        """
+        Sort the edges into CSR arrays, keeping the edges of each node in the order they
+        were added.
+
+        :param array sources:
+        :param array targets:
+        :param array edge_types:
+        :param dict relationships: relationship objects by edge number
+        """
+        node_count = len(self._names)
+        self._offsets = _prefix_sums(sources, node_count)
+        self._in_offsets = _prefix_sums(targets, node_count)
+
+        edge_count = len(sources)
+        self._targets = array("i", bytes(4 * edge_count))
+        self._edge_types = array("H", bytes(2 * edge_count))
+        self._relationships = dict()
+        positions = self._offsets[:-1]
+        order = array("q", bytes(8 * edge_count))
+        for edge in range(edge_count):
+            source = sources[edge]
+            position = positions[source]
+            positions[source] = position + 1
+            order[edge] = position
+            self._targets[position] = targets[edge]
+            self._edge_types[position] = edge_types[edge]
+        for edge, relationship in relationships.items():
+            self._relationships[order[edge]] = relationship
+
+        self._in_sources = array("i", bytes(4 * edge_count))
+        self._in_edges = array("q", bytes(8 * edge_count))
+        positions = self._in_offsets[:-1]
+        for edge in range(edge_count):
+            target = targets[edge]
+            position = positions[target]
+            positions[target] = position + 1
+            self._in_sources[position] = sources[edge]
+            self._in_edges[position] = order[edge]
+
+    def _remove_extension_nodes(self):
+        """
+        Mark extension definitions and their creators as removed, like
+        :func:`attack_flow.graph.remove_extension_nodes`.
+
+        :returns: whether any node was removed
+        :rtype: bool
+        """
+        removed = self._removed
+        found = False
+        for index, name in enumerate(self._names):
+            if not name.startswith(EXTENSION_PREFIX) or removed[index]:
+                continue
+            found = True
+            neighbors = dict.fromkeys(
+                i for i in self.successor_indices(index) if not removed[i]
+            )
+            removed[index] = 1
+            self._removed_count += 1
+            for neighbor in neighbors:
+                if removed[neighbor]:
+                    continue
+                if all(
+                    removed[i] or i == neighbor
+                    for i in self.successor_indices(neighbor)
+                ):
+                    removed[neighbor] = 1
+                    self._removed_count += 1
+        return found
+
+    def _compact(self):
+        """
+        Rebuild the CSR arrays without the edges of removed nodes.
+        """
+        removed = self._removed
+        sources = array("i")
+        targets = array("i")
+        edge_types = array("H")
+        relationships = dict()
+        for source in range(len(self._names)):
+            if removed[source]:
+                continue
+            for edge in range(self._offsets[source], self._offsets[source + 1]):
+                target = self._targets[edge]
+                if removed[target]:
+                    continue
+                if edge in self._relationships:
+                    relationships[len(sources)] = self._relationships[edge]
+                sources.append(source)
+                targets.append(target)
+                edge_types.append(self._edge_types[edge])
+        self._build_csr(sources, targets, edge_types, relationships)
+
+
+def _prefix_sums(indices, node_count):
+    """
+    Count the edges of each node and turn the counts into CSR offsets.
+
+    :param array indices: the node of each edge
+    :param int node_count:
+    :returns: ``node_count + 1`` offsets
+    :rtype: array
+    """
+    offsets = array("q", bytes(8 * (node_count + 1)))
+    for index in indices:
+        offsets[index + 1] += 1
+    for index in range(node_count):
+        offsets[index + 1] += offsets[index]
+    return offsets
+
+
+class NetworkXView(nx.DiGraph):
+    """
+    A read-only NetworkX graph that reads a :class:`FlowGraph`.
+
+    Nodes and edges are the same as :func:`attack_flow.graph.bundle_to_networkx`
+    would create. Node attributes are the STIX objects themselves, and the attributes of
+    a relationship edge are a read-only view of the relationship without its
+    ``source_ref`` and ``target_ref``. Nothing is copied until it is read, so
+    the view costs almost no memory; NetworkX algorithms that only read the graph
+    work as usual. Any attempt to modify the view raises ``nx.NetworkXError``. Use
+    :meth:`copy` for a graph that can be modified.
+
+    :param FlowGraph flow_graph:
+    """
+
+    def __init__(self, flow_graph=None, **attr):
+        if flow_graph is None:
+            # NetworkX creates empty instances of the class for its own views.
+            super().__init__(**attr)
+            return
+        self.graph = dict(attr)
+        self.flow_graph = flow_graph
+        self._node = _NodeMap(flow_graph)
+        self._adj = self._succ = _AdjacencyMap(flow_graph, outgoing=True)
+        self._pred = _AdjacencyMap(flow_graph, outgoing=False)
+        self.__networkx_cache__ = dict()
+        nx.freeze(self)
+
+    def copy(self, as_view=False):
+        """
+        Copy the view into an ordinary ``nx.DiGraph``.
+
+        :param bool as_view: return a view of this view instead
+        :rtype: nx.DiGraph
+        """
+        if as_view:
+            return nx.graphviews.generic_graph_view(self)
+        graph = nx.DiGraph()
+        graph.graph.update(self.graph)
+        graph.add_nodes_from((node, dict(data)) for node, data in self._node.items())
+        graph.add_edges_from(
+            (source, target, dict(data))
+            for source, targets in self._succ.items()
+            for target, data in targets.items()
+        )
+        return graph
+
+
+# Properties of a relationship that bundle_to_networkx() leaves out of edge attributes.
+_ENDPOINTS = frozenset(("source_ref", "target_ref"))
+
+
+class _NodeMap(Mapping):
+    """
+    Node attributes, by node, for :class:`NetworkXView`.
+    """
+
+    def __init__(self, flow_graph):
+        self._graph = flow_graph
+
+    def __getitem__(self, node):
+        payload = self._graph.node(node)
+        return _NO_ATTRS if payload is None else payload
+
+    def __iter__(self):
+        return iter(self._graph)
+
+    def __len__(self):
+        return len(self._graph)
+
+    def __contains__(self, node):
+        return node in self._graph
+
+
+class _AdjacencyMap(Mapping):
+    """
+    Successors or predecessors, with edge attributes, by node, for
+    :class:`NetworkXView`.
+    """
+
+    def __init__(self, flow_graph, outgoing):
+        self._graph = flow_graph
+        self._outgoing = outgoing
+        self._edge_attrs = [
+            MappingProxyType({"type": name}) for name in flow_graph._edge_type_names
+        ]
+
+    def __getitem__(self, node):
+        graph = self._graph
+        names = graph._names
+        edge_types = graph._edge_types
+        relationships = graph._relationships
+        # When there are several edges between two nodes, the last one wins.
+        neighbors = dict()
+        index = graph.index(node)
+        for neighbor, edge in graph._iter_edge_indices(index, self._outgoing):
+            relationship = relationships.get(edge)
+            if relationship is None:
+                attrs = self._edge_attrs[edge_types[edge]]
+            else:
+                attrs = _RelationshipAttrs(relationship)
+            neighbors[names[neighbor]] = attrs
+        return MappingProxyType(neighbors)
+
+    def __iter__(self):
+        return iter(self._graph)
+
+    def __len__(self):
+        return len(self._graph)
+
+    def __contains__(self, node):
+        return node in self._graph
+
+
+class _RelationshipAttrs(Mapping):
+    """
+    The attributes of a relationship edge for :class:`NetworkXView`: the relationship's
+    properties without its endpoints.
+    """
+
+    __slots__ = ("_relationship",)
+
+    def __init__(self, relationship):
+        self._relationship = relationship
+
+    def __getitem__(self, key):
+        if key in _ENDPOINTS:
+            raise KeyError(key)
+        return self._relationship[key]
+
+    def __iter__(self):
+        return (key for key in self._relationship if key not in _ENDPOINTS)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        return key not in _ENDPOINTS and key in self._relationship
+
+    def __repr__(self):
+        return repr(dict(self))
@@ -2,42 +2,92 @@
 Convert Attack Flow to NeworkX format for standard graph analysis/manipulation.
 """
 
+import weakref
+
 import networkx as nx
 
+import attack_flow.flowgraph
+import attack_flow.profiling
+
+ACTION_PREFIX = "attack-action--"
+CONNECTOR_TYPES = ("attack-operator", "attack-condition")
+FLOW_EDGE_TYPES = ("effect", "on_true", "on_false")
+_action_graph_cache = dict()
+
 
 def bundle_to_networkx(flow_bundle):
     """
     Convert an Attack Flow in STIX bundle format to NetworkX format.
 
-    :param stix2.Bundle flow_bundle:
+    :param stix2.Bundle flow_bundle: or a decoded bundle, or a record bundle
     :rtype: nx.Graph
     """
-    graph = nx.DiGraph()
+    with attack_flow.profiling.span("graph.networkx"):
+        graph = nx.DiGraph()
 
-    # Make a first pass to add nodes to the graph.
-    for obj in flow_bundle.get("objects", []):
-        if obj["type"] == "relationship":
-            continue
-        else:
-            graph.add_node(obj["id"], **obj)
-
-    # Make a second pass to add edges to the graph.
-    for obj in flow_bundle.get("objects", []):
-        if obj["type"] == "relationship":
-            properties = dict(obj.items())
-            del properties["source_ref"]
-            del properties["target_ref"]
-            graph.add_edge(obj.source_ref, obj.target_ref, **properties)
-        else:
-            for property_name, target_ref in obj.items():
-                if property_name.endswith("_ref"):
-                    graph.add_edge(obj.id, target_ref, type=property_name[:-4])
-                elif property_name.endswith("_refs"):
-                    target_refs = target_ref
-                    for target_ref in target_refs:
-                        graph.add_edge(obj["id"], target_ref, type=property_name[:-5])
-
-    # Remove extension objects and creators if they are not attached to other nodes.
+        # Make a first pass to add nodes to the graph.
+        for obj in flow_bundle.get("objects", []):
+            if obj["type"] == "relationship":
+                continue
+            else:
+                graph.add_node(obj["id"], **obj)
+
+        # Make a second pass to add edges to the graph.
+        for obj in flow_bundle.get("objects", []):
+            graph.add_edges_from(iter_object_edges(obj))
+
+        remove_extension_nodes(graph)
+    attack_flow.profiling.count("graph.nodes", graph.number_of_nodes())
+    attack_flow.profiling.count("graph.edges", graph.number_of_edges())
+    return graph
+
+
+def bundle_to_flow_graph(flow_bundle):
+    """
+    Convert an Attack Flow in STIX bundle format to a compact graph.
+
+    The graph has the same nodes and edges as :func:`bundle_to_networkx` but uses a
+    fraction of the memory, because it refers to the STIX objects instead of copying
+    them. Use its ``to_networkx()`` method to run NetworkX algorithms on it.
+
+    :param stix2.Bundle flow_bundle:
+    :rtype: attack_flow.flowgraph.FlowGraph
+    """
+    return attack_flow.flowgraph.FlowGraph.from_bundle(flow_bundle)
+
+
+def iter_object_edges(obj):
+    """
+    Generate the graph edges for a single STIX object.
+
+    A relationship is a single edge from its source to its target, labeled with the
+    relationship's other properties. Any other object has one edge for each ``_ref`` or
+    ``_refs`` property, labeled with the property name.
+
+    :param stix2.base._STIXBase obj:
+    :returns: generator of ``(source, target, properties)`` tuples
+    """
+    if obj["type"] == "relationship":
+        properties = dict(obj.items())
+        del properties["source_ref"]
+        del properties["target_ref"]
+        yield obj["source_ref"], obj["target_ref"], properties
+    else:
+        for property_name, target_ref in obj.items():
+            if property_name.endswith("_ref"):
+                yield obj["id"], target_ref, {"type": property_name[:-4]}
+            elif property_name.endswith("_refs"):
+                target_refs = target_ref
+                for target_ref in target_refs:
+                    yield obj["id"], target_ref, {"type": property_name[:-5]}
+
+
+def remove_extension_nodes(graph):
+    """
+    Remove extension objects and creators if they are not attached to other nodes.
+
+    :param nx.DiGraph graph: modified in place
+    """
     ext_nodes = [id for id in graph.nodes() if id.startswith("extension-definition--")]
     for ext_node in ext_nodes:
         neighbors = list(graph.neighbors(ext_node))
@@ -49,8 +99,6 @@ def bundle_to_networkx(flow_bundle):
             if len(neighbor_neighbors) == 0:
                 graph.remove_node(neighbor)
 
-    return graph
-
 
 def induce_action_graph(full_graph):
     """
@@ -73,3 +121,246 @@ def induce_action_graph(full_graph):
         graph.remove_node(node)
 
     return graph
+
+
+def build_action_graph(flow_graph, effects_only=True):
+    """
+    Induce the action graph for an Attack Flow by following its effect edges.
+
+    Unlike :func:`induce_action_graph`, this does not connect every incoming edge of a
+    non-action node to every outgoing edge. It follows the ``effect_refs``,
+    ``on_true_refs``, and ``on_false_refs`` edges from each action to its nearest
+    downstream actions, through any operators and conditions in between. All of the
+    edges out of an operator or condition are followed, because the Builder exports
+    some of them as relationships, but paths through other objects such as assets are
+    not. The actions reachable from each operator or condition are computed once and
+    shared by every path through it, so the time is linear in the size of the flow
+    rather than quadratic in node degree.
+
+    With ``effects_only=False``, every edge is followed, through any object that is not
+    an action. The result then has the same edges as :func:`induce_action_graph`,
+    including those between actions that are connected through an asset.
+
+    Each edge is labeled ``type="effect"`` like the edges of
+    :func:`induce_action_graph`, and ``via`` lists the IDs of the objects that connect
+    the two actions, in node order. These are operators and conditions, or with
+    ``effects_only=False``, any objects that are not actions, such as assets. ``via`` is
+    empty when an action refers to the other action directly.
+
+    :param attack_flow.flowgraph.FlowGraph flow_graph:
+    :param bool effects_only: only follow effect edges, and only through operators and
+        conditions
+    :rtype: nx.DiGraph
+    """
+    with attack_flow.profiling.span("graph.action_graph"):
+        flow_codes = set()
+        for edge_type in FLOW_EDGE_TYPES:
+            code = flow_graph.edge_type_code(edge_type)
+            if code is not None:
+                flow_codes.add(code)
+
+        def flow_successors(index):
+            if not effects_only or index in is_connector:
+                return flow_graph.successor_indices(index)
+            return [
+                target
+                for target, code in zip(
+                    flow_graph.successor_indices(index),
+                    flow_graph.edge_type_indices(index),
+                )
+                if code in flow_codes
+            ]
+
+        actions = [
+            flow_graph.index(node)
+            for node in flow_graph
+            if node.startswith(ACTION_PREFIX)
+        ]
+        is_action = set(actions)
+        is_connector = {
+            flow_graph.index(node)
+            for node_type in CONNECTOR_TYPES
+            for node in flow_graph.nodes_of_type(node_type)
+        }
+        reach = _reach_actions(actions, is_action, flow_successors)
+
+        node_id = flow_graph.node_id
+        via_ids = dict()
+
+        def iter_edges(action):
+            source = node_id(action)
+            for target_action, via in _downstream_actions(
+                flow_successors(action), is_action, reach
+            ).items():
+                try:
+                    via_names = via_ids[via]
+                except KeyError:
+                    via_names = via_ids[via] = tuple(map(node_id, via))
+                data = {"type": "effect", "via": via_names}
+                yield source, node_id(target_action), data
+
+        graph = nx.DiGraph()
+        for action in actions:
+            payload = flow_graph.node(node_id(action))
+            graph.add_node(node_id(action), **(payload or {}))
+        for action in actions:
+            graph.add_edges_from(iter_edges(action))
+    attack_flow.profiling.count("graph.actions", graph.number_of_nodes())
+    return graph
+
+
+def get_action_graph(flow_bundle, effects_only=True):
+    """
+    Get the action graph for a bundle, reusing the graph from an earlier call with the
+    same bundle object and arguments.
+
+    Graphs are cached by the identity of the bundle until the bundle is garbage
+    collected, so a graph is not updated if its bundle is modified. Bundles that cannot
+    be weakly referenced, such as plain dicts, are not cached. The graph is frozen
+    because it is shared between callers; use ``graph.copy()`` to get one that can be
+    modified.
+
+    :param stix2.Bundle flow_bundle:
+    :param bool effects_only: see :func:`build_action_graph`
+    :returns: the result of :func:`build_action_graph`
+    :rtype: nx.DiGraph
+    """
+    key = (id(flow_bundle), effects_only)
+    cached = _action_graph_cache.get(key)
+    if cached is not None and cached[0]() is flow_bundle:
+        return cached[1]
+
+    flow_graph = bundle_to_flow_graph(flow_bundle)
+    graph = nx.freeze(build_action_graph(flow_graph, effects_only))
+    try:
+        bundle_ref = weakref.ref(
+            flow_bundle, lambda _, key=key: _action_graph_cache.pop(key, None)
+        )
+    except TypeError:
+        return graph
+    _action_graph_cache[key] = (bundle_ref, graph)
+    return graph
+
+
+def clear_action_graph_cache():
+    """
+    Forget the graphs cached by :func:`get_action_graph`.
+    """
+    _action_graph_cache.clear()
+
+
+def _reach_actions(actions, is_action, flow_successors):
+    """
+    Find the nearest actions downstream of each connecting node.
+
+    Connecting nodes are the nodes other than actions that ``flow_successors`` leads
+    to: operators and conditions, or any other objects if every edge is followed. They
+    are visited depth first with Tarjan's algorithm, which finishes each strongly
+    connected component after every component downstream of it, so each component's
+    result is built from results that are already complete. The nodes in a cycle share
+    one result.
+
+    :param list[int] actions: node indexes of the actions
+    :param set[int] is_action: the same indexes, for lookups
+    :param flow_successors: function that returns the targets of a node's effect edges
+    :returns: a dict that maps each connecting node reachable from an action to a dict
+        from action index to the sorted indexes of the connecting nodes traversed on the
+        way to that action
+    :rtype: dict
+    """
+    reach = dict()
+    order = dict()
+    lowlink = dict()
+    stack = list()
+    on_stack = set()
+    work = list()
+
+    def visit(node):
+        order[node] = lowlink[node] = len(order)
+        stack.append(node)
+        on_stack.add(node)
+        work.append((node, iter(flow_successors(node))))
+
+    for action in actions:
+        for root in flow_successors(action):
+            if root in is_action or root in order:
+                continue
+            visit(root)
+            while work:
+                node, successors = work[-1]
+                for target in successors:
+                    if target in is_action:
+                        continue
+                    if target not in order:
+                        visit(target)
+                        break
+                    if target in on_stack:
+                        lowlink[node] = min(lowlink[node], order[target])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == order[node]:
+                        component = set()
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.add(member)
+                            if member == node:
+                                break
+                        result = _component_reach(
+                            component, reach, is_action, flow_successors
+                        )
+                        for member in component:
+                            reach[member] = result
+    return reach
+
+
+def _component_reach(component, reach, is_action, flow_successors):
+    """
+    :param set[int] component: a strongly connected set of connecting nodes
+    :param dict reach: the results for the components downstream of this one
+    :param set[int] is_action:
+    :param flow_successors:
+    :returns: the result for the component, as described in :func:`_reach_actions`
+    :rtype: dict
+    """
+    result = dict()
+    for member in component:
+        for target in flow_successors(member):
+            if target in is_action:
+                result.setdefault(target, set()).update(component)
+            elif target not in component:
+                for action, via in reach[target].items():
+                    result.setdefault(action, set()).update(via, component)
+    return {action: tuple(sorted(via)) for action, via in result.items()}
+
+
+def _downstream_actions(successors, is_action, reach):
+    """
+    Combine the actions reachable through each of an action's effect edges.
+
+    :param successors: the targets of the action's effect edges
+    :param set[int] is_action:
+    :param dict reach: the result of :func:`_reach_actions`
+    :returns: a dict from action index to the sorted indexes of the connecting nodes
+        traversed on the way to it
+    :rtype: dict
+    """
+    if len(successors) == 1 and successors[0] not in is_action:
+        # The common case of a single connecting node: share its result.
+        return reach[successors[0]]
+    downstream = dict()
+    for target in successors:
+        if target in is_action:
+            items = ((target, ()),)
+        else:
+            items = reach[target].items()
+        for action, via in items:
+            previous = downstream.get(action)
+            if previous is None or previous == via:
+                downstream[action] = via
+            else:
+                downstream[action] = tuple(sorted(set(previous).union(via)))
+    return downstream
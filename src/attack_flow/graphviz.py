@@ -4,10 +4,12 @@ import textwrap
 
 import graphviz
 
+import attack_flow.profiling
 from .model import (
     confidence_num_to_label,
     get_flow_object,
     get_viz_ignored_ids,
+    index_bundle,
     VIZ_IGNORE_COMMON_PROPERTIES,
 )
 
@@ -19,6 +21,22 @@ def label_escape(text):
     return graphviz.escape(html.escape(text))
 
 
+def convert(bundle):
+    """
+    Convert an Attack Flow STIX bundle into Graphviz format.
+
+    A bundle whose flow has the ``attack-tree`` scope is drawn as an attack tree;
+    anything else is drawn as an attack flow.
+
+    :param stix2.Bundle bundle:
+    :rtype: str
+    """
+    with attack_flow.profiling.span("graphviz.convert"):
+        if bundle.get("objects", "") and get_flow_object(bundle).scope == "attack-tree":
+            return convert_attack_tree(bundle)
+        return convert_attack_flow(bundle)
+
+
 def convert_attack_flow(bundle):
     """
     Convert an Attack Flow STIX bundle into Graphviz format.
@@ -26,6 +44,7 @@ def convert_attack_flow(bundle):
     :param stix2.Bundle flow:
     :rtype: str
     """
+    bundle = index_bundle(bundle)
 
     gv = graphviz.Digraph()
     gv.body = _get_body_label(bundle)
@@ -80,6 +99,7 @@ def convert_attack_tree(bundle):
     :param stix2.Bundle flow:
     :rtype: str
     """
+    bundle = index_bundle(bundle)
 
     gv = graphviz.Digraph(graph_attr={"rankdir": "BT"})
     gv.body = _get_body_label(bundle)
@@ -0,0 +1,514 @@
+"""
+Re-validate an Attack Flow document after small changes.
+
+An editor or an ingest service that patches a bundle one object at a time would
+otherwise have to re-validate the whole bundle after every patch. The
+:class:`IncrementalValidator` holds a validated bundle and updates its validation
+state as objects are added, updated, and deleted, so the cost of each change depends on
+the size of the change rather than the size of the flow.
+"""
+
+from collections import Counter, deque
+import re
+
+import stix2.exceptions
+
+from .model import (
+    ATTACK_FLOW_EXTENSION_ID,
+    parse_attack_flow_bundle,
+    parse_attack_flow_bundle_header,
+    parse_attack_flow_bundle_object,
+)
+from .refgraph import iter_object_refs, summarize_node
+from .schema import (
+    ATTACK_FLOW_SDOS,
+    check_object_schema,
+    check_object_summary,
+    ValidationResult,
+)
+
+SEED_TYPES = ("attack-flow", "extension-definition")
+
+
+class IncrementalValidator:
+    """
+    Hold an Attack Flow bundle and keep its validation result up to date.
+
+    The result of :meth:`validate` has the same messages as
+    :func:`attack_flow.schema.validate_json` on the current bundle, except that the
+    graph warnings are ordered by node rather than in an arbitrary order.
+
+    Each change re-runs the schema check and the STIX parser for the changed object
+    only. The graph checks keep track of which nodes are connected to the main flow:
+    adding references only explores the nodes that become connected, and removing
+    references only explores the nodes around the removed references until each one
+    finds a path back to the flow. Changes that affect which extension nodes are
+    removed from the graph, or that remove the ``attack-flow`` object itself, recompute
+    the connectivity of the whole graph.
+
+    :param dict flow_json: a bundle parsed from JSON; its objects must have unique IDs
+    :param bool compiled: use compiled validators for Attack Flow SDOs
+    """
+
+    def __init__(self, flow_json, compiled=False):
+        self._compiled = compiled
+        self._header = {k: v for k, v in flow_json.items() if k != "objects"}
+        self._has_objects = isinstance(flow_json.get("objects"), list)
+        self._is_bundle = self._header.get("type") == "bundle"
+        self._header_error = self._parse_header()
+
+        # Object state
+        self._objects = dict()
+        self._seq = dict()
+        self._next_seq = 0
+        self._type_counts = Counter()
+        self._schema_messages = dict()
+        self._stix_errors = dict()
+
+        # Graph state
+        self._object_edges = dict()
+        self._node_attrs = dict()
+        self._succ = dict()
+        self._pred = dict()
+        self._degree = Counter()
+        self._node_order = dict()
+        self._next_node_order = 0
+        self._ext_nodes = set()
+        self._flow_nodes = set()
+        self._removed = set()
+        self._reached = set()
+        self._unreached = set()
+        self._dangling = set()
+
+        for obj in flow_json["objects"] if self._has_objects else []:
+            if obj.get("id") in self._objects:
+                raise ValueError(f"Duplicate object id={obj.get('id')}")
+            self._apply(obj.get("id"), obj, incremental=False)
+        self._removed = self._find_removed_nodes()
+        self._rebuild()
+
+    def add(self, obj):
+        """
+        Add an object to the bundle.
+
+        :param dict obj: a STIX object parsed from JSON
+        :raises ValueError: if an object with the same ID already exists
+        """
+        if obj.get("id") in self._objects:
+            raise ValueError(f"Object id={obj.get('id')} already exists")
+        self._apply(obj.get("id"), obj)
+
+    def update(self, obj):
+        """
+        Replace the object that has the same ID.
+
+        :param dict obj: a STIX object parsed from JSON
+        :raises KeyError: if there is no object with that ID
+        """
+        if obj.get("id") not in self._objects:
+            raise KeyError(f"Object id={obj.get('id')} does not exist")
+        self._apply(obj["id"], obj)
+
+    def delete(self, obj_id):
+        """
+        Delete an object from the bundle.
+
+        :param str obj_id:
+        :raises KeyError: if there is no object with that ID
+        """
+        if obj_id not in self._objects:
+            raise KeyError(f"Object id={obj_id} does not exist")
+        self._apply(obj_id, None)
+
+    def validate(self):
+        """
+        Return the validation result for the bundle in its current state.
+
+        :rtype: ValidationResult
+        """
+        result = ValidationResult()
+        check_object_summary(
+            self._header,
+            self._has_objects,
+            self._type_counts["attack-flow"],
+            self._type_counts[_ATTACK_FLOW_EXTENSION] > 0,
+            result,
+        )
+        for obj_id in sorted(self._schema_messages, key=self._seq.__getitem__):
+            result.messages.extend(self._schema_messages[obj_id])
+
+        stix_error = self._header_error
+        if stix_error is None and self._is_bundle and self._stix_errors:
+            stix_error = self._stix_errors[min(self._stix_errors, key=self._seq.get)]
+        if stix_error is not None:
+            result.add_error(f"Unable to parse this flow as STIX 2.1: {stix_error}")
+            return result
+        if not self._is_bundle:
+            # Not a bundle, so there is no flow graph to check.
+            return result
+
+        for node in sorted(self._unreached, key=self._node_key):
+            if not re.match(r"^(threat-actor|campaign)--", node):
+                result.add_warning(f"Node id={node} is not connected to the main flow.")
+        for node in sorted(self._dangling, key=self._node_key):
+            result.add_warning(
+                f"Node id={node} is referenced in the flow but is not defined."
+            )
+        flows = [n for n in self._flow_nodes if n not in self._removed]
+        if flows:
+            flow = min(flows, key=self._node_key)
+            if not self._node_attrs.get(flow, {}).get("description"):
+                result.add_warning(
+                    "The ``attack-flow`` object should have a description."
+                )
+        return result
+
+    def to_json(self):
+        """
+        Return the bundle in its current state.
+
+        :rtype: dict
+        """
+        flow_json = dict(self._header)
+        flow_json["objects"] = list(self._objects.values())
+        return flow_json
+
+    def _parse_header(self):
+        """Parse the bundle's own properties and return the STIX error, if any."""
+        try:
+            if self._is_bundle:
+                parse_attack_flow_bundle_header(self._header)
+            else:
+                parse_attack_flow_bundle(self._header)
+        except stix2.exceptions.STIXError as e:
+            return e
+        return None
+
+    def _apply(self, obj_id, obj, incremental=True):
+        """
+        Replace the object with ``obj_id`` by ``obj``, or delete it if ``obj`` is None.
+
+        The new object is checked before any state is changed, so the validator is
+        unchanged if the check raises an exception.
+        """
+        if obj is not None:
+            messages = ValidationResult()
+            check_object_schema(obj, messages, self._compiled)
+            stix_obj = stix_error = None
+            try:
+                stix_obj = parse_attack_flow_bundle_object(obj, self._header)
+            except stix2.exceptions.STIXError as e:
+                stix_error = e
+
+        old_obj = self._objects.get(obj_id)
+        if old_obj is not None:
+            self._type_counts[_object_kind(old_obj)] -= 1
+        self._schema_messages.pop(obj_id, None)
+        self._stix_errors.pop(obj_id, None)
+        old_edges = self._object_edges.pop(obj_id, ())
+        new_edges = ()
+        new_attrs = None
+
+        if obj is None:
+            del self._objects[obj_id]
+            del self._seq[obj_id]
+        else:
+            self._objects[obj_id] = obj
+            if obj_id not in self._seq:
+                self._seq[obj_id] = self._next_seq
+                self._next_seq += 1
+            self._type_counts[_object_kind(obj)] += 1
+            if messages.messages:
+                self._schema_messages[obj_id] = messages.messages
+            if stix_error is not None:
+                self._stix_errors[obj_id] = stix_error
+            elif stix_obj["type"] != "relationship":
+                new_attrs = summarize_node(stix_obj)
+            if stix_obj is not None:
+                new_edges = list(iter_object_refs(stix_obj))
+                self._object_edges[obj_id] = new_edges
+
+        self._update_graph(obj_id, new_attrs, old_edges, new_edges, incremental)
+
+    def _update_graph(self, node, attrs, old_edges, new_edges, incremental):
+        """
+        Update the graph for a changed object.
+
+        :param str node: the changed object's ID
+        :param dict attrs: the object's new node attributes, or None if it is no
+            longer a node
+        :param list old_edges: the object's previous edges
+        :param list new_edges: the object's current edges
+        :param bool incremental: update connectivity; otherwise the caller must call
+            :meth:`_rebuild`
+        """
+        was_seed = self._is_seed(node)
+        if attrs is None:
+            self._node_attrs.pop(node, None)
+        else:
+            self._node_attrs[node] = attrs
+
+        new_counts = Counter(new_edges)
+        old_counts = Counter(old_edges)
+        added_edges = new_counts - old_counts
+        removed_edges = old_counts - new_counts
+        touched = {node}
+        for (source, target), count in removed_edges.items():
+            self._remove_edge(source, target, count)
+            touched.update((source, target))
+        for (source, target), count in added_edges.items():
+            self._add_edge(source, target, count)
+            touched.update((source, target))
+        for touched_node in touched:
+            self._refresh_node(touched_node)
+
+        if not incremental:
+            return
+
+        removed = self._find_removed_nodes()
+        if removed != self._removed or (was_seed and not self._is_seed(node)):
+            self._removed = removed
+            self._rebuild()
+            return
+
+        for touched_node in touched:
+            self._refresh_active_node(touched_node)
+
+        # Nodes that lost a neighbor may no longer be connected to a seed.
+        self._prune(
+            node
+            for edge in removed_edges
+            if not self._adjacent(*edge)
+            for node in edge
+            if node in self._reached
+        )
+
+        # Nodes that gained a neighbor, or became a seed, may now be connected.
+        starts = list()
+        if self._is_seed(node) and node in self._unreached:
+            self._unreached.remove(node)
+            self._reached.add(node)
+            starts.append(node)
+        for source, target in added_edges:
+            for near, far in ((source, target), (target, source)):
+                if near in self._reached and far in self._unreached:
+                    self._unreached.remove(far)
+                    self._reached.add(far)
+                    starts.append(far)
+        self._extend(starts)
+
+    def _add_edge(self, source, target, count):
+        self._succ.setdefault(source, Counter())[target] += count
+        self._pred.setdefault(target, Counter())[source] += count
+        self._degree[source] += count
+        self._degree[target] += count
+
+    def _remove_edge(self, source, target, count):
+        _decrement(self._succ, source, target, count)
+        _decrement(self._pred, target, source, count)
+        _decrement(self._degree, None, source, count)
+        _decrement(self._degree, None, target, count)
+
+    def _adjacent(self, a, b):
+        """Return true if ``a`` and ``b`` share an edge, in either direction."""
+        return b in self._succ.get(a, ()) or a in self._succ.get(b, ())
+
+    def _exists(self, node):
+        return node in self._node_attrs or node in self._degree
+
+    def _is_active(self, node):
+        return self._exists(node) and node not in self._removed
+
+    def _is_seed(self, node):
+        return (
+            self._is_active(node)
+            and self._node_attrs.get(node, {}).get("type") in SEED_TYPES
+        )
+
+    def _neighbors(self, node):
+        """Generate the active nodes next to ``node`` in the undirected graph."""
+        for neighbor in self._succ.get(node, ()):
+            if neighbor not in self._removed:
+                yield neighbor
+        for neighbor in self._pred.get(node, ()):
+            if neighbor not in self._removed:
+                yield neighbor
+
+    def _node_key(self, node):
+        """
+        Sort nodes the way :func:`attack_flow.graph.bundle_to_networkx` adds them:
+        defined objects in bundle order, then referenced IDs in the order they were
+        first seen.
+        """
+        if node in self._node_attrs:
+            return (0, self._seq[node])
+        return (1, self._node_order[node])
+
+    def _refresh_node(self, node):
+        """Update the bookkeeping that depends on whether a node exists."""
+        if self._exists(node):
+            if node not in self._node_order:
+                self._node_order[node] = self._next_node_order
+                self._next_node_order += 1
+            if node.startswith("extension-definition--"):
+                self._ext_nodes.add(node)
+            elif node.startswith("attack-flow--"):
+                self._flow_nodes.add(node)
+        else:
+            self._node_order.pop(node, None)
+            self._ext_nodes.discard(node)
+            self._flow_nodes.discard(node)
+
+    def _refresh_active_node(self, node):
+        """Update the bookkeeping that depends on whether a node is active."""
+        if self._is_active(node):
+            if node not in self._reached:
+                self._unreached.add(node)
+            if node not in self._node_attrs and _is_attack_flow_ref(node):
+                self._dangling.add(node)
+            else:
+                self._dangling.discard(node)
+        else:
+            self._reached.discard(node)
+            self._unreached.discard(node)
+            self._dangling.discard(node)
+
+    def _find_removed_nodes(self):
+        """
+        Find the nodes that :func:`attack_flow.graph.remove_extension_nodes` would
+        remove: extension nodes, and any node whose only successor is an extension.
+
+        :rtype: set
+        """
+        removed = set()
+        for ext_node in sorted(self._ext_nodes, key=self._node_key):
+            neighbors = [n for n in self._succ.get(ext_node, ()) if n not in removed]
+            removed.add(ext_node)
+            for neighbor in neighbors:
+                if neighbor in removed:
+                    continue
+                neighbor_neighbors = set(self._succ.get(neighbor, ())) - removed
+                neighbor_neighbors.discard(neighbor)
+                if not neighbor_neighbors:
+                    removed.add(neighbor)
+        return removed
+
+    def _rebuild(self):
+        """Recompute connectivity and dangling references for the whole graph."""
+        active = [n for n in self._node_order if n not in self._removed]
+        seeds = [n for n in active if self._is_seed(n)]
+        self._reached = set(seeds)
+        self._unreached = set(active) - self._reached
+        self._extend(seeds)
+        self._dangling = {
+            n for n in active if n not in self._node_attrs and _is_attack_flow_ref(n)
+        }
+
+    def _extend(self, starts):
+        """
+        Mark every unreached node that is connected to ``starts`` as reached.
+
+        :param starts: nodes that have just been marked as reached
+        """
+        queue = deque(starts)
+        while queue:
+            node = queue.popleft()
+            for neighbor in self._neighbors(node):
+                if neighbor in self._unreached:
+                    self._unreached.remove(neighbor)
+                    self._reached.add(neighbor)
+                    queue.append(neighbor)
+
+    def _prune(self, starts):
+        """
+        Mark reached nodes that are no longer connected to a seed as unreached.
+
+        A search grows around each start node in turn, one node at a time. A search
+        stops as soon as it finds a seed. Two searches that meet are merged. A search
+        that runs out of nodes without finding a seed has found a component that is no
+        longer connected to the flow. When a reference is removed from a large flow,
+        the search on the side that is still connected usually finds a seed quickly,
+        and the search on the side that was cut off is limited to that side.
+
+        :param starts: reached nodes that lost a neighbor
+        """
+        region = dict()
+        owner = list()
+        frontiers = list()
+        connected = list()
+
+        def find(search):
+            while owner[search] != search:
+                owner[search] = owner[owner[search]]
+                search = owner[search]
+            return search
+
+        for start in starts:
+            if start in region:
+                continue
+            search = len(owner)
+            region[start] = search
+            owner.append(search)
+            frontiers.append(deque([start]))
+            connected.append(self._is_seed(start))
+
+        active = [s for s in range(len(owner)) if not connected[s]]
+        while active:
+            next_active = list()
+            for search in active:
+                if find(search) != search or connected[search]:
+                    continue
+                frontier = frontiers[search]
+                if not frontier:
+                    continue
+                node = frontier.popleft()
+                for neighbor in self._neighbors(node):
+                    if neighbor not in self._reached:
+                        continue
+                    if neighbor in region:
+                        other = find(region[neighbor])
+                        if other != search:
+                            owner[other] = search
+                            frontiers[search].extend(frontiers[other])
+                            frontiers[other] = deque()
+                            connected[search] = connected[search] or connected[other]
+                    else:
+                        region[neighbor] = search
+                        frontier.append(neighbor)
+                        if self._is_seed(neighbor):
+                            connected[search] = True
+                if not connected[search] and frontier:
+                    next_active.append(search)
+            active = next_active
+
+        for node, search in region.items():
+            if not connected[find(search)]:
+                self._reached.remove(node)
+                self._unreached.add(node)
+
+
+_ATTACK_FLOW_EXTENSION = "attack-flow-extension"
+
+
+def _object_kind(obj):
+    """Classify an object for :func:`attack_flow.schema.check_object_summary`."""
+    if (
+        obj["type"] == "extension-definition"
+        and obj.get("id") == ATTACK_FLOW_EXTENSION_ID
+    ):
+        return _ATTACK_FLOW_EXTENSION
+    return obj["type"]
+
+
+def _is_attack_flow_ref(node):
+    return node.split("--")[0] in ATTACK_FLOW_SDOS
+
+
+def _decrement(counters, key, item, count):
+    """Decrement ``counters[key][item]`` (or ``counters[item]``), deleting zeros."""
+    counter = counters if key is None else counters[key]
+    counter[item] -= count
+    if counter[item] <= 0:
+        del counter[item]
+    if key is not None and not counter:
+        del counters[key]
@@ -0,0 +1,127 @@
+"""
+Read and write JSON with the fastest backend that is available.
+
+Decoding is most of the cost of loading a large bundle, such as a merged corpus or the
+ATT&CK data. When `orjson <https://github.com/ijl/orjson>`__ is installed it is used to
+decode and encode JSON, and files are memory-mapped so that they are decoded without
+first being copied into a Python ``bytes`` object. Otherwise the standard library's
+:mod:`json` module is used.
+
+Both backends accept and produce the same documents. orjson is stricter than the
+standard library: it rejects ``NaN`` and integers that do not fit in 64 bits, for
+example. Anything that orjson cannot handle is passed on to the standard library, so
+the choice of backend only affects speed, and the error for an invalid document is the
+standard library's :class:`json.JSONDecodeError`.
+
+The backend may be chosen with :func:`set_backend`, e.g. to compare the two.
+"""
+
+import json
+import mmap
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+BACKENDS = ("orjson", "json")
+_backend = "orjson" if orjson is not None else "json"
+
+
+def get_backend():
+    """
+    Get the name of the backend in use.
+
+    :rtype: str
+    """
+    return _backend
+
+
+def set_backend(name):
+    """
+    Choose the backend.
+
+    :param str name: one of :data:`BACKENDS`
+    :raises ValueError: if the backend is unknown or not installed
+    """
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown JSON backend: {name}")
+    if name == "orjson" and orjson is None:
+        raise ValueError("The orjson backend is not installed.")
+    _backend = name
+
+
+def loads(data):
+    """
+    Decode a JSON document.
+
+    :param data: a document as ``str``, ``bytes``, or, with orjson, any buffer such as a
+        ``memoryview``
+    :returns: the decoded value
+    :raises json.JSONDecodeError: if the document is not valid JSON
+    """
+    if _backend == "orjson":
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    if not isinstance(data, (str, bytes, bytearray)):
+        data = bytes(data)
+    return json.loads(data)
+
+
+def load_path(path):
+    """
+    Decode a JSON file.
+
+    :param pathlib.Path path:
+    :returns: the decoded value
+    :raises json.JSONDecodeError: if the file is not valid JSON
+    """
+    with path.open("rb") as f:
+        if _backend == "orjson":
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # Empty files and some special files cannot be mapped.
+                pass
+            else:
+                with mapped, memoryview(mapped) as view:
+                    return loads(view)
+        return loads(f.read())
+
+
+def dumps(obj, indent=None):
+    """
+    Encode a JSON document.
+
+    Both backends write non-ASCII characters as UTF-8 rather than escaping them. Without
+    ``indent`` the output is compact, with no spaces after separators.
+
+    :param obj: the value to encode
+    :param int indent: the number of spaces to indent by, or None for a single line
+    :rtype: str
+    :raises TypeError: if the value cannot be encoded
+    """
+    if _backend == "orjson" and indent in (None, 2):
+        option = orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_DATETIME
+        if indent == 2:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, option=option).decode("utf8")
+        except TypeError:
+            pass
+    separators = (",", ":") if indent is None else (",", ": ")
+    return json.dumps(obj, indent=indent, separators=separators, ensure_ascii=False)
+
+
+def dump_path(obj, path, indent=None):
+    """
+    Encode a JSON document and write it to a file as UTF-8.
+
+    :param obj: the value to encode
+    :param pathlib.Path path:
+    :param int indent: the number of spaces to indent by, or None for a single line
+    """
+    path.write_text(dumps(obj, indent), encoding="utf8")
@@ -0,0 +1,203 @@
+"""
+Read large JSON documents incrementally.
+
+A STIX bundle is a JSON object whose ``objects`` member is an array that may hold
+millions of objects. The reader in this module walks the top level of such a document
+and decodes the elements of that array one at a time, so that only one object needs to
+be held in memory at once.
+"""
+
+import json
+import re
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Characters that may continue a number that ends exactly at the end of the buffer.
+_NUMBER_TAIL = re.compile(r"[0-9.eE+\-]*\Z")
+# A decoding error this close to the end of the buffer may only mean that the value
+# continues in the next chunk: this is the length of the longest token, "-Infinity".
+_INCOMPLETE_MARGIN = 9
+
+
+def iter_document(fp, stream_keys=("objects",), chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Iterate over the top level of a JSON object without loading the whole document.
+
+    Generates ``(event, key, value)`` tuples:
+
+    * ``("member", key, value)`` for each ordinary top-level member.
+    * ``("array", key, None)`` when a member named in ``stream_keys`` holds an array.
+    * ``("item", key, value)`` for each element of that array, in order.
+
+    A member named in ``stream_keys`` that is not an array is reported as an ordinary
+    member.
+
+    :param fp: a text file opened for reading
+    :param tuple[str] stream_keys: names of top-level arrays to stream
+    :param int chunk_size: number of characters to read from the file at a time
+    :raises ValueError: if the document is not valid JSON or is not a JSON object
+    """
+    reader = _Reader(fp, chunk_size)
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.advance()
+    else:
+        while True:
+            key = reader.value()
+            if not isinstance(key, str):
+                raise reader.error("Expecting property name enclosed in double quotes")
+            reader.expect(":")
+            if key in stream_keys and reader.peek() == "[":
+                reader.advance()
+                yield "array", key, None
+                if reader.peek() == "]":
+                    reader.advance()
+                else:
+                    while True:
+                        yield "item", key, reader.value()
+                        if not reader.delimiter("]"):
+                            break
+            else:
+                yield "member", key, reader.value()
+            if not reader.delimiter("}"):
+                break
+    if reader.peek() != "":
+        raise reader.error("Extra data")
+
+
+class _Reader:
+    """
+    A buffer over a text file that decodes one JSON value at a time.
+
+    Characters before the current position are discarded each time the buffer is
+    refilled, so the buffer only grows as large as the largest single value.
+    """
+
+    def __init__(self, fp, chunk_size):
+        self._fp = fp
+        self._chunk_size = chunk_size
+        self._buffer = ""
+        self._pos = 0
+        self._offset = 0
+        self._eof = False
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character, or an empty string at the end
+        of the file.
+
+        :rtype: str
+        """
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+
+    def advance(self):
+        """Consume the character returned by the last call to :meth:`peek`."""
+        self._pos += 1
+
+    def expect(self, char):
+        """
+        Consume the next non-whitespace character, which must be ``char``.
+
+        :param str char:
+        """
+        if self.peek() != char:
+            raise self.error(f"Expecting '{char}'")
+        self.advance()
+
+    def delimiter(self, end):
+        """
+        Consume the separator after a value in an array or object.
+
+        :param str end: the character that closes the container
+        :returns: true if another value follows, false if the container was closed
+        """
+        char = self.peek()
+        if char == ",":
+            self.advance()
+            return True
+        elif char == end:
+            self.advance()
+            return False
+        else:
+            raise self.error(f"Expecting ',' delimiter or '{end}'")
+
+    def value(self):
+        """
+        Decode the next JSON value.
+
+        If the value does not fit in the buffer, then more of the file is read and
+        decoding is retried. Each retry at least doubles the buffer, so a large value
+        is decoded in a logarithmic number of attempts. An error that is not at the end
+        of the buffer is raised at once, without reading the rest of the file.
+
+        :returns: the decoded value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError as e:
+                if self._is_incomplete(e) and self._fill(len(self._buffer) - self._pos):
+                    continue
+                raise self.error(e.msg, e.pos)
+            if (
+                isinstance(value, (int, float))
+                and not isinstance(value, bool)
+                and _NUMBER_TAIL.match(self._buffer, end)
+                and self._fill()
+            ):
+                # The number may continue in the next chunk.
+                continue
+            self._pos = end
+            return value
+
+    def _is_incomplete(self, exc):
+        """
+        Check whether a decoding error may be caused by the end of the buffer.
+
+        :param json.JSONDecodeError exc:
+        :rtype: bool
+        """
+        # A string error reports where the string starts, but a string is only
+        # unterminated if it runs to the end of the buffer.
+        return exc.pos >= len(self._buffer) - _INCOMPLETE_MARGIN or exc.msg.startswith(
+            "Unterminated string"
+        )
+
+    def error(self, message, pos=None):
+        """
+        Create an exception that reports a position in the whole document.
+
+        :param str message:
+        :param int pos: position in the buffer; defaults to the current position
+        :rtype: ValueError
+        """
+        if pos is None:
+            pos = self._pos
+        return ValueError(f"{message}: char {self._offset + pos}")
+
+    def _fill(self, at_least=0):
+        """
+        Discard consumed characters and read more of the file into the buffer.
+
+        :param int at_least: read at least this many characters
+        :returns: false if the end of the file has been reached
+        """
+        if self._eof:
+            return False
+        self._offset += self._pos
+        self._buffer = self._buffer[self._pos :]
+        self._pos = 0
+        chunk = self._fp.read(max(self._chunk_size, at_least))
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer += chunk
+        return True
@@ -0,0 +1,466 @@
+"""
+Compare the shapes of Attack Flows with Weisfeiler-Lehman graph kernels.
+
+Two flows can use different techniques but still have the same shape: one initial
+access that fans out, several actions that converge on an ``AND`` operator, or a chain
+of conditions. The Weisfeiler-Lehman (WL) subtree features of a flow's graph describe
+its shape. Each node starts with a label made from its type, and for actions their
+technique. In each iteration, each node's label is replaced by a hash of its label and
+the labels of its neighbors, along with the names of the ``_ref`` properties or
+relationship types that connect them, so after ``h`` iterations a label describes the
+subtree of depth ``h`` around the node. A flow's features count the nodes with each
+label in each iteration, and the WL kernel of two flows is the dot product of their
+features.
+
+Feature extraction is independent for each flow, so :func:`extract_features` runs it in
+worker processes and can keep the features of each file in an
+:class:`attack_flow.cache.FeatureCache`, keyed by the file's hash. The features of a
+corpus are kept in a :class:`FeatureMatrix`, which stores only the non-zero counts.
+Kernels are computed a batch of rows at a time, so the kernel matrix of a large corpus
+never has to be in memory at once.
+"""
+
+from array import array
+import concurrent.futures
+import functools
+import hashlib
+import math
+import os
+from pathlib import Path
+
+import attack_flow.flowgraph
+import attack_flow.jsonio
+import attack_flow.profiling
+
+# Increment when the way features are computed or saved changes.
+FEATURES_FORMAT = 1
+WL_ITERATIONS = 3
+DEFAULT_BATCH_SIZE = 256
+
+
+def node_label(obj):
+    """
+    Compute the initial WL label of a node.
+
+    :param dict obj: a STIX object, or None for an object that is not defined
+    :rtype: str
+    """
+    if obj is None:
+        return "undefined"
+    if obj["type"] == "attack-action":
+        return f"attack-action:{obj.get('technique_id') or ''}"
+    if obj["type"] == "attack-operator":
+        return f"attack-operator:{obj.get('operator', '')}"
+    return obj["type"]
+
+
+def edge_label(edge_type, relationship):
+    """
+    :param str edge_type: the name of the ``_ref`` property without its suffix, or
+        ``relationship``
+    :param relationship: the relationship object, if the edge is a relationship
+    :returns: the label of an edge
+    :rtype: str
+    """
+    if relationship is None:
+        return edge_type
+    return f"{edge_type}:{relationship.get('relationship_type', '')}"
+
+
+def wl_features(flow_bundle, iterations=WL_ITERATIONS):
+    """
+    Compute the WL subtree features of a flow.
+
+    The graph is that of :func:`attack_flow.graph.bundle_to_networkx`. The initial
+    labels are readable, such as ``attack-action:T1059`` or ``attack-operator:AND``;
+    the labels of later iterations are hashes, which are the same in every process.
+
+    :param stix2.Bundle flow_bundle: or a decoded bundle, or a record bundle
+    :param int iterations: the number of relabeling iterations
+    :returns: the number of nodes with each label, over all iterations
+    :rtype: dict[str, int]
+    """
+    with attack_flow.profiling.span("kernels.features"):
+        flow_graph = attack_flow.flowgraph.FlowGraph.from_bundle(flow_bundle)
+        nodes = list(flow_graph)
+        labels = {node: node_label(flow_graph.node(node)) for node in nodes}
+        neighbors = {node: _neighbors(flow_graph, node) for node in nodes}
+
+        features = dict()
+        for iteration in range(iterations + 1):
+            if iteration:
+                labels = {
+                    node: _relabel(labels[node], neighbors[node], labels)
+                    for node in nodes
+                }
+            for label in labels.values():
+                features[label] = features.get(label, 0) + 1
+    return features
+
+
+def _neighbors(flow_graph, node):
+    """
+    :returns: ``(direction, edge_label, neighbor)`` tuples for a node's edges, with one
+        edge to each neighbor in each direction, as in a NetworkX ``DiGraph``
+    :rtype: list[tuple]
+    """
+    edges = dict()
+    for target, edge_type, relationship in flow_graph.out_edges(node):
+        edges[">", target] = edge_label(edge_type, relationship)
+    for source, edge_type, relationship in flow_graph.in_edges(node):
+        edges["<", source] = edge_label(edge_type, relationship)
+    return [(direction, label, other) for (direction, other), label in edges.items()]
+
+
+def _relabel(label, neighbors, labels):
+    """
+    :returns: the hash of a node's label and its neighbors' labels
+    :rtype: str
+    """
+    parts = sorted(
+        f"{direction}{edge}={labels[other]}" for direction, edge, other in neighbors
+    )
+    signature = "\n".join([label] + parts).encode("utf8")
+    return hashlib.blake2b(signature, digest_size=8).hexdigest()
+
+
+def extract_features(paths, iterations=WL_ITERATIONS, jobs=1, cache_dir=None):
+    """
+    Compute the WL subtree features of some Attack Flow files.
+
+    :param list[Path] paths: ``.json`` or ``.afb`` files
+    :param int iterations: see :func:`wl_features`
+    :param int jobs: the number of worker processes to use
+    :param Path cache_dir: a directory for an :class:`attack_flow.cache.FeatureCache`
+        to reuse the features of unchanged files, or None
+    :returns: a matrix with a row for each file, named after its absolute path, in the
+        same order as ``paths``
+    :rtype: FeatureMatrix
+    """
+    extract = functools.partial(
+        _file_features, iterations=iterations, cache_dir=cache_dir
+    )
+    with attack_flow.profiling.span("kernels.extract"):
+        if jobs > 1 and len(paths) > 1:
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(jobs, len(paths))
+            ) as executor:
+                chunk_size = max(1, len(paths) // (jobs * 4))
+                features = list(executor.map(extract, paths, chunksize=chunk_size))
+        else:
+            features = list(map(extract, paths))
+    names = [os.path.abspath(path) for path in paths]
+    return FeatureMatrix.from_features(names, features)
+
+
+def _file_features(path, iterations, cache_dir):
+    """
+    Compute the features of one file, in a worker process.
+
+    :param Path path:
+    :param int iterations:
+    :param Path cache_dir: or None
+    :rtype: dict[str, int]
+    """
+    import attack_flow.model
+
+    cache = key = None
+    if cache_dir is not None:
+        import attack_flow.cache
+
+        cache = attack_flow.cache.FeatureCache.shared(
+            cache_dir, attack_flow.cache.DEFAULT_MAX_SIZE
+        )
+        key = cache.key_for_file(path, f"wl-{FEATURES_FORMAT}-{iterations}")
+        features = cache.get(key)
+        if features is not None:
+            return features
+
+    flow_bundle = attack_flow.model.load_attack_flow_bundle(path)
+    features = wl_features(flow_bundle, iterations)
+    if cache is not None:
+        cache.put(key, features)
+    return features
+
+
+class FeatureMatrix:
+    """
+    The features of many flows, with a row for each flow and a column for each feature.
+
+    The non-zero entries of row ``i`` are at positions ``offsets[i]`` to
+    ``offsets[i + 1]`` of ``columns`` and ``values``, sorted by column, in the
+    compressed sparse row layout that SciPy uses. Create one with
+    :meth:`from_features`.
+
+    :param list[str] names: the names of the flows
+    :param list[str] features: the names of the features, sorted
+    :param array offsets:
+    :param array columns:
+    :param array values:
+    """
+
+    def __init__(self, names, features, offsets, columns, values):
+        self.names = names
+        self.features = features
+        self.offsets = offsets
+        self.columns = columns
+        self.values = values
+        self._rows = {name: i for i, name in enumerate(names)}
+        self._norms = None
+        self._postings = None
+
+    @classmethod
+    def from_features(cls, names, features):
+        """
+        :param list[str] names: the names of the flows
+        :param list[dict] features: the features of each flow, such as the results of
+            :func:`wl_features`
+        :rtype: FeatureMatrix
+        """
+        feature_names = sorted({name for row in features for name in row})
+        index = {name: i for i, name in enumerate(feature_names)}
+        offsets = array("q", [0])
+        columns = array("l")
+        values = array("q")
+        for row in features:
+            cells = sorted((index[name], count) for name, count in row.items() if count)
+            columns.extend(column for column, _ in cells)
+            values.extend(count for _, count in cells)
+            offsets.append(len(columns))
+        return cls(list(names), feature_names, offsets, columns, values)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a matrix that was saved with :meth:`save`.
+
+        :param Path path:
+        :rtype: FeatureMatrix
+        :raises ValueError: if the file was saved in a different format
+        """
+        matrix_json = attack_flow.jsonio.load_path(path)
+        if (
+            not isinstance(matrix_json, dict)
+            or matrix_json.get("format") != FEATURES_FORMAT
+        ):
+            raise ValueError(
+                f"Not a feature matrix in format {FEATURES_FORMAT}: {path}"
+            )
+        return cls(
+            matrix_json["names"],
+            matrix_json["features"],
+            array("q", matrix_json["offsets"]),
+            array("l", matrix_json["columns"]),
+            array("q", matrix_json["values"]),
+        )
+
+    def save(self, path):
+        """
+        Save the matrix to a JSON file.
+
+        :param Path path:
+        """
+        matrix_json = {
+            "format": FEATURES_FORMAT,
+            "names": self.names,
+            "features": self.features,
+            "offsets": self.offsets.tolist(),
+            "columns": self.columns.tolist(),
+            "values": self.values.tolist(),
+        }
+        attack_flow.jsonio.dump_path(matrix_json, Path(path))
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def nnz(self):
+        """
+        The number of non-zero entries.
+
+        :rtype: int
+        """
+        return len(self.values)
+
+    def row(self, name):
+        """
+        :param str name: the name of a flow
+        :returns: the flow's non-zero features
+        :rtype: dict[str, int]
+        :raises KeyError: if there is no flow with that name
+        """
+        i = self._rows[name]
+        return {
+            self.features[self.columns[position]]: self.values[position]
+            for position in range(self.offsets[i], self.offsets[i + 1])
+        }
+
+    def to_scipy(self):
+        """
+        Convert the matrix to a SciPy sparse array. This requires NumPy and SciPy, which
+        are not dependencies of this library.
+
+        :rtype: scipy.sparse.csr_array
+        """
+        import numpy
+        import scipy.sparse
+
+        return scipy.sparse.csr_array(
+            (
+                numpy.asarray(self.values),
+                numpy.asarray(self.columns),
+                numpy.asarray(self.offsets),
+            ),
+            shape=(len(self.names), len(self.features)),
+        )
+
+    def kernel(self, name, other, normalize=True):
+        """
+        Compute the WL kernel of two flows.
+
+        :param str name:
+        :param str other:
+        :param bool normalize: divide by the norms of the features, which scales the
+            result to the range 0 to 1, where 1 means the same shape
+        :rtype: float
+        """
+        i, j = self._rows[name], self._rows[other]
+        value = float(self._dot(i, j))
+        if normalize:
+            return _normalize(value, self._get_norms()[i], self._get_norms()[j])
+        return value
+
+    def iter_kernel_batches(self, batch_size=DEFAULT_BATCH_SIZE, normalize=True):
+        """
+        Compute the kernel matrix of all of the flows, a batch of rows at a time.
+
+        Each batch is computed from an index of the rows that have each feature, so the
+        time depends on how many features the flows share rather than on the number of
+        features.
+
+        :param int batch_size: the number of rows in a batch
+        :param bool normalize: see :meth:`kernel`
+        :returns: generator of ``(start, rows)`` tuples, where ``rows`` is a list of
+            the kernel matrix's rows from ``start``, each an ``array`` of floats with a
+            column for each flow
+        """
+        postings = self._get_postings()
+        norms = self._get_norms()
+        size = len(self.names)
+        for start in range(0, size, batch_size):
+            rows = list()
+            for i in range(start, min(start + batch_size, size)):
+                row = array("d", bytes(8 * size))
+                for position in range(self.offsets[i], self.offsets[i + 1]):
+                    value = self.values[position]
+                    for j, other_value in postings[self.columns[position]]:
+                        row[j] += value * other_value
+                if normalize:
+                    for j in range(size):
+                        row[j] = _normalize(row[j], norms[i], norms[j])
+                rows.append(row)
+            yield start, rows
+
+    def kernel_matrix(self, normalize=True):
+        """
+        Compute the whole kernel matrix. For a large corpus, use
+        :meth:`iter_kernel_batches` instead.
+
+        :param bool normalize: see :meth:`kernel`
+        :returns: a list of rows, each an ``array`` of floats
+        :rtype: list[array]
+        """
+        matrix = list()
+        for _, rows in self.iter_kernel_batches(normalize=normalize):
+            matrix.extend(rows)
+        return matrix
+
+    def cluster(self, threshold=0.9, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Group the flows by shape, with single-linkage clustering: two flows are in the
+        same cluster if a chain of flows connects them where each pair of neighbors has
+        a normalized kernel of at least ``threshold``.
+
+        The kernel matrix is computed in batches and only the pairs above the threshold
+        are kept, so the memory used does not grow with the square of the corpus.
+
+        :param float threshold: from 0 to 1
+        :param int batch_size: see :meth:`iter_kernel_batches`
+        :returns: the clusters, each a list of flow names in matrix order, largest
+            first, with ties in matrix order
+        :rtype: list[list[str]]
+        """
+        with attack_flow.profiling.span("kernels.cluster"):
+            parents = list(range(len(self.names)))
+
+            def find(i):
+                while parents[i] != i:
+                    parents[i] = parents[parents[i]]
+                    i = parents[i]
+                return i
+
+            for start, rows in self.iter_kernel_batches(batch_size):
+                for offset, row in enumerate(rows):
+                    i = start + offset
+                    for j in range(i + 1, len(row)):
+                        if row[j] >= threshold:
+                            root_i, root_j = find(i), find(j)
+                            if root_i != root_j:
+                                parents[max(root_i, root_j)] = min(root_i, root_j)
+
+            clusters = dict()
+            for i, name in enumerate(self.names):
+                clusters.setdefault(find(i), list()).append(name)
+        return sorted(clusters.values(), key=lambda names: -len(names))
+
+    def _dot(self, i, j):
+        """
+        :returns: the dot product of two rows
+        :rtype: int
+        """
+        values = dict(
+            zip(
+                self.columns[self.offsets[j] : self.offsets[j + 1]],
+                self.values[self.offsets[j] : self.offsets[j + 1]],
+            )
+        )
+        return sum(
+            self.values[position] * values.get(self.columns[position], 0)
+            for position in range(self.offsets[i], self.offsets[i + 1])
+        )
+
+    def _get_norms(self):
+        """
+        :returns: the Euclidean norm of each row
+        :rtype: list[float]
+        """
+        if self._norms is None:
+            self._norms = [
+                math.sqrt(sum(value * value for value in self.values[start:end]))
+                for start, end in zip(self.offsets, self.offsets[1:])
+            ]
+        return self._norms
+
+    def _get_postings(self):
+        """
+        :returns: for each column, the ``(row, value)`` tuples of its non-zero entries
+        :rtype: list[list[tuple[int, int]]]
+        """
+        if self._postings is None:
+            postings = [list() for _ in self.features]
+            for i in range(len(self.names)):
+                for position in range(self.offsets[i], self.offsets[i + 1]):
+                    postings[self.columns[position]].append((i, self.values[position]))
+            self._postings = postings
+        return self._postings
+
+
+def _normalize(value, norm, other_norm):
+    """
+    :returns: a kernel value divided by the norms of the two rows, or 0.0 for an empty
+        row
+    :rtype: float
+    """
+    if not norm or not other_norm:
+        return 0.0
+    return value / (norm * other_norm)
@@ -18,6 +18,7 @@ from xml.etree import ElementTree
 from defusedxml.ElementTree import parse as defusedxml_parse
 
 import attack_flow.graph
+import attack_flow.profiling
 
 
 logger = logging.getLogger(__name__)
@@ -43,13 +44,17 @@ def render(matrix_file, flow_bundle, out_file, show_control_points=False):
     :param show_control_points: For debugging, display the control points for the
         arrows' curves.
     """
+    span = attack_flow.profiling.span
     ElementTree.register_namespace("", "http://www.w3.org/2000/svg")
-    tree = defusedxml_parse(matrix_file)
+    with span("matrix.parse_svg"):
+        tree = defusedxml_parse(matrix_file)
 
     # Build a lookup table from technique ID -> translation coordinates for that
     # technique's <g> element.
     technique_geometries = dict()
-    _enumerate_technique_geometries(technique_geometries, tree.getroot())
+    with span("matrix.geometries"):
+        _enumerate_technique_geometries(technique_geometries, tree.getroot())
+    attack_flow.profiling.count("matrix.techniques", len(technique_geometries))
 
     # Create a new <g> to hold all of the Attack Flow overlay elements.
     attack_flow_overlay = ElementTree.Element("g", {"class": "attack-flow-overlay"})
@@ -57,15 +62,20 @@ def render(matrix_file, flow_bundle, out_file, show_control_points=False):
     tree.getroot().append(attack_flow_overlay)
 
     # Create the Attack Flow overlay elements.
-    full_graph = attack_flow.graph.bundle_to_networkx(flow_bundle)
-    graph = attack_flow.graph.induce_action_graph(full_graph)
+    with span("matrix.action_graph"):
+        graph = attack_flow.graph.get_action_graph(flow_bundle, effects_only=False)
+    attack_flow.profiling.count("matrix.actions", graph.number_of_nodes())
 
+    # The graph is shared with other callers, so subtechniques that are drawn as their
+    # parent technique are recorded here instead of in the node data.
+    technique_ids = dict()
     for node, data in graph.nodes(data=True):
         try:
             tid = data["technique_id"]
         except KeyError:
             logger.warning("Node (%s) does not have a technique ID.", node)
             continue
+        technique_ids[node] = tid
         if translation := technique_geometries.get(tid):
             technique_overlay = _create_technique_overlay(tid, translation)
             attack_flow_overlay.append(technique_overlay)
@@ -78,7 +88,7 @@ def render(matrix_file, flow_bundle, out_file, show_control_points=False):
                         tid,
                         tid2,
                     )
-                    data["technique_id"] = tid2
+                    technique_ids[node] = tid2
                     technique_overlay = _create_technique_overlay(tid2, translation)
                     attack_flow_overlay.append(technique_overlay)
                 else:
@@ -91,11 +101,9 @@ def render(matrix_file, flow_bundle, out_file, show_control_points=False):
                 logger.warning(f"Did not find technique ID {tid} in input SVG.")
 
     for src_id, target_id in graph.edges:
-        src_data = graph.nodes[src_id]
-        target_data = graph.nodes[target_id]
         try:
-            src_tid = src_data["technique_id"]
-            target_tid = target_data["technique_id"]
+            src_tid = technique_ids[src_id]
+            target_tid = technique_ids[target_id]
             src_geom = technique_geometries[src_tid]
             target_geom = technique_geometries[target_tid]
         except KeyError:
@@ -107,7 +115,8 @@ def render(matrix_file, flow_bundle, out_file, show_control_points=False):
         attack_flow_overlay.append(arrow_overlay)
 
     # Write the SVG to output.
-    tree.write(out_file, xml_declaration=True)
+    with span("matrix.write"):
+        tree.write(out_file, xml_declaration=True)
 
 
 def _enumerate_technique_geometries(technique_geometries, node, parent_x=0, parent_y=0):
@@ -4,9 +4,12 @@ Generate `Mermaid graphs <https://mermaid-js.github.io/mermaid/#/>`__ from Attac
 
 import textwrap
 
+import attack_flow.profiling
 from .model import (
     confidence_num_to_label,
+    get_flow_object,
     get_viz_ignored_ids,
+    index_bundle,
     VIZ_IGNORE_COMMON_PROPERTIES,
 )
 
@@ -71,6 +74,22 @@ class MermaidGraph:
         return "\n".join(lines)
 
 
+def convert(bundle):
+    """
+    Convert an Attack Flow STIX bundle into Mermaid format.
+
+    A bundle whose flow has the ``attack-tree`` scope is drawn as an attack tree;
+    anything else is drawn as an attack flow.
+
+    :param stix2.Bundle bundle:
+    :rtype: str
+    """
+    with attack_flow.profiling.span("mermaid.convert"):
+        if bundle.get("objects", "") and get_flow_object(bundle).scope == "attack-tree":
+            return convert_attack_tree(bundle)
+        return convert_attack_flow(bundle)
+
+
 def convert_attack_flow(bundle):
     """
     Convert an Attack Flow STIX bundle into Mermaid format.
@@ -78,6 +97,7 @@ def convert_attack_flow(bundle):
     :param stix2.Bundle flow:
     :rtype: str
     """
+    bundle = index_bundle(bundle)
     graph = MermaidGraph()
     graph.add_class("action", "rect", "fill:#99ccff")
     graph.add_class("operator", "circle", "fill:#ff9900")
@@ -141,6 +161,7 @@ def convert_attack_tree(bundle):
     :param stix2.Bundle flow:
     :rtype: str
     """
+    bundle = index_bundle(bundle)
     graph = MermaidGraph()
     graph.direction = "BT"
     graph.add_class("action", "rect", "fill:#B40000, color:white")
@@ -0,0 +1,138 @@
+"""
+Upgrade legacy v2 Attack Flow Builder files to the current file format in bulk.
+
+The Builder upgrades a v2 file each time it is opened, and its command line tool
+upgrades files one at a time. :func:`upgrade_files` upgrades whole directories in a pool
+of worker processes instead, so that an archive of legacy files can be normalized once.
+
+Like the Builder's ``upgrade-v2`` command, the original ``.afb`` file is kept with an
+``.afb-v2`` suffix and the upgraded file takes its place. The upgraded file is written
+to a temporary file and then renamed, so a file is never left half written.
+"""
+
+import concurrent.futures
+import functools
+import shutil
+import time
+
+import attack_flow.afb
+import attack_flow.jsonio
+import attack_flow.profiling
+import attack_flow.storage
+
+BACKUP_SUFFIX = ".afb-v2"
+
+
+class UpgradeResult:
+    """
+    The outcome of upgrading one file.
+
+    :param Path path: the file that was upgraded
+    :param str status: ``upgraded``, ``skipped`` if the file is not a v2 file, or
+        ``failed``
+    :param float seconds: how long the upgrade took
+    :param Path output_path: where the upgraded file was written, if it was
+    :param Path backup_path: where the original file was copied to, if it was
+    :param str error: why the upgrade failed, if it did
+    """
+
+    __slots__ = ("path", "status", "seconds", "output_path", "backup_path", "error")
+
+    def __init__(
+        self, path, status, seconds, output_path=None, backup_path=None, error=None
+    ):
+        self.path = path
+        self.status = status
+        self.seconds = seconds
+        self.output_path = output_path
+        self.backup_path = backup_path
+        self.error = error
+
+    def __repr__(self):
+        return f"UpgradeResult({str(self.path)!r}, {self.status!r})"
+
+
+def find_files(paths):
+    """
+    List the Builder files to upgrade.
+
+    Directories are searched recursively for ``.afb`` files. Files are listed as given,
+    so that ``.afb-v2`` backups can be upgraded again if needed.
+
+    :param list[Path] paths: files and directories
+    :rtype: list[Path]
+    """
+    found = list()
+    for path in paths:
+        if path.is_dir():
+            found.extend(sorted(path.rglob(f"*{attack_flow.afb.AFB_SUFFIX}")))
+        else:
+            found.append(path)
+    return found
+
+
+def upgrade_files(paths, jobs=1, backup=True):
+    """
+    Upgrade Builder files.
+
+    :param list[Path] paths: the files to upgrade, e.g. from :func:`find_files`
+    :param int jobs: the number of worker processes to use
+    :param bool backup: whether to keep a copy of each original ``.afb`` file
+    :returns: generator of :class:`UpgradeResult`, in the same order as ``paths``
+    """
+    upgrade = functools.partial(upgrade_file, backup=backup)
+    if jobs > 1 and len(paths) > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(jobs, len(paths))
+        ) as executor:
+            yield from executor.map(upgrade, paths, chunksize=_chunk_size(paths, jobs))
+    else:
+        yield from map(upgrade, paths)
+
+
+def upgrade_file(path, backup=True):
+    """
+    Upgrade one Builder file, if it is a v2 file.
+
+    The upgraded file is saved with an ``.afb`` suffix, replacing the original. An
+    ``.afb-v2`` file is upgraded to the ``.afb`` file with the same name.
+
+    :param Path path:
+    :param bool backup: whether to copy an original ``.afb`` file to ``.afb-v2`` first
+    :rtype: UpgradeResult
+    """
+    start = time.perf_counter()
+    try:
+        doc = attack_flow.afb.load_afb(path)
+        if not isinstance(doc, dict) or not attack_flow.afb.is_legacy_v2(doc):
+            return UpgradeResult(path, "skipped", time.perf_counter() - start)
+        with attack_flow.profiling.span("afb.upgrade"):
+            upgraded = attack_flow.afb.upgrade_v2(doc)
+        with attack_flow.profiling.span("json.encode"):
+            data = attack_flow.jsonio.dumps(upgraded, indent=4)
+
+        output_path = path.with_suffix(attack_flow.afb.AFB_SUFFIX)
+        backup_path = None
+        if backup and path.suffix == attack_flow.afb.AFB_SUFFIX:
+            backup_path = path.with_suffix(BACKUP_SUFFIX)
+            shutil.copy2(path, backup_path)
+        attack_flow.storage.write_atomic(
+            output_path, lambda f: f.write(data.encode("utf8")), path.stat().st_mode
+        )
+    except (ValueError, OSError) as e:
+        return UpgradeResult(path, "failed", time.perf_counter() - start, error=str(e))
+    return UpgradeResult(
+        path, "upgraded", time.perf_counter() - start, output_path, backup_path
+    )
+
+
+def _chunk_size(paths, jobs):
+    """
+    Send files to workers in batches, so that small files do not each cost a round
+    trip, while still giving each worker several batches to balance the load.
+
+    :param list paths:
+    :param int jobs:
+    :rtype: int
+    """
+    return max(1, len(paths) // (jobs * 4))
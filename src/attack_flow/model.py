@@ -6,11 +6,23 @@ sure how best to refactor: generate JSON schema from this code, or generate this
 from the JSON scheme?
 """
 
+import stix2.v20
+import stix2.v21
 from stix2 import Bundle, CustomObject, parse
 from stix2.properties import ListProperty, ReferenceProperty, StringProperty
 
+import attack_flow.afb
+import attack_flow.jsonio
+import attack_flow.profiling
+
 ATTACK_FLOW_EXTENSION_ID = "extension-definition--fb9c968a-745b-4ade-9b25-c324172197f4"
 
+# Stands in for the real bundle ID when objects are parsed one at a time.
+_PLACEHOLDER_BUNDLE_ID = "bundle--00000000-0000-4000-8000-000000000000"
+
+# The cache used by load_attack_flow_bundle(), if any. See set_bundle_cache().
+_bundle_cache = None
+
 # SDO types to ignore when making visualizations.
 VIZ_IGNORE_SDOS = ("attack-flow", "extension-definition")
 
@@ -130,17 +142,68 @@ class AttackOperator:
     pass
 
 
+def set_bundle_cache(bundle_cache):
+    """
+    Make :func:`load_attack_flow_bundle` store parsed bundles in a cache and reuse them
+    while the files are unchanged.
+
+    :param attack_flow.cache.BundleCache bundle_cache: the cache, or None to stop using
+        one
+    """
+    global _bundle_cache
+    _bundle_cache = bundle_cache
+
+
 def load_attack_flow_bundle(path):
     """
     Load an Attack Flow STIX bundle from a given path.
 
+    If a cache has been set with :func:`set_bundle_cache`, a bundle that has been loaded
+    before is read from the cache instead of being decoded and parsed again.
+
+    Attack Flow Builder files (``.afb``) are exported to STIX first, with
+    :func:`attack_flow.afb.load_afb_bundle`.
+
     :param pathlib.Path path:
     :rtype: stix2.Bundle
     """
-    with path.open() as f:
-        bundle = parse(f, allow_custom=True)
+    bundle_cache = _bundle_cache
+    if bundle_cache is not None:
+        key = bundle_cache.key_for_file(path)
+        bundle = bundle_cache.get(key)
+        if bundle is not None:
+            return bundle
+
+    if path.suffix == attack_flow.afb.AFB_SUFFIX:
+        bundle_json = attack_flow.afb.load_afb_bundle(path)
+    else:
+        with attack_flow.profiling.span("json.decode"):
+            bundle_json = attack_flow.jsonio.load_path(path)
+    if isinstance(bundle_json.get("objects"), list):
+        attack_flow.profiling.count("objects", len(bundle_json["objects"]))
+    bundle = parse_attack_flow_bundle(bundle_json)
+
+    if bundle_cache is not None:
+        bundle_cache.put(key, bundle)
+    return bundle
+
+
+def parse_attack_flow_bundle(bundle_json):
+    """
+    Parse an Attack Flow STIX bundle that has already been decoded from JSON.
+
+    The input is not modified, so the same decoded document can be shared with other
+    consumers such as the schema validator.
+
+    :param dict bundle_json:
+    :rtype: stix2.Bundle
+    """
+    with attack_flow.profiling.span("stix2.parse"):
+        bundle = parse(bundle_json, allow_custom=True)
     # The STIX library will not parse unknown objects; it just returns them as dict. We should
     # throw an error since it will break downstream code that expects real STIX objects.
+    if bundle_json.get("type") == "bundle" and not isinstance(bundle, Bundle):
+        raise Exception("This bundle could not be parsed into STIX: %s", bundle_json)
     if isinstance(bundle, Bundle):
         for o in bundle.objects:
             if type(o) == dict:
@@ -148,6 +211,158 @@ def load_attack_flow_bundle(path):
     return bundle
 
 
+def parse_attack_flow_bundle_object(obj, bundle_header):
+    """
+    Parse a single object from an Attack Flow STIX bundle.
+
+    The object is parsed exactly as it would be inside the full bundle, so it produces
+    the same STIX objects and the same errors. This allows a bundle to be checked one
+    object at a time. The bundle's own properties are checked separately by
+    :func:`parse_attack_flow_bundle_header`.
+
+    :param dict obj: an object from the bundle's ``objects`` array
+    :param dict bundle_header: the bundle's other top-level properties
+    :rtype: stix2.base._STIXBase
+    """
+    bundle_json = dict(bundle_header)
+    bundle_json["type"] = "bundle"
+    bundle_json["id"] = _PLACEHOLDER_BUNDLE_ID
+    bundle_json["objects"] = [obj]
+    return parse_attack_flow_bundle(bundle_json).objects[0]
+
+
+def parse_attack_flow_bundle_header(bundle_header):
+    """
+    Parse the top-level properties of an Attack Flow STIX bundle without its objects.
+
+    :param dict bundle_header: the bundle's top-level properties, except ``objects``
+    :rtype: stix2.Bundle
+    """
+    # A bundle with a ``spec_version`` is a STIX 2.0 bundle.
+    if "spec_version" in bundle_header:
+        return stix2.v20.Bundle(allow_custom=True, **bundle_header)
+    else:
+        return stix2.v21.Bundle(allow_custom=True, **bundle_header)
+
+
+class IndexedBundle:
+    """
+    A STIX bundle with indexes for looking up its objects.
+
+    The indexes are built once, so that each lookup takes constant time instead of a
+    scan of the bundle's objects. The ID and type indexes are built when the wrapper is
+    created, and the index of references the first time :meth:`get_referrers` is
+    called. Any other attribute is read from the wrapped bundle, so the wrapper can be
+    used in place of the bundle. The indexes are not updated if the bundle's objects
+    are modified.
+
+    The graph-based modules, such as :mod:`attack_flow.matrix`, look objects up in an
+    :class:`attack_flow.flowgraph.FlowGraph` instead, which has its own ID and type
+    indexes.
+
+    :param stix2.Bundle bundle: a stix2 bundle or a
+        :class:`attack_flow.records.RecordBundle`
+    """
+
+    def __init__(self, bundle):
+        self.bundle = bundle
+        self._by_id = dict()
+        self._by_type = dict()
+        for obj in bundle.get("objects", []):
+            self._by_id.setdefault(obj["id"], []).append(obj)
+            self._by_type.setdefault(obj["type"], []).append(obj)
+        self._referrers = None
+        self._viz_ignored_ids = None
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.bundle, name)
+
+    def __getitem__(self, key):
+        return self.bundle[key]
+
+    def get(self, key, default=None):
+        return self.bundle.get(key, default)
+
+    def get_obj(self, obj_id):
+        """
+        Find objects by ID, like ``stix2.Bundle.get_obj()``.
+
+        :param str obj_id:
+        :returns: a list of the matching objects
+        :raises KeyError: if there are none
+        """
+        try:
+            return self._by_id[obj_id]
+        except KeyError:
+            raise KeyError(
+                f"'{obj_id}' does not match the ID of any object in the bundle"
+            ) from None
+
+    def get_objs_by_type(self, obj_type):
+        """
+        Find objects by type.
+
+        :param str obj_type:
+        :returns: a list of the matching objects, in bundle order
+        """
+        return self._by_type.get(obj_type, [])
+
+    def get_referrers(self, obj_id):
+        """
+        Find the references to an object.
+
+        Only top-level ``_ref`` and ``_refs`` properties are indexed. A relationship
+        refers to both its source and its target.
+
+        :param str obj_id:
+        :returns: a list of ``(source_id, property_name)`` tuples, in bundle order
+        """
+        if self._referrers is None:
+            self._referrers = _index_referrers(self.bundle.get("objects", []))
+        return self._referrers.get(obj_id, [])
+
+    @property
+    def viz_ignored_ids(self):
+        """
+        The result of :func:`get_viz_ignored_ids`, computed the first time it is used.
+
+        :rtype: frozenset[str]
+        """
+        if self._viz_ignored_ids is None:
+            self._viz_ignored_ids = frozenset(_find_viz_ignored_ids(self))
+        return self._viz_ignored_ids
+
+
+def _index_referrers(objects):
+    """
+    :param list objects:
+    :returns: a dict of ``(source_id, property_name)`` lists, by referenced ID
+    """
+    referrers = dict()
+    for obj in objects:
+        for property_name, value in obj.items():
+            if property_name.endswith("_ref"):
+                referrers.setdefault(value, []).append((obj["id"], property_name))
+            elif property_name.endswith("_refs"):
+                for ref in value:
+                    referrers.setdefault(ref, []).append((obj["id"], property_name))
+    return referrers
+
+
+def index_bundle(flow_bundle):
+    """
+    Wrap a bundle in an :class:`IndexedBundle` unless it already is one.
+
+    :param stix2.Bundle flow_bundle:
+    :rtype: IndexedBundle
+    """
+    if isinstance(flow_bundle, IndexedBundle):
+        return flow_bundle
+    return IndexedBundle(flow_bundle)
+
+
 def get_flow_object(flow_bundle):
     """
     Given an Attack Flow STIX bundle, extract the ``attack-flow`` object.
@@ -155,6 +370,9 @@ def get_flow_object(flow_bundle):
     :param flow_bundle stix.Bundle:
     :rtype: AttackFlow
     """
+    if isinstance(flow_bundle, IndexedBundle):
+        flows = flow_bundle.get_objs_by_type("attack-flow")
+        return flows[0] if flows else None
     for obj in flow_bundle.objects:
         if obj.type == "attack-flow":
             return obj
@@ -200,7 +418,15 @@ def get_viz_ignored_ids(flow_bundle):
     """
     Process a flow bundle and return a set of IDs that the visualizer should ignore,
     e.g. the extension object, the extension creator identity, etc.
+
+    The result is cached on an :class:`IndexedBundle`.
     """
+    if isinstance(flow_bundle, IndexedBundle):
+        return flow_bundle.viz_ignored_ids
+    return _find_viz_ignored_ids(flow_bundle)
+
+
+def _find_viz_ignored_ids(flow_bundle):
     ignored = set()
 
     # Ignore flow creator identity:
@@ -0,0 +1,465 @@
+"""
+Enumerate the attack paths through an Attack Flow.
+
+An attack path is a sequence of actions, operators, and conditions that starts at one of
+the flow's ``start_refs`` and follows the flow's edges to a node that leads nowhere,
+usually a final action. Edges are followed the way
+:func:`attack_flow.graph.build_action_graph` follows them: the effect edges out of
+actions and every edge out of operators and conditions, as long as it leads to another
+action, operator, or condition. A path never visits the same node twice, and an ``AND``
+operator is treated like any other node, so a path passes through one of its inputs.
+
+The number of paths grows exponentially with the number of branches, so nothing here
+builds a list of all of them. :meth:`PathEngine.iter_paths` is a generator, and every
+query has a hard limit on the length of a path and the number of paths it returns.
+
+The engine shares work between paths through their common suffixes. A flow's graph is
+split into strongly connected components, and a path that leaves a component can never
+return to it, so the paths from the first node that a path visits in a component do not
+depend on how the path got there. The number of paths from such a node, and the fewest
+nodes and lowest weight of any path from every node, are computed once and reused by
+every path that reaches it. In a flow without cycles, which is most of them, that covers
+every node.
+"""
+
+import heapq
+import math
+
+import attack_flow.flowgraph
+import attack_flow.graph
+import attack_flow.profiling
+
+PATH_NODE_TYPES = ("attack-action",) + attack_flow.graph.CONNECTOR_TYPES
+# The default limits on the number of nodes in a path and the number of paths.
+MAX_PATH_LENGTH = 256
+MAX_PATHS = 10000
+# The confidence of an action that does not state one, as in the visualizers.
+DEFAULT_CONFIDENCE = 95
+
+
+def confidence_weight(obj):
+    """
+    Weigh a node by the confidence that it happened.
+
+    An action's weight is ``-log(confidence / 100)``, using the same 0 to 100 scale as
+    :func:`attack_flow.model.confidence_num_to_label`, so the weight of a path is the
+    negative log of the probability that all of its actions happened, and the shortest
+    path is the most likely one. Operators and conditions weigh nothing.
+
+    :param dict obj: a STIX object, or None for an object that is not defined
+    :returns: a weight, or infinity for an action with a confidence of 0
+    :rtype: float
+    :raises ValueError: if the confidence is not between 0 and 100
+    """
+    if obj is None or obj["type"] != "attack-action":
+        return 0.0
+    confidence = obj.get("confidence", DEFAULT_CONFIDENCE)
+    if not 0 <= confidence <= 100:
+        raise ValueError("Confidence number must be between 0 and 100 inclusive.")
+    if confidence == 0:
+        return math.inf
+    return -math.log(confidence / 100)
+
+
+class PathEngine:
+    """
+    Answer path queries about one flow.
+
+    The engine keeps the flow's graph in the arrays of a
+    :class:`attack_flow.flowgraph.FlowGraph` and builds its own indexes when it is
+    created, so create one engine for each flow and reuse it for every query.
+
+    :param attack_flow.flowgraph.FlowGraph flow_graph:
+    :param list[str] start_refs: the IDs of the nodes that paths start at; by default,
+        the ``start_refs`` of the flow, or if it has none, the actions, operators, and
+        conditions that no other one leads to
+    :param weight: a function that takes a STIX object, or None for an object that is
+        not defined, and returns its non-negative weight; by default,
+        :func:`confidence_weight`
+    """
+
+    def __init__(self, flow_graph, start_refs=None, weight=confidence_weight):
+        with attack_flow.profiling.span("paths.index"):
+            self._graph = flow_graph
+            self._successors = _path_successors(flow_graph)
+            self._weights = {
+                node: weight(flow_graph.node(flow_graph.node_id(node)))
+                for node in self._successors
+            }
+            self._terminals = {
+                node for node, targets in self._successors.items() if not targets
+            }
+            self._components = _strongly_connected_components(self._successors)
+            self._min_nodes = _suffix_minimums(
+                self._successors, self._terminals, dict.fromkeys(self._successors, 1)
+            )
+            self._min_weights = _suffix_minimums(
+                self._successors, self._terminals, self._weights
+            )
+            if start_refs is None:
+                start_refs = _default_start_refs(flow_graph, self._successors)
+            self._starts = [
+                flow_graph.index(node_id)
+                for node_id in start_refs
+                if node_id in flow_graph
+                and flow_graph.index(node_id) in self._successors
+            ]
+            self._count_memo = dict()
+
+    @classmethod
+    def from_bundle(cls, flow_bundle, start_refs=None, weight=confidence_weight):
+        """
+        Create an engine for a STIX bundle.
+
+        :param stix2.Bundle flow_bundle: or a decoded bundle, or a record bundle
+        :param list[str] start_refs: see :class:`PathEngine`
+        :param weight: see :class:`PathEngine`
+        :rtype: PathEngine
+        """
+        flow_graph = attack_flow.flowgraph.FlowGraph.from_bundle(flow_bundle)
+        return cls(flow_graph, start_refs, weight)
+
+    @property
+    def start_refs(self):
+        """
+        The IDs of the nodes that paths start at.
+
+        :rtype: list[str]
+        """
+        return [self._graph.node_id(node) for node in self._starts]
+
+    @property
+    def terminal_refs(self):
+        """
+        The IDs of the nodes that paths end at, i.e. the nodes that lead nowhere.
+
+        :rtype: list[str]
+        """
+        return [self._graph.node_id(node) for node in sorted(self._terminals)]
+
+    def count_paths(self, max_length=MAX_PATH_LENGTH):
+        """
+        Count the paths without enumerating them.
+
+        The count of paths from the first node that a path visits in each strongly
+        connected component is memoized, so the time is linear in the size of a flow
+        without cycles. Counting the paths inside a cycle is still exponential.
+
+        :param int max_length: the maximum number of nodes in a path
+        :rtype: int
+        """
+        with attack_flow.profiling.span("paths.count"):
+            return sum(self._count_from(start, max_length) for start in self._starts)
+
+    def iter_paths(self, max_length=MAX_PATH_LENGTH, max_paths=MAX_PATHS):
+        """
+        Enumerate paths depth first, in the order of the start nodes and edges.
+
+        Only the path that is being extended is kept in memory. Branches that cannot
+        reach the end of a path within ``max_length`` nodes are skipped without being
+        visited.
+
+        :param int max_length: the maximum number of nodes in a path
+        :param int max_paths: the maximum number of paths to generate
+        :returns: generator of paths, each a tuple of STIX IDs
+        """
+        if max_paths <= 0:
+            return
+        node_id = self._graph.node_id
+        successors = self._successors
+        min_nodes = self._min_nodes
+        count = 0
+        for start in self._starts:
+            if min_nodes[start] > max_length:
+                continue
+            path = [start]
+            on_path = {start}
+            work = [iter(successors[start])]
+            if start in self._terminals:
+                yield (node_id(start),)
+                count += 1
+                if count >= max_paths:
+                    return
+            while work:
+                for target in work[-1]:
+                    if target in on_path or len(path) + min_nodes[target] > max_length:
+                        continue
+                    path.append(target)
+                    on_path.add(target)
+                    work.append(iter(successors[target]))
+                    if target in self._terminals:
+                        yield tuple(map(node_id, path))
+                        count += 1
+                        if count >= max_paths:
+                            return
+                    break
+                else:
+                    work.pop()
+                    on_path.discard(path.pop())
+
+    def k_shortest_paths(self, k=10, max_length=MAX_PATH_LENGTH):
+        """
+        Find the paths with the lowest weight, lightest first.
+
+        This is a best-first search over partial paths, ordered by their weight plus the
+        lowest weight of any path from their last node. That lowest weight is computed
+        once for every node, so in a flow without cycles every partial path that is
+        taken from the queue leads directly to one of the results. Paths through a node
+        of infinite weight are not returned. Partial paths share their prefixes.
+
+        :param int k: the maximum number of paths
+        :param int max_length: the maximum number of nodes in a path
+        :returns: generator of ``(weight, path)`` tuples, where ``path`` is a tuple of
+            STIX IDs
+        """
+        if k <= 0:
+            return
+        node_id = self._graph.node_id
+        successors = self._successors
+        weights = self._weights
+        min_weights = self._min_weights
+        min_nodes = self._min_nodes
+        components = self._components
+        # Entries are (estimate, tie breaker, weight, length, prefix), where the prefix
+        # is a (node, parent prefix) linked list.
+        queue = list()
+        tie = 0
+        for start in self._starts:
+            if min_weights[start] < math.inf and min_nodes[start] <= max_length:
+                entry = (min_weights[start], tie, weights[start], 1, (start, None))
+                queue.append(entry)
+                tie += 1
+        heapq.heapify(queue)
+
+        found = 0
+        while queue:
+            _, _, weight, length, prefix = heapq.heappop(queue)
+            node = prefix[0]
+            if node in self._terminals:
+                yield weight, tuple(map(node_id, reversed(_unlink(prefix))))
+                found += 1
+                if found >= k:
+                    return
+                continue
+            for target in successors[node]:
+                if (
+                    min_weights[target] == math.inf
+                    or length + min_nodes[target] > max_length
+                    or _on_path(target, prefix, components)
+                ):
+                    continue
+                target_weight = weight + weights[target]
+                estimate = weight + min_weights[target]
+                entry = (estimate, tie, target_weight, length + 1, (target, prefix))
+                heapq.heappush(queue, entry)
+                tie += 1
+
+    def _count_from(self, start, max_length):
+        """
+        Count the paths from a start node, depth first without recursion.
+
+        :param int start:
+        :param int max_length: the maximum number of nodes in a path
+        :rtype: int
+        """
+        memo = self._count_memo
+        min_nodes = self._min_nodes
+        successors = self._successors
+        components = self._components
+        on_path = set()
+        work = list()
+
+        def enter(node, budget, parent_component):
+            # Returns the count if it is known, or else pushes a frame for the node.
+            if min_nodes[node] > budget:
+                return 0
+            component = components[node]
+            key = (node, budget) if component != parent_component else None
+            if key is not None and key in memo:
+                return memo[key]
+            count = 1 if node in self._terminals else 0
+            on_path.add(node)
+            work.append([node, budget, key, iter(successors[node]), count])
+            return None
+
+        total = enter(start, max_length, None)
+        while work:
+            frame = work[-1]
+            node, budget, _, targets, _ = frame
+            for target in targets:
+                if target in on_path:
+                    continue
+                count = enter(target, budget - 1, components[node])
+                if count is None:
+                    break
+                frame[4] += count
+            else:
+                work.pop()
+                on_path.discard(node)
+                key, count = frame[2], frame[4]
+                if key is not None:
+                    memo[key] = count
+                if work:
+                    work[-1][4] += count
+                else:
+                    total = count
+        return total
+
+
+def _path_successors(flow_graph):
+    """
+    Find the edges that paths follow.
+
+    :param attack_flow.flowgraph.FlowGraph flow_graph:
+    :returns: a dict from the index of every action, operator, and condition to the
+        indexes of the nodes it leads to, without duplicates or self loops
+    :rtype: dict[int, tuple[int]]
+    """
+    flow_codes = set()
+    for edge_type in attack_flow.graph.FLOW_EDGE_TYPES:
+        code = flow_graph.edge_type_code(edge_type)
+        if code is not None:
+            flow_codes.add(code)
+
+    path_nodes = {
+        flow_graph.index(node_id): node_type
+        for node_type in PATH_NODE_TYPES
+        for node_id in flow_graph.nodes_of_type(node_type)
+    }
+    successors = dict()
+    for node, node_type in sorted(path_nodes.items()):
+        targets = flow_graph.successor_indices(node)
+        if node_type == "attack-action":
+            codes = flow_graph.edge_type_indices(node)
+            targets = [t for t, code in zip(targets, codes) if code in flow_codes]
+        successors[node] = tuple(
+            dict.fromkeys(t for t in targets if t in path_nodes and t != node)
+        )
+    return successors
+
+
+def _default_start_refs(flow_graph, successors):
+    """
+    :returns: the flow's ``start_refs``, or if it has none, the IDs of the path nodes
+        without incoming path edges
+    :rtype: list[str]
+    """
+    for flow_id in flow_graph.nodes_of_type("attack-flow"):
+        start_refs = flow_graph.node(flow_id).get("start_refs")
+        if start_refs:
+            return start_refs
+    has_predecessor = {target for targets in successors.values() for target in targets}
+    return [
+        flow_graph.node_id(node) for node in successors if node not in has_predecessor
+    ]
+
+
+def _strongly_connected_components(successors):
+    """
+    Label the strongly connected components of a graph with Tarjan's algorithm.
+
+    :param dict successors: maps each node to its successors
+    :returns: a dict from each node to the number of its component
+    :rtype: dict[int, int]
+    """
+    components = dict()
+    order = dict()
+    lowlink = dict()
+    stack = list()
+    on_stack = set()
+    for root in successors:
+        if root in order:
+            continue
+        order[root] = lowlink[root] = len(order)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(successors[root]))]
+        while work:
+            node, targets = work[-1]
+            for target in targets:
+                if target not in order:
+                    order[target] = lowlink[target] = len(order)
+                    stack.append(target)
+                    on_stack.add(target)
+                    work.append((target, iter(successors[target])))
+                    break
+                if target in on_stack:
+                    lowlink[node] = min(lowlink[node], order[target])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == order[node]:
+                    component = len(components)
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        components[member] = component
+                        if member == node:
+                            break
+    return components
+
+
+def _suffix_minimums(successors, terminals, weights):
+    """
+    Find the lowest total weight of the nodes on any path from each node to a terminal
+    node, with Dijkstra's algorithm run backwards from the terminal nodes. The paths are
+    not required to be simple, so this is a lower bound inside cycles.
+
+    :param dict successors: maps each node to its successors
+    :param set terminals:
+    :param dict weights: maps each node to its non-negative weight
+    :returns: a dict from each node to its minimum, which is infinite for nodes that
+        cannot reach a terminal node
+    :rtype: dict
+    """
+    predecessors = {node: list() for node in successors}
+    for node, targets in successors.items():
+        for target in targets:
+            predecessors[target].append(node)
+
+    minimums = dict.fromkeys(successors, math.inf)
+    queue = [(weights[node], node) for node in terminals]
+    heapq.heapify(queue)
+    while queue:
+        total, node = heapq.heappop(queue)
+        if total >= minimums[node]:
+            continue
+        minimums[node] = total
+        for predecessor in predecessors[node]:
+            candidate = total + weights[predecessor]
+            if candidate < minimums[predecessor]:
+                heapq.heappush(queue, (candidate, predecessor))
+    return minimums
+
+
+def _on_path(node, prefix, components):
+    """
+    Check whether a node is on a partial path. A path cannot return to a component it
+    has left, so only the end of the path that is in the node's component is searched.
+
+    :param int node:
+    :param tuple prefix: a ``(node, parent prefix)`` linked list
+    :param dict components:
+    :rtype: bool
+    """
+    component = components[node]
+    while prefix is not None and components[prefix[0]] == component:
+        if prefix[0] == node:
+            return True
+        prefix = prefix[1]
+    return False
+
+
+def _unlink(prefix):
+    """
+    :param tuple prefix: a ``(node, parent prefix)`` linked list
+    :returns: the nodes, last first
+    :rtype: list
+    """
+    nodes = list()
+    while prefix is not None:
+        nodes.append(prefix[0])
+        prefix = prefix[1]
+    return nodes
@@ -0,0 +1,183 @@
+"""
+Measure where the time and memory go while processing a flow.
+
+Library code marks each stage of its work with :func:`span` and reports sizes with
+:func:`count`. Both do nothing unless a profile has been started with :func:`start`, so
+they are cheap enough to leave in place permanently::
+
+    with attack_flow.profiling.span("check_schema"):
+        ...
+    attack_flow.profiling.count("objects", len(objects))
+
+Spans may be nested. A span that is opened many times inside the same parent, such as a
+stage that runs once per object, is reported once with its total time and the number of
+calls. When memory profiling is enabled, each span also records the peak memory that
+Python allocated while it was open, over and above what was already allocated when it
+was opened, as measured by :mod:`tracemalloc`.
+"""
+
+import contextlib
+import json
+import time
+import tracemalloc
+
+_NULL_SPAN = contextlib.nullcontext()
+_active = None
+
+
+class Profile:
+    """
+    The spans and counters recorded between :func:`start` and :func:`stop`.
+
+    :param bool memory: record peak memory with :mod:`tracemalloc`
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.started = time.perf_counter()
+        #: Spans as dicts, in the order they were first opened.
+        self.spans = list()
+        #: Counter totals, in the order they were first counted.
+        self.counters = dict()
+        self._stack = list()
+        self._children = {None: dict()}
+        # The peak memory of the innermost open span, or of the whole profile.
+        self._peaks = [0]
+        self._stop_tracing = False
+
+    def to_text(self):
+        """
+        Format the profile as an indented table for people to read.
+
+        :rtype: str
+        """
+        lines = ["Profile:"]
+        width = max([len(s["name"]) + 2 * s["depth"] for s in self.spans] + [0])
+        for span in self.spans:
+            indent = "  " * span["depth"]
+            line = f"  {indent}{span['name']:<{width - len(indent)}}  "
+            line += f"{span['duration_ms']:10.1f} ms"
+            line += f"  {span['calls']:>6} calls" if span["calls"] > 1 else " " * 13
+            if "peak_bytes" in span:
+                line += f"  {span['peak_bytes'] / (1024 * 1024):10.1f} MiB peak"
+            lines.append(line)
+        if self.counters:
+            lines.append("Counters:")
+            width = max(len(name) for name in self.counters)
+            for name, value in self.counters.items():
+                lines.append(f"  {name:<{width}}  {value:>10}")
+        return "\n".join(lines) + "\n"
+
+    def iter_json_lines(self):
+        """
+        Format the profile as JSON lines: one object per span and then one per counter.
+
+        :returns: generator of str
+        """
+        for span in self.spans:
+            yield json.dumps({"type": "span", **span})
+        for name, value in self.counters.items():
+            yield json.dumps({"type": "counter", "name": name, "value": value})
+
+    def _enter(self, name):
+        parent = id(self._stack[-1][0]) if self._stack else None
+        siblings = self._children[parent]
+        entry = siblings.get(name)
+        if entry is None:
+            entry = siblings[name] = {
+                "name": name,
+                "depth": len(self._stack),
+                "start_ms": 1000 * (time.perf_counter() - self.started),
+                "duration_ms": 0.0,
+                "calls": 0,
+            }
+            self._children[id(entry)] = dict()
+            self.spans.append(entry)
+        entry["calls"] += 1
+        allocated = 0
+        if self.memory:
+            allocated, peak = tracemalloc.get_traced_memory()
+            self._peaks[-1] = max(self._peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self._peaks.append(0)
+        self._stack.append((entry, time.perf_counter(), allocated))
+
+    def _exit(self):
+        entry, started, allocated = self._stack.pop()
+        entry["duration_ms"] += 1000 * (time.perf_counter() - started)
+        if self.memory:
+            peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+            entry["peak_bytes"] = max(entry.get("peak_bytes", 0), peak - allocated)
+            self._peaks[-1] = max(self._peaks[-1], peak)
+
+
+class _Span:
+    def __init__(self, profile, name):
+        self._profile = profile
+        self._name = name
+
+    def __enter__(self):
+        self._profile._enter(self._name)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._profile._exit()
+
+
+def start(memory=False):
+    """
+    Start recording spans and counters.
+
+    :param bool memory: also record peak memory, which slows down the program
+    :rtype: Profile
+    """
+    global _active
+    if _active is not None:
+        raise RuntimeError("A profile has already been started.")
+    profile = Profile(memory)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        profile._stop_tracing = True
+    _active = profile
+    return profile
+
+
+def stop():
+    """
+    Stop recording.
+
+    :returns: the completed profile
+    :rtype: Profile
+    """
+    global _active
+    profile = _active
+    _active = None
+    if profile is None:
+        raise RuntimeError("No profile has been started.")
+    while profile._stack:
+        profile._exit()
+    if profile._stop_tracing:
+        tracemalloc.stop()
+    return profile
+
+
+def span(name):
+    """
+    Time a stage of work.
+
+    :param str name:
+    :returns: a context manager
+    """
+    if _active is None:
+        return _NULL_SPAN
+    return _Span(_active, name)
+
+
+def count(name, value=1):
+    """
+    Add to a counter.
+
+    :param str name:
+    :param int value:
+    """
+    if _active is not None:
+        _active.counters[name] = _active.counters.get(name, 0) + value
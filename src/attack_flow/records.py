@@ -0,0 +1,407 @@
+"""
+Load Attack Flow bundles into lightweight records instead of stix2 objects.
+
+:func:`attack_flow.model.load_attack_flow_bundle` parses every object with
+``stix2.parse``, which checks and converts each property and builds a large immutable
+object. That is the right thing to do when validating, but it is most of the cost of
+loading a flow that will only be rendered or analyzed. The records in this module skip
+the checks: the Attack Flow SDOs are stored in ``__slots__`` and other objects wrap the
+decoded JSON.
+
+Records look like the stix2 objects that they replace, so the visualization and graph
+modules accept either. Properties are available as attributes, by subscript, and with
+``get()``; ``items()`` lists them in the order that stix2 would; timestamps are parsed
+into datetimes; optional properties that stix2 fills with a default, like
+``revoked``, are filled in the same way; and nested values that stix2 converts, such as
+external references, hashes, and the values of a registry key, are converted by stix2
+itself, so they print the same way. Other nested structures remain plain dicts and
+lists.
+
+Records are not validated. Use :mod:`attack_flow.schema` to validate a document first if
+it might not be well formed.
+"""
+
+from datetime import datetime
+import functools
+
+import stix2.exceptions
+import stix2.properties
+import stix2.registry
+
+import attack_flow.afb
+import attack_flow.model
+import attack_flow.jsonio
+import attack_flow.profiling
+
+
+class Record:
+    """
+    A STIX object backed by the dict it was decoded from.
+
+    :param dict properties: the object's properties, in order
+    """
+
+    __slots__ = ("_properties",)
+
+    def __init__(self, properties):
+        self._properties = properties
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            # Avoid recursion when _properties is not set yet, e.g. while copying.
+            raise AttributeError(name)
+        try:
+            return self._properties[name]
+        except KeyError:
+            raise AttributeError(
+                f"'{type(self).__name__}' object has no attribute '{name}'"
+            ) from None
+
+    def __getitem__(self, key):
+        return self._properties[key]
+
+    def __contains__(self, key):
+        return key in self._properties
+
+    def __iter__(self):
+        return iter(self._properties)
+
+    def __len__(self):
+        return len(self._properties)
+
+    def __repr__(self):
+        return f"{type(self).__name__}(id={self.get('id')!r})"
+
+    def get(self, key, default=None):
+        return self._properties.get(key, default)
+
+    def keys(self):
+        return self._properties.keys()
+
+    def values(self):
+        return self._properties.values()
+
+    def items(self):
+        return self._properties.items()
+
+
+class _SlottedRecord(Record):
+    """
+    A record that stores the properties of a known type in slots.
+
+    A subclass lists its properties in ``__slots__``. Properties that are not listed,
+    such as custom properties, are stored in a dict. ``_keys`` holds the names of the
+    properties that are present, in order; it is shared between records with the same
+    properties, so it costs almost nothing per record.
+    """
+
+    __slots__ = ("_keys", "_extra")
+    _fields = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = frozenset(cls.__slots__)
+
+    def __init__(self, keys, values):
+        self._keys = keys
+        self._extra = None
+        fields = self._fields
+        for key, value in zip(keys, values):
+            if key in fields:
+                setattr(self, key, value)
+            else:
+                if self._extra is None:
+                    self._extra = dict()
+                self._extra[key] = value
+
+    def __getattr__(self, name):
+        # Called for properties that are not in slots, and for empty slots.
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if self._extra is not None and name in self._extra:
+            return self._extra[name]
+        raise AttributeError(
+            f"'{type(self).__name__}' object has no attribute '{name}'"
+        )
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is not None:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self._keys
+
+    def values(self):
+        return [self[key] for key in self._keys]
+
+    def items(self):
+        return [(key, self[key]) for key in self._keys]
+
+
+class AttackFlow(_SlottedRecord):
+    """An ``attack-flow`` record."""
+
+    __slots__ = tuple(attack_flow.model.AttackFlow._properties)
+
+
+class AttackAction(_SlottedRecord):
+    """An ``attack-action`` record."""
+
+    __slots__ = tuple(attack_flow.model.AttackAction._properties)
+
+
+class AttackAsset(_SlottedRecord):
+    """An ``attack-asset`` record."""
+
+    __slots__ = tuple(attack_flow.model.AttackAsset._properties)
+
+
+class AttackCondition(_SlottedRecord):
+    """An ``attack-condition`` record."""
+
+    __slots__ = tuple(attack_flow.model.AttackCondition._properties)
+
+
+class AttackOperator(_SlottedRecord):
+    """An ``attack-operator`` record."""
+
+    __slots__ = tuple(attack_flow.model.AttackOperator._properties)
+
+
+RECORD_CLASSES = {
+    "attack-flow": AttackFlow,
+    "attack-action": AttackAction,
+    "attack-asset": AttackAsset,
+    "attack-condition": AttackCondition,
+    "attack-operator": AttackOperator,
+}
+
+
+class RecordBundle(Record):
+    """
+    A STIX bundle whose ``objects`` are records.
+    """
+
+    __slots__ = ()
+
+    @property
+    def objects(self):
+        return self._properties.get("objects", [])
+
+    def get_obj(self, obj_id):
+        """
+        Find objects by ID, like ``stix2.Bundle.get_obj()``.
+
+        :param str obj_id:
+        :returns: a list of the matching records
+        :raises KeyError: if there are none
+        """
+        found = [obj for obj in self.objects if obj.get("id") == obj_id]
+        if not found:
+            raise KeyError(
+                f"'{obj_id}' does not match the ID of any object in the bundle"
+            )
+        return found
+
+
+def load_bundle(path):
+    """
+    Load an Attack Flow STIX bundle into records.
+
+    Attack Flow Builder files (``.afb``) are exported to STIX first.
+
+    :param pathlib.Path path:
+    :rtype: RecordBundle
+    """
+    if path.suffix == attack_flow.afb.AFB_SUFFIX:
+        bundle_json = attack_flow.afb.load_afb_bundle(path)
+    else:
+        with attack_flow.profiling.span("json.decode"):
+            bundle_json = attack_flow.jsonio.load_path(path)
+    if isinstance(bundle_json.get("objects"), list):
+        attack_flow.profiling.count("objects", len(bundle_json["objects"]))
+    return parse_bundle(bundle_json)
+
+
+def parse_bundle(bundle_json):
+    """
+    Convert a bundle that has already been decoded from JSON into records.
+
+    The input is not modified, but generic records share nested values with it.
+
+    :param dict bundle_json:
+    :returns: a :class:`RecordBundle`, or a single record if the input is not a bundle
+    """
+    spec_version = "2.0" if bundle_json.get("spec_version") == "2.0" else "2.1"
+    with attack_flow.profiling.span("records.parse"):
+        if bundle_json.get("type") != "bundle":
+            return make_record(bundle_json, spec_version)
+        properties = dict(bundle_json)
+        if "objects" in properties:
+            properties["objects"] = [
+                make_record(obj, spec_version) for obj in bundle_json["objects"]
+            ]
+        return RecordBundle(properties)
+
+
+def make_record(obj, spec_version="2.1"):
+    """
+    Convert one STIX object that has been decoded from JSON into a record.
+
+    :param dict obj:
+    :param str spec_version: the STIX version used to look up the object's properties
+    :rtype: Record
+    """
+    type_info = _get_type_info(obj["type"], spec_version)
+    keys = type_info.key_order(tuple(obj))
+    timestamps = type_info.timestamps
+    defaults = type_info.defaults
+    nested = type_info.nested
+    values = list()
+    for key in keys:
+        value = obj[key] if key in obj else defaults[key]
+        if key in timestamps and isinstance(value, str):
+            value = _parse_timestamp(value)
+        elif key in nested and value is not None:
+            value = _clean_nested(nested[key], value)
+        values.append(value)
+
+    if any(value is None or value == [] for value in values):
+        # stix2 drops empty properties.
+        pairs = [(k, v) for k, v in zip(keys, values) if v is not None and v != []]
+        keys = tuple(k for k, _ in pairs)
+        values = [v for _, v in pairs]
+
+    record_class = RECORD_CLASSES.get(obj["type"])
+    if record_class is not None:
+        return record_class(keys, values)
+    return Record(dict(zip(keys, values)))
+
+
+def _parse_timestamp(value):
+    """
+    Parse a STIX timestamp the way stix2 does, except for the precision.
+
+    :param str value: such as ``2022-08-02T19:34:35.143Z``
+    :rtype: datetime
+    """
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return datetime.fromisoformat(value)
+
+
+def _clean_nested(prop, value):
+    """
+    Convert a nested value the way stix2 does, or leave it as it is if stix2 can't.
+
+    :param stix2.properties.Property prop:
+    :param value:
+    """
+    try:
+        return prop.clean(value, True)[0]
+    except (stix2.exceptions.STIXError, TypeError, ValueError):
+        return value
+
+
+def _is_nested(prop):
+    """
+    :param stix2.properties.Property prop:
+    :returns: whether stix2 converts the property's values into other objects
+    :rtype: bool
+    """
+    if isinstance(prop, stix2.properties.ListProperty):
+        prop = prop.contained
+        if isinstance(prop, type):
+            return True
+    return isinstance(
+        prop,
+        (
+            stix2.properties.EmbeddedObjectProperty,
+            stix2.properties.ExtensionsProperty,
+            stix2.properties.HashesProperty,
+        ),
+    )
+
+
+class _TypeInfo:
+    """
+    What stix2 knows about one object type, gathered once.
+
+    :param dict properties: the stix2 class's properties, or None for an unknown type
+    """
+
+    def __init__(self, properties):
+        properties = properties or dict()
+        self.order = {name: index for index, name in enumerate(properties)}
+        self.timestamps = frozenset(
+            name
+            for name, prop in properties.items()
+            if isinstance(prop, stix2.properties.TimestampProperty)
+        )
+        self.nested = {
+            name: prop for name, prop in properties.items() if _is_nested(prop)
+        }
+        self.defaults = dict()
+        for name, prop in properties.items():
+            if not hasattr(prop, "default") or isinstance(
+                prop, (stix2.properties.IDProperty, stix2.properties.TimestampProperty)
+            ):
+                # IDs and timestamps are generated, so they are not filled in.
+                continue
+            default = prop.default()
+            if isinstance(default, (bool, int, str)):
+                self.defaults[name] = default
+        self._key_orders = dict()
+
+    def key_order(self, keys):
+        """
+        Order an object's property names the way stix2 does: the type's own properties
+        first, in the order they are defined, and then any others in sorted order.
+        Missing properties that have defaults are included.
+
+        :param tuple[str] keys: the names of the properties in the decoded object
+        :rtype: tuple[str]
+        """
+        ordered = self._key_orders.get(keys)
+        if ordered is None:
+            present = set(keys) | self.defaults.keys()
+            known = sorted((k for k in present if k in self.order), key=self.order.get)
+            custom = sorted(k for k in present if k not in self.order)
+            ordered = self._key_orders[keys] = tuple(known + custom)
+        return ordered
+
+
+@functools.lru_cache(maxsize=None)
+def _get_type_info(obj_type, spec_version):
+    """
+    :param str obj_type:
+    :param str spec_version:
+    :rtype: _TypeInfo
+    """
+    stix_class = None
+    for category in ("objects", "observables"):
+        stix_class = stix2.registry.class_for_type(obj_type, spec_version, category)
+        if stix_class is not None:
+            break
+    return _TypeInfo(stix_class._properties if stix_class else None)
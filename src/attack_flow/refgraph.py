@@ -0,0 +1,324 @@
+"""
+A compact graph of the references between STIX objects.
+
+The validator only needs to know which objects refer to which, which nodes are
+connected to the flow, and which referenced objects are missing. A NetworkX graph stores
+a dictionary for every node and every edge, which dominates the time and memory needed
+to validate a large bundle. This graph interns each STIX ID as an integer, stores edges
+in flat arrays, and finds connected components with a union-find.
+"""
+
+from array import array
+
+EXTENSION_PREFIX = "extension-definition--"
+
+
+class ReferenceGraph:
+    """
+    A directed graph of STIX objects and the references between them.
+
+    A node is *defined* if it was added with :meth:`add_node`. An edge can refer to a
+    node that is never defined, and then the node has no type.
+    """
+
+    def __init__(self):
+        self._index = dict()
+        self._names = list()
+        self._types = list()
+        self._attrs = dict()
+        self._defined_order = dict()
+        self._sources = array("l")
+        self._targets = array("l")
+        self._removed = bytearray()
+
+    @classmethod
+    def from_bundle(cls, flow_bundle):
+        """
+        Create a reference graph from a STIX bundle.
+
+        Like :func:`attack_flow.graph.bundle_to_networkx`, relationships are edges and
+        every other object is a node, but extension nodes are not removed until
+        :meth:`remove_extension_nodes` is called.
+
+        :param stix2.Bundle flow_bundle:
+        :rtype: ReferenceGraph
+        """
+        graph = cls()
+        objects = flow_bundle.get("objects", [])
+        for obj in objects:
+            if obj["type"] != "relationship":
+                graph.add_node(obj["id"], summarize_node(obj))
+        for obj in objects:
+            for source, target in iter_object_refs(obj):
+                graph.add_edge(source, target)
+        return graph
+
+    @classmethod
+    def from_networkx(cls, nx_graph):
+        """
+        Create a reference graph from a NetworkX graph.
+
+        Nodes with empty attributes are treated as undefined.
+
+        :param nx.Graph nx_graph:
+        :rtype: ReferenceGraph
+        """
+        graph = cls()
+        for node, data in nx_graph.nodes(data=True):
+            if data:
+                graph.add_node(node, data)
+            else:
+                graph._intern(node)
+        for source, target in nx_graph.edges():
+            graph.add_edge(source, target)
+        return graph
+
+    def __len__(self):
+        return len(self._names) - sum(self._removed)
+
+    def __contains__(self, node):
+        index = self._index.get(node)
+        return index is not None and not self._removed[index]
+
+    def number_of_edges(self):
+        """
+        Count the edges between nodes that have not been removed.
+
+        :rtype: int
+        """
+        removed = self._removed
+        return sum(
+            1
+            for source, target in zip(self._sources, self._targets)
+            if not (removed[source] or removed[target])
+        )
+
+    def add_node(self, node, attrs):
+        """
+        Define a node.
+
+        Defining the same node twice merges the attributes.
+
+        :param str node: STIX ID
+        :param dict attrs: node attributes; must include ``type``
+        """
+        index = self._intern(node)
+        self._types[index] = attrs["type"]
+        self._defined_order.setdefault(index, len(self._defined_order))
+        if len(attrs) > 1 or index in self._attrs:
+            self._attrs.setdefault(index, dict()).update(attrs)
+
+    def add_edge(self, source, target):
+        """
+        Add a reference from ``source`` to ``target``.
+
+        :param str source: STIX ID
+        :param str target: STIX ID
+        """
+        self._sources.append(self._intern(source))
+        self._targets.append(self._intern(target))
+
+    def add_object(self, obj):
+        """
+        Add a parsed STIX object's node and its references.
+
+        :param stix2.base._STIXBase obj:
+        """
+        if obj["type"] != "relationship":
+            self.add_node(obj["id"], summarize_node(obj))
+        for source, target in iter_object_refs(obj):
+            self.add_edge(source, target)
+
+    def get_attrs(self, node):
+        """
+        Return a node's attributes, or an empty dict if it is not defined.
+
+        :param str node: STIX ID
+        :rtype: dict
+        """
+        index = self._index[node]
+        if index in self._attrs:
+            return self._attrs[index]
+        elif self._types[index] is not None:
+            return {"type": self._types[index]}
+        else:
+            return {}
+
+    def nodes_with_prefix(self, prefix):
+        """
+        Return the nodes whose IDs start with ``prefix``, in node order.
+
+        :param str prefix:
+        :rtype: list[str]
+        """
+        indices = [
+            index
+            for index, name in enumerate(self._names)
+            if name.startswith(prefix) and not self._removed[index]
+        ]
+        return [self._names[index] for index in sorted(indices, key=self._order_key)]
+
+    def remove_extension_nodes(self):
+        """
+        Remove extension objects and creators if they are not attached to other nodes.
+
+        This has the same effect as :func:`attack_flow.graph.remove_extension_nodes`.
+        """
+        extensions = [
+            index
+            for index, name in enumerate(self._names)
+            if name.startswith(EXTENSION_PREFIX) and not self._removed[index]
+        ]
+        if not extensions:
+            return
+        extensions.sort(key=self._order_key)
+
+        # Collect the successors of the extensions, and then the successors of those.
+        successors = self._collect_successors(set(extensions))
+        neighbors = set()
+        for extension in extensions:
+            neighbors.update(successors[extension])
+        successors.update(self._collect_successors(neighbors - successors.keys()))
+
+        removed = set()
+        for extension in extensions:
+            extension_neighbors = [n for n in successors[extension] if n not in removed]
+            removed.add(extension)
+            for neighbor in extension_neighbors:
+                if neighbor in removed:
+                    continue
+                neighbor_neighbors = set(successors[neighbor]) - removed
+                # remove edges from the node back to itself:
+                neighbor_neighbors.discard(neighbor)
+                if not neighbor_neighbors:
+                    removed.add(neighbor)
+
+        for index in removed:
+            self._removed[index] = 1
+
+    def analyze(self, seed_types, dangling_types):
+        """
+        Find the nodes that are disconnected from the seeds and the dangling references.
+
+        Edges are treated as undirected. A node is disconnected if it is not in the
+        same connected component as any defined node whose type is in ``seed_types``.
+        A node is dangling if it is not defined and the type prefix of its ID is in
+        ``dangling_types``. Removed nodes are ignored.
+
+        :param tuple[str] seed_types:
+        :param tuple[str] dangling_types:
+        :returns: a tuple ``(disconnected, dangling)`` of lists of STIX IDs in node
+            order
+        """
+        removed = self._removed
+        parent = array("l", range(len(self._names)))
+
+        def find(index):
+            while parent[index] != index:
+                parent[index] = parent[parent[index]]
+                index = parent[index]
+            return index
+
+        for source, target in zip(self._sources, self._targets):
+            if removed[source] or removed[target]:
+                continue
+            source_root = find(source)
+            target_root = find(target)
+            if source_root != target_root:
+                parent[target_root] = source_root
+
+        seed_roots = {
+            find(index)
+            for index, node_type in enumerate(self._types)
+            if node_type in seed_types and not removed[index]
+        }
+
+        disconnected = list()
+        dangling = list()
+        for index, name in enumerate(self._names):
+            if removed[index]:
+                continue
+            if find(index) not in seed_roots:
+                disconnected.append(index)
+            if self._types[index] is None and name.split("--")[0] in dangling_types:
+                dangling.append(index)
+
+        disconnected.sort(key=self._order_key)
+        dangling.sort(key=self._order_key)
+        return (
+            [self._names[index] for index in disconnected],
+            [self._names[index] for index in dangling],
+        )
+
+    def _intern(self, node):
+        index = self._index.get(node)
+        if index is None:
+            index = len(self._names)
+            self._index[node] = index
+            self._names.append(node)
+            self._types.append(None)
+            self._removed.append(0)
+        return index
+
+    def _order_key(self, index):
+        """
+        Sort nodes the way :func:`attack_flow.graph.bundle_to_networkx` adds them:
+        defined nodes in the order they were defined, then undefined nodes in the order
+        they were first referenced.
+        """
+        if index in self._defined_order:
+            return (0, self._defined_order[index])
+        return (1, index)
+
+    def _collect_successors(self, indices):
+        """
+        Find the successors of the given nodes that have not been removed.
+
+        :param set[int] indices:
+        :returns: a dict of node to a list of its successors, in the order they were
+            added
+        """
+        successors = {index: dict() for index in indices}
+        if not successors:
+            return successors
+        for source, target in zip(self._sources, self._targets):
+            if source in successors and not self._removed[target]:
+                successors[source][target] = None
+        return {index: list(targets) for index, targets in successors.items()}
+
+
+def iter_object_refs(obj):
+    """
+    Generate the references from a single STIX object.
+
+    This is like :func:`attack_flow.graph.iter_object_edges` without the edge
+    properties.
+
+    :param stix2.base._STIXBase obj:
+    :returns: generator of ``(source, target)`` tuples
+    """
+    if obj["type"] == "relationship":
+        yield obj["source_ref"], obj["target_ref"]
+    else:
+        for property_name, target_ref in obj.items():
+            if property_name.endswith("_ref"):
+                yield obj["id"], target_ref
+            elif property_name.endswith("_refs"):
+                for ref in target_ref:
+                    yield obj["id"], ref
+
+
+def summarize_node(obj):
+    """
+    Return the node attributes that the validator's graph checks need from an object.
+
+    This is much smaller than the full set of attributes that
+    :func:`attack_flow.graph.bundle_to_networkx` stores on each node.
+
+    :param stix2.base._STIXBase obj:
+    :rtype: dict
+    """
+    node = {"type": obj["type"]}
+    if obj["type"] == "attack-flow" and "description" in obj:
+        node["description"] = obj["description"]
+    return node
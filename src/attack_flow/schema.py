@@ -2,20 +2,30 @@
 Tools for working with the Attack Flow schema.
 """
 
-import json
 import functools
+import hashlib
 from pathlib import Path
-import re
 import urllib.parse
 
 import jsonschema
-import networkx as nx
+import jsonschema._utils
 import stix2.exceptions
 
-from .graph import bundle_to_networkx
-from .model import load_attack_flow_bundle, get_flow_object, ATTACK_FLOW_EXTENSION_ID
+import attack_flow.afb
+import attack_flow.jsonio
+import attack_flow.profiling
+from .jsonstream import iter_document
+from .model import (
+    parse_attack_flow_bundle,
+    parse_attack_flow_bundle_header,
+    parse_attack_flow_bundle_object,
+    ATTACK_FLOW_EXTENSION_ID,
+)
+from .refgraph import ReferenceGraph
+from .schema_compiler import CompiledValidator
 
 SCHEMA_DIR = Path(__file__).resolve().parents[2] / "stix"
+ATTACK_FLOW_SCHEMA = SCHEMA_DIR / "attack-flow-schema-2.0.0.json"
 ATTACK_FLOW_SDOS = (
     "attack-flow",
     "attack-action",
@@ -92,6 +102,26 @@ class ValidationResult:
     def add_exc(self, message, exc):
         self.messages.append(FlowValidationFailure("error", message, exc))
 
+    def to_dict(self):
+        """
+        Convert to a JSON-serializable form.
+
+        :rtype: dict
+        """
+        return {"messages": [m.to_dict() for m in self.messages]}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Restore a result from the output of :meth:`to_dict`.
+
+        :param dict data:
+        :rtype: ValidationResult
+        """
+        result = cls()
+        result.messages = [FlowValidationFailure.from_dict(m) for m in data["messages"]]
+        return result
+
 
 class FlowValidationFailure(Exception):
     """Generic error for validation failure."""
@@ -104,25 +134,228 @@ class FlowValidationFailure(Exception):
     def __str__(self):
         return f"[{self.type_}] {self.message}"
 
+    def to_dict(self):
+        """
+        Convert to a JSON-serializable form.
+
+        A wrapped JSON schema error is converted with all of its details, so that the
+        restored error prints exactly the same way. Any other wrapped exception is
+        reduced to its type name and text.
+
+        :rtype: dict
+        """
+        return {
+            "type": self.type_,
+            "message": self.message,
+            "exc": _exc_to_dict(self.exc) if self.exc is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Restore a failure from the output of :meth:`to_dict`.
+
+        :param dict data:
+        :rtype: FlowValidationFailure
+        """
+        exc = _exc_from_dict(data["exc"]) if data["exc"] is not None else None
+        return cls(data["type"], data["message"], exc)
 
-def validate_doc(flow_path):
+
+class SerializedException(Exception):
+    """
+    Stands in for an exception that was restored from its serialized form.
+
+    :param str type_name: the name of the original exception's class
+    :param str text: the original exception's text
+    """
+
+    def __init__(self, type_name, text):
+        super().__init__(text)
+        self.type_name = type_name
+        self.text = text
+
+    def __str__(self):
+        return self.text
+
+
+_VALIDATION_ERROR_FIELDS = (
+    "message",
+    "validator",
+    "validator_value",
+    "instance",
+    "schema",
+)
+
+
+def _exc_to_dict(exc):
+    if isinstance(exc, jsonschema.ValidationError):
+        data = {"class": "ValidationError"}
+        for field in _VALIDATION_ERROR_FIELDS:
+            value = getattr(exc, field)
+            if not isinstance(value, jsonschema._utils.Unset):
+                data[field] = value
+        data["path"] = list(exc.relative_path)
+        data["schema_path"] = list(exc.relative_schema_path)
+        data["context"] = [_exc_to_dict(e) for e in exc.context]
+        return data
+    elif isinstance(exc, SerializedException):
+        return {"class": exc.type_name, "text": exc.text}
+    else:
+        return {"class": type(exc).__name__, "text": str(exc)}
+
+
+def _exc_from_dict(data):
+    if data["class"] == "ValidationError" and "message" in data:
+        kwargs = {f: data[f] for f in _VALIDATION_ERROR_FIELDS if f in data}
+        return jsonschema.ValidationError(
+            path=data["path"],
+            schema_path=data["schema_path"],
+            context=[_exc_from_dict(e) for e in data["context"]],
+            **kwargs,
+        )
+    else:
+        return SerializedException(data["class"], data["text"])
+
+
+def validate_doc(flow_path, compiled=False, streaming=False):
     """
     Validate an Attack Flow document.
 
+    An Attack Flow Builder file (``.afb``) is exported to STIX and the export is
+    validated. Builder files are always loaded into memory, even when ``streaming`` is
+    set.
+
+    :param Path flow_path: path to attack flow doc
+    :param bool compiled: use compiled validators for Attack Flow SDOs
+    :param bool streaming: validate with :func:`validate_stream`
+    :rtype: ValidationResult
+    """
+    if flow_path.suffix == attack_flow.afb.AFB_SUFFIX:
+        try:
+            flow_json = attack_flow.afb.load_afb_bundle(flow_path)
+        except ValueError as e:
+            result = ValidationResult()
+            result.add_error(
+                f"Unable to export this Attack Flow Builder file to STIX: {e}"
+            )
+            return result
+        return validate_json(flow_json, compiled)
+
+    if streaming:
+        return validate_stream(flow_path, compiled)
+
+    with attack_flow.profiling.span("json.decode"):
+        flow_json = attack_flow.jsonio.load_path(flow_path)
+
+    return validate_json(flow_json, compiled)
+
+
+def validate_json(flow_json, compiled=False):
+    """
+    Validate an Attack Flow document that has already been decoded from JSON.
+
+    Every check consumes the same decoded document: the document is parsed into STIX
+    objects from ``flow_json`` rather than being read from disk again, and the graph
+    checks run on a compact :class:`attack_flow.refgraph.ReferenceGraph`.
+
+    :param dict flow_json: The flow parsed from JSON
+    :param bool compiled: use compiled validators for Attack Flow SDOs
+    :rtype: ValidationResult
+    """
+    span = attack_flow.profiling.span
+    if isinstance(flow_json.get("objects"), list):
+        attack_flow.profiling.count("objects", len(flow_json["objects"]))
+    result = ValidationResult()
+    with span("check_objects"):
+        check_objects(flow_json, result)
+    with span("check_schema"):
+        check_schema(flow_json, result, compiled)
+    try:
+        bundle = parse_attack_flow_bundle(flow_json)
+        with span("graph.build"):
+            graph = ReferenceGraph.from_bundle(bundle)
+            graph.remove_extension_nodes()
+        attack_flow.profiling.count("graph.nodes", len(graph))
+        attack_flow.profiling.count("graph.edges", graph.number_of_edges())
+        with span("check_graph"):
+            check_graph(graph, result)
+            check_best_practices(graph, result)
+    except stix2.exceptions.STIXError as e:
+        result.add_error(f"Unable to parse this flow as STIX 2.1: {e}")
+
+    return result
+
+
+def validate_stream(flow_path, compiled=False):
+    """
+    Validate an Attack Flow document without loading the whole document into memory.
+
+    The ``objects`` array is decoded one object at a time. Each object is checked
+    against the schema and parsed as STIX as soon as it is read, and then only its ID,
+    its type, and its references are kept for the graph checks. Peak memory therefore
+    depends on the number of objects and references, not on the size of the document.
+
+    The result has the same messages, in the same order, as :func:`validate_doc`.
+
     :param Path flow_path: path to attack flow doc
+    :param bool compiled: use compiled validators for Attack Flow SDOs
     :rtype: ValidationResult
     """
-    with flow_path.open() as flow_file:
-        flow_json = json.load(flow_file)
+    header = dict()
+    has_objects = False
+    flow_count = 0
+    has_extension = False
+    schema_result = ValidationResult()
+    stix_error = None
+    graph = ReferenceGraph()
+    span = attack_flow.profiling.span
+
+    with flow_path.open() as flow_file, span("validate_stream.objects"):
+        for event, key, value in iter_document(flow_file):
+            if event == "member":
+                header[key] = value
+                continue
+            elif event == "array":
+                has_objects = True
+                continue
+
+            obj = value
+            attack_flow.profiling.count("objects")
+            if obj["type"] == "attack-flow":
+                flow_count += 1
+            elif _is_attack_flow_extension(obj):
+                has_extension = True
+            check_object_schema(obj, schema_result, compiled)
+
+            # Like validate_json(), stop parsing STIX at the first error.
+            if stix_error is None:
+                try:
+                    stix_obj = parse_attack_flow_bundle_object(obj, header)
+                except stix2.exceptions.STIXError as e:
+                    stix_error = e
+                    continue
+                graph.add_object(stix_obj)
 
     result = ValidationResult()
-    check_objects(flow_json, result)
-    check_schema(flow_json, result)
+    check_object_summary(header, has_objects, flow_count, has_extension, result)
+    result.messages.extend(schema_result.messages)
     try:
-        bundle = load_attack_flow_bundle(flow_path)
-        graph = bundle_to_networkx(bundle).to_undirected()
-        check_graph(graph, result)
-        check_best_practices(graph, result)
+        if header.get("type") != "bundle":
+            # Not a bundle, so there is no flow graph to check.
+            parse_attack_flow_bundle(header)
+            return result
+        # The bundle's own properties are checked before its objects.
+        parse_attack_flow_bundle_header(header)
+        if stix_error is not None:
+            raise stix_error
+        with span("graph.build"):
+            graph.remove_extension_nodes()
+        attack_flow.profiling.count("graph.nodes", len(graph))
+        attack_flow.profiling.count("graph.edges", graph.number_of_edges())
+        with span("check_graph"):
+            check_graph(graph, result)
+            check_best_practices(graph, result)
     except stix2.exceptions.STIXError as e:
         result.add_error(f"Unable to parse this flow as STIX 2.1: {e}")
 
@@ -130,23 +363,27 @@ def validate_doc(flow_path):
 
 
 @functools.lru_cache(maxsize=None)
-def get_validator_for_object(obj_type):
+def get_validator_for_object(obj_type, compiled=False):
     """
     Return a validator for the given object type.
 
-    Validators are cached for efficiency.
+    Validators are cached for efficiency. All validators resolve references against
+    the same preloaded schema store, so building a validator does not touch the disk.
+
+    If ``compiled`` is true, then Attack Flow SDOs are validated with a
+    :class:`attack_flow.schema_compiler.CompiledValidator`, which produces the same
+    errors as the generic validator but runs much faster. Other object types always
+    use the generic validator.
 
     :param str obj_type:
+    :param bool compiled:
     :rtype: jsonschema.protocols.Validator
     """
-    resolver = jsonschema.validators.RefResolver(
-        base_uri="",
-        referrer=True,
-        handlers={"https": resolve_url_to_local, "http": resolve_url_to_local},
-    )
+    if compiled and obj_type in ATTACK_FLOW_SDOS:
+        return get_compiled_attack_flow_validator()
 
     if obj_type in ATTACK_FLOW_SDOS:
-        schema_path = SCHEMA_DIR / "attack-flow-schema-2.0.0.json"
+        schema_path = ATTACK_FLOW_SCHEMA
     elif obj_type in SDOS:
         schema_path = SCHEMA_DIR / "oasis-open" / "sdos" / f"{obj_type}.json"
     elif obj_type in SCOS:
@@ -159,13 +396,121 @@ def get_validator_for_object(obj_type):
         schema_path = None
 
     if schema_path:
-        with schema_path.open() as schema_file:
-            schema_json = json.load(schema_file)
-        return jsonschema.Draft202012Validator(schema_json, resolver=resolver)
+        return jsonschema.Draft202012Validator(
+            load_schema_file(schema_path), resolver=_get_resolver()
+        )
     else:
         return None
 
 
+@functools.lru_cache(maxsize=None)
+def get_compiled_attack_flow_validator():
+    """
+    Return a compiled validator for the Attack Flow schema.
+
+    All five Attack Flow SDO types share this validator.
+
+    :rtype: attack_flow.schema_compiler.CompiledValidator
+    """
+    return CompiledValidator(load_schema_file(ATTACK_FLOW_SCHEMA), _get_resolver())
+
+
+def _get_resolver():
+    """Create a reference resolver backed by the shared schema store."""
+    return jsonschema.validators.RefResolver(
+        base_uri="",
+        referrer=True,
+        store=get_schema_store(),
+        handlers={"https": resolve_url_to_local, "http": resolve_url_to_local},
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_schema_store():
+    """
+    Load the Attack Flow schema and all of the OASIS schemas into a single store.
+
+    The store maps each schema's ``$id`` to the parsed schema. It is built once per
+    process and shared by every validator.
+
+    :rtype: dict
+    """
+    store = dict()
+    for schema_path in _get_schema_paths():
+        schema_json = load_schema_file(schema_path)
+        if schema_id := schema_json.get("$id"):
+            store[schema_id] = schema_json
+    return store
+
+
+@functools.lru_cache(maxsize=None)
+def get_schema_fingerprint():
+    """
+    Compute a hash of all of the schema files.
+
+    The fingerprint changes whenever any schema file is added, removed, or modified,
+    so it can be used to invalidate stored validation results.
+
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    for schema_path in _get_schema_paths():
+        digest.update(schema_path.relative_to(SCHEMA_DIR).as_posix().encode("utf8"))
+        digest.update(b"\0")
+        digest.update(schema_path.read_bytes())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _get_schema_paths():
+    """Return the paths of all schema files, in a stable order."""
+    schema_paths = [ATTACK_FLOW_SCHEMA]
+    schema_paths.extend(sorted((SCHEMA_DIR / "oasis-open").glob("*/*.json")))
+    return schema_paths
+
+
+@functools.lru_cache(maxsize=None)
+def load_schema_file(schema_path):
+    """
+    Load a JSON schema from disk.
+
+    Each file is read at most once per process. The returned object is shared, so
+    callers must not modify it.
+
+    :param Path schema_path:
+    :rtype: dict
+    """
+    return attack_flow.jsonio.load_path(schema_path)
+
+
+def warm_validators(compiled=False):
+    """
+    Build and cache validators for every object type that has a schema.
+
+    This is used to initialize worker processes so that the first document each
+    worker validates does not pay the cost of loading schemas.
+
+    :param bool compiled: also build the compiled Attack Flow validator
+    """
+    for obj_type in ATTACK_FLOW_SDOS + SDOS + SCOS + SROS + (COMMON,):
+        get_validator_for_object(obj_type, compiled)
+
+
+def validate_doc_to_dict(validate_doc, flow_path):
+    """
+    Validate a document and convert the result with :meth:`ValidationResult.to_dict`.
+
+    This is run in worker processes, whose results have to be pickled to be sent back:
+    the JSON schema errors that a result wraps cannot be pickled, but its dict form can.
+
+    :param validate_doc: function that validates one document, such as
+        :func:`validate_doc`
+    :param Path flow_path:
+    :rtype: dict
+    """
+    return validate_doc(flow_path).to_dict()
+
+
 def resolve_url_to_local(url):
     """
     To avoid constantly downloading schemas from the internet, they are all stored
@@ -182,9 +527,7 @@ def resolve_url_to_local(url):
         local_path = oasis_schema.joinpath(*parsed.path.split("/")[-2:])
     else:
         raise RuntimeError(f"Cannot resolve schema URL to a local file path: {url}")
-    with local_path.open() as local_file:
-        local_schema = json.load(local_file)
-    return local_schema
+    return load_schema_file(local_path)
 
 
 def check_objects(flow_json, result):
@@ -196,97 +539,128 @@ def check_objects(flow_json, result):
     :param dict flow_json: The flow parsed from JSON
     :param ValidationResult result:
     """
-    if flow_json.get("type") != "bundle":
+    objects = flow_json.get("objects", [])
+    flow_count = len([o for o in objects if o["type"] == "attack-flow"])
+    has_extension = any(_is_attack_flow_extension(o) for o in objects)
+    check_object_summary(
+        flow_json,
+        isinstance(flow_json.get("objects"), list),
+        flow_count,
+        has_extension,
+        result,
+    )
+
+
+def check_object_summary(header, has_objects, flow_count, has_extension, result):
+    """
+    Report the errors of :func:`check_objects` from a summary of the document.
+
+    This allows the check to be made without holding all of the objects in memory.
+
+    :param dict header: the document's top-level properties
+    :param bool has_objects: true if the document has an ``objects`` array
+    :param int flow_count: number of ``attack-flow`` objects
+    :param bool has_extension: true if the Attack Flow ``extension-definition`` is
+        present
+    :param ValidationResult result:
+    """
+    if header.get("type") != "bundle":
         result.add_error(
             "An Attack Flow document must contain a top-level STIX bundle."
         )
-    if not flow_json.get("id", "").startswith("bundle--"):
+    if not header.get("id", "").startswith("bundle--"):
         result.add_error("The bundle ID must be a GUID starting with `bundle--`.")
-    if not isinstance(flow_json.get("objects"), list):
+    if not has_objects:
         result.add_error("The bundle must contain an array called `objects`.")
-    flows = [o for o in flow_json.get("objects", []) if o["type"] == "attack-flow"]
-    if len(flows) != 1:
+    if flow_count != 1:
         result.add_error("The bundle must contain exactly one `attack-flow` object.")
-    exts = [
-        o
-        for o in flow_json.get("objects", [])
-        if o["type"] == "extension-definition"
-        and o.get("id") == ATTACK_FLOW_EXTENSION_ID
-    ]
-    if not exts:
+    if not has_extension:
         result.add_error(
             "The bundle must include the Attack Flow `extension-definition`."
         )
 
 
-def check_schema(flow_json, result):
+def _is_attack_flow_extension(obj):
+    return (
+        obj["type"] == "extension-definition"
+        and obj.get("id") == ATTACK_FLOW_EXTENSION_ID
+    )
+
+
+def check_schema(flow_json, result, compiled=False):
     """
     Validate a document against the JSON schema.
 
     :param dict flow_json: The flow parsed from JSON
     :param ValidationResult result:
+    :param bool compiled: use compiled validators for Attack Flow SDOs
     """
     for item in flow_json.get("objects", []):
-        if not (validator := get_validator_for_object(item["type"])):
-            result.add_warning(f"Cannot validate objects of type: {item['type']}")
-            continue
-
-        for error in validator.iter_errors(item):
-            if isinstance(error.instance, dict):
-                obj_id = error.instance.get("id", "N/A")
-                message = f"Object id={obj_id}: "
-            else:
-                message = f"{error.instance}: "
-            if comment := error.schema.get("$comment"):
-                message += f"{comment} (Detail: {error.message})"
-            else:
-                message += error.message
-            result.add_exc(message, error)
+        check_object_schema(item, result, compiled)
+
+
+def check_object_schema(item, result, compiled=False):
+    """
+    Validate a single object from a document against the JSON schema.
+
+    :param dict item: a STIX object parsed from JSON
+    :param ValidationResult result:
+    :param bool compiled: use compiled validators for Attack Flow SDOs
+    """
+    if not (validator := get_validator_for_object(item["type"], compiled)):
+        result.add_warning(f"Cannot validate objects of type: {item['type']}")
+        return
+
+    for error in validator.iter_errors(item):
+        if isinstance(error.instance, dict):
+            obj_id = error.instance.get("id", "N/A")
+            message = f"Object id={obj_id}: "
+        else:
+            message = f"{error.instance}: "
+        if comment := error.schema.get("$comment"):
+            message += f"{comment} (Detail: {error.message})"
+        else:
+            message += error.message
+        result.add_exc(message, error)
 
 
 def check_graph(graph, result):
     """
     Check characteristics of the Attack Flow graph.
 
-    :param nx.DiGraph graph:
+    Check that all nodes are connected to the attack flow graph or one of the
+    extension-definitions, and check for dangling Attack Flow references.
+
+    :param ReferenceGraph graph: a NetworkX graph is also accepted
     :param ValidationResult result:
     """
-    # Check that all nodes are connected to the attack flow graph or one of the
-    # extension-definitions.
-    nodes = set(graph.nodes)
-    seeds = set(
-        id_
-        for id_, data in graph.nodes(data=True)
-        if data.get("type") in ("attack-flow", "extension-definition")
+    if not isinstance(graph, ReferenceGraph):
+        graph = ReferenceGraph.from_networkx(graph)
+    disconnected, dangling = graph.analyze(
+        ("attack-flow", "extension-definition"), ATTACK_FLOW_SDOS
     )
-    visited = set()
-
-    for seed in seeds:
-        visited.update(nx.dfs_preorder_nodes(graph, seed))
 
-    disconnected = nodes - visited
     for node in disconnected:
-        if not re.match(r"^(threat-actor|campaign)--", node):
+        if not node.startswith(("threat-actor--", "campaign--")):
             result.add_warning(f"Node id={node} is not connected to the main flow.")
 
-    # Check for dangling Attack Flow references.
-    for id_, data in graph.nodes(data=True):
-        inferred_type = id_.split("--")[0]
-        if inferred_type in ATTACK_FLOW_SDOS and data == {}:
-            result.add_warning(
-                f"Node id={id_} is referenced in the flow but is not defined."
-            )
+    for node in dangling:
+        result.add_warning(
+            f"Node id={node} is referenced in the flow but is not defined."
+        )
 
 
 def check_best_practices(graph, result):
     """
     Check for some best practices.
 
-    :param nx.DiGraph graph:
+    :param ReferenceGraph graph: a NetworkX graph is also accepted
     :param ValidationResult result:
     """
-    flows = [n for n in graph.nodes if n.startswith("attack-flow--")]
+    if not isinstance(graph, ReferenceGraph):
+        graph = ReferenceGraph.from_networkx(graph)
+    flows = graph.nodes_with_prefix("attack-flow--")
 
     if flows:
-        if not graph.nodes[flows[0]].get("description"):
+        if not graph.get_attrs(flows[0]).get("description"):
             result.add_warning("The ``attack-flow`` object should have a description.")
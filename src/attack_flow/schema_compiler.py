@@ -0,0 +1,705 @@
+"""
+Compile JSON schemas into specialized Python validation functions.
+
+The generic ``jsonschema`` validators interpret the schema on every call: each
+keyword is looked up, each ``$ref`` is resolved, and each subschema is wrapped in a
+new validator object. This module does that work once, up front, and produces a tree
+of closures that only perform the checks themselves.
+
+The compiled validators are a drop-in replacement for
+``jsonschema.Draft202012Validator``: they yield the same
+``jsonschema.exceptions.ValidationError`` objects, with the same messages, paths, and
+schemas, in the same order. Only the keywords used by the Attack Flow and STIX schemas
+are supported; compiling a schema that uses any other keyword raises
+``UnsupportedSchema``.
+"""
+
+import re
+
+import jsonschema
+from jsonschema import _validators
+from jsonschema._utils import equal, extras_msg, find_additional_properties
+from jsonschema.exceptions import ValidationError
+
+TYPE_CHECKER = jsonschema.Draft202012Validator.TYPE_CHECKER
+
+# Keywords that have no effect on validation results.
+_ANNOTATIONS = ("format",)
+
+# Keywords that do not descend into subschemas are delegated to the jsonschema
+# implementation, which guarantees identical messages.
+_LEAF_KEYWORDS = (
+    "dependentRequired",
+    "exclusiveMaximum",
+    "exclusiveMinimum",
+    "maximum",
+    "maxItems",
+    "maxLength",
+    "maxProperties",
+    "minimum",
+    "minLength",
+    "minProperties",
+    "multipleOf",
+    "uniqueItems",
+)
+
+_TYPE_CHECKS = {
+    "array": lambda i: isinstance(i, list),
+    "boolean": lambda i: isinstance(i, bool),
+    "integer": lambda i: isinstance(i, int) and not isinstance(i, bool),
+    "null": lambda i: i is None,
+    "number": lambda i: TYPE_CHECKER.is_type(i, "number"),
+    "object": lambda i: isinstance(i, dict),
+    "string": lambda i: isinstance(i, str),
+}
+
+
+class UnsupportedSchema(Exception):
+    """The schema uses a keyword that the compiler does not support."""
+
+
+class _LeafValidator:
+    """
+    The minimal validator interface needed by jsonschema's leaf keyword functions.
+    """
+
+    format_checker = None
+
+    @staticmethod
+    def is_type(instance, type_):
+        return TYPE_CHECKER.is_type(instance, type_)
+
+
+def _no_errors(instance, collect=True):
+    return ()
+
+
+def _descend(errors, path=None, schema_path=None):
+    """
+    Prefix the paths of errors produced by a subschema, like
+    ``Validator.descend()``.
+    """
+    for error in errors:
+        if path is not None:
+            error.path.appendleft(path)
+        if schema_path is not None:
+            error.schema_path.appendleft(schema_path)
+    return errors
+
+
+class CompiledValidator:
+    """
+    A validator for one schema, compiled into closures.
+
+    Each compiled node is a function ``node(instance, collect=True)``. When
+    ``collect`` is true it returns a list of errors (or an empty tuple), and when it
+    is false it returns a truthy value as soon as the first failure is found, without
+    building any error objects. The second form is used wherever jsonschema only
+    asks whether an instance is valid, e.g. for ``if`` and ``not``.
+
+    :param dict schema: the root schema
+    :param jsonschema.RefResolver resolver: used to resolve ``$ref`` at compile time
+    """
+
+    def __init__(self, schema, resolver):
+        self.schema = schema
+        self._resolver = resolver
+        self._nodes = dict()
+        self._evaluated = dict()
+        self._root = self._compile(schema)
+
+    def iter_errors(self, instance):
+        """
+        Validate ``instance`` and yield each error.
+
+        :rtype: Iterator[jsonschema.exceptions.ValidationError]
+        """
+        yield from self._root(instance)
+
+    def is_valid(self, instance):
+        """
+        :rtype: bool
+        """
+        return not self._root(instance, False)
+
+    def _scope_key(self, schema):
+        return (id(schema), self._resolver.resolution_scope)
+
+    def _compile(self, schema):
+        """
+        Compile a schema into a node function.
+
+        Compiled nodes are memoized by schema identity and resolution scope, which
+        shares work between repeated references and allows recursive schemas.
+        """
+        if schema is True:
+            return _no_errors
+        if schema is False:
+
+            def false_schema(instance, collect=True):
+                if not collect:
+                    return True
+                return [
+                    ValidationError(
+                        f"False schema does not allow {instance!r}",
+                        validator=None,
+                        validator_value=None,
+                        instance=instance,
+                        schema=schema,
+                    )
+                ]
+
+            return false_schema
+
+        key = self._scope_key(schema)
+        if key in self._nodes:
+            cell = self._nodes[key]
+            if cell[0] is None:
+                # Recursive reference to a node that is still being compiled.
+                return lambda instance, collect=True: cell[0](instance, collect)
+            return cell[0]
+        cell = [None]
+        self._nodes[key] = cell
+
+        scope = jsonschema.Draft202012Validator.ID_OF(schema)
+        if scope:
+            self._resolver.push_scope(scope)
+        try:
+            checks = list()
+            for keyword, value in schema.items():
+                if keyword not in jsonschema.Draft202012Validator.VALIDATORS:
+                    continue
+                if keyword in _ANNOTATIONS:
+                    continue
+                compile_keyword = getattr(self, f"_k_{keyword.lstrip('$')}", None)
+                if compile_keyword is None:
+                    if keyword not in _LEAF_KEYWORDS:
+                        raise UnsupportedSchema(f"Unsupported keyword: {keyword}")
+                    check = self._leaf(keyword, value, schema)
+                else:
+                    check = compile_keyword(value, schema)
+                checks.append((keyword, value, check, keyword not in ("if", "$ref")))
+        finally:
+            if scope:
+                self._resolver.pop_scope()
+
+        checks = tuple(checks)
+
+        def node(instance, collect=True):
+            errors = None
+            for keyword, value, check, prefix in checks:
+                keyword_errors = check(instance, collect)
+                if keyword_errors:
+                    if not collect:
+                        return True
+                    if errors is None:
+                        errors = list()
+                    for error in keyword_errors:
+                        error._set(
+                            validator=keyword,
+                            validator_value=value,
+                            instance=instance,
+                            schema=schema,
+                            type_checker=TYPE_CHECKER,
+                        )
+                        if prefix:
+                            error.schema_path.appendleft(keyword)
+                        errors.append(error)
+            return errors or ()
+
+        cell[0] = node
+        return node
+
+    def _leaf(self, keyword, value, schema):
+        validate = getattr(_validators, keyword)
+
+        def check(instance, collect):
+            if not collect:
+                return next(validate(_LeafValidator, value, instance, schema), None)
+            return list(validate(_LeafValidator, value, instance, schema))
+
+        return check
+
+    def _k_ref(self, ref, schema):
+        scope, resolved = self._resolver.resolve(ref)
+        self._resolver.push_scope(scope)
+        try:
+            return self._compile(resolved)
+        finally:
+            self._resolver.pop_scope()
+
+    def _k_type(self, types, schema):
+        types = [types] if isinstance(types, str) else list(types)
+        try:
+            type_checks = tuple(_TYPE_CHECKS[t] for t in types)
+        except KeyError as e:
+            raise UnsupportedSchema(f"Unknown type: {e}")
+        reprs = ", ".join(repr(t) for t in types)
+
+        if len(type_checks) == 1:
+            (is_type,) = type_checks
+
+            def check(instance, collect):
+                if not is_type(instance):
+                    if not collect:
+                        return True
+                    return [ValidationError(f"{instance!r} is not of type {reprs}")]
+
+        else:
+
+            def check(instance, collect):
+                if not any(is_type(instance) for is_type in type_checks):
+                    if not collect:
+                        return True
+                    return [ValidationError(f"{instance!r} is not of type {reprs}")]
+
+        return check
+
+    def _k_const(self, const, schema):
+        def check(instance, collect):
+            if not equal(instance, const):
+                if not collect:
+                    return True
+                return [ValidationError(f"{const!r} was expected")]
+
+        return check
+
+    def _k_enum(self, enums, schema):
+        return self._leaf("enum", enums, schema)
+
+    def _k_pattern(self, pattern, schema):
+        search = re.compile(pattern).search
+
+        def check(instance, collect):
+            if isinstance(instance, str) and not search(instance):
+                if not collect:
+                    return True
+                return [ValidationError(f"{instance!r} does not match {pattern!r}")]
+
+        return check
+
+    def _k_required(self, required, schema):
+        def check(instance, collect):
+            if isinstance(instance, dict):
+                return [
+                    ValidationError(f"{property!r} is a required property")
+                    for property in required
+                    if property not in instance
+                ]
+
+        return check
+
+    def _k_minItems(self, min_items, schema):
+        def check(instance, collect):
+            if isinstance(instance, list) and len(instance) < min_items:
+                if not collect:
+                    return True
+                return [ValidationError(f"{instance!r} is too short")]
+
+        return check
+
+    def _k_properties(self, properties, schema):
+        compiled = tuple(
+            (property, self._compile(subschema))
+            for property, subschema in properties.items()
+        )
+
+        def check(instance, collect):
+            if not isinstance(instance, dict):
+                return
+            errors = None
+            for property, node in compiled:
+                if property in instance:
+                    property_errors = node(instance[property], collect)
+                    if property_errors:
+                        if not collect:
+                            return True
+                        if errors is None:
+                            errors = list()
+                        errors.extend(_descend(property_errors, property, property))
+            return errors
+
+        return check
+
+    def _k_patternProperties(self, pattern_properties, schema):
+        compiled = tuple(
+            (pattern, re.compile(pattern).search, self._compile(subschema))
+            for pattern, subschema in pattern_properties.items()
+        )
+
+        def check(instance, collect):
+            if not isinstance(instance, dict):
+                return
+            errors = list()
+            for pattern, search, node in compiled:
+                for k, v in instance.items():
+                    if search(k):
+                        sub_errors = node(v, collect)
+                        if sub_errors and not collect:
+                            return True
+                        errors.extend(_descend(sub_errors, k, pattern))
+            return errors
+
+        return check
+
+    def _k_additionalProperties(self, additional, schema):
+        if isinstance(additional, dict):
+            node = self._compile(additional)
+
+            def check(instance, collect):
+                if not isinstance(instance, dict):
+                    return
+                errors = list()
+                for extra in set(find_additional_properties(instance, schema)):
+                    sub_errors = node(instance[extra], collect)
+                    if sub_errors and not collect:
+                        return True
+                    errors.extend(_descend(sub_errors, extra))
+                return errors
+
+            return check
+        elif not additional:
+            return self._leaf("additionalProperties", additional, schema)
+        else:
+            return _no_errors
+
+    def _k_propertyNames(self, property_names, schema):
+        node = self._compile(property_names)
+
+        def check(instance, collect):
+            if not isinstance(instance, dict):
+                return
+            errors = list()
+            for property in instance:
+                sub_errors = node(property, collect)
+                if sub_errors and not collect:
+                    return True
+                errors.extend(sub_errors)
+            return errors
+
+        return check
+
+    def _k_items(self, items, schema):
+        if items is False or "prefixItems" in schema:
+            raise UnsupportedSchema("Unsupported form of keyword: items")
+        node = self._compile(items)
+
+        def check(instance, collect):
+            if not isinstance(instance, list):
+                return
+            errors = None
+            for index, item in enumerate(instance):
+                item_errors = node(item, collect)
+                if item_errors:
+                    if not collect:
+                        return True
+                    if errors is None:
+                        errors = list()
+                    errors.extend(_descend(item_errors, index))
+            return errors
+
+        return check
+
+    def _k_contains(self, contains, schema):
+        node = self._compile(contains)
+        min_contains = schema.get("minContains", 1)
+
+        def check(instance, collect):
+            if not isinstance(instance, list):
+                return
+            max_contains = schema.get("maxContains", len(instance))
+            matches = 0
+            for each in instance:
+                if not node(each, False):
+                    matches += 1
+                    if matches > max_contains:
+                        return [
+                            ValidationError(
+                                "Too many items match the given schema "
+                                f"(expected at most {max_contains})",
+                                validator="maxContains",
+                                validator_value=max_contains,
+                            )
+                        ]
+            if matches < min_contains:
+                if not matches:
+                    return [
+                        ValidationError(
+                            f"{instance!r} does not contain items "
+                            "matching the given schema",
+                        )
+                    ]
+                return [
+                    ValidationError(
+                        "Too few items match the given schema (expected at least "
+                        f"{min_contains} but only {matches} matched)",
+                        validator="minContains",
+                        validator_value=min_contains,
+                    )
+                ]
+
+        return check
+
+    def _k_allOf(self, all_of, schema):
+        compiled = tuple(self._compile(subschema) for subschema in all_of)
+
+        def check(instance, collect):
+            errors = None
+            for index, node in enumerate(compiled):
+                sub_errors = node(instance, collect)
+                if sub_errors:
+                    if not collect:
+                        return True
+                    if errors is None:
+                        errors = list()
+                    errors.extend(_descend(sub_errors, schema_path=index))
+            return errors
+
+        return check
+
+    def _k_anyOf(self, any_of, schema):
+        compiled = tuple(self._compile(subschema) for subschema in any_of)
+
+        def check(instance, collect):
+            # Most instances are valid, so check that first and only build the
+            # errors for the context when the keyword actually fails.
+            if any(not node(instance, False) for node in compiled):
+                return
+            if not collect:
+                return True
+            all_errors = list()
+            for index, node in enumerate(compiled):
+                errors = _descend(list(node(instance)), schema_path=index)
+                if not errors:
+                    return
+                all_errors.extend(errors)
+            return [
+                ValidationError(
+                    f"{instance!r} is not valid under any of the given schemas",
+                    context=all_errors,
+                )
+            ]
+
+        return check
+
+    def _k_oneOf(self, one_of, schema):
+        compiled = tuple((subschema, self._compile(subschema)) for subschema in one_of)
+
+        def check(instance, collect):
+            valid_count = sum(not node(instance, False) for _, node in compiled)
+            if valid_count == 1:
+                return
+            if not collect:
+                return True
+            errors = list()
+            all_errors = list()
+            first_valid = None
+            remaining = iter(enumerate(compiled))
+            for index, (subschema, node) in remaining:
+                sub_errors = _descend(list(node(instance)), schema_path=index)
+                if not sub_errors:
+                    first_valid = subschema
+                    break
+                all_errors.extend(sub_errors)
+            else:
+                errors.append(
+                    ValidationError(
+                        f"{instance!r} is not valid under any of the given schemas",
+                        context=all_errors,
+                    )
+                )
+
+            more_valid = [
+                subschema
+                for _, (subschema, node) in remaining
+                if not node(instance, False)
+            ]
+            if more_valid:
+                more_valid.append(first_valid)
+                reprs = ", ".join(repr(s) for s in more_valid)
+                errors.append(
+                    ValidationError(f"{instance!r} is valid under each of {reprs}")
+                )
+            return errors
+
+        return check
+
+    def _k_not(self, not_schema, schema):
+        node = self._compile(not_schema)
+
+        def check(instance, collect):
+            if not node(instance, False):
+                if not collect:
+                    return True
+                return [
+                    ValidationError(
+                        f"{instance!r} should not be valid under {not_schema!r}"
+                    )
+                ]
+
+        return check
+
+    def _k_if(self, if_schema, schema):
+        if_node = self._compile(if_schema)
+        then_node = self._compile(schema["then"]) if "then" in schema else None
+        else_node = self._compile(schema["else"]) if "else" in schema else None
+
+        def check(instance, collect):
+            if not if_node(instance, False):
+                if then_node is not None:
+                    sub_errors = then_node(instance, collect)
+                    if collect:
+                        return _descend(list(sub_errors), schema_path="then")
+                    return sub_errors
+            elif else_node is not None:
+                sub_errors = else_node(instance, collect)
+                if collect:
+                    return _descend(list(sub_errors), schema_path="else")
+                return sub_errors
+
+        return check
+
+    def _k_unevaluatedProperties(self, unevaluated, schema):
+        evaluated_keys = self._compile_evaluated(schema)
+        node = self._compile(unevaluated)
+
+        def check(instance, collect):
+            if not isinstance(instance, dict):
+                return
+            evaluated = evaluated_keys(instance)
+            unevaluated_keys = list()
+            for property in instance:
+                if property not in evaluated:
+                    if not collect:
+                        if node(instance[property], False):
+                            return True
+                        continue
+                    for _ in node(instance[property]):
+                        unevaluated_keys.append(property)
+            if unevaluated_keys:
+                if unevaluated is False:
+                    error = "Unevaluated properties are not allowed (%s %s unexpected)"
+                else:
+                    error = (
+                        "Unevaluated properties are not valid under "
+                        "the given schema (%s %s unevaluated and invalid)"
+                    )
+                return [ValidationError(error % extras_msg(unevaluated_keys))]
+
+        return check
+
+    def _compile_evaluated(self, schema):
+        """
+        Compile a function that returns the set of property names that ``schema``
+        evaluates for an instance. This mirrors
+        ``jsonschema._utils.find_evaluated_property_keys_by_schema``.
+        """
+        if isinstance(schema, bool):
+            return lambda instance: set()
+
+        key = self._scope_key(schema)
+        if key in self._evaluated:
+            cell = self._evaluated[key]
+            if cell[0] is None:
+                return lambda instance: cell[0](instance)
+            return cell[0]
+        cell = [None]
+        self._evaluated[key] = cell
+
+        parts = list()
+        if "$ref" in schema:
+            scope, resolved = self._resolver.resolve(schema["$ref"])
+            self._resolver.push_scope(scope)
+            try:
+                parts.append(self._compile_evaluated(resolved))
+            finally:
+                self._resolver.pop_scope()
+
+        for keyword in ("properties", "additionalProperties", "unevaluatedProperties"):
+            if keyword not in schema:
+                continue
+            value = schema[keyword]
+            if value is True:
+                parts.append(lambda instance: set(instance))
+            elif isinstance(value, dict):
+                compiled = tuple(
+                    (property, self._compile(subschema))
+                    for property, subschema in value.items()
+                )
+
+                def evaluated(instance, compiled=compiled):
+                    return {
+                        property
+                        for property, node in compiled
+                        if property in instance and not node(instance[property], False)
+                    }
+
+                parts.append(evaluated)
+
+        if "patternProperties" in schema:
+            pattern_properties = schema["patternProperties"]
+            searches = tuple(re.compile(p).search for p in pattern_properties)
+            node = self._compile(pattern_properties)
+
+            def evaluated(instance):
+                return {
+                    property
+                    for property, value in instance.items()
+                    for search in searches
+                    if search(property) and not node({property: value}, False)
+                }
+
+            parts.append(evaluated)
+
+        if "dependentSchemas" in schema:
+            raise UnsupportedSchema("Unsupported keyword: dependentSchemas")
+
+        for keyword in ("allOf", "oneOf", "anyOf"):
+            if keyword not in schema:
+                continue
+            compiled = tuple(
+                (self._compile(subschema), self._compile_evaluated(subschema))
+                for subschema in schema[keyword]
+            )
+
+            def evaluated(instance, compiled=compiled):
+                keys = set()
+                for node, sub_evaluated in compiled:
+                    if not node(instance, False):
+                        keys |= sub_evaluated(instance)
+                return keys
+
+            parts.append(evaluated)
+
+        if "if" in schema:
+            if_node = self._compile(schema["if"])
+            if_evaluated = self._compile_evaluated(schema["if"])
+            then_evaluated = (
+                self._compile_evaluated(schema["then"]) if "then" in schema else None
+            )
+            else_evaluated = (
+                self._compile_evaluated(schema["else"]) if "else" in schema else None
+            )
+
+            def evaluated(instance):
+                if not if_node(instance, False):
+                    keys = if_evaluated(instance)
+                    if then_evaluated is not None:
+                        keys = keys | then_evaluated(instance)
+                    return keys
+                elif else_evaluated is not None:
+                    return else_evaluated(instance)
+                return set()
+
+            parts.append(evaluated)
+
+        parts = tuple(parts)
+
+        def evaluated_keys(instance):
+            keys = set()
+            for part in parts:
+                keys |= part(instance)
+            return keys
+
+        cell[0] = evaluated_keys
+        return evaluated_keys
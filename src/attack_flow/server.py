@@ -0,0 +1,575 @@
+"""
+A long-running server that validates and converts Attack Flow documents.
+
+Starting ``af`` imports several large libraries and builds the schema validators, which
+takes much longer than validating or converting a typical flow. The server pays that
+cost once: it keeps a pool of worker processes whose validators are already built, and
+clients send documents over HTTP, either on a TCP port or on a Unix socket.
+
+Every endpoint except ``GET /health`` and ``GET /metrics`` is a ``POST`` whose body is
+an Attack Flow document:
+
+* ``/validate`` responds with a JSON object containing ``success`` and ``messages``.
+* ``/graphviz`` and ``/mermaid`` respond with the converted document.
+* ``/matrix`` responds with the flow drawn on the server's ATT&CK matrix SVG.
+
+``POST /batch`` takes ``{"requests": [{"command": ..., "flow": ...}, ...]}`` and runs
+all of the requests concurrently, responding with a list of results in the same order.
+"""
+
+import collections
+import concurrent.futures
+import http.server
+import io
+import logging
+import multiprocessing
+import os
+import socketserver
+import threading
+import time
+
+import attack_flow.graphviz
+import attack_flow.jsonio
+import attack_flow.matrix
+import attack_flow.mermaid
+import attack_flow.model
+import attack_flow.schema
+
+COMMANDS = ("validate", "graphviz", "mermaid", "matrix")
+# The number of recent latencies kept for each command to compute percentiles.
+LATENCY_WINDOW = 1024
+# The largest request body that is read, in bytes.
+DEFAULT_MAX_BODY_SIZE = 64 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+# These globals are set in each worker process by _init_worker().
+_compiled = False
+_matrix_svg = None
+
+
+def _init_worker(compiled, matrix_svg):
+    """
+    Prepare a worker process before it handles any requests.
+
+    :param bool compiled: use compiled validators for Attack Flow SDOs
+    :param str matrix_svg: the content of the ATT&CK matrix SVG, or None
+    """
+    global _compiled, _matrix_svg
+    _compiled = compiled
+    _matrix_svg = matrix_svg
+    attack_flow.schema.warm_validators(compiled)
+
+
+def run_command(command, flow_json):
+    """
+    Run one command on a decoded Attack Flow document.
+
+    This runs in a worker process, using the options that the worker was started with.
+
+    :param str command: one of :data:`COMMANDS`
+    :param dict flow_json:
+    :returns: a tuple ``(content_type, body)``
+    """
+    if command == "validate":
+        result = attack_flow.schema.validate_json(flow_json, _compiled)
+        body = attack_flow.jsonio.dumps(
+            {
+                "success": result.success,
+                "messages": [
+                    {"type": m.type_, "message": m.message} for m in result.messages
+                ],
+            }
+        )
+        return "application/json", body
+
+    flow_bundle = attack_flow.model.parse_attack_flow_bundle(flow_json)
+    if command == "graphviz":
+        return "text/vnd.graphviz", attack_flow.graphviz.convert(flow_bundle)
+    elif command == "mermaid":
+        return "text/plain", attack_flow.mermaid.convert(flow_bundle)
+    elif command == "matrix":
+        if _matrix_svg is None:
+            raise RuntimeError("the server was started without a matrix SVG")
+        out_file = io.BytesIO()
+        attack_flow.matrix.render(io.StringIO(_matrix_svg), flow_bundle, out_file)
+        return "image/svg+xml", out_file.getvalue().decode("utf8")
+    else:
+        raise ValueError(f"unknown command: {command}")
+
+
+class RequestError(Exception):
+    """An error that is reported to the client with an HTTP status code."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class LatencyMetrics:
+    """
+    Thread-safe counters and latency percentiles for each command.
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self._stats = dict()
+
+    def record(self, command, seconds, ok=True):
+        """
+        Record one request.
+
+        :param str command:
+        :param float seconds: how long the request took
+        :param bool ok: false if the request failed
+        """
+        with self._lock:
+            stats = self._stats.get(command)
+            if stats is None:
+                stats = self._stats[command] = {
+                    "count": 0,
+                    "errors": 0,
+                    "total": 0.0,
+                    "max": 0.0,
+                    "recent": collections.deque(maxlen=self._window),
+                }
+            stats["count"] += 1
+            stats["errors"] += 0 if ok else 1
+            stats["total"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            stats["recent"].append(seconds)
+
+    def snapshot(self):
+        """
+        Summarize the requests recorded so far.
+
+        Times are in milliseconds. The percentiles are computed over the most recent
+        requests only.
+
+        :rtype: dict
+        """
+        with self._lock:
+            summary = dict()
+            for command, stats in self._stats.items():
+                recent = sorted(stats["recent"])
+                summary[command] = {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "mean_ms": 1000 * stats["total"] / stats["count"],
+                    "max_ms": 1000 * stats["max"],
+                    "p50_ms": 1000 * _percentile(recent, 0.50),
+                    "p95_ms": 1000 * _percentile(recent, 0.95),
+                    "p99_ms": 1000 * _percentile(recent, 0.99),
+                }
+            return summary
+
+
+def _percentile(sorted_values, fraction):
+    """
+    Return the nearest-rank percentile of a sorted, non-empty list.
+
+    :param list[float] sorted_values:
+    :param float fraction: between 0 and 1
+    :rtype: float
+    """
+    rank = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class AttackFlowService:
+    """
+    Run commands in a bounded pool of warm worker processes.
+
+    At most ``max_pending`` requests are accepted at once, counting each request in a
+    batch separately; further requests are rejected with status 503 rather than queued
+    without limit. A batch with more than ``max_pending`` requests is rejected with
+    status 413, because it could never be accepted.
+
+    If a worker process dies, for example because it ran out of memory, the requests
+    that it was running fail with status 503 and the pool is replaced with a new one.
+
+    :param int workers: number of worker processes; defaults to the number of CPUs
+    :param bool compiled: use compiled validators for Attack Flow SDOs
+    :param str matrix_svg: the content of the ATT&CK matrix SVG used by ``matrix``
+    :param int max_pending: defaults to four times the number of workers
+    :param int max_body_size: the largest request body in bytes; larger requests are
+        rejected with status 413 before their body is read
+    """
+
+    def __init__(
+        self,
+        workers=None,
+        compiled=False,
+        matrix_svg=None,
+        max_pending=None,
+        max_body_size=None,
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 4 * self.workers
+        self.max_body_size = max_body_size or DEFAULT_MAX_BODY_SIZE
+        self.metrics = LatencyMetrics()
+        self._pending = threading.BoundedSemaphore(self.max_pending)
+        self._initargs = (compiled, matrix_svg)
+        self._executor_lock = threading.Lock()
+        self._executor = self._new_executor()
+        self._executor_broken = False
+
+    def _new_executor(self):
+        # Request handler threads are running when a pool is replaced, and forking a
+        # process that has threads can deadlock, so workers are started by a forkserver.
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=_init_worker,
+            initargs=self._initargs,
+        )
+
+    def _current_executor(self):
+        """
+        Get the worker pool, replacing it first if it was marked broken.
+
+        :rtype: concurrent.futures.ProcessPoolExecutor
+        """
+        with self._executor_lock:
+            executor = self._executor
+            broken = self._executor_broken
+        if broken:
+            self._replace_executor(executor)
+        return self._executor
+
+    def _replace_executor(self, broken):
+        """
+        Replace the worker pool after a worker process died.
+
+        This must not be called from a future's done callback: the pool runs those
+        callbacks while it holds a lock that shutting it down needs.
+
+        :param concurrent.futures.ProcessPoolExecutor broken: the pool that broke; if it
+            was already replaced, nothing is done
+        """
+        with self._executor_lock:
+            if self._executor is not broken:
+                return
+            logger.warning("A worker process died; starting a new pool.")
+            self._executor = self._new_executor()
+            self._executor_broken = False
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def start(self):
+        """
+        Start every worker process and wait until their validators are built, so that
+        the first requests do not pay for it.
+        """
+        futures = [self._executor.submit(os.getpid) for _ in range(self.workers)]
+        concurrent.futures.wait(futures)
+
+    def close(self):
+        """Stop the worker processes."""
+        self._executor.shutdown(cancel_futures=True)
+
+    def handle(self, command, body):
+        """
+        Handle a request for one command.
+
+        :param str command: one of :data:`COMMANDS`, or ``batch``
+        :param bytes body: the request body
+        :returns: a tuple ``(content_type, body)``
+        :raises RequestError: if the request fails
+        """
+        if command not in COMMANDS and command != "batch":
+            raise RequestError(404, f"unknown command: {command}")
+        started = time.perf_counter()
+        ok = False
+        try:
+            request_json = _decode_json(body)
+            if command == "batch":
+                response = self._handle_batch(request_json)
+            else:
+                response = self._wait(self._submit([(command, request_json)])[0])
+            ok = True
+            return response
+        finally:
+            self.metrics.record(command, time.perf_counter() - started, ok)
+
+    def _handle_batch(self, request_json):
+        """
+        Run every request in a batch concurrently.
+
+        A failed request does not fail the batch; its result has an ``error`` instead of
+        a ``body``.
+
+        :param dict request_json:
+        :returns: a tuple ``(content_type, body)``
+        """
+        try:
+            requests = [(r["command"], r["flow"]) for r in request_json["requests"]]
+        except (KeyError, TypeError):
+            raise RequestError(
+                400, 'expected {"requests": [{"command": ..., "flow": ...}, ...]}'
+            )
+        for command, _ in requests:
+            if command not in COMMANDS:
+                raise RequestError(400, f"unknown command: {command}")
+        if len(requests) > self.max_pending:
+            raise RequestError(
+                413, f"a batch can have at most {self.max_pending} requests"
+            )
+
+        # Each request's latency is measured from the start of the batch, because that
+        # is when it was submitted.
+        started = time.perf_counter()
+        results = list()
+        for (command, _), future in zip(requests, self._submit(requests)):
+            try:
+                content_type, body = self._wait(future)
+            except RequestError as e:
+                results.append(
+                    {"command": command, "status": e.status, "error": str(e)}
+                )
+                ok = False
+            else:
+                results.append(
+                    {
+                        "command": command,
+                        "status": 200,
+                        "content_type": content_type,
+                        "body": body,
+                    }
+                )
+                ok = True
+            self.metrics.record(command, time.perf_counter() - started, ok)
+        return "application/json", attack_flow.jsonio.dumps({"responses": results})
+
+    def _submit(self, requests):
+        """
+        Reserve room for the requests and submit them to the workers.
+
+        :param list[tuple[str, dict]] requests: ``(command, flow_json)`` pairs
+        :returns: a list of futures
+        :raises RequestError: if the server is too busy to accept all of the requests
+        """
+        reserved = 0
+        try:
+            for _ in requests:
+                if not self._pending.acquire(blocking=False):
+                    raise RequestError(503, "the server is busy")
+                reserved += 1
+        except RequestError:
+            for _ in range(reserved):
+                self._pending.release()
+            raise
+
+        futures = list()
+        for index, (command, flow_json) in enumerate(requests):
+            try:
+                futures.append(self._submit_one(command, flow_json))
+            except BaseException:
+                for _ in range(len(requests) - index):
+                    self._pending.release()
+                raise
+        return futures
+
+    def _submit_one(self, command, flow_json):
+        """
+        Submit one request whose room is already reserved.
+
+        If the pool is broken, it is replaced and the request is submitted to the new
+        pool.
+
+        :param str command:
+        :param dict flow_json:
+        :rtype: concurrent.futures.Future
+        """
+        executor = self._current_executor()
+        try:
+            future = executor.submit(run_command, command, flow_json)
+        except concurrent.futures.process.BrokenProcessPool:
+            self._replace_executor(executor)
+            executor = self._executor
+            future = executor.submit(run_command, command, flow_json)
+        future.add_done_callback(lambda f: self._finish(executor, f))
+        return future
+
+    def _finish(self, executor, future):
+        """
+        Release a finished request's reservation, and mark its pool broken if it broke.
+
+        The pool is replaced by the next request rather than here, because the pool
+        runs this callback while it holds a lock that shutting it down needs.
+
+        :param concurrent.futures.ProcessPoolExecutor executor: the pool that ran it
+        :param concurrent.futures.Future future:
+        """
+        self._pending.release()
+        if not future.cancelled() and isinstance(
+            future.exception(), concurrent.futures.process.BrokenProcessPool
+        ):
+            with self._executor_lock:
+                if self._executor is executor:
+                    self._executor_broken = True
+
+    def _wait(self, future):
+        """
+        Wait for a command to finish.
+
+        :param concurrent.futures.Future future:
+        :returns: a tuple ``(content_type, body)``
+        :raises RequestError: if the command failed
+        """
+        try:
+            return future.result()
+        except concurrent.futures.process.BrokenProcessPool:
+            raise RequestError(503, "a worker process died; try again")
+        except Exception as e:
+            raise RequestError(422, str(e) or type(e).__name__)
+
+
+def _decode_json(body):
+    """
+    :param bytes body:
+    :rtype: dict
+    :raises RequestError: if the body is not a JSON object
+    """
+    try:
+        decoded = attack_flow.jsonio.loads(body)
+    except ValueError as e:
+        raise RequestError(400, f"invalid JSON: {e}")
+    if not isinstance(decoded, dict):
+        raise RequestError(400, "expected a JSON object")
+    return decoded
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Translate HTTP requests into calls to the server's :class:`AttackFlowService`.
+    """
+
+    # Keep connections open so that a client can send many requests cheaply.
+    protocol_version = "HTTP/1.1"
+    # Each connection holds a pool thread until it closes, so close idle connections
+    # quickly rather than let them starve other clients.
+    timeout = 5
+    # Send small responses immediately instead of waiting for the client's ACK.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        started = time.perf_counter()
+        if self.path == "/health":
+            self._respond(200, "application/json", '{"status":"ok"}', started)
+        elif self.path == "/metrics":
+            metrics = attack_flow.jsonio.dumps(self.server.service.metrics.snapshot())
+            self._respond(200, "application/json", metrics, started)
+        else:
+            self._respond_error(404, f"not found: {self.path}", started)
+
+    def do_POST(self):
+        started = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            # The body cannot be skipped, so the connection cannot be reused.
+            self.close_connection = True
+            self._respond_error(400, "invalid Content-Length", started)
+            return
+        max_body_size = self.server.service.max_body_size
+        if length > max_body_size:
+            # The body is not read, so the connection cannot be reused.
+            self.close_connection = True
+            self._respond_error(
+                413, f"the request body is larger than {max_body_size} bytes", started
+            )
+            return
+        body = self.rfile.read(length)
+        try:
+            content_type, response = self.server.service.handle(
+                self.path.strip("/"), body
+            )
+        except RequestError as e:
+            self._respond_error(e.status, str(e), started)
+        else:
+            self._respond(200, content_type, response, started)
+
+    def _respond_error(self, status, message, started):
+        body = attack_flow.jsonio.dumps({"error": message})
+        self._respond(status, "application/json", body, started)
+
+    def _respond(self, status, content_type, body, started):
+        encoded = body.encode("utf8")
+        elapsed_ms = 1000 * (time.perf_counter() - started)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(encoded)))
+        self.send_header("Server-Timing", f"total;dur={elapsed_ms:.1f}")
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def address_string(self):
+        # Unix socket clients do not have an address.
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        logger.info("%s %s", self.address_string(), format % args)
+
+
+class UnixRequestHandler(RequestHandler):
+    # Unix sockets do not have Nagle's algorithm.
+    disable_nagle_algorithm = False
+
+
+class _PooledServerMixIn:
+    """
+    Handle each connection in a bounded pool of threads.
+
+    The threads only parse HTTP and wait for the worker processes, so a few per worker
+    is enough.
+    """
+
+    def init_pool(self, service, threads):
+        self.service = service
+        self._threads = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self._threads.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._threads.shutdown(wait=False, cancel_futures=True)
+
+
+class TCPServer(_PooledServerMixIn, http.server.HTTPServer):
+    pass
+
+
+class UnixServer(_PooledServerMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def make_server(service, host="127.0.0.1", port=0, socket_path=None):
+    """
+    Create an HTTP server for a service.
+
+    :param AttackFlowService service:
+    :param str host: the address to listen on
+    :param int port: the port to listen on; 0 picks a free port
+    :param str socket_path: listen on this Unix socket instead of a TCP port
+    :rtype: socketserver.BaseServer
+    """
+    if socket_path is not None:
+        server = UnixServer(str(socket_path), UnixRequestHandler)
+    else:
+        server = TCPServer((host, port), RequestHandler)
+    server.init_pool(service, threads=max(4, 2 * service.max_pending))
+    return server
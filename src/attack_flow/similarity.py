@@ -0,0 +1,337 @@
+"""
+Find flows that are similar to a flow, such as other reports of the same campaign.
+
+Comparing a flow to every flow in a corpus takes time proportional to the size of the
+corpus. A :class:`SimilarityIndex` answers the same question in time proportional to
+the number of similar flows, with locality-sensitive hashing (LSH).
+
+Each flow is described by a set of shingles: its technique IDs, and the sequences of
+techniques along the paths of up to ``ngram`` actions in the action graph that
+:func:`attack_flow.graph.induce_action_graph` induces from it. The similarity of
+two flows is the Jaccard similarity of their shingle sets. A MinHash signature
+summarizes a set in a fixed number of hash values, and the share of positions where two
+signatures agree estimates the Jaccard similarity of their sets. The index splits each
+signature into bands and files the flow under each band's values, so flows that share a
+band are candidates, and only the candidates are compared. Two flows with similarity
+``s`` share at least one of ``b`` bands of ``r`` values with probability
+``1 - (1 - s ** r) ** b``, which rises steeply around :attr:`SimilarityIndex.threshold`.
+"""
+
+from array import array
+import hashlib
+import random
+
+import attack_flow.graph
+import attack_flow.profiling
+import attack_flow.storage
+
+# Increment when the format of saved indexes changes.
+INDEX_FORMAT = 1
+NUM_PERM = 128
+BANDS = 32
+NGRAM = 3
+# The hash functions are ``(a * x + b) % _PRIME``, which is less than ``_PRIME``, so
+# ``_PRIME`` is the signature of an empty set.
+_PRIME = (1 << 61) - 1
+
+
+def flow_shingles(flow_bundle, ngram=NGRAM):
+    """
+    Describe a flow as a set of strings.
+
+    The set has the technique ID of each action, and for each path of 2 to ``ngram``
+    actions in the flow's action graph whose actions all have technique IDs, the IDs
+    joined by ``>``, such as ``T1566>T1204>T1059``.
+
+    :param stix2.Bundle flow_bundle: or a decoded bundle, or a record bundle
+    :param int ngram: the most actions in a path
+    :rtype: set[str]
+    """
+    full_graph = attack_flow.graph.bundle_to_networkx(flow_bundle)
+    action_graph = attack_flow.graph.induce_action_graph(full_graph)
+    techniques = {
+        node: technique_id
+        for node, technique_id in action_graph.nodes(data="technique_id")
+        if technique_id
+    }
+    shingles = set(techniques.values())
+    paths = [(node, technique_id) for node, technique_id in techniques.items()]
+    for _ in range(ngram - 1):
+        longer = list()
+        for node, shingle in paths:
+            for target in action_graph.successors(node):
+                technique_id = techniques.get(target)
+                if technique_id is not None:
+                    longer.append((target, f"{shingle}>{technique_id}"))
+        shingles.update(shingle for _, shingle in longer)
+        paths = longer
+    return shingles
+
+
+class SimilarityIndex(attack_flow.storage.FileFlows):
+    """
+    An LSH index of the MinHash signatures of many flows.
+
+    Flows are identified by a name of the caller's choosing; flows that are read from
+    files are named after their absolute path. The index can be updated one flow at a
+    time, and saved and loaded, like a :class:`attack_flow.corpus.CorpusStore`.
+
+    :param int num_perm: the number of hash values in a signature
+    :param int bands: the number of bands that a signature is split into; it must
+        divide ``num_perm``
+    :param int ngram: see :func:`flow_shingles`
+    :param int seed: the seed of the hash functions; signatures from indexes with
+        different seeds cannot be compared
+    """
+
+    def __init__(self, num_perm=NUM_PERM, bands=BANDS, ngram=NGRAM, seed=1):
+        if num_perm % bands:
+            raise ValueError(f"bands ({bands}) must divide num_perm ({num_perm})")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.ngram = ngram
+        self.seed = seed
+        self._signatures = dict()
+        self._sources = dict()
+        self._init_hashes()
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def __contains__(self, flow_name):
+        return flow_name in self._signatures
+
+    def __iter__(self):
+        return iter(self._signatures)
+
+    @property
+    def threshold(self):
+        """
+        The similarity at which two flows are candidates with a probability of about
+        one half: ``(1 / bands) ** (1 / rows)``.
+
+        :rtype: float
+        """
+        return (1 / self.bands) ** (self.bands / self.num_perm)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an index that was saved with :meth:`save`.
+
+        Loading runs :mod:`pickle`, so only load files that are as trustworthy as the
+        code that reads them.
+
+        :param Path path:
+        :rtype: SimilarityIndex
+        :raises ValueError: if the file was saved in a different format
+        """
+        with attack_flow.profiling.span("similarity.load"):
+            state = attack_flow.storage.load_state(
+                path, INDEX_FORMAT, "similarity index"
+            )
+            index = cls.__new__(cls)
+            index.num_perm = state["num_perm"]
+            index.bands = state["bands"]
+            index.ngram = state["ngram"]
+            index.seed = state["seed"]
+            index._signatures = state["signatures"]
+            index._sources = state["sources"]
+            index._init_hashes()
+        return index
+
+    def save(self, path):
+        """
+        Save the index to a file. The file is written to a temporary file first and
+        then renamed, so a file is never left half written.
+
+        The bands are not saved; :meth:`load` rebuilds them.
+
+        :param Path path:
+        """
+        state = {
+            "format": INDEX_FORMAT,
+            "num_perm": self.num_perm,
+            "bands": self.bands,
+            "ngram": self.ngram,
+            "seed": self.seed,
+            "signatures": self._signatures,
+            "sources": self._sources,
+        }
+        with attack_flow.profiling.span("similarity.save"):
+            attack_flow.storage.save_state(path, state)
+
+    def signature(self, flow_bundle):
+        """
+        Compute the MinHash signature of a flow with this index's hash functions.
+
+        :param stix2.Bundle flow_bundle: or a decoded bundle, or a record bundle
+        :rtype: array
+        """
+        return self.signature_of(flow_shingles(flow_bundle, self.ngram))
+
+    def signature_of(self, shingles):
+        """
+        Compute the MinHash signature of a set of shingles.
+
+        :param shingles: iterable of strings
+        :rtype: array
+        """
+        values = [
+            int.from_bytes(
+                hashlib.blake2b(shingle.encode("utf8"), digest_size=8).digest(),
+                "little",
+            )
+            for shingle in shingles
+        ]
+        if not values:
+            return array("Q", [_PRIME]) * self.num_perm
+        return array(
+            "Q",
+            (
+                min((a * value + b) % _PRIME for value in values)
+                for a, b in self._hashes
+            ),
+        )
+
+    def add_flow(self, flow_name, flow_bundle, source=None):
+        """
+        Add a flow to the index, replacing any flow with the same name.
+
+        :param str flow_name:
+        :param stix2.Bundle flow_bundle: or a decoded bundle, or a record bundle
+        :param tuple source: see :meth:`attack_flow.storage.FileFlows.add_flow`
+        """
+        with attack_flow.profiling.span("similarity.add"):
+            self.add_signature(flow_name, self.signature(flow_bundle), source)
+
+    def add_signature(self, flow_name, signature, source=None):
+        """
+        Add a flow to the index by its signature, replacing any flow with the same name.
+
+        :param str flow_name:
+        :param array signature: the result of :meth:`signature`
+        :param tuple source: see :meth:`attack_flow.storage.FileFlows.add_flow`
+        """
+        if len(signature) != self.num_perm:
+            raise ValueError(
+                f"Signature has {len(signature)} values, expected {self.num_perm}"
+            )
+        if flow_name in self._signatures:
+            self.remove_flow(flow_name)
+        self._signatures[flow_name] = signature
+        self._sources[flow_name] = source
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            if key is not None:
+                bucket.setdefault(key, set()).add(flow_name)
+
+    def get_sources(self):
+        return dict(self._sources)
+
+    def remove_flow(self, flow_name):
+        """
+        Remove a flow from the index.
+
+        :param str flow_name:
+        :raises KeyError: if there is no flow with that name
+        """
+        signature = self._signatures.pop(flow_name)
+        del self._sources[flow_name]
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            if key is None:
+                continue
+            names = bucket[key]
+            names.discard(flow_name)
+            if not names:
+                del bucket[key]
+
+    def query(self, flow_bundle, k=10):
+        """
+        Find the flows in the index that are most similar to a flow.
+
+        :param stix2.Bundle flow_bundle: or a decoded bundle, or a record bundle
+        :param int k: the maximum number of flows
+        :returns: see :meth:`query_signature`
+        :rtype: list[tuple[str, float]]
+        """
+        return self.query_signature(self.signature(flow_bundle), k)
+
+    def query_signature(self, signature, k=10, exclude=None):
+        """
+        Find the flows in the index whose signatures are most similar to a signature.
+
+        Only the flows that share a band with the signature are compared, so flows that
+        are much less similar than :attr:`threshold` are usually missed.
+
+        :param array signature: the result of :meth:`signature`
+        :param int k: the maximum number of flows
+        :param str exclude: the name of a flow to leave out
+        :returns: a list of ``(flow_name, similarity)`` tuples, most similar first,
+            where ``similarity`` estimates the Jaccard similarity of the flows'
+            shingles; ties are sorted by name
+        :rtype: list[tuple[str, float]]
+        """
+        with attack_flow.profiling.span("similarity.query"):
+            candidates = set()
+            for bucket, key in zip(self._buckets, self._band_keys(signature)):
+                if key is not None:
+                    candidates.update(bucket.get(key, ()))
+            candidates.discard(exclude)
+            scored = [
+                (name, self._estimate(signature, self._signatures[name]))
+                for name in candidates
+            ]
+            scored.sort(key=lambda item: (-item[1], item[0]))
+        attack_flow.profiling.count("similarity.candidates", len(candidates))
+        return scored[:k]
+
+    def similar_flows(self, flow_name, k=10):
+        """
+        Find the flows in the index that are most similar to another flow in it.
+
+        :param str flow_name:
+        :param int k: the maximum number of flows
+        :returns: see :meth:`query_signature`
+        :rtype: list[tuple[str, float]]
+        :raises KeyError: if there is no flow with that name
+        """
+        return self.query_signature(self._signatures[flow_name], k, exclude=flow_name)
+
+    def _init_hashes(self):
+        """
+        Create the hash functions from the seed, and file the signatures in bands.
+        """
+        rng = random.Random(self.seed)
+        self._hashes = [
+            (rng.randrange(1, _PRIME), rng.randrange(0, _PRIME))
+            for _ in range(self.num_perm)
+        ]
+        self._buckets = [dict() for _ in range(self.bands)]
+        for flow_name, signature in self._signatures.items():
+            for bucket, key in zip(self._buckets, self._band_keys(signature)):
+                if key is not None:
+                    bucket.setdefault(key, set()).add(flow_name)
+
+    def _band_keys(self, signature):
+        """
+        :param array signature:
+        :returns: the key of each band, or None for each band of an empty flow, which
+            is not similar to anything
+        :rtype: list[bytes]
+        """
+        if signature[0] == _PRIME:
+            return [None] * self.bands
+        rows = self.num_perm // self.bands
+        return [
+            signature[start : start + rows].tobytes()
+            for start in range(0, self.num_perm, rows)
+        ]
+
+    def _estimate(self, signature, other):
+        """
+        :returns: the share of positions where two signatures agree
+        :rtype: float
+        """
+        if signature[0] == _PRIME or other[0] == _PRIME:
+            return 0.0
+        return sum(a == b for a, b in zip(signature, other)) / self.num_perm
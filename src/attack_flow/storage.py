@@ -0,0 +1,177 @@
+"""
+Write files safely, and keep collections of flows in step with the files they were read
+from.
+
+Caches, stores, and indexes are written to a temporary file next to their destination
+and then renamed, so that a reader never sees a file half written, even if the writer
+is interrupted. :class:`FileFlows` is the base of the collections that can be saved
+this way and updated from a directory of flows, such as
+:class:`attack_flow.corpus.CorpusStore`.
+"""
+
+import abc
+import os
+from pathlib import Path
+import pickle
+import tempfile
+
+
+def write_atomic(path, write, mode=None):
+    """
+    Write a file by writing a temporary file next to it and then renaming it.
+
+    :param Path path:
+    :param write: a function that is called with a binary file object
+    :param int mode: the permissions to give the file; by default, only its owner can
+        read and write it
+    """
+    fd, temp_name = tempfile.mkstemp(dir=Path(path).parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            write(temp_file)
+        if mode is not None:
+            os.chmod(temp_name, mode)
+        os.replace(temp_name, path)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+
+
+def save_state(path, state):
+    """
+    Pickle a dict to a file with :func:`write_atomic`.
+
+    :param Path path:
+    :param dict state: it should have a ``format`` key for :func:`load_state` to check
+    """
+    write_atomic(path, lambda f: pickle.dump(state, f, pickle.HIGHEST_PROTOCOL))
+
+
+def load_state(path, state_format, description):
+    """
+    Load a dict that was saved with :func:`save_state`.
+
+    Loading runs :mod:`pickle`, so only load files that are as trustworthy as the code
+    that reads them.
+
+    :param Path path:
+    :param state_format: the ``format`` that the dict must have
+    :param str description: what the file holds, for the error message
+    :rtype: dict
+    :raises ValueError: if the file was saved in a different format
+    """
+    with Path(path).open("rb") as state_file:
+        state = pickle.load(state_file)
+    if not isinstance(state, dict) or state.get("format") != state_format:
+        raise ValueError(f"Not a {description} in format {state_format}: {path}")
+    return state
+
+
+class FileFlows(abc.ABC):
+    """
+    A collection of named flows, some of which were read from files.
+
+    A flow that is read from a file is named after the file's absolute path, so the
+    name does not depend on the working directory, and its source is the file's
+    modification time and size, so that a changed file can be read again.
+    """
+
+    @abc.abstractmethod
+    def add_flow(self, flow_name, flow_bundle, source=None):
+        """
+        Add a flow, replacing any flow with the same name.
+
+        :param str flow_name:
+        :param stix2.Bundle flow_bundle: or a decoded bundle, or a record bundle
+        :param tuple source: the file's ``(st_mtime_ns, st_size)``, or None for a flow
+            that was not read from a file
+        """
+
+    @abc.abstractmethod
+    def remove_flow(self, flow_name):
+        """
+        Remove a flow.
+
+        :param str flow_name:
+        :raises KeyError: if there is no flow with that name
+        """
+
+    @abc.abstractmethod
+    def get_sources(self):
+        """
+        :returns: the source of every flow, by name
+        :rtype: dict
+        """
+
+    def add_file(self, path):
+        """
+        Read a flow from a file and add it, named after its absolute path.
+
+        :param Path path: a ``.json`` or ``.afb`` file
+        """
+        import attack_flow.model
+
+        stat = path.stat()
+        flow_bundle = attack_flow.model.load_attack_flow_bundle(path)
+        source = (stat.st_mtime_ns, stat.st_size)
+        self.add_flow(os.path.abspath(path), flow_bundle, source=source)
+
+    def update_files(self, paths):
+        """
+        Add the flows in some files that are new or have changed since they were added.
+
+        :param list[Path] paths:
+        :returns: the names of the flows that were added
+        :rtype: list[str]
+        """
+        sources = self.get_sources()
+        added = list()
+        for path in paths:
+            flow_name = os.path.abspath(path)
+            stat = path.stat()
+            if sources.get(flow_name) != (stat.st_mtime_ns, stat.st_size):
+                self.add_file(path)
+                added.append(flow_name)
+        return added
+
+    def remove_files(self, paths):
+        """
+        Remove the flows that were read from some files.
+
+        The files do not have to exist any more. Files whose flows are not in the
+        collection are ignored.
+
+        :param list[Path] paths:
+        :returns: the names of the flows that were removed
+        :rtype: list[str]
+        """
+        sources = self.get_sources()
+        removed = list()
+        for path in paths:
+            flow_name = os.path.abspath(path)
+            if sources.get(flow_name) is not None and flow_name not in removed:
+                self.remove_flow(flow_name)
+                removed.append(flow_name)
+        return removed
+
+    def sync_files(self, paths):
+        """
+        Make the collection contain exactly the flows in some files.
+
+        Files that are not in the collection are added, files that have changed since
+        they were added are added again, and flows that were read from files that are
+        not in ``paths`` are removed. Flows that were not read from files are kept.
+
+        :param list[Path] paths:
+        :returns: the names of the flows that were added and removed
+        :rtype: tuple[list[str], list[str]]
+        """
+        wanted = {os.path.abspath(path) for path in paths}
+        removed = [
+            flow_name
+            for flow_name, source in self.get_sources().items()
+            if source is not None and flow_name not in wanted
+        ]
+        for flow_name in removed:
+            self.remove_flow(flow_name)
+        return self.update_files(paths), removed
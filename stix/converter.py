@@ -1,9 +1,14 @@
 import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 def extract_objects_from_stix(input_file, output_file):
     # Leer archivo JSON
-    with open(input_file, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    with open(input_file, "rb") as f:
+        data = orjson.loads(f.read()) if orjson is not None else json.load(f)
 
     result = []
 
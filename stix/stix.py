@@ -1,10 +1,19 @@
 import json
+import re
 import uuid
 import datetime
 from pprint import pprint
 import requests
 
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
 SPARTA_VERSION = "3.0"
+# Characters that json.dump() escapes by default: everything outside printable ASCII
+# that orjson does not already escape.
+NON_ASCII_RE = re.compile(r"[^\x00-\x7e]")
 
 class StixObject:
   def __init__(self):
@@ -194,12 +203,22 @@ class StixObject:
           
           
     flow["objects"].append(self.create_tactic_refs())
-    with open("../src/attack_flow_builder/data/sparta-attack.json", "w") as f:
-      json.dump(flow, f, indent=2)
+    output_path = "../src/attack_flow_builder/data/sparta-attack.json"
+    if orjson is not None:
+      # The ATT&CK-sized output is much faster to encode with orjson. It writes
+      # non-ASCII characters as UTF-8, so escape them the way json.dump() does, which
+      # keeps the file the same whichever encoder wrote it.
+      encoded = orjson.dumps(flow, option=orjson.OPT_INDENT_2).decode("utf8")
+      encoded = NON_ASCII_RE.sub(lambda m: json.dumps(m.group())[1:-1], encoded)
+      with open(output_path, "w") as f:
+        f.write(encoded)
+    else:
+      with open(output_path, "w") as f:
+        json.dump(flow, f, indent=2)
       
 
 if __name__ == "__main__":
   stix = StixObject()
-  with open("input.json", "r") as f:
-    input_data = json.loads(f.read())
-    stix.sparta_to_attackflow(input_data)
+  with open("input.json", "rb") as f:
+    input_data = orjson.loads(f.read()) if orjson is not None else json.load(f)
+  stix.sparta_to_attackflow(input_data)
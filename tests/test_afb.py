@@ -0,0 +1,456 @@
+import io
+import json
+from pathlib import Path
+import runpy
+import shutil
+import sys
+from unittest.mock import patch
+
+import pytest
+
+import attack_flow.afb
+import attack_flow.model
+import attack_flow.records
+import attack_flow.schema
+
+ATTACK_TREE_PATH = Path("corpus/Example Attack Tree.afb")
+CORPUS_PATHS = sorted(Path("corpus").glob("*.afb"))
+FLOW_ID = "6f3a6e64-0b59-4b3c-9d8f-5d0b8f9ab001"
+
+
+class _Doc:
+    """Builds a small Attack Flow v3 document one block at a time."""
+
+    def __init__(self, **properties):
+        self.objects = list()
+        self.canvas = {
+            "id": "flow",
+            "instance": FLOW_ID,
+            "properties": [[k, v] for k, v in properties.items()],
+            "objects": [],
+        }
+        self.latches = dict()
+        self.count = 0
+
+    def _instance(self):
+        self.count += 1
+        return f"00000000-0000-4000-8000-{self.count:012d}"
+
+    def block(self, template, positions=("0", "180"), **properties):
+        instance = self._instance()
+        anchors = dict()
+        for position in positions:
+            anchor = {"id": "vertical_anchor", "instance": self._instance()}
+            anchor["latches"] = []
+            anchors[position] = anchor["instance"]
+            self.objects.append(anchor)
+            self.latches[instance, position] = anchor
+        self.canvas["objects"].append(instance)
+        self.objects.append(
+            {
+                "id": template,
+                "instance": instance,
+                "properties": [[k, v] for k, v in properties.items()],
+                "anchors": anchors,
+            }
+        )
+        return instance
+
+    def line(self, source, target, via="180", to="0"):
+        source_latch = {"id": "generic_latch", "instance": self._instance()}
+        target_latch = {"id": "generic_latch", "instance": self._instance()}
+        self.latches[source, via]["latches"].append(source_latch["instance"])
+        self.latches[target, to]["latches"].append(target_latch["instance"])
+        line = {
+            "id": "dynamic_line",
+            "instance": self._instance(),
+            "source": source_latch["instance"],
+            "target": target_latch["instance"],
+            "handles": [],
+        }
+        self.canvas["objects"].append(line["instance"])
+        self.objects.extend((source_latch, target_latch, line))
+
+    def to_json(self):
+        return {"schema": "attack_flow_v2", "objects": [self.canvas] + self.objects}
+
+
+def _objects_by_type(bundle, stix_type):
+    return [obj for obj in bundle["objects"] if obj["type"] == stix_type]
+
+
+def test_export_v3():
+    doc = _Doc(
+        name="  Test flow ",
+        author=[["name", "Jane"], ["identity_class", "individual"]],
+        external_references=[[None, [["source_name", "Ref"], ["url", None]]]],
+        created="2023-01-02T03:04:05Z",
+        unknown="dropped",
+    )
+    first = doc.block(
+        "action",
+        name=" First ",
+        ttp=[["tactic", "TA0001"], ["technique", "T1566"]],
+        confidence="probable",
+    )
+    second = doc.block("action", name="Second")
+    tool = doc.block("tool", name="Tool", tool_types=[[None, " a "], [None, None]])
+    asset = doc.block("asset", name="Asset")
+    doc.line(first, second)
+    doc.line(first, tool)
+    doc.line(second, asset)
+    bundle = attack_flow.afb.afb_to_stix(doc.to_json())
+
+    assert list(bundle) == ["type", "id", "objects"]
+    objects = bundle["objects"]
+    assert [obj["type"] for obj in objects] == [
+        "extension-definition",
+        "identity",
+        "attack-flow",
+        "identity",
+        "attack-action",
+        "attack-action",
+        "tool",
+        "attack-asset",
+        "relationship",
+    ]
+    extension, extension_author, flow, author = objects[:4]
+    assert extension["id"] == attack_flow.model.ATTACK_FLOW_EXTENSION_ID
+    assert extension_author["created_by_ref"] == extension_author["id"]
+    assert flow["id"] == f"attack-flow--{FLOW_ID}"
+    assert list(flow)[:9] == [
+        "type",
+        "id",
+        "spec_version",
+        "created",
+        "modified",
+        "extensions",
+        "created_by_ref",
+        "start_refs",
+        "name",
+    ]
+    assert flow["created"] == "2023-01-02T03:04:05.000Z"
+    assert flow["name"] == "  Test flow "
+    assert flow["scope"] == "incident"
+    assert flow["external_references"] == [{"source_name": "Ref"}]
+    assert "unknown" not in flow
+    assert flow["created_by_ref"] == author["id"]
+    assert author["name"] == "Jane"
+    assert author["identity_class"] == "individual"
+
+    first_action, second_action, tool_obj, asset_obj, relationship = objects[4:]
+    assert flow["start_refs"] == [first_action["id"]]
+    assert first_action["name"] == "First"
+    assert first_action["tactic_id"] == "TA0001"
+    assert first_action["technique_id"] == "T1566"
+    assert first_action["tactic_ref"] == (
+        "x-mitre-tactic--ffd5bcee-6e16-4dd2-8eca-7b3beedf33ca"
+    )
+    assert first_action["technique_ref"] == (
+        "attack-pattern--a62a8db3-f23a-4d8f-afd6-9dbc77e7813b"
+    )
+    assert first_action["confidence"] == 70
+    assert first_action["effect_refs"] == [second_action["id"]]
+    assert second_action["asset_refs"] == [asset_obj["id"]]
+    assert tool_obj["tool_types"] == ["a"]
+    assert relationship["source_ref"] == first_action["id"]
+    assert relationship["target_ref"] == tool_obj["id"]
+
+
+def test_export_stix_ids():
+    doc = _Doc()
+    doc.block("action", ttp=[["technique", "T1566"], ["subtechnique", "T9999.001"]])
+    ref = "attack-pattern--00000000-0000-4000-8000-000000000000"
+    bundle = attack_flow.afb.afb_to_stix(
+        doc.to_json(), stix_ids={"T1566": ref, "T9999.001": ref}
+    )
+    (action,) = _objects_by_type(bundle, "attack-action")
+    assert action["technique_ref"] == ref
+    assert action["subtechnique_ref"] == ref
+
+    # Without the Builder's table, only the IDs that were passed in are used.
+    doc.block("action", ttp=[["tactic", "TA0001"]])
+    with patch("attack_flow.afb.get_builder_stix_ids", return_value=dict()):
+        bundle = attack_flow.afb.afb_to_stix(doc.to_json())
+    assert not any(
+        key.endswith("_ref") and key != "created_by_ref"
+        for action in _objects_by_type(bundle, "attack-action")
+        for key in action
+    )
+
+
+def test_builder_stix_ids():
+    stix_ids = attack_flow.afb.get_builder_stix_ids()
+    assert stix_ids["TA0001"] == "x-mitre-tactic--ffd5bcee-6e16-4dd2-8eca-7b3beedf33ca"
+    assert stix_ids["T1566.001"] == (
+        "attack-pattern--2e34237d-8574-43f6-aace-ae2915de8597"
+    )
+
+
+def test_packaged_stix_ids(tmp_path, caplog):
+    """The packaged copy is used without the Builder's source and is up to date."""
+    stix_ids = attack_flow.afb.get_builder_stix_ids()
+    attack_flow.afb.get_builder_stix_ids.cache_clear()
+    missing = tmp_path / "MitreAttack.ts"
+    try:
+        with patch("attack_flow.afb.BUILDER_ATTACK_TABLE", missing):
+            assert attack_flow.afb.get_builder_stix_ids() == stix_ids
+            attack_flow.afb.get_builder_stix_ids.cache_clear()
+            with patch("attack_flow.afb.PACKAGED_STIX_IDS", tmp_path / "ids.json"):
+                assert attack_flow.afb.get_builder_stix_ids() == dict()
+        assert "were not found" in caplog.text
+    finally:
+        attack_flow.afb.get_builder_stix_ids.cache_clear()
+
+
+def test_export_property_values():
+    doc = _Doc()
+    doc.block("action", name="Start")
+    doc.block(
+        "network_traffic",
+        src_port="80.6",
+        dst_port=70000,
+        src_byte_count="abc",
+        start={"time": "2023-06-01T12:00:00", "zone": "America/New_York"},
+        end="not a date",
+    )
+    bundle = attack_flow.afb.afb_to_stix(doc.to_json())
+    (traffic,) = _objects_by_type(bundle, "network-traffic")
+    assert traffic["src_port"] == 80
+    assert traffic["dst_port"] == 65535
+    assert traffic["src_byte_count"] is None
+    assert traffic["start"] == "2023-06-01T16:00:00.000Z"
+    assert traffic["end"] is None
+
+
+def test_export_hashes_stop_merging():
+    """Like the Builder, properties after a block's hashes are not exported."""
+    doc = _Doc()
+    doc.block("action", name="Start")
+    doc.block(
+        "file",
+        name="x.exe",
+        hashes=[[None, [["hash_type", "md5"], ["hash_value", "abc"]]]],
+        mime_type="text/plain",
+    )
+    bundle = attack_flow.afb.afb_to_stix(doc.to_json())
+    (file_obj,) = _objects_by_type(bundle, "file")
+    assert file_obj["hashes"] == {"md5": "abc"}
+    assert file_obj["name"] == "x.exe"
+    assert "mime_type" not in file_obj
+
+
+def test_export_condition_branches():
+    doc = _Doc()
+    condition = doc.block(
+        "condition", positions=("0", "branch:True"), description="Done?"
+    )
+    action = doc.block("action", name="Next")
+    doc.line(condition, action, via="branch:True")
+    bundle = attack_flow.afb.afb_to_stix(doc.to_json())
+    (condition_obj,) = _objects_by_type(bundle, "attack-condition")
+    (relationship,) = _objects_by_type(bundle, "relationship")
+    assert "on_true_refs" not in condition_obj
+    assert relationship["source_ref"] == condition_obj["id"]
+
+
+def test_export_cycle():
+    doc = _Doc()
+    first = doc.block("action", name="First")
+    second = doc.block("action", name="Second")
+    doc.line(first, second)
+    doc.line(second, first)
+    with pytest.raises(ValueError, match="does the flow contain a cycle"):
+        attack_flow.afb.afb_to_stix(doc.to_json())
+
+
+def test_export_unknown_template():
+    doc = _Doc()
+    doc.block("not_a_template")
+    with pytest.raises(ValueError, match="Unknown template 'not_a_template'"):
+        attack_flow.afb.afb_to_stix(doc.to_json())
+
+
+def test_export_legacy_v2():
+    doc = attack_flow.afb.load_afb(ATTACK_TREE_PATH)
+    assert attack_flow.afb.is_legacy_v2(doc)
+    bundle = attack_flow.afb.afb_to_stix(doc)
+    operators = _objects_by_type(bundle, "attack-operator")
+    assert {operator["operator"] for operator in operators} == {"AND", "OR"}
+    assert all(operator["effect_refs"] for operator in operators)
+    (flow,) = _objects_by_type(bundle, "attack-flow")
+    assert len(flow["start_refs"]) > 1
+
+
+def test_write_bundle():
+    doc = attack_flow.afb.load_afb(ATTACK_TREE_PATH)
+    objects = list(attack_flow.afb.iter_stix_objects(doc))
+    out = io.StringIO()
+    attack_flow.afb.write_bundle(objects, out)
+    written = json.loads(out.getvalue())
+    assert written["objects"] == objects
+    assert out.getvalue() == json.dumps(written, indent=2, ensure_ascii=False)
+
+
+def test_write_empty_bundle():
+    out = io.StringIO()
+    attack_flow.afb.write_bundle([], out)
+    assert json.loads(out.getvalue())["objects"] == []
+
+
+@pytest.mark.parametrize("afb_path", CORPUS_PATHS, ids=lambda p: p.name)
+def test_corpus_is_valid(afb_path):
+    result = attack_flow.schema.validate_doc(afb_path)
+    assert result.success, result.messages
+    assert not [m for m in result.messages if m.type == "error"]
+
+
+def test_load_afb():
+    bundle = attack_flow.model.load_attack_flow_bundle(ATTACK_TREE_PATH)
+    records = attack_flow.records.load_bundle(ATTACK_TREE_PATH)
+    assert len(bundle.objects) == len(records.objects)
+
+
+def test_validate_unexportable(tmp_path):
+    afb_path = tmp_path / "bad.afb"
+    afb_path.write_text(json.dumps({"schema": "attack_flow_v2", "objects": []}))
+    result = attack_flow.schema.validate_doc(afb_path)
+    assert not result.success
+    assert "Unable to export this Attack Flow Builder file" in str(result.messages[0])
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+@patch("sys.exit")
+def test_cli_export_stix(exit_mock, jobs, tmp_path, capsys):
+    afb_path = tmp_path / ATTACK_TREE_PATH.name
+    shutil.copy(ATTACK_TREE_PATH, afb_path)
+    bad_path = tmp_path / "bad.afb"
+    bad_path.write_text(json.dumps({"schema": "attack_flow_v2", "objects": []}))
+    other_path = tmp_path / "other.json"
+    sys.argv = [
+        "af",
+        "export-stix",
+        "--verbose",
+        "-j",
+        jobs,
+        str(afb_path),
+        str(bad_path),
+        str(other_path),
+    ]
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    captured = capsys.readouterr()
+    json_path = afb_path.with_suffix(".json")
+    assert f"Exporting {afb_path} -> {json_path}" in captured.out
+    assert f"{bad_path}: FAIL" in captured.out
+    assert attack_flow.schema.validate_doc(json_path).success
+    assert not bad_path.with_suffix(".json").exists()
+    exit_mock.assert_called_with(1)
+
+
+def _v2_object(id_, template, children=(), x=0, y=0, attrs=0, properties=()):
+    return {
+        "id": id_,
+        "x": x,
+        "y": y,
+        "attrs": attrs,
+        "template": template,
+        "children": list(children),
+        "properties": list(properties),
+    }
+
+
+def test_upgrade_v2():
+    condition_anchors = [f"c{i}" for i in range(10)]
+    doc = {
+        "version": "2.0.1",
+        "id": "page",
+        "location": {"x": 1.5, "y": -2, "k": 0.5},
+        "objects": [
+            _v2_object("flow", "flow", ["a", "c", "o", "line"], x=12.5, y=-12.5),
+            _v2_object(
+                "a",
+                "action",
+                ["a0", "a1"],
+                x=13,
+                y=-13,
+                properties=[["name", "A"], ["technique_id", "T1566"]],
+            ),
+            _v2_object("a0", "@__builtin__anchor", ["src"]),
+            _v2_object("a1", "@__builtin__anchor"),
+            _v2_object("c", "condition", condition_anchors),
+            *(_v2_object(i, "@__builtin__anchor") for i in condition_anchors[:-1]),
+            _v2_object("c9", "true_anchor", ["dst"]),
+            _v2_object("o", "or"),
+            _v2_object(
+                "line", "@__builtin__line_horizontal_elbow", ["src", "h1", "h2", "dst"]
+            ),
+            _v2_object("src", "@__builtin__line_source", x=2, y=3),
+            _v2_object("h1", "@__builtin__line_handle", x=7, y=8),
+            _v2_object("h2", "@__builtin__line_handle", x=7, y=8, attrs=0b100000001),
+            _v2_object("dst", "@__builtin__line_target", x=4, y=4),
+        ],
+    }
+    upgraded = attack_flow.afb.upgrade_v2(doc)
+    assert list(upgraded) == ["schema", "theme", "objects", "layout", "camera"]
+    assert upgraded["camera"] == doc["location"]
+    objects = {obj["instance"]: obj for obj in upgraded["objects"]}
+    assert list(objects) == [obj["id"] for obj in doc["objects"]]
+    assert objects["flow"]["objects"] == ["a", "c", "o", "line"]
+    assert objects["a"]["anchors"] == {"90": "a1", "120": "a0"}
+    assert objects["a"]["properties"][-1] == [
+        "ttp",
+        [["tactic", None], ["technique", "T1566"], ["subtechnique", None]],
+    ]
+    assert objects["a0"] == {
+        "id": "vertical_anchor",
+        "instance": "a0",
+        "latches": ["src"],
+    }
+    assert list(objects["c"]["anchors"])[-2:] == ["330", "branch:True"]
+    assert objects["c0"]["id"] == "horizontal_anchor"
+    assert objects["c9"]["id"] == "vertical_anchor"
+    assert objects["o"]["id"] == "OR_operator"
+    assert objects["line"] == {
+        "id": "dynamic_line",
+        "instance": "line",
+        "source": "src",
+        "target": "dst",
+        "handles": ["h1", "h2"],
+    }
+    assert upgraded["layout"] == {
+        "flow": [15, -15],
+        "a": [15, -15],
+        "c": [0, 0],
+        "o": [0, 0],
+        "src": [0, 5],
+        "h2": [5, 10],
+        "dst": [5, 5],
+    }
+    # The input is not modified.
+    assert len(doc["objects"][1]["properties"]) == 2
+
+
+def test_upgrade_v2_malformed():
+    doc = {
+        "version": "2.0.1",
+        "location": {"x": 0, "y": 0, "k": 1},
+        "objects": [
+            _v2_object("a", "action", ["x"]),
+            _v2_object("x", "@__builtin__line_source"),
+        ],
+    }
+    with pytest.raises(ValueError, match="Malformed Attack Flow V2 file"):
+        attack_flow.afb.upgrade_v2(doc)
+    with pytest.raises(ValueError, match="Malformed Attack Flow V2 file"):
+        attack_flow.afb.upgrade_v2({"version": "2.0.1", "objects": []})
+
+
+def test_upgrade_v2_exports_the_same():
+    doc = attack_flow.afb.load_afb(ATTACK_TREE_PATH)
+    original = attack_flow.afb.read_diagram(doc)
+    upgraded = attack_flow.afb.read_diagram(attack_flow.afb.upgrade_v2(doc))
+    assert [n.stix_id for n in upgraded.nodes] == [n.stix_id for n in original.nodes]
+    assert [(s.instance, v, t.instance) for s, v, t in upgraded.edges] == [
+        (s.instance, v, t.instance) for s, v, t in original.edges
+    ]
+    assert upgraded.stix_ids == original.stix_ids
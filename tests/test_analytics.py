@@ -0,0 +1,195 @@
+from collections import Counter
+import math
+from pathlib import Path
+
+import pytest
+
+import attack_flow.graph
+import attack_flow.model
+from attack_flow.analytics import SparseMatrix, TechniqueStats, parent_technique
+from attack_flow.corpus import CorpusStore
+from .fixtures import get_flow_bundle, get_tree_bundle
+
+ACTION1 = "attack-action--52f2c35a-fa2a-45a4-b84c-46ad9498071f"
+
+
+def _action(action_id, technique_id, tactic_id, *effects):
+    return {
+        "type": "attack-action",
+        "id": action_id,
+        "technique_id": technique_id,
+        "tactic_id": tactic_id,
+        "effect_refs": list(effects),
+    }
+
+
+def _subtechnique_bundle():
+    return {
+        "type": "bundle",
+        "objects": [
+            _action("attack-action--1", "T1566.001", "TA0001", "attack-action--2"),
+            _action("attack-action--2", "T1059.001", "TA0002", "attack-action--3"),
+            _action("attack-action--3", "T1059.003", "TA0002"),
+        ],
+    }
+
+
+def test_from_store():
+    store = CorpusStore()
+    store.add_flow("flow", get_flow_bundle())
+    store.add_flow("tree", get_tree_bundle())
+    stats = TechniqueStats.from_store(store)
+
+    assert stats.flow_count == 2
+    assert stats.transitions.to_dict() == {
+        ("T1", "T3"): 1,
+        ("T1", "T4"): 1,
+        ("T3", "T3"): 1,
+    }
+    assert stats.flow_frequency("T3") == 2
+    assert stats.flow_frequency("T9999") == 0
+    assert stats.cooccurrence.get("T1", "T4") == 1
+    assert stats.transition_probability("T1", "T3") == 0.5
+    assert stats.transition_probability("T4", "T1") == 0.0
+    assert stats.next_labels("T1") == [("T3", 0.5), ("T4", 0.5)]
+    assert stats.next_labels("T1", limit=1) == [("T3", 0.5)]
+
+    # T3 is in every flow, so it tells nothing about T1.
+    assert stats.pmi("T1", "T3") == 0.0
+    assert stats.pmi("T1", "T9999") == -math.inf
+
+
+def test_levels():
+    store = CorpusStore()
+    store.add_flow("sub", _subtechnique_bundle())
+    store.add_flow("flow", get_flow_bundle())
+
+    technique = TechniqueStats.from_store(store, "technique")
+    assert technique.transitions.get("T1059.001", "T1059.003") == 1
+
+    parent = TechniqueStats.from_store(store, "parent")
+    assert parent.transitions.get("T1059", "T1059") == 1
+    assert parent.transitions.get("T1566", "T1059") == 1
+    assert parent.flow_frequency("T1059") == 1
+
+    tactic = TechniqueStats.from_store(store, "tactic")
+    assert tactic.transitions.to_dict() == {
+        ("TA0001", "TA0002"): 1,
+        ("TA0002", "TA0002"): 1,
+    }
+    assert tactic.cooccurrence.labels == ["TA0001", "TA0002"]
+
+    with pytest.raises(ValueError):
+        TechniqueStats.from_store(store, "procedure")
+    assert parent_technique("T1059.001") == "T1059"
+    assert parent_technique("T1059") == "T1059"
+
+
+def test_conflicting_techniques():
+    store = CorpusStore()
+    store.add_flow("flow", get_flow_bundle())
+    store.add_flow(
+        "other",
+        {
+            "type": "bundle",
+            "objects": [
+                _action(ACTION1, "T1059", None, "attack-action--2"),
+                _action("attack-action--2", "T3", None),
+            ],
+        },
+    )
+    stats = TechniqueStats.from_store(store)
+    assert stats.transitions.get("T1", "T3") == 1
+    assert stats.transitions.get("T1059", "T3") == 1
+    assert stats.flow_frequency("T1") == 1
+    assert stats.cooccurrence.get("T1", "T1059") == 0
+
+
+def test_matches_induced_action_graphs_without_assets():
+    paths = [
+        Path("corpus/Black Basta Ransomware.afb"),
+        Path("corpus/Ivanti Vulnerabilities.afb"),
+        Path("corpus/WhisperGate.afb"),
+    ]
+    induced = Counter()
+    expected = Counter()
+    for path in paths:
+        bundle = attack_flow.model.load_attack_flow_bundle(path)
+        graph = attack_flow.graph.bundle_to_networkx(bundle)
+        without_assets = graph.copy()
+        without_assets.remove_nodes_from(
+            [node for node in graph if node.startswith("attack-asset--")]
+        )
+        for counts, full_graph in ((induced, graph), (expected, without_assets)):
+            action_graph = attack_flow.graph.induce_action_graph(full_graph)
+            for source, target in action_graph.edges:
+                source_id = action_graph.nodes[source].get("technique_id")
+                target_id = action_graph.nodes[target].get("technique_id")
+                if source_id and target_id:
+                    counts[source_id, target_id] += 1
+
+    stats = TechniqueStats.from_files(paths)
+    assert stats.flow_count == 3
+    assert stats.transitions.to_dict() == dict(expected)
+    # Transitions through assets are not counted.
+    assert induced - expected == Counter(
+        {
+            ("T1555", "T1021.001"): 1,
+            ("T1056.003", "T1021.004"): 1,
+            ("T1056.003", "T1021.002"): 1,
+        }
+    )
+
+
+def test_save_and_load(tmp_path):
+    store = CorpusStore()
+    store.add_flow("sub", _subtechnique_bundle())
+    store.add_flow("flow", get_flow_bundle())
+    stats = TechniqueStats.from_store(store, "parent")
+    stats_path = tmp_path / "stats.json"
+    stats.save(stats_path)
+
+    loaded = TechniqueStats.load(stats_path)
+    assert loaded.level == "parent"
+    assert loaded.flow_count == 2
+    assert loaded.transitions.to_dict() == stats.transitions.to_dict()
+    assert loaded.cooccurrence.to_dict() == stats.cooccurrence.to_dict()
+    assert loaded.pmi("T1059", "T1566") == stats.pmi("T1059", "T1566")
+
+    stats_path.write_text('{"format": 0}')
+    with pytest.raises(ValueError):
+        TechniqueStats.load(stats_path)
+
+
+def test_pmi_matrix():
+    store = CorpusStore()
+    store.add_flow("sub", _subtechnique_bundle())
+    store.add_flow("flow", get_flow_bundle())
+    store.add_flow("tree", get_tree_bundle())
+    stats = TechniqueStats.from_store(store, "parent")
+
+    assert stats.pmi("T1", "T4") == pytest.approx(math.log(3))
+    assert stats.pmi("T1", "T4", normalized=True) == pytest.approx(1.0)
+    matrix = stats.pmi_matrix()
+    assert matrix.get("T1", "T4") == pytest.approx(math.log(3))
+    assert matrix.get("T1", "T1") == 0
+    assert "T1566" in matrix
+
+
+def test_sparse_matrix():
+    matrix = SparseMatrix.from_dict({("b", "a"): 2, ("a", "c"): 1, ("c", "c"): 0}, "d")
+    assert matrix.labels == ["a", "b", "c", "d"]
+    assert matrix.nnz == 2
+    assert matrix.get("b", "a") == 2
+    assert matrix.get("a", "b") == 0
+    assert matrix.get("x", "a", None) is None
+    assert matrix.row("b") == {"a": 2}
+    assert matrix.row_sum("a") == 1
+    assert list(matrix.items()) == [("a", "c", 1), ("b", "a", 2)]
+    assert list(matrix.offsets) == [0, 1, 2, 2, 2]
+
+    copy = SparseMatrix.from_json(matrix.to_json())
+    assert copy.to_dict() == matrix.to_dict()
+    assert copy.values.typecode == "q"
+    floats = SparseMatrix.from_dict({("a", "a"): 0.5})
+    assert SparseMatrix.from_json(floats.to_json()).get("a", "a") == 0.5
@@ -0,0 +1,149 @@
+from pathlib import Path
+
+import pytest
+
+import attack_flow.model
+from attack_flow.attacktree import AttackTree
+from .fixtures import get_tree_bundle
+
+
+def _tree(goals, leaves=None):
+    """
+    An attack tree. ``goals`` maps each goal to an operator and its inputs, and
+    ``leaves`` maps leaves to their confidence.
+    """
+    objects = dict()
+    for leaf, confidence in (leaves or {}).items():
+        objects[leaf] = {
+            "type": "attack-action",
+            "id": f"attack-action--{leaf}",
+            "confidence": confidence,
+        }
+    for goal, (operator, inputs) in goals.items():
+        objects.setdefault(
+            goal, {"type": "attack-action", "id": f"attack-action--{goal}"}
+        )
+        operator_id = f"attack-operator--{goal}"
+        objects[operator_id] = {
+            "type": "attack-operator",
+            "id": operator_id,
+            "operator": operator,
+            "effect_refs": [objects[goal]["id"]],
+        }
+        for name in inputs:
+            source = objects.setdefault(
+                name, {"type": "attack-action", "id": f"attack-action--{name}"}
+            )
+            source.setdefault("effect_refs", []).append(operator_id)
+    return {"type": "bundle", "objects": list(objects.values())}
+
+
+def _ladder(levels):
+    """
+    A tree where every goal shares the two goals below it, so evaluating each subtree
+    separately takes exponential time.
+    """
+    goals = dict()
+    for i in range(2, levels):
+        goals[f"and-a{i}"] = ("AND", [f"g{i - 1}", f"a{i}"])
+        goals[f"and-b{i}"] = ("AND", [f"g{i - 2}", f"b{i}"])
+        goals[f"g{i}"] = ("OR", [f"and-a{i}", f"and-b{i}"])
+    return _tree(goals)
+
+
+def _names(cut_sets):
+    return sorted(sorted(leaf.split("--")[1] for leaf in c) for c in cut_sets)
+
+
+def test_example_attack_tree():
+    path = Path("corpus/Example Attack Tree.afb")
+    bundle = attack_flow.model.load_attack_flow_bundle(path)
+    tree = AttackTree.from_bundle(bundle)
+    root = next(obj for obj in bundle.objects if obj.id == tree.root_ref)
+    assert root.name == "Obtain User Location Information"
+    assert len(tree.leaf_refs) == 29
+    assert tree.count_cut_sets() == 16
+    assert len(list(tree.iter_cut_sets())) == 16
+    assert len(list(tree.iter_cut_sets(max_size=1))) == 4
+    cost, cut_set = tree.min_cost()
+    assert cost == 1
+    assert cut_set in list(tree.iter_cut_sets(max_size=1))
+    assert tree.probability() == pytest.approx(1.0, abs=1e-6)
+
+
+def test_tree_fixture():
+    tree = AttackTree.from_bundle(get_tree_bundle())
+    assert tree.root_ref == "attack-action--a0847849-a533-4b1f-a94a-720bbd25fc17"
+    assert len(list(tree.iter_cut_sets())) == 2
+    assert tree.probability() == pytest.approx(1 - 0.05**2)
+
+
+def test_shared_leaves():
+    bundle = _tree(
+        {
+            "root": ("OR", ["and-1", "and-2"]),
+            "and-1": ("AND", ["a", "b"]),
+            "and-2": ("AND", ["a", "c"]),
+        },
+        {"a": 50, "b": 50, "c": 50},
+    )
+    tree = AttackTree.from_bundle(bundle)
+    assert _names(tree.iter_cut_sets()) == [["a", "b"], ["a", "c"]]
+    # Leaf "a" is counted once: P(a) * P(b or c), not 1 - (1 - P(a and b))^2.
+    assert tree.probability() == pytest.approx(0.5 * 0.75)
+
+    costs = {"attack-action--a": 1, "attack-action--b": 5, "attack-action--c": 2}
+    tree = AttackTree.from_bundle(bundle, cost=lambda obj: costs[obj["id"]])
+    cost, cut_set = tree.min_cost()
+    assert (cost, sorted(cut_set)) == (3, ["attack-action--a", "attack-action--c"])
+
+    # Cut sets are minimal.
+    tree = AttackTree.from_bundle(
+        _tree({"root": ("OR", ["a", "and"]), "and": ("AND", ["a", "b"])})
+    )
+    assert _names(tree.iter_cut_sets()) == [["a"]]
+    assert tree.probability() == pytest.approx(0.95)
+
+
+def test_shared_subtrees():
+    tree = AttackTree.from_bundle(_ladder(1000))
+    assert len(tree.leaf_refs) == 2 + 2 * 998
+    # The cut sets of each goal are those of the two goals below it, so they are
+    # counted by the Fibonacci numbers.
+    fibonacci = [1, 1]
+    while len(fibonacci) < 1000:
+        fibonacci.append(fibonacci[-1] + fibonacci[-2])
+    assert tree.count_cut_sets() == fibonacci[-1]
+    assert tree.min_cost()[0] == 500
+    assert max(tree.diagram_sizes()) < 10 * len(tree.leaf_refs)
+    assert 0 < tree.probability() < 1
+
+    small = AttackTree.from_bundle(_ladder(5))
+    assert small.count_cut_sets() == 5
+    assert _names(small.iter_cut_sets(max_size=3)) == [
+        ["a2", "b4", "g1"],
+        ["a4", "b3", "g1"],
+        ["b2", "b4", "g0"],
+    ]
+
+
+def test_invalid_trees():
+    two_roots = _tree({"x": ("OR", ["a"]), "y": ("AND", ["b"])})
+    with pytest.raises(ValueError):
+        AttackTree.from_bundle(two_roots)
+    tree = AttackTree.from_bundle(two_roots, root="attack-action--y")
+    assert tree.leaf_refs == ["attack-action--b"]
+    with pytest.raises(ValueError):
+        AttackTree.from_bundle(two_roots, root="attack-action--missing")
+
+    cycle = _tree({"root": ("OR", ["a", "b"]), "b": ("AND", ["c"]), "c": ("OR", ["b"])})
+    with pytest.raises(ValueError):
+        AttackTree.from_bundle(cycle)
+
+    bad_operator = _tree({"root": ("XOR", ["a", "b"])})
+    with pytest.raises(ValueError):
+        AttackTree.from_bundle(bad_operator)
+
+    bad_confidence = _tree({"root": ("OR", ["a", "b"])}, {"a": 101})
+    with pytest.raises(ValueError):
+        AttackTree.from_bundle(bad_confidence)
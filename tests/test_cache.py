@@ -0,0 +1,233 @@
+import json
+import os
+from pathlib import Path
+import shutil
+
+import pytest
+
+import attack_flow.cache
+import attack_flow.jsonio
+import attack_flow.model
+import attack_flow.schema
+from attack_flow.cache import BundleCache, ResultCache, validate_doc
+from attack_flow.schema import SCHEMA_DIR, ValidationResult
+
+EXAMPLE_PATH = SCHEMA_DIR / "attack-flow-example.json"
+
+
+def test_validate_doc_cached(tmp_path, mocker):
+    cache_dir = tmp_path / "cache"
+    validate_spy = mocker.spy(attack_flow.schema, "validate_doc")
+
+    result1 = validate_doc(EXAMPLE_PATH, cache_dir)
+    assert result1.success
+    assert validate_spy.call_count == 1
+    assert len(list(cache_dir.glob("*.json"))) == 1
+
+    result2 = validate_doc(EXAMPLE_PATH, cache_dir)
+    assert result2.success
+    assert validate_spy.call_count == 1
+
+
+def test_validate_doc_cached_changed(tmp_path, mocker):
+    cache_dir = tmp_path / "cache"
+    flow_path = tmp_path / "flow.json"
+    shutil.copy(EXAMPLE_PATH, flow_path)
+    validate_spy = mocker.spy(attack_flow.schema, "validate_doc")
+
+    assert validate_doc(flow_path, cache_dir).success
+
+    flow_json = json.loads(flow_path.read_text())
+    flow_json["id"] = "not-a-bundle-id"
+    flow_path.write_text(json.dumps(flow_json))
+    result = validate_doc(flow_path, cache_dir)
+    assert not result.success
+    assert validate_spy.call_count == 2
+
+    cached_result = validate_doc(flow_path, cache_dir)
+    assert validate_spy.call_count == 2
+    assert [str(m) for m in cached_result.messages] == [str(m) for m in result.messages]
+
+
+def test_cached_exception(tmp_path):
+    """A wrapped schema error prints the same way after it is restored."""
+    cache = ResultCache(tmp_path)
+    flow_path = tmp_path / "flow.json"
+    flow_json = json.loads(EXAMPLE_PATH.read_text())
+    del flow_json["objects"][0]["name"]
+    flow_path.write_text(json.dumps(flow_json))
+    result = attack_flow.schema.validate_doc(flow_path)
+    assert not result.success
+
+    key = cache.key_for_file(flow_path)
+    cache.put(key, result)
+    cached_result = cache.get(key)
+    assert len(cached_result.messages) == len(result.messages)
+    for cached, original in zip(cached_result.messages, result.messages):
+        assert str(cached) == str(original)
+        assert str(cached.exc) == str(original.exc)
+
+
+def test_cache_miss(tmp_path):
+    cache = ResultCache(tmp_path)
+    assert cache.get(cache.key_for_hash("0" * 64)) is None
+
+
+def test_cache_entry_without_result(tmp_path):
+    cache = ResultCache(tmp_path)
+    key = cache.key_for_hash("0" * 64)
+    cache.put(key, ValidationResult())
+    (entry_path,) = tmp_path.glob("*.json")
+    entry_path.write_text(json.dumps({"format": attack_flow.cache.CACHE_FORMAT}))
+    assert cache.get(key) is None
+    entry_path.write_text("[]")
+    assert cache.get(key) is None
+
+
+def test_cache_eviction(tmp_path):
+    result = ValidationResult()
+    result.add_warning("A warning.")
+    entry_size = len(json.dumps({"format": 1, "result": result.to_dict()}))
+    cache = ResultCache(tmp_path, max_size=entry_size * 4)
+    keys = [cache.key_for_hash(f"{i:064x}") for i in range(5)]
+
+    for i, key in enumerate(keys[:4]):
+        cache.put(key, result)
+        os.utime(tmp_path / f"{key}.json", (i, i))
+    # Make the first entry the most recently used.
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[4], result)
+
+    # The cache was too big, so it shrank to 3/4 of its maximum size.
+    assert [cache.get(key) is not None for key in keys] == [
+        True,
+        False,
+        False,
+        True,
+        True,
+    ]
+
+
+def test_cache_scans_when_full(tmp_path, mocker):
+    result = ValidationResult()
+    cache = ResultCache(tmp_path, max_size=1024 * 1024)
+    evict_spy = mocker.spy(cache, "evict")
+    for i in range(10):
+        cache.put(cache.key_for_hash(f"{i:064x}"), result)
+    # The directory is scanned once, and then its size is kept up to date.
+    assert evict_spy.call_count == 1
+
+    cache.max_size = 0
+    cache.put(cache.key_for_hash("f" * 64), result)
+    assert evict_spy.call_count == 2
+    assert list(tmp_path.glob("*.json")) == []
+    assert ResultCache.shared(tmp_path, 10) is ResultCache.shared(tmp_path, 10)
+
+
+def test_cache_key_depends_on_content():
+    cache = ResultCache(Path("unused"))
+    assert cache.key_for_hash("0" * 64) != cache.key_for_hash("1" * 64)
+    assert cache.key_for_hash("0" * 64) == cache.key_for_hash("0" * 64)
+
+
+def test_package_version_includes_source(mocker):
+    """Source changes count even when the installed version does not change."""
+    mocker.patch("importlib.metadata.version", return_value="3.0.0")
+    get_source_hash = mocker.patch(
+        "attack_flow.cache._get_source_hash", return_value="a" * 64
+    )
+    version1 = attack_flow.cache._get_package_version("attack-flow")
+    get_source_hash.return_value = "b" * 64
+    version2 = attack_flow.cache._get_package_version("attack-flow")
+    assert version1.startswith("3.0.0+")
+    assert version1 != version2
+    assert attack_flow.cache._get_package_version("stix2") == "3.0.0"
+
+
+def test_source_hash_includes_data_files(tmp_path, mocker):
+    (tmp_path / "cache.py").write_text("")
+    data_path = tmp_path / "attack_stix_ids.json"
+    data_path.write_text("{}")
+    mocker.patch.object(attack_flow.cache, "__file__", str(tmp_path / "cache.py"))
+    attack_flow.cache._get_source_hash.cache_clear()
+    try:
+        hash1 = attack_flow.cache._get_source_hash()
+        attack_flow.cache._get_source_hash.cache_clear()
+        data_path.write_text('{"T1566": "attack-pattern--1"}')
+        assert attack_flow.cache._get_source_hash() != hash1
+    finally:
+        attack_flow.cache._get_source_hash.cache_clear()
+
+
+@pytest.fixture
+def bundle_cache(tmp_path):
+    bundle_cache = BundleCache(tmp_path / "bundles")
+    attack_flow.model.set_bundle_cache(bundle_cache)
+    yield bundle_cache
+    attack_flow.model.set_bundle_cache(None)
+
+
+def test_bundle_cache(bundle_cache, mocker):
+    load_spy = mocker.spy(attack_flow.jsonio, "load_path")
+    bundle = attack_flow.model.load_attack_flow_bundle(EXAMPLE_PATH)
+    assert load_spy.call_count == 1
+    assert len(list(bundle_cache.cache_dir.glob("*.pickle"))) == 1
+
+    cached = attack_flow.model.load_attack_flow_bundle(EXAMPLE_PATH)
+    assert load_spy.call_count == 1
+    assert cached == bundle
+    assert [type(obj) for obj in cached.objects] == [
+        type(obj) for obj in bundle.objects
+    ]
+    # Timestamps keep their precision, so the bundle serializes the same way.
+    assert cached.serialize(pretty=True) == bundle.serialize(pretty=True)
+
+
+def test_bundle_cache_changed(bundle_cache, tmp_path, mocker):
+    flow_path = tmp_path / "flow.json"
+    shutil.copy(EXAMPLE_PATH, flow_path)
+    hash_spy = mocker.spy(attack_flow.cache, "_hash_file")
+    attack_flow.model.load_attack_flow_bundle(flow_path)
+    attack_flow.model.load_attack_flow_bundle(flow_path)
+    # The hash is reused while the file's size and modification time are unchanged.
+    assert hash_spy.call_count == 1
+
+    flow_json = json.loads(flow_path.read_text())
+    flow_json["objects"][0]["name"] = "Changed"
+    flow_path.write_text(json.dumps(flow_json))
+    bundle = attack_flow.model.load_attack_flow_bundle(flow_path)
+    assert hash_spy.call_count == 2
+    assert bundle.objects[0].name == "Changed"
+
+    # A file with the same contents but a new modification time is still a hit.
+    stat = flow_path.stat()
+    os.utime(flow_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    load_spy = mocker.spy(attack_flow.jsonio, "load_path")
+    assert attack_flow.model.load_attack_flow_bundle(flow_path) == bundle
+    assert hash_spy.call_count == 3
+    assert load_spy.call_count == 0
+
+
+def test_bundle_cache_touches_pointer(bundle_cache):
+    key = bundle_cache.key_for_file(EXAMPLE_PATH)
+    (pointer_path,) = bundle_cache.cache_dir.glob("*.path")
+    os.utime(pointer_path, (0, 0))
+    assert bundle_cache.key_for_file(EXAMPLE_PATH) == key
+    # A pointer that is used is not the first to be evicted.
+    assert pointer_path.stat().st_mtime > 0
+
+
+def test_bundle_cache_unreadable(bundle_cache):
+    key = bundle_cache.key_for_file(EXAMPLE_PATH)
+    (bundle_cache.cache_dir / f"{key}.pickle").write_bytes(b"not a pickle")
+    assert bundle_cache.get(key) is None
+    bundle = attack_flow.model.load_attack_flow_bundle(EXAMPLE_PATH)
+    assert bundle_cache.get(key) == bundle
+
+
+def test_bundle_cache_eviction(tmp_path):
+    bundle = attack_flow.model.load_attack_flow_bundle(EXAMPLE_PATH)
+    bundle_cache = BundleCache(tmp_path, max_size=0)
+    key = bundle_cache.key_for_hash("0" * 64)
+    bundle_cache.put(key, bundle)
+    assert bundle_cache.get(key) is None
@@ -4,9 +4,11 @@ Test entry points for command line tools.
 These tests are minimal: checking basic argument parsing and making sure that
 the entrypoints call into the appropriate places in the package.
 """
+import json
 import os
 from pathlib import Path
 import runpy
+import subprocess
 import sys
 from tempfile import NamedTemporaryFile, TemporaryDirectory
 from textwrap import dedent
@@ -277,3 +279,225 @@ def test_reraises_in_debug_mode(get_dist_mock, exit_mock):
     with pytest.raises(ValueError):
         runpy.run_module("attack_flow.cli", run_name="__main__")
     exit_mock.assert_not_called()
+
+
+@patch("sys.exit")
+def test_validate_parallel(exit_mock, capsys):
+    flow_path = str(attack_flow.schema.SCHEMA_DIR / "attack-flow-example.json")
+    sys.argv = ["af", "validate", "--jobs", "2", flow_path, flow_path, flow_path]
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    captured = capsys.readouterr()
+    assert captured.out == f"{flow_path}: OK\n" * 3
+    exit_mock.assert_called_with(0)
+
+
+@patch("sys.exit")
+def test_validate_parallel_fail(exit_mock, capsys):
+    good_path = str(attack_flow.schema.SCHEMA_DIR / "attack-flow-example.json")
+    with NamedTemporaryFile("w", suffix=".json") as bad:
+        bad.write(
+            '{"type": "bundle", "id": "bundle--1", "objects": [{"type": "identity", '
+            '"spec_version": "2.1", '
+            '"id": "identity--d673f8cb-c168-42da-8ed4-0cb26725f86c", '
+            '"created": "2022-08-02T19:34:35.143Z", '
+            '"modified": "2022-08-02T19:34:35.143Z", '
+            '"name": "Unit Test"}]}'
+        )
+        bad.flush()
+        sys.argv = ["af", "validate", "-j", "2", bad.name, good_path]
+        runpy.run_module("attack_flow.cli", run_name="__main__")
+    captured = capsys.readouterr()
+    lines = captured.out.splitlines()
+    assert lines[0] == f"{bad.name}: FAIL"
+    assert lines[-1] == f"{good_path}: OK"
+    exit_mock.assert_called_with(1)
+
+
+@patch("sys.exit")
+def test_validate_parallel_schema_error(exit_mock, capsys, tmp_path):
+    """Schema errors are sent back from the workers and printed with --verbose."""
+    good_path = attack_flow.schema.SCHEMA_DIR / "attack-flow-example.json"
+    doc = json.loads(good_path.read_text())
+    action = next(obj for obj in doc["objects"] if obj["type"] == "attack-action")
+    del action["name"]
+    bad_path = tmp_path / "bad.json"
+    bad_path.write_text(json.dumps(doc))
+
+    sys.argv = ["af", "validate", "--verbose", "-j", "2", str(bad_path)]
+    sys.argv.append(str(good_path))
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    out = capsys.readouterr().out
+    lines = out.splitlines()
+    assert lines[0] == f"{bad_path}: FAIL"
+    assert "'name' is a required property" in out
+    assert "EXCEPTION" in out
+    assert lines[-1] == f"{good_path}: OK"
+    exit_mock.assert_called_with(1)
+
+
+@patch("sys.exit")
+@patch("attack_flow.schema.validate_doc")
+def test_validate_stream(validate_mock, exit_mock, capsys):
+    validate_mock.return_value = attack_flow.schema.ValidationResult()
+    sys.argv = ["af", "validate", "--stream", "doc.json"]
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    validate_mock.assert_called_with(Path("doc.json"), streaming=True)
+    captured = capsys.readouterr()
+    assert "doc.json: OK" in captured.out
+    exit_mock.assert_called_with(0)
+
+
+@patch("sys.exit")
+def test_validate_cache_dir(exit_mock, capsys, tmp_path):
+    flow_path = str(attack_flow.schema.SCHEMA_DIR / "attack-flow-example.json")
+    cache_dir = tmp_path / "cache"
+    sys.argv = ["af", "validate", "--cache-dir", str(cache_dir), flow_path]
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    captured = capsys.readouterr()
+    assert captured.out == f"{flow_path}: OK\n" * 2
+    assert len(list(cache_dir.glob("*.json"))) == 1
+    exit_mock.assert_called_with(0)
+
+
+@patch("sys.exit")
+def test_validate_cache_dir_parallel(exit_mock, capsys, tmp_path):
+    """Fresh results with schema errors are stored and sent back from the workers."""
+    good_path = attack_flow.schema.SCHEMA_DIR / "attack-flow-example.json"
+    doc = json.loads(good_path.read_text())
+    action = next(obj for obj in doc["objects"] if obj["type"] == "attack-action")
+    del action["name"]
+    bad_path = tmp_path / "bad.json"
+    bad_path.write_text(json.dumps(doc))
+    cache_dir = tmp_path / "cache"
+
+    sys.argv = ["af", "validate", "--cache-dir", str(cache_dir), "-j", "2"]
+    sys.argv += [str(bad_path), str(good_path)]
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    cold = capsys.readouterr().out
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    warm = capsys.readouterr().out
+    assert cold.splitlines()[0] == f"{bad_path}: FAIL"
+    assert f"{good_path}: OK" in cold.splitlines()
+    assert warm == cold
+    assert len(list(cache_dir.glob("*.json"))) == 2
+    exit_mock.assert_called_with(1)
+
+
+@patch("sys.exit")
+def test_profile(exit_mock, capsys):
+    sys.argv = [
+        "af",
+        "--profile",
+        "json",
+        "validate",
+        str(attack_flow.schema.SCHEMA_DIR / "attack-flow-example.json"),
+    ]
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    exit_mock.assert_called_with(0)
+    captured = capsys.readouterr()
+    assert captured.out.endswith("OK\n")
+    records = [json.loads(line) for line in captured.err.splitlines()]
+    assert records[0]["name"] == "validate"
+    assert records[0]["depth"] == 0
+    assert {"json.decode", "check_schema", "stix2.parse"} <= {
+        r["name"] for r in records if r["type"] == "span"
+    }
+    assert {"type": "counter", "name": "objects", "value": 20} in records
+
+
+@patch("sys.exit")
+@patch("attack_flow.model._bundle_cache", None)
+def test_mermaid_cache_dir(exit_mock, capsys, tmp_path):
+    """The second conversion reads the parsed bundle from the cache."""
+    output_path = tmp_path / "flow.mmd"
+    sys.argv = [
+        "af",
+        "--profile",
+        "json",
+        "mermaid",
+        "--cache-dir",
+        str(tmp_path / "cache"),
+        "tests/fixtures/flow1.json",
+        str(output_path),
+    ]
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    expected = output_path.read_text()
+    capsys.readouterr()
+
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    exit_mock.assert_called_with(0)
+    assert output_path.read_text() == expected
+    records = [json.loads(line) for line in capsys.readouterr().err.splitlines()]
+    assert {"type": "counter", "name": "bundle_cache.hits", "value": 1} in records
+    assert "json.decode" not in {r["name"] for r in records if r["type"] == "span"}
+
+
+@patch("sys.exit")
+def test_profile_memory(exit_mock, capsys):
+    sys.argv = [
+        "af",
+        "--profile-memory",
+        "validate",
+        str(attack_flow.schema.SCHEMA_DIR / "attack-flow-example.json"),
+    ]
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    exit_mock.assert_called_with(0)
+    err = capsys.readouterr().err
+    assert err.startswith("Profile:\n  validate")
+    assert "MiB peak" in err
+
+
+HEAVY_MODULES = ("defusedxml", "graphviz", "jsonschema", "networkx", "stix2")
+# Runs a command in a fresh interpreter and prints the heavy modules it imported. Only
+# the imports matter, so the command is allowed to fail.
+IMPORT_CHECK = """
+import json, sys
+import attack_flow.cli
+heavy = json.loads(sys.argv[2])
+sys.argv = ["af"] + json.loads(sys.argv[1])
+try:
+    attack_flow.cli.main()
+except (Exception, SystemExit):
+    pass
+print(json.dumps(sorted(m for m in sys.modules if m.split(".")[0] in heavy)))
+"""
+
+
+def get_imported_heavy_modules(argv):
+    """Run the CLI in a subprocess and return the heavy libraries it imported."""
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            IMPORT_CHECK,
+            json.dumps(argv),
+            json.dumps(HEAVY_MODULES),
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    return {module.split(".")[0] for module in json.loads(output.splitlines()[-1])}
+
+
+@pytest.mark.parametrize(
+    "argv,allowed",
+    [
+        (["--help"], set()),
+        (["version"], set()),
+        (["validate", "{flow}"], {"jsonschema", "stix2"}),
+        (["mermaid", "{flow}", "{out}"], {"stix2"}),
+        (["graphviz", "{flow}", "{out}"], {"graphviz", "stix2"}),
+    ],
+)
+def test_lazy_imports(argv, allowed, tmp_path):
+    """
+    Subcommands only import the libraries they need.
+
+    Importing every library takes most of the time of a short ``af`` run, so this guards
+    against a new top-level import slowing down every subcommand.
+    """
+    flow_path = attack_flow.schema.SCHEMA_DIR / "attack-flow-example.json"
+    argv = [arg.format(flow=flow_path, out=tmp_path / "out") for arg in argv]
+    assert get_imported_heavy_modules(argv) <= allowed
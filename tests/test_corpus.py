@@ -0,0 +1,210 @@
+from pathlib import Path
+import runpy
+import shutil
+import sys
+from unittest.mock import patch
+
+import pytest
+
+from attack_flow.corpus import CorpusStore
+from .fixtures import get_flow_bundle, get_tree_bundle
+
+CORPUS_PATHS = [
+    Path("corpus/Black Basta Ransomware.afb"),
+    Path("corpus/Marriott Breach.afb"),
+    Path("corpus/WhisperGate.afb"),
+]
+ACTION1 = "attack-action--52f2c35a-fa2a-45a4-b84c-46ad9498071f"
+
+
+def _summary(store):
+    """Describe a store through its public interface."""
+    techniques = sorted(
+        technique_id
+        for node_id in store.nodes_of_type("attack-action")
+        if (technique_id := store.node(node_id).technique_id)
+    )
+    return {
+        "flows": sorted(store),
+        "nodes": store.number_of_nodes(),
+        "edges": store.number_of_edges(),
+        "techniques": {t: sorted(store.flows_with_technique(t)) for t in techniques},
+        "effect": sorted(store.edges_of_type("effect")),
+        "transitions": {
+            (a, b): sorted(store.flows_with_transition(a, b))
+            for a in techniques
+            for b in techniques
+            if store.flows_with_transition(a, b)
+        },
+    }
+
+
+def test_queries():
+    store = CorpusStore()
+    store.add_flow("flow", get_flow_bundle())
+    store.add_flow("tree", get_tree_bundle())
+
+    assert len(store) == 2
+    assert "flow" in store
+    assert store.flows_with_technique("T3") == ["flow", "tree"]
+    assert store.flows_with_technique("T1") == ["flow"]
+    assert store.flows_with_technique("T9999") == []
+    assert store.flows_with_transition("T1", "T3") == ["flow"]
+    assert store.flows_with_transition("T3", "T1") == []
+    assert store.flows_with_all(["T1", "T3"]) == ["flow"]
+    assert store.flows_with_all([]) == []
+    assert store.flows_with_type("attack-flow") == ["flow", "tree"]
+    assert store.flows_with_edge_type("on_true") == ["flow", "tree"]
+    assert store.flows_with_edge_type("no-such-type") == []
+    assert store.flows_with_node(ACTION1) == ["flow"]
+    assert store.nodes_with_technique("T1") == {ACTION1}
+    assert store.node(ACTION1).node_type == "attack-action"
+    assert store.flow_nodes("flow")[0].startswith("attack-flow--")
+    assert len(store.flow_action_edges("flow")) == 3
+
+
+def test_deduplicates_nodes():
+    store = CorpusStore()
+    store.add_flow("a", get_flow_bundle())
+    nodes = store.number_of_nodes()
+    edges = store.number_of_edges()
+    store.add_flow("b", get_flow_bundle())
+    assert store.number_of_nodes() == nodes
+    assert store.number_of_edges() == edges
+    assert store.flows_with_node(ACTION1) == ["a", "b"]
+
+
+def test_remove_flow():
+    only_tree = CorpusStore()
+    only_tree.add_flow("tree", get_tree_bundle())
+
+    store = CorpusStore()
+    store.add_flow("flow", get_flow_bundle())
+    store.add_flow("tree", get_tree_bundle())
+    store.remove_flow("flow")
+    assert _summary(store) == _summary(only_tree)
+    assert store.nodes_with_technique("T1") == set()
+    with pytest.raises(KeyError):
+        store.remove_flow("flow")
+
+    # The removed flow's slot is reused.
+    store.add_flow("again", get_flow_bundle())
+    assert store.flows_with_technique("T3") == ["again", "tree"]
+
+
+def test_conflicting_properties():
+    store = CorpusStore()
+    store.add_flow("flow", get_flow_bundle())
+    flow_json = {
+        "type": "bundle",
+        "objects": [
+            {
+                "type": "attack-action",
+                "id": ACTION1,
+                "technique_id": "T1059",
+                "effect_refs": ["attack-action--2"],
+            },
+            {"type": "attack-action", "id": "attack-action--2", "technique_id": "T3"},
+        ],
+    }
+    store.add_flow("other", flow_json)
+    # Each flow is indexed with its own properties for the shared action.
+    assert store.flows_with_technique("T1059") == ["other"]
+    assert store.flows_with_technique("T1") == ["flow"]
+    assert store.flows_with_transition("T1059", "T3") == ["other"]
+    assert store.flows_with_transition("T1", "T3") == ["flow"]
+    assert store.nodes_with_technique("T1") == {ACTION1}
+    assert store.node(ACTION1).technique_id == "T1059"
+
+    store.remove_flow("other")
+    assert store.node(ACTION1).technique_id == "T1"
+    assert store.nodes_with_technique("T1059") == set()
+
+
+def test_save_and_load(tmp_path):
+    store = CorpusStore()
+    store.add_flow("flow", get_flow_bundle())
+    store.add_flow("tree", get_tree_bundle())
+    store.remove_flow("flow")
+    store.add_flow("flow2", get_flow_bundle())
+    store_path = tmp_path / "corpus.pickle"
+    store.save(store_path)
+
+    loaded = CorpusStore.load(store_path)
+    assert _summary(loaded) == _summary(store)
+    loaded.remove_flow("tree")
+    assert loaded.flows_with_technique("T3") == ["flow2"]
+
+
+def test_load_wrong_format(tmp_path):
+    store_path = tmp_path / "corpus.pickle"
+    store_path.write_bytes(b"\x80\x04N.")
+    with pytest.raises(ValueError):
+        CorpusStore.load(store_path)
+
+
+def test_sync_files(tmp_path):
+    paths = list()
+    for path in CORPUS_PATHS:
+        paths.append(tmp_path / path.name)
+        shutil.copy(path, paths[-1])
+
+    store = CorpusStore()
+    store.add_flow("fixture", get_flow_bundle())
+    added, removed = store.sync_files(paths)
+    assert added == [str(path) for path in paths]
+    assert removed == []
+
+    assert store.sync_files(paths) == ([], [])
+
+    fresh = CorpusStore()
+    for path in paths[1:]:
+        fresh.add_file(path)
+    fresh.add_flow("fixture", get_flow_bundle())
+    assert store.sync_files(paths[1:]) == ([], [str(paths[0])])
+    assert _summary(store) == _summary(fresh)
+
+    paths[1].write_bytes(paths[0].read_bytes())
+    assert store.sync_files(paths[1:]) == ([str(paths[1])], [])
+    assert "fixture" in store
+
+
+@patch("sys.exit")
+def test_cli_corpus(exit_mock, tmp_path, capsys):
+    store_path = tmp_path / "corpus.pickle"
+    sys.argv = ["af", "corpus", str(store_path)] + [str(p) for p in CORPUS_PATHS]
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    exit_mock.assert_called_with(0)
+    assert capsys.readouterr().out.startswith("3 flows (3 added, 0 removed), ")
+
+    # Listed files are added to the store without removing the others.
+    sys.argv = ["af", "corpus", str(store_path), str(CORPUS_PATHS[0])]
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    assert capsys.readouterr().out.startswith("3 flows (0 added, 0 removed), ")
+
+    sys.argv = ["af", "corpus", "--remove", str(store_path), str(CORPUS_PATHS[0])]
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    assert capsys.readouterr().out.startswith("2 flows (0 added, 1 removed), ")
+
+    sys.argv = ["af", "corpus", "--sync", str(store_path), str(CORPUS_PATHS[0])]
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    assert capsys.readouterr().out.startswith("1 flows (1 added, 2 removed), ")
+
+    sys.argv = ["af", "corpus", str(store_path)] + [str(p) for p in CORPUS_PATHS]
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    capsys.readouterr()
+    sys.argv = ["af", "corpus", str(store_path)]
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    assert capsys.readouterr().out.startswith("3 flows, ")
+    exit_mock.assert_called_with(0)
+
+    sys.argv = ["af", "corpus", str(store_path), "--transition", "T1566", "T1555"]
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    expected = CorpusStore.load(store_path).flows_with_transition("T1566", "T1555")
+    assert len(expected) == 1
+    assert capsys.readouterr().out.splitlines() == expected
+
+    store_path.write_bytes(b"\x80\x04N.")
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    exit_mock.assert_called_with(1)
+    assert "Not a corpus store" in capsys.readouterr().err
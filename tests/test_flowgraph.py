@@ -0,0 +1,151 @@
+from pathlib import Path
+
+import networkx as nx
+import pytest
+
+import attack_flow.graph
+import attack_flow.model
+import attack_flow.records
+from attack_flow.flowgraph import FlowGraph, FlowGraphBuilder
+from attack_flow.schema import SCHEMA_DIR
+from .fixtures import get_flow_bundle, get_tree_bundle
+
+FLOW_PATHS = [
+    SCHEMA_DIR / "attack-flow-example.json",
+    Path("tests/fixtures/flow1.json"),
+    Path("tests/fixtures/flow2.json"),
+    Path("corpus/Example Attack Tree.afb"),
+]
+
+OPERATOR = "attack-operator--8932b181-be87-4f81-851a-ab0b4288406a"
+ACTION1 = "attack-action--52f2c35a-fa2a-45a4-b84c-46ad9498071f"
+ACTION2 = "attack-action--dd3820fa-bae3-4270-8000-5c4642fa780c"
+ASSET = "attack-asset--4ae37379-6a11-44c1-b6a8-d11733cfac06"
+INFRA = "infrastructure--a75c83f7-147e-4695-b173-0981521b2f01"
+
+
+@pytest.mark.parametrize("flow_path", FLOW_PATHS, ids=lambda p: p.name)
+def test_matches_networkx(flow_path):
+    bundle = attack_flow.model.load_attack_flow_bundle(flow_path)
+    expected = attack_flow.graph.bundle_to_networkx(bundle)
+    view = attack_flow.graph.bundle_to_flow_graph(bundle).to_networkx()
+
+    assert list(view.nodes) == list(expected.nodes)
+    assert sorted(view.edges) == sorted(expected.edges)
+    for node, data in expected.nodes(data=True):
+        assert dict(view.nodes[node]) == data
+    for source, target, data in expected.edges(data=True):
+        assert dict(view.edges[source, target]) == data
+        assert dict(view.copy().edges[source, target]) == data
+    assert nx.utils.graphs_equal(view.copy(), expected)
+
+
+def test_payloads_are_not_copied():
+    bundle = get_flow_bundle()
+    graph = FlowGraph.from_bundle(bundle)
+    objects = {obj["id"]: obj for obj in bundle.objects}
+    assert graph.node(ACTION2) is objects[ACTION2]
+    (relationship,) = [obj for obj in bundle.objects if obj["type"] == "relationship"]
+    view = graph.to_networkx()
+    data = view.edges[ACTION2, INFRA]
+    assert data["id"] is relationship["id"]
+    assert "source_ref" not in data
+    assert dict(data) == {
+        k: v for k, v in relationship.items() if k not in ("source_ref", "target_ref")
+    }
+    with pytest.raises(TypeError):
+        data["relationship_type"] = "uses"
+    assert view.nodes[ACTION2] is objects[ACTION2]
+
+
+def test_queries():
+    graph = FlowGraph.from_bundle(get_flow_bundle())
+    assert len(graph) == 11
+    assert graph.number_of_edges() == 10
+    assert ACTION2 in graph
+    assert "extension-definition--fb9c968a-745b-4ade-9b25-c324172197f4" not in graph
+    assert graph.node_type(ACTION2) == "attack-action"
+    assert graph.successors(ACTION2) == [ASSET, INFRA]
+    assert list(graph.out_edges(ACTION2))[0] == (ASSET, "asset", None)
+    assert graph.predecessors(ACTION2) == [OPERATOR]
+    assert [(s, t) for s, t, _ in graph.in_edges(ACTION2)] == [(OPERATOR, "effect")]
+    assert graph.nodes_of_type("attack-action")[:2] == [ACTION1, ACTION2]
+    assert graph.nodes_of_type("no-such-type") == []
+
+    index = graph.index(ACTION2)
+    assert graph.node_id(index) == ACTION2
+    assert [graph.node_id(i) for i in graph.successor_indices(index)] == [ASSET, INFRA]
+    effect = graph.edge_type_code("effect")
+    assert list(graph.edge_type_indices(graph.index(OPERATOR))) == [effect, effect]
+    assert graph.edge_type_code("no-such-type") is None
+    with pytest.raises(KeyError):
+        graph.index("attack-action--00000000-0000-4000-8000-000000000000")
+
+
+def test_keep_extensions():
+    graph = FlowGraph.from_bundle(get_flow_bundle(), remove_extensions=False)
+    assert "extension-definition--fb9c968a-745b-4ade-9b25-c324172197f4" in graph
+    assert len(graph) > 11
+
+
+def test_duplicate_references():
+    bundle = {
+        "type": "bundle",
+        "objects": [
+            {"type": "attack-operator", "id": "o", "effect_refs": ["a", "a"]},
+            {"type": "attack-action", "id": "a"},
+        ],
+    }
+    graph = FlowGraph.from_bundle(bundle)
+    assert graph.successors("o") == ["a", "a"]
+    assert graph.node_type("a") == "attack-action"
+    view = graph.to_networkx()
+    assert list(view.edges) == [("o", "a")]
+
+
+def test_merge_bundles():
+    flow = get_flow_bundle()
+    tree = get_tree_bundle()
+    graph = FlowGraph.from_bundles([flow, tree])
+    separate = len(FlowGraph.from_bundle(flow)) + len(FlowGraph.from_bundle(tree))
+    assert len(graph) <= separate
+    assert ACTION2 in graph
+
+    twice = FlowGraph.from_bundles([flow, flow])
+    once = FlowGraph.from_bundle(flow)
+    assert list(twice) == list(once)
+    assert twice.number_of_edges() == once.number_of_edges()
+
+
+def test_builder_records():
+    path = FLOW_PATHS[0]
+    builder = FlowGraphBuilder()
+    builder.add_bundle(attack_flow.records.load_bundle(path))
+    graph = builder.build()
+    expected = FlowGraph.from_bundle(attack_flow.model.load_attack_flow_bundle(path))
+    assert list(graph) == list(expected)
+    assert graph.number_of_edges() == expected.number_of_edges()
+
+
+def test_networkx_view_is_read_only():
+    view = FlowGraph.from_bundle(get_flow_bundle()).to_networkx()
+    with pytest.raises(nx.NetworkXError):
+        view.add_node("x")
+    with pytest.raises(nx.NetworkXError):
+        view.remove_edge(OPERATOR, ACTION2)
+    copy = view.copy()
+    copy.add_node("x")
+    assert "x" in copy and "x" not in view
+
+
+def test_networkx_algorithms():
+    view = FlowGraph.from_bundle(get_flow_bundle()).to_networkx()
+    assert ASSET in nx.descendants(view, OPERATOR)
+    assert view.in_degree(ACTION2) == 1
+    assert view.out_degree(ACTION2) == 2
+    assert set(view.subgraph([OPERATOR, ACTION2]).edges) == {(OPERATOR, ACTION2)}
+    induced = attack_flow.graph.induce_action_graph(view)
+    expected = attack_flow.graph.induce_action_graph(
+        attack_flow.graph.bundle_to_networkx(get_flow_bundle())
+    )
+    assert set(induced.edges) == set(expected.edges)
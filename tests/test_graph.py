@@ -1,6 +1,12 @@
 from datetime import datetime
+from pathlib import Path
 
+import networkx as nx
+import pytest
+
+import attack_flow.flowgraph
 import attack_flow.graph
+import attack_flow.model
 from .fixtures import get_flow_bundle
 
 
@@ -58,3 +64,158 @@ def test_induce_action_graph():
 
     assert len(graph.nodes) == 4
     assert len(graph.edges) == 3
+
+
+def test_build_action_graph():
+    flow_bundle = get_flow_bundle()
+    graph = attack_flow.graph.build_action_graph(
+        attack_flow.graph.bundle_to_flow_graph(flow_bundle)
+    )
+    expected = attack_flow.graph.induce_action_graph(
+        attack_flow.graph.bundle_to_networkx(flow_bundle)
+    )
+
+    assert list(graph.nodes) == list(expected.nodes)
+    assert set(graph.edges) == set(expected.edges)
+    action1 = "attack-action--52f2c35a-fa2a-45a4-b84c-46ad9498071f"
+    action2 = "attack-action--dd3820fa-bae3-4270-8000-5c4642fa780c"
+    action3 = "attack-action--7ddab166-c83e-4c79-a701-a0dc2a905dd3"
+    condition = "attack-condition--64d5bf0b-6acc-4f43-b0f2-aa93a219897a"
+    operator = "attack-operator--8932b181-be87-4f81-851a-ab0b4288406a"
+    assert graph.edges[action1, action2] == {
+        "type": "effect",
+        "via": (condition, operator),
+    }
+    assert graph.edges[action1, action3]["via"] == (condition,)
+    assert graph.nodes[action1] == expected.nodes[action1]
+
+
+def _action_graph(objects):
+    flow_graph = attack_flow.flowgraph.FlowGraph.from_bundle(
+        {"type": "bundle", "objects": objects}
+    )
+    return attack_flow.graph.build_action_graph(flow_graph)
+
+
+def test_build_action_graph_skips_hubs():
+    # Actions that share an asset are not connected through it.
+    objects = [
+        {"type": "attack-asset", "id": "attack-asset--1"},
+        {"type": "attack-action", "id": "attack-action--3", "asset_refs": []},
+    ]
+    for i in range(2):
+        objects.append(
+            {
+                "type": "attack-action",
+                "id": f"attack-action--{i}",
+                "asset_refs": ["attack-asset--1"],
+                "effect_refs": ["attack-action--3"],
+            }
+        )
+    objects.append(
+        {
+            "type": "relationship",
+            "id": "relationship--1",
+            "source_ref": "attack-asset--1",
+            "target_ref": "attack-action--3",
+            "relationship_type": "related-to",
+        }
+    )
+    graph = _action_graph(objects)
+    assert set(graph.edges) == {
+        ("attack-action--0", "attack-action--3"),
+        ("attack-action--1", "attack-action--3"),
+    }
+    assert graph.edges["attack-action--0", "attack-action--3"]["via"] == ()
+
+
+def test_build_action_graph_operator_cycle():
+    graph = _action_graph(
+        [
+            {
+                "type": "attack-action",
+                "id": "attack-action--1",
+                "effect_refs": ["attack-operator--1"],
+            },
+            {
+                "type": "attack-operator",
+                "id": "attack-operator--1",
+                "effect_refs": ["attack-condition--1"],
+            },
+            {
+                "type": "attack-condition",
+                "id": "attack-condition--1",
+                "on_true_refs": ["attack-operator--1", "attack-action--2"],
+                "on_false_refs": ["attack-action--1"],
+            },
+            {"type": "attack-action", "id": "attack-action--2"},
+        ]
+    )
+    assert set(graph.edges) == {
+        ("attack-action--1", "attack-action--1"),
+        ("attack-action--1", "attack-action--2"),
+    }
+    assert graph.edges["attack-action--1", "attack-action--2"]["via"] == (
+        "attack-operator--1",
+        "attack-condition--1",
+    )
+
+
+@pytest.mark.parametrize(
+    "afb_path",
+    [
+        Path("corpus/Black Basta Ransomware.afb"),
+        Path("corpus/Ivanti Vulnerabilities.afb"),
+    ],
+)
+def test_build_action_graph_all_edges(afb_path):
+    """These flows connect some actions through assets."""
+    flow_bundle = attack_flow.model.load_attack_flow_bundle(afb_path)
+    induced = attack_flow.graph.induce_action_graph(
+        attack_flow.graph.bundle_to_networkx(flow_bundle)
+    )
+    flow_graph = attack_flow.graph.bundle_to_flow_graph(flow_bundle)
+    effects = attack_flow.graph.build_action_graph(flow_graph)
+    full = attack_flow.graph.build_action_graph(flow_graph, effects_only=False)
+    assert set(full.nodes) == set(induced.nodes)
+    assert set(full.edges) == set(induced.edges)
+    assert set(effects.edges) < set(induced.edges)
+    # Only the full graph connects actions through objects such as assets.
+    assert any(
+        flow_graph.node_type(node) == "attack-asset"
+        for _, _, via in full.edges(data="via")
+        for node in via
+    )
+    assert not any(
+        flow_graph.node_type(node) not in ("attack-operator", "attack-condition")
+        for _, _, via in effects.edges(data="via")
+        for node in via
+    )
+
+
+def test_get_action_graph():
+    attack_flow.graph.clear_action_graph_cache()
+    flow_bundle = get_flow_bundle()
+    graph = attack_flow.graph.get_action_graph(flow_bundle)
+    assert attack_flow.graph.get_action_graph(flow_bundle) is graph
+    assert attack_flow.graph.get_action_graph(get_flow_bundle()) is not graph
+    assert nx.is_frozen(graph)
+    full = attack_flow.graph.get_action_graph(flow_bundle, effects_only=False)
+    assert full is not graph
+    assert attack_flow.graph.get_action_graph(flow_bundle, effects_only=False) is full
+    attack_flow.graph.clear_action_graph_cache()
+    assert attack_flow.graph.get_action_graph(flow_bundle) is not graph
+
+
+def test_get_action_graph_lifetime():
+    attack_flow.graph.clear_action_graph_cache()
+    flow_bundle = get_flow_bundle()
+    attack_flow.graph.get_action_graph(flow_bundle)
+    assert len(attack_flow.graph._action_graph_cache) == 1
+    del flow_bundle
+    assert len(attack_flow.graph._action_graph_cache) == 0
+
+    # Plain dicts cannot be weakly referenced, so they are not cached.
+    bundle = {"type": "bundle", "objects": []}
+    assert attack_flow.graph.get_action_graph(bundle).number_of_nodes() == 0
+    assert len(attack_flow.graph._action_graph_cache) == 0
@@ -0,0 +1,129 @@
+import copy
+import json
+
+import pytest
+
+from attack_flow.incremental import IncrementalValidator
+from attack_flow.schema import SCHEMA_DIR, validate_json
+
+FLOW_ID = "attack-flow--e9ec3a4b-f787-4e81-a3d9-4cfe017ebc2f"
+ACTION_ID = "attack-action--1c0078ec-0731-4bf4-b1e5-6e3289c9c4eb"
+CONDITION_ID = "attack-condition--2277d494-031e-4d79-b557-f31e4451a305"
+NEW_ACTION_ID = "attack-action--fb991df9-ec4b-45c6-ab82-7742e51a4a92"
+
+
+@pytest.fixture
+def flow_json():
+    with (SCHEMA_DIR / "attack-flow-example.json").open() as example_file:
+        return json.load(example_file)
+
+
+def get_object(validator, obj_id):
+    for obj in validator.to_json()["objects"]:
+        if obj["id"] == obj_id:
+            return copy.deepcopy(obj)
+
+
+def messages(result):
+    return [str(m) for m in result.messages]
+
+
+def assert_matches_full_validation(validator):
+    """The incremental result matches validating the current bundle from scratch."""
+    expected = validate_json(validator.to_json())
+    assert sorted(messages(validator.validate())) == sorted(messages(expected))
+
+
+def test_incremental_validator(flow_json):
+    validator = IncrementalValidator(flow_json)
+    result = validator.validate()
+    assert result.success
+    assert len(result.messages) == 0
+    assert validator.to_json() == flow_json
+
+
+def test_add_disconnected_action(flow_json):
+    validator = IncrementalValidator(flow_json)
+    action = get_object(validator, ACTION_ID)
+    action["id"] = NEW_ACTION_ID
+    del action["technique_ref"]
+    del action["asset_refs"]
+    validator.add(action)
+    assert messages(validator.validate()) == [
+        f"[warning] Node id={NEW_ACTION_ID} is not connected to the main flow."
+    ]
+    assert_matches_full_validation(validator)
+
+    # Connect it to the flow.
+    condition = get_object(validator, CONDITION_ID)
+    condition["on_true_refs"].append(NEW_ACTION_ID)
+    validator.update(condition)
+    assert messages(validator.validate()) == []
+    assert_matches_full_validation(validator)
+
+    # Disconnect it again.
+    condition["on_true_refs"].remove(NEW_ACTION_ID)
+    validator.update(condition)
+    assert messages(validator.validate()) == [
+        f"[warning] Node id={NEW_ACTION_ID} is not connected to the main flow."
+    ]
+    assert_matches_full_validation(validator)
+
+
+def test_delete_action(flow_json):
+    validator = IncrementalValidator(flow_json)
+    validator.delete(ACTION_ID)
+    result = validator.validate()
+    assert result.success
+    assert (
+        f"[warning] Node id={ACTION_ID} is referenced in the flow but is not defined."
+        in messages(result)
+    )
+    assert_matches_full_validation(validator)
+
+
+def test_delete_flow(flow_json):
+    validator = IncrementalValidator(flow_json)
+    validator.delete(FLOW_ID)
+    result = validator.validate()
+    assert not result.success
+    assert (
+        "[error] The bundle must contain exactly one `attack-flow` object."
+        in messages(result)
+    )
+    assert_matches_full_validation(validator)
+
+
+def test_update_schema_and_stix_errors(flow_json):
+    validator = IncrementalValidator(flow_json)
+    action = get_object(validator, ACTION_ID)
+    original = copy.deepcopy(action)
+    action["asset_refs"].append(FLOW_ID)
+    validator.update(action)
+    result = validator.validate()
+    assert not result.success
+    assert messages(result)[-1].startswith(
+        "[error] Unable to parse this flow as STIX 2.1: "
+        "Invalid value for AttackAction 'asset_refs': "
+    )
+    assert_matches_full_validation(validator)
+
+    validator.update(original)
+    assert validator.validate().strict_success
+    assert validator.to_json() == flow_json
+
+
+def test_invalid_operations(flow_json):
+    validator = IncrementalValidator(flow_json)
+    with pytest.raises(ValueError):
+        validator.add(get_object(validator, ACTION_ID))
+    with pytest.raises(KeyError):
+        validator.delete(NEW_ACTION_ID)
+    action = get_object(validator, ACTION_ID)
+    action["id"] = NEW_ACTION_ID
+    with pytest.raises(KeyError):
+        validator.update(action)
+
+    flow_json["objects"].append(flow_json["objects"][-1])
+    with pytest.raises(ValueError):
+        IncrementalValidator(flow_json)
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+import attack_flow.jsonio
+from attack_flow.schema import SCHEMA_DIR
+
+EXAMPLE_FLOW = SCHEMA_DIR / "attack-flow-example.json"
+
+
+@pytest.fixture(
+    params=[
+        pytest.param(
+            "orjson",
+            marks=pytest.mark.skipif(
+                attack_flow.jsonio.orjson is None, reason="orjson is not installed"
+            ),
+        ),
+        "json",
+    ]
+)
+def backend(request):
+    previous = attack_flow.jsonio.get_backend()
+    attack_flow.jsonio.set_backend(request.param)
+    yield request.param
+    attack_flow.jsonio.set_backend(previous)
+
+
+def test_load_path(backend):
+    assert attack_flow.jsonio.load_path(EXAMPLE_FLOW) == json.loads(
+        EXAMPLE_FLOW.read_text()
+    )
+
+
+def test_load_path_invalid(backend, tmp_path):
+    empty = tmp_path / "empty.json"
+    empty.write_bytes(b"")
+    with pytest.raises(json.JSONDecodeError):
+        attack_flow.jsonio.load_path(empty)
+
+    truncated = tmp_path / "truncated.json"
+    truncated.write_bytes(b'{"type": "bundle"')
+    with pytest.raises(json.JSONDecodeError) as exc_info:
+        attack_flow.jsonio.load_path(truncated)
+    # The error is the same for both backends.
+    assert exc_info.value.pos == 17
+
+
+def test_loads_fallback(backend):
+    """Documents that orjson rejects are decoded by the standard library."""
+    assert attack_flow.jsonio.loads('{"n": NaN}')["n"] != 0
+    assert attack_flow.jsonio.loads(b'{"n": 18446744073709551616}') == {"n": 2**64}
+    assert attack_flow.jsonio.loads(memoryview(b"[1]")) == [1]
+
+
+def test_dumps(backend):
+    obj = {"name": "Flöw", "objects": [1, 2], "empty": {}}
+    expected = '{"name":"Flöw","objects":[1,2],"empty":{}}'
+    assert attack_flow.jsonio.dumps(obj) == expected
+    assert attack_flow.jsonio.dumps(obj, indent=2) == json.dumps(
+        obj, indent=2, ensure_ascii=False
+    )
+    assert attack_flow.jsonio.dumps(obj, indent=4) == json.dumps(
+        obj, indent=4, ensure_ascii=False
+    )
+    assert attack_flow.jsonio.dumps({"n": 2**64}) == '{"n":18446744073709551616}'
+    with pytest.raises(TypeError):
+        attack_flow.jsonio.dumps({"s": {1, 2}})
+
+
+def test_dump_path(backend, tmp_path):
+    path = tmp_path / "out.json"
+    attack_flow.jsonio.dump_path({"a": ["b"]}, path, indent=2)
+    assert json.loads(path.read_text()) == {"a": ["b"]}
+
+
+def test_set_backend():
+    with pytest.raises(ValueError):
+        attack_flow.jsonio.set_backend("simplejson")
@@ -0,0 +1,82 @@
+import io
+import json
+
+import pytest
+
+from attack_flow.jsonstream import iter_document
+
+DOCUMENT = {
+    "type": "bundle",
+    "id": "bundle--dd0c81fd-f196-4513-b3a9-cd84b41bc414",
+    "objects": [
+        {"type": "identity", "name": "Unit Test é", "score": -1.5e-3},
+        {"type": "note", "abstract": 'A "quoted" string', "object_refs": []},
+        12345678,
+        [True, False, None],
+    ],
+    "spec_version": 2.1,
+}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 1 << 16])
+def test_iter_document(chunk_size):
+    text = json.dumps(DOCUMENT, indent=2, ensure_ascii=False)
+    events = list(iter_document(io.StringIO(text), chunk_size=chunk_size))
+    assert events == [
+        ("member", "type", "bundle"),
+        ("member", "id", "bundle--dd0c81fd-f196-4513-b3a9-cd84b41bc414"),
+        ("array", "objects", None),
+        ("item", "objects", DOCUMENT["objects"][0]),
+        ("item", "objects", DOCUMENT["objects"][1]),
+        ("item", "objects", 12345678),
+        ("item", "objects", [True, False, None]),
+        ("member", "spec_version", 2.1),
+    ]
+
+
+def test_iter_document_empty():
+    assert list(iter_document(io.StringIO(" { } "))) == []
+    events = list(iter_document(io.StringIO('{"objects": []}')))
+    assert events == [("array", "objects", None)]
+
+
+def test_iter_document_objects_not_array():
+    events = list(iter_document(io.StringIO('{"objects": {"a": 1}}')))
+    assert events == [("member", "objects", {"a": 1})]
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "[]",
+        '{"objects": [1 2]}',
+        '{"objects": [{"a": }]}',
+        '{"type": "bundle"',
+        '{"type": "bundle"} []',
+        "{1: 2}",
+    ],
+)
+def test_iter_document_invalid(text):
+    with pytest.raises(ValueError):
+        list(iter_document(io.StringIO(text), chunk_size=4))
+
+
+class _CountingReader(io.StringIO):
+    def __init__(self, text):
+        super().__init__(text)
+        self.chars_read = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.chars_read += len(chunk)
+        return chunk
+
+
+@pytest.mark.parametrize("bad_item", ['{"a": }', '{"a": "b\n"}', '{"a" 1}'])
+def test_iter_document_invalid_stops_early(bad_item):
+    """An error in the middle of the buffer does not read the rest of the file."""
+    tail = ", ".join(['{"type": "note"}'] * 100_000)
+    fp = _CountingReader(f'{{"objects": [{bad_item}, {tail}]}}')
+    with pytest.raises(ValueError):
+        list(iter_document(fp, chunk_size=1024))
+    assert fp.chars_read <= 4096
@@ -0,0 +1,154 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from attack_flow.kernels import FeatureMatrix, extract_features, wl_features
+from .fixtures import get_flow_bundle
+
+FLOW_PATHS = [
+    Path("tests/fixtures/flow1.json"),
+    Path("tests/fixtures/flow2.json"),
+    Path("corpus/WhisperGate.afb"),
+]
+
+
+def _fan_out(prefix, count, operator=None):
+    """A flow where one action leads to ``count`` actions, maybe through an operator."""
+    first = {"type": "attack-action", "id": f"attack-action--{prefix}0"}
+    targets = [
+        {"type": "attack-action", "id": f"attack-action--{prefix}{i + 1}"}
+        for i in range(count)
+    ]
+    objects = [first] + targets
+    refs = [target["id"] for target in targets]
+    if operator:
+        objects.append(
+            {
+                "type": "attack-operator",
+                "id": f"attack-operator--{prefix}",
+                "operator": operator,
+                "effect_refs": refs,
+            }
+        )
+        refs = [objects[-1]["id"]]
+    first["effect_refs"] = refs
+    return {"type": "bundle", "objects": objects}
+
+
+def _chain(prefix, count):
+    objects = [
+        {"type": "attack-action", "id": f"attack-action--{prefix}{i}"}
+        for i in range(count)
+    ]
+    for source, target in zip(objects, objects[1:]):
+        source["effect_refs"] = [target["id"]]
+    return {"type": "bundle", "objects": objects}
+
+
+def test_wl_features():
+    features = wl_features(get_flow_bundle(), iterations=0)
+    assert features["attack-action:T1"] == 1
+    assert features["attack-action:"] == 1
+    assert features["attack-operator:OR"] == 1
+    assert features["attack-condition"] == 1
+    assert sum(features.values()) == 11
+
+    deeper = wl_features(get_flow_bundle(), iterations=2)
+    assert sum(deeper.values()) == 33
+    assert {k: v for k, v in deeper.items() if k in features} == features
+
+    # Features depend on the shape of the flow, not on its IDs.
+    assert wl_features(_fan_out("a", 3)) == wl_features(_fan_out("b", 3))
+    assert wl_features(_fan_out("a", 3)) != wl_features(_fan_out("a", 3, "AND"))
+    assert wl_features(_fan_out("a", 3, "AND")) != wl_features(_fan_out("a", 3, "OR"))
+
+
+def test_edge_labels():
+    forward = _chain("a", 2)
+    relationship = _chain("a", 1)
+    relationship["objects"].append({"type": "attack-action", "id": "attack-action--a1"})
+    relationship["objects"].append(
+        {
+            "type": "relationship",
+            "id": "relationship--1",
+            "relationship_type": "related-to",
+            "source_ref": "attack-action--a0",
+            "target_ref": "attack-action--a1",
+        }
+    )
+    assert wl_features(forward, 0) == wl_features(relationship, 0)
+    assert wl_features(forward, 1) != wl_features(relationship, 1)
+
+
+def test_kernels_and_clusters():
+    names = ["fan1", "fan2", "and1", "and2", "chain1", "chain2"]
+    bundles = [
+        _fan_out("a", 4),
+        _fan_out("b", 4),
+        _fan_out("c", 4, "AND"),
+        _fan_out("d", 4, "AND"),
+        _chain("e", 5),
+        _chain("f", 6),
+    ]
+    matrix = FeatureMatrix.from_features(names, [wl_features(b) for b in bundles])
+    assert len(matrix) == 6
+    assert matrix.kernel("and1", "and2") == pytest.approx(1.0)
+    assert matrix.kernel("chain1", "chain2") > matrix.kernel("chain1", "fan1")
+    assert matrix.kernel("fan1", "fan1", normalize=False) == sum(
+        count * count for count in matrix.row("fan1").values()
+    )
+
+    kernel = matrix.kernel_matrix()
+    batches = list(matrix.iter_kernel_batches(batch_size=4))
+    assert [start for start, _ in batches] == [0, 4]
+    assert [list(row) for _, rows in batches for row in rows] == [
+        list(row) for row in kernel
+    ]
+    for i, name in enumerate(names):
+        for j, other in enumerate(names):
+            assert kernel[i][j] == pytest.approx(matrix.kernel(name, other))
+
+    assert matrix.cluster(threshold=0.9) == [
+        ["fan1", "fan2"],
+        ["and1", "and2"],
+        ["chain1", "chain2"],
+    ]
+    assert matrix.cluster(threshold=1.01) == [[name] for name in names]
+    assert matrix.cluster(threshold=0.0) == [names]
+
+
+def test_save_and_load(tmp_path):
+    features = [{"x": 1, "y": 2}, {"y": 3, "z": 4}]
+    matrix = FeatureMatrix.from_features(["a", "b"], features)
+    assert matrix.nnz == 4
+    assert matrix.features == ["x", "y", "z"]
+    matrix_path = tmp_path / "features.json"
+    matrix.save(matrix_path)
+
+    loaded = FeatureMatrix.load(matrix_path)
+    assert loaded.names == ["a", "b"]
+    assert loaded.row("b") == {"y": 3, "z": 4}
+    assert loaded.kernel("a", "b", normalize=False) == 6.0
+
+    matrix_path.write_text('{"format": 0}')
+    with pytest.raises(ValueError):
+        FeatureMatrix.load(matrix_path)
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_extract_features(jobs, tmp_path):
+    cache_dir = tmp_path / "cache"
+    matrix = extract_features(FLOW_PATHS, jobs=jobs, cache_dir=cache_dir)
+    assert matrix.names == [os.path.abspath(path) for path in FLOW_PATHS]
+    assert len(list(cache_dir.glob("*.features.json"))) == len(FLOW_PATHS)
+
+    cached = extract_features(FLOW_PATHS, cache_dir=cache_dir)
+    uncached = extract_features(FLOW_PATHS)
+    for result in (cached, uncached):
+        assert result.features == matrix.features
+        assert result.values == matrix.values
+
+    # Different parameters are cached separately.
+    extract_features(FLOW_PATHS[:1], iterations=1, cache_dir=cache_dir)
+    assert len(list(cache_dir.glob("*.features.json"))) == len(FLOW_PATHS) + 1
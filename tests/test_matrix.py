@@ -7,6 +7,7 @@ import stix2
 import attack_flow.matrix
 from attack_flow.model import (
     AttackAction,
+    AttackAsset,
     AttackFlow,
 )
 
@@ -97,6 +98,55 @@ def test_graph_is_missing_node(caplog):
     )
 
 
+def test_actions_connected_through_asset():
+    """
+    Two actions that are connected through an asset, rather than by an effect, are
+    still connected by an arrow.
+    """
+    svg_base_path = Path("tests/fixtures/matrix-base.svg")
+
+    action2 = AttackAction(
+        id="attack-action--3f3a1b4e-6b1d-4e5c-9a51-0b4f3a0e6a02",
+        technique_id="T1204",
+        name="Action 2",
+    )
+    asset = AttackAsset(
+        id="attack-asset--9c2b7d1e-2f3a-4b5c-8d6e-7f8a9b0c1d2e",
+        name="Asset",
+    )
+    relationship = stix2.Relationship(
+        id="relationship--5b1d2c3e-4f5a-4b6c-9d7e-8f9a0b1c2d3e",
+        source_ref=asset.id,
+        target_ref=action2.id,
+        relationship_type="related-to",
+    )
+    action1 = AttackAction(
+        id="attack-action--3f3a1b4e-6b1d-4e5c-9a51-0b4f3a0e6a01",
+        technique_id="T1566",
+        name="Action 1",
+        asset_refs=[asset.id],
+    )
+    flow = AttackFlow(
+        id="attack-flow--7cabcb58-6930-47b9-b15c-3be2f3a5fce1",
+        name="My Flow",
+        start_refs=[action1.id],
+    )
+    flow_bundle = stix2.Bundle(
+        flow,
+        action1,
+        asset,
+        action2,
+        relationship,
+        id="bundle--06cf9129-8d0d-4d58-9484-b5323caf09ad",
+    )
+
+    svg_output = BytesIO()
+    with svg_base_path.open() as svg_base:
+        attack_flow.matrix.render(svg_base, flow_bundle, svg_output)
+
+    assert b'class="overlay T1566-T1204"' in svg_output.getvalue()
+
+
 def test_svg_is_missing_technique_id(caplog):
     """
     The flow references a technique ID that does not exist in the SVG.
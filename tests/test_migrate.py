@@ -0,0 +1,109 @@
+import json
+from pathlib import Path
+import runpy
+import shutil
+import sys
+from unittest.mock import patch
+
+import pytest
+
+import attack_flow.afb
+import attack_flow.migrate
+
+CORPUS_PATHS = [
+    Path("corpus/Example Attack Tree.afb"),
+    Path("corpus/Conti PWC.afb"),
+    Path("corpus/SearchAwesome Adware.afb"),
+]
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """A directory of v2 files, with one in a subdirectory."""
+    shutil.copy(CORPUS_PATHS[0], tmp_path)
+    shutil.copy(CORPUS_PATHS[1], tmp_path)
+    (tmp_path / "nested").mkdir()
+    shutil.copy(CORPUS_PATHS[2], tmp_path / "nested")
+    return tmp_path
+
+
+def test_find_files(archive):
+    backup = archive / "old.afb-v2"
+    backup.write_text("{}")
+    found = attack_flow.migrate.find_files([archive, backup])
+    assert found == [
+        archive / CORPUS_PATHS[1].name,
+        archive / CORPUS_PATHS[0].name,
+        archive / "nested" / CORPUS_PATHS[2].name,
+        backup,
+    ]
+
+
+def test_upgrade_file(archive):
+    path = archive / CORPUS_PATHS[0].name
+    original = path.read_bytes()
+    result = attack_flow.migrate.upgrade_file(path)
+    assert result.status == "upgraded"
+    assert result.output_path == path
+    assert result.backup_path == path.with_suffix(".afb-v2")
+    assert result.seconds > 0
+    assert result.backup_path.read_bytes() == original
+    upgraded = json.loads(path.read_text())
+    assert upgraded == attack_flow.afb.upgrade_v2(json.loads(original))
+    assert path.read_text().startswith('{\n    "schema": "attack_flow_v2",')
+    assert not list(archive.glob("*.tmp"))
+
+    # Upgraded files are not upgraded again.
+    result = attack_flow.migrate.upgrade_file(path)
+    assert result.status == "skipped"
+    assert json.loads(path.read_text()) == upgraded
+
+
+def test_upgrade_backup(archive):
+    path = archive / CORPUS_PATHS[0].name
+    backup_path = path.with_suffix(".afb-v2")
+    path.rename(backup_path)
+    result = attack_flow.migrate.upgrade_file(backup_path)
+    assert result.status == "upgraded"
+    assert result.output_path == path
+    assert result.backup_path is None
+    assert attack_flow.afb.is_legacy_v2(json.loads(backup_path.read_text()))
+
+
+def test_upgrade_no_backup(archive):
+    path = archive / CORPUS_PATHS[0].name
+    result = attack_flow.migrate.upgrade_file(path, backup=False)
+    assert result.status == "upgraded"
+    assert not path.with_suffix(".afb-v2").exists()
+
+
+def test_upgrade_fail(tmp_path):
+    path = tmp_path / "bad.afb"
+    path.write_text('{"version": "2.0.1", "objects": []}')
+    result = attack_flow.migrate.upgrade_file(path)
+    assert result.status == "failed"
+    assert "Malformed Attack Flow V2 file" in result.error
+    assert json.loads(path.read_text()) == {"version": "2.0.1", "objects": []}
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_upgrade_files(archive, jobs):
+    paths = attack_flow.migrate.find_files([archive])
+    results = list(attack_flow.migrate.upgrade_files(paths, jobs=jobs))
+    assert [result.path for result in results] == paths
+    assert {result.status for result in results} == {"upgraded"}
+
+
+@patch("sys.exit")
+def test_cli_upgrade_v2(exit_mock, archive, capsys):
+    bad_path = archive / "bad.afb"
+    bad_path.write_text("not json")
+    sys.argv = ["af", "upgrade-v2", "-j", "2", str(archive)]
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    captured = capsys.readouterr()
+    path = archive / CORPUS_PATHS[0].name
+    assert f"{path} -> {path} (" in captured.out
+    assert f"{bad_path}: FAIL" in captured.out
+    assert "Upgraded 3 files in" in captured.out
+    assert "(0 skipped, 1 failed)" in captured.out
+    exit_mock.assert_called_with(1)
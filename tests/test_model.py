@@ -7,6 +7,9 @@ import pytest
 import stix2
 
 import attack_flow.model
+from attack_flow.schema import SCHEMA_DIR
+
+EXAMPLE_FLOW = SCHEMA_DIR / "attack-flow-example.json"
 
 
 def test_load_attack_flow_bundle():
@@ -34,6 +37,29 @@ def test_load_attack_flow_bundle():
         assert flow_bundle.id == "bundle--3b210ed6-4aac-4620-9e75-79a9b7ae99c5"
 
 
+def test_parse_attack_flow_bundle():
+    bundle_json = {
+        "type": "bundle",
+        "id": "bundle--3b210ed6-4aac-4620-9e75-79a9b7ae99c5",
+        "objects": [
+            {
+                "type": "attack-flow",
+                "spec_version": "2.1",
+                "id": "attack-flow--77694729-3848-4261-a294-889837d58460",
+                "name": "Test Flow",
+            }
+        ],
+    }
+    flow_bundle = attack_flow.model.parse_attack_flow_bundle(bundle_json)
+    assert flow_bundle.objects[0].name == "Test Flow"
+    assert bundle_json["objects"][0] == {
+        "type": "attack-flow",
+        "spec_version": "2.1",
+        "id": "attack-flow--77694729-3848-4261-a294-889837d58460",
+        "name": "Test Flow",
+    }
+
+
 def test_confidence_label_to_num():
     assert attack_flow.model.confidence_label_to_num("Speculation") == 0
     assert attack_flow.model.confidence_label_to_num("Even Odds") == 50
@@ -67,3 +93,63 @@ def test_get_flow_object():
     )
     flow = attack_flow.model.get_flow_object(bundle)
     assert flow.id == "attack-flow--0c545a6f-3da2-4fa8-9789-68fd98257d10"
+
+
+def test_indexed_bundle():
+    bundle = attack_flow.model.load_attack_flow_bundle(EXAMPLE_FLOW)
+    indexed = attack_flow.model.index_bundle(bundle)
+    assert attack_flow.model.index_bundle(indexed) is indexed
+    assert indexed.id == bundle.id
+    assert indexed["type"] == "bundle"
+    assert indexed.objects is bundle.objects
+
+    for obj in bundle.objects:
+        assert indexed.get_obj(obj.id) == bundle.get_obj(obj.id)
+    with pytest.raises(KeyError):
+        indexed.get_obj("attack-action--00000000-0000-0000-0000-000000000000")
+
+    actions = [obj for obj in bundle.objects if obj.type == "attack-action"]
+    assert indexed.get_objs_by_type("attack-action") == actions
+    assert indexed.get_objs_by_type("not-a-type") == []
+
+    flow = attack_flow.model.get_flow_object(indexed)
+    assert flow == attack_flow.model.get_flow_object(bundle)
+    # The reference index is only built when it is first needed.
+    assert indexed._referrers is None
+    for ref in flow.start_refs:
+        assert (flow.id, "start_refs") in indexed.get_referrers(ref)
+
+
+def test_indexed_bundle_referrers():
+    relationship = stix2.Relationship(
+        id="relationship--d6b8a6a4-1f2a-4ebc-9f4c-aa3e11cc8fb5",
+        source_ref="attack-action--37345417-8d21-4d0e-8e38-3b1d6f3a2a2a",
+        target_ref="attack-asset--f8a1c9e2-6d3c-4b4e-b8a6-7b4e52a4d1d4",
+        relationship_type="related-to",
+    )
+    indexed = attack_flow.model.index_bundle(stix2.Bundle(relationship))
+    assert indexed.get_referrers(relationship.source_ref) == [
+        (relationship.id, "source_ref")
+    ]
+    assert indexed.get_referrers(relationship.target_ref) == [
+        (relationship.id, "target_ref")
+    ]
+    assert indexed.get_referrers(relationship.id) == []
+
+
+def test_indexed_bundle_viz_ignored_ids():
+    bundle = attack_flow.model.load_attack_flow_bundle(EXAMPLE_FLOW)
+    indexed = attack_flow.model.index_bundle(bundle)
+    ignored = attack_flow.model.get_viz_ignored_ids(indexed)
+    assert ignored == attack_flow.model.get_viz_ignored_ids(bundle)
+    assert attack_flow.model.get_viz_ignored_ids(indexed) is ignored
+
+
+def test_indexed_record_bundle():
+    import attack_flow.records
+
+    records = attack_flow.records.load_bundle(EXAMPLE_FLOW)
+    indexed = attack_flow.model.index_bundle(records)
+    flow = attack_flow.model.get_flow_object(indexed)
+    assert flow.type == "attack-flow"
+    assert indexed.get_obj(flow.id) == [flow]
@@ -0,0 +1,151 @@
+import math
+from pathlib import Path
+
+import pytest
+
+import attack_flow.model
+from attack_flow.paths import PathEngine, confidence_weight
+from .fixtures import get_flow_bundle
+
+ACTION1 = "attack-action--52f2c35a-fa2a-45a4-b84c-46ad9498071f"
+ACTION2 = "attack-action--dd3820fa-bae3-4270-8000-5c4642fa780c"
+ACTION3 = "attack-action--a0847849-a533-4b1f-a94a-720bbd25fc17"
+ACTION4 = "attack-action--7ddab166-c83e-4c79-a701-a0dc2a905dd3"
+CONDITION = "attack-condition--64d5bf0b-6acc-4f43-b0f2-aa93a219897a"
+OPERATOR = "attack-operator--8932b181-be87-4f81-851a-ab0b4288406a"
+
+
+def _action(action_id, confidence, *effects):
+    return {
+        "type": "attack-action",
+        "id": f"attack-action--{action_id}",
+        "confidence": confidence,
+        "effect_refs": [f"attack-action--{effect}" for effect in effects],
+    }
+
+
+def _diamonds(count):
+    """A chain of actions where each one is followed by one of two actions."""
+    flow = {"type": "attack-flow", "id": "attack-flow--1"}
+    objects = [dict(flow, start_refs=["attack-action--s0"])]
+    for i in range(count):
+        following = [f"s{i + 1}"] if i < count - 1 else []
+        objects.append(
+            {
+                "type": "attack-action",
+                "id": f"attack-action--s{i}",
+                "effect_refs": [f"attack-condition--c{i}"],
+            }
+        )
+        objects.append(
+            {
+                "type": "attack-condition",
+                "id": f"attack-condition--c{i}",
+                "on_true_refs": [f"attack-action--a{i}"],
+                "on_false_refs": [f"attack-action--b{i}"],
+            }
+        )
+        objects.append(_action(f"a{i}", 80, *following))
+        objects.append(_action(f"b{i}", 60, *following))
+    return {"type": "bundle", "objects": objects}
+
+
+def test_iter_paths():
+    engine = PathEngine.from_bundle(get_flow_bundle())
+    assert engine.start_refs == [ACTION1]
+    assert engine.terminal_refs == [ACTION2, ACTION3, ACTION4]
+    assert list(engine.iter_paths()) == [
+        (ACTION1, CONDITION, OPERATOR, ACTION2),
+        (ACTION1, CONDITION, OPERATOR, ACTION3),
+        (ACTION1, CONDITION, ACTION4),
+    ]
+    assert engine.count_paths() == 3
+    assert list(engine.iter_paths(max_length=3)) == [(ACTION1, CONDITION, ACTION4)]
+    assert engine.count_paths(max_length=3) == 1
+    assert len(list(engine.iter_paths(max_paths=2))) == 2
+    assert list(engine.iter_paths(max_length=2)) == []
+
+    engine = PathEngine.from_bundle(get_flow_bundle(), start_refs=[OPERATOR])
+    assert list(engine.iter_paths()) == [(OPERATOR, ACTION2), (OPERATOR, ACTION3)]
+
+
+def test_paths_are_lazy():
+    engine = PathEngine.from_bundle(_diamonds(200))
+    assert engine.count_paths(max_length=1000) == 2**200
+    assert engine.count_paths() == 0
+    paths = engine.iter_paths(max_length=1000)
+    first = next(paths)
+    assert len(first) == 600
+    assert first[-1] == "attack-action--a199"
+    assert next(paths)[-1] == "attack-action--b199"
+
+
+def test_k_shortest_paths():
+    engine = PathEngine.from_bundle(_diamonds(3))
+    results = list(engine.k_shortest_paths(k=3))
+    weights = [weight for weight, _ in results]
+    assert weights == sorted(weights)
+    assert weights[0] == pytest.approx(-3 * math.log(0.8) - 3 * math.log(0.95))
+    # The next most likely paths take one of the less likely branches.
+    branches = [sum("--b" in node for node in path) for _, path in results]
+    assert branches == [0, 1, 1]
+    assert results[0][1][1::3] == tuple(f"attack-condition--c{i}" for i in range(3))
+    assert len(list(engine.k_shortest_paths(k=100))) == 8
+    assert list(engine.k_shortest_paths(k=100, max_length=8)) == []
+
+    # All paths go through an action that certainly did not happen.
+    bundle = _diamonds(3)
+    bundle["objects"][1]["confidence"] = 0
+    assert list(PathEngine.from_bundle(bundle).k_shortest_paths()) == []
+
+
+def test_cycles():
+    bundle = {
+        "type": "bundle",
+        "objects": [
+            _action("1", 100, "2"),
+            _action("2", 100, "3", "4"),
+            _action("3", 100, "2", "3"),
+            _action("4", 100),
+        ],
+    }
+    engine = PathEngine.from_bundle(bundle)
+    expected = [
+        ("attack-action--1", "attack-action--2", "attack-action--4"),
+    ]
+    assert list(engine.iter_paths()) == expected
+    assert engine.count_paths() == 1
+    assert [path for _, path in engine.k_shortest_paths()] == expected
+
+    engine = PathEngine.from_bundle(bundle, start_refs=["attack-action--3"])
+    assert list(engine.iter_paths()) == [
+        ("attack-action--3", "attack-action--2", "attack-action--4")
+    ]
+
+
+def test_matches_corpus_enumeration():
+    bundle = attack_flow.model.load_attack_flow_bundle(
+        Path("corpus/Maastricht University Ransomware.afb")
+    )
+    engine = PathEngine.from_bundle(bundle)
+    paths = list(engine.iter_paths())
+    assert len(paths) == len(set(paths)) == engine.count_paths()
+    assert all(path[0] in engine.start_refs for path in paths)
+    assert all(path[-1] in engine.terminal_refs for path in paths)
+
+    by_weight = sorted(
+        sum(confidence_weight(bundle.get_obj(node_id)[0]) for node_id in path)
+        for path in paths
+    )
+    shortest = [weight for weight, _ in engine.k_shortest_paths(k=len(paths))]
+    assert shortest == pytest.approx(by_weight)
+
+
+def test_confidence_weight():
+    assert confidence_weight(None) == 0.0
+    assert confidence_weight({"type": "attack-operator"}) == 0.0
+    assert confidence_weight({"type": "attack-action"}) == -math.log(0.95)
+    assert confidence_weight({"type": "attack-action", "confidence": 100}) == 0.0
+    assert confidence_weight({"type": "attack-action", "confidence": 0}) == math.inf
+    with pytest.raises(ValueError):
+        confidence_weight({"type": "attack-action", "confidence": 101})
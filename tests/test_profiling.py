@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+import attack_flow.profiling
+import attack_flow.schema
+from attack_flow.schema import SCHEMA_DIR
+
+
+@pytest.fixture
+def profile():
+    attack_flow.profiling.start()
+    yield
+    if attack_flow.profiling._active is not None:
+        attack_flow.profiling.stop()
+
+
+def test_inactive():
+    assert attack_flow.profiling._active is None
+    with attack_flow.profiling.span("nothing"):
+        attack_flow.profiling.count("nothing")
+    with pytest.raises(RuntimeError):
+        attack_flow.profiling.stop()
+
+
+def test_spans_and_counters(profile):
+    span = attack_flow.profiling.span
+    with span("outer"):
+        for _ in range(3):
+            with span("inner"):
+                attack_flow.profiling.count("items", 2)
+        with span("other"):
+            pass
+    with span("inner"):
+        pass
+    attack_flow.profiling.count("things")
+    profile = attack_flow.profiling.stop()
+
+    assert [(s["name"], s["depth"], s["calls"]) for s in profile.spans] == [
+        ("outer", 0, 1),
+        ("inner", 1, 3),
+        ("other", 1, 1),
+        ("inner", 0, 1),
+    ]
+    outer, inner = profile.spans[:2]
+    assert outer["duration_ms"] >= inner["duration_ms"] >= 0
+    assert "peak_bytes" not in outer
+    assert profile.counters == {"items": 6, "things": 1}
+
+    lines = [json.loads(line) for line in profile.iter_json_lines()]
+    assert lines[0] == {"type": "span", **outer}
+    assert lines[-1] == {"type": "counter", "name": "things", "value": 1}
+
+    text = profile.to_text()
+    assert text.startswith("Profile:\n  outer")
+    assert "3 calls" in text
+    assert "Counters:\n  items" in text
+
+
+def test_already_started(profile):
+    with pytest.raises(RuntimeError):
+        attack_flow.profiling.start()
+
+
+def test_memory():
+    attack_flow.profiling.start(memory=True)
+    with attack_flow.profiling.span("outer"):
+        with attack_flow.profiling.span("allocate"):
+            data = bytearray(4 * 1024 * 1024)
+            del data
+        with attack_flow.profiling.span("small"):
+            pass
+    profile = attack_flow.profiling.stop()
+    outer, allocate, small = profile.spans
+    assert allocate["peak_bytes"] >= 4 * 1024 * 1024
+    assert small["peak_bytes"] < 1024 * 1024
+    assert outer["peak_bytes"] >= allocate["peak_bytes"]
+    assert "MiB peak" in profile.to_text()
+
+
+def test_stop_closes_open_spans(profile):
+    attack_flow.profiling.span("unfinished").__enter__()
+    profile = attack_flow.profiling.stop()
+    assert profile.spans[0]["duration_ms"] >= 0
+
+
+def test_validate_doc_stages(profile):
+    attack_flow.schema.validate_doc(SCHEMA_DIR / "attack-flow-example.json")
+    profile = attack_flow.profiling.stop()
+    names = [s["name"] for s in profile.spans]
+    assert names == [
+        "json.decode",
+        "check_objects",
+        "check_schema",
+        "stix2.parse",
+        "graph.build",
+        "check_graph",
+    ]
+    assert profile.counters == {"objects": 20, "graph.nodes": 21, "graph.edges": 25}
@@ -0,0 +1,193 @@
+import copy
+from datetime import datetime, timezone
+import json
+from pathlib import Path
+import pickle
+
+import pytest
+
+import attack_flow.afb
+import attack_flow.graph
+import attack_flow.graphviz
+import attack_flow.mermaid
+import attack_flow.model
+import attack_flow.records
+from attack_flow.schema import SCHEMA_DIR
+
+FLOW_PATHS = [
+    SCHEMA_DIR / "attack-flow-example.json",
+    Path("tests/fixtures/flow1.json"),
+    Path("tests/fixtures/flow2.json"),
+    Path("tests/fixtures/matrix-flow.json"),
+]
+CORPUS_PATHS = sorted(Path("corpus").glob("*.afb"))
+
+
+@pytest.mark.parametrize("flow_path", FLOW_PATHS, ids=lambda p: p.name)
+def test_matches_stix2(flow_path):
+    """Records are interchangeable with stix2 objects for the visualizers."""
+    stix_bundle = attack_flow.model.load_attack_flow_bundle(flow_path)
+    record_bundle = attack_flow.records.load_bundle(flow_path)
+
+    assert len(record_bundle.objects) == len(stix_bundle.objects)
+    for stix_obj, record in zip(stix_bundle.objects, record_bundle.objects):
+        assert list(record.keys()) == list(stix_obj.keys())
+        for key, value in stix_obj.items():
+            assert record[key] == value
+
+    assert attack_flow.graphviz.convert(record_bundle) == attack_flow.graphviz.convert(
+        stix_bundle
+    )
+    assert attack_flow.mermaid.convert(record_bundle) == attack_flow.mermaid.convert(
+        stix_bundle
+    )
+    stix_graph = attack_flow.graph.bundle_to_networkx(stix_bundle)
+    record_graph = attack_flow.graph.bundle_to_networkx(record_bundle)
+    assert list(record_graph.nodes) == list(stix_graph.nodes)
+    assert list(record_graph.edges(data=True)) == list(stix_graph.edges(data=True))
+
+
+def test_nested_values_render_like_stix2():
+    """Nested values, like registry key values and hashes, render like stix2's."""
+    with Path("tests/fixtures/flow1.json").open() as flow_file:
+        bundle_json = json.load(flow_file)
+    bundle_json["objects"].extend(
+        [
+            {
+                "type": "windows-registry-key",
+                "spec_version": "2.1",
+                "id": "windows-registry-key--2ba37ae7-2745-5082-9dfd-9486dad41016",
+                "key": "HKEY_LOCAL_MACHINE\\System\\Foo\\Bar",
+                "values": [{"name": "Foo", "data": "qwerty", "data_type": "REG_SZ"}],
+            },
+            {
+                "type": "file",
+                "spec_version": "2.1",
+                "id": "file--5a27d487-c542-5f97-a131-a8866b477b46",
+                "name": "payload.exe",
+                "hashes": {"sha256": "a" * 64},
+            },
+        ]
+    )
+    stix_bundle = attack_flow.model.parse_attack_flow_bundle(bundle_json)
+    record_bundle = attack_flow.records.parse_bundle(bundle_json)
+    for stix_obj, record in zip(stix_bundle.objects, record_bundle.objects):
+        for key, value in stix_obj.items():
+            assert str(record[key]) == str(value)
+    assert attack_flow.graphviz.convert(record_bundle) == attack_flow.graphviz.convert(
+        stix_bundle
+    )
+    assert attack_flow.mermaid.convert(record_bundle) == attack_flow.mermaid.convert(
+        stix_bundle
+    )
+
+
+@pytest.mark.parametrize("afb_path", CORPUS_PATHS, ids=lambda p: p.stem)
+def test_corpus_renders_like_stix2(afb_path):
+    """Every corpus flow renders the same from records as from stix2 objects."""
+    # Export once, since the export stamps the flow with the current time.
+    bundle_json = attack_flow.afb.load_afb_bundle(afb_path)
+    stix_bundle = attack_flow.model.parse_attack_flow_bundle(bundle_json)
+    record_bundle = attack_flow.records.parse_bundle(bundle_json)
+    for stix_obj, record in zip(stix_bundle.objects, record_bundle.objects):
+        for key, value in stix_obj.items():
+            assert str(record[key]) == str(value)
+    assert attack_flow.graphviz.convert(record_bundle) == attack_flow.graphviz.convert(
+        stix_bundle
+    )
+    assert attack_flow.mermaid.convert(record_bundle) == attack_flow.mermaid.convert(
+        stix_bundle
+    )
+
+
+def test_attack_flow_record():
+    action = attack_flow.records.make_record(
+        {
+            "type": "attack-action",
+            "id": "attack-action--37345417-3ee0-4e11-b421-1d4be68e6f15",
+            "spec_version": "2.1",
+            "created": "2022-08-02T19:34:35.143Z",
+            "modified": "2022-08-02T19:34:35Z",
+            "name": "Action",
+            "x_custom": "custom value",
+            "asset_refs": [],
+            "description": None,
+        }
+    )
+    assert isinstance(action, attack_flow.records.AttackAction)
+    assert not hasattr(action, "__dict__")
+    assert action.name == action["name"] == action.get("name") == "Action"
+    assert action.x_custom == action["x_custom"] == "custom value"
+    assert action.created == datetime(2022, 8, 2, 19, 34, 35, 143000, timezone.utc)
+    assert str(action.modified) == "2022-08-02 19:34:35+00:00"
+    # Like stix2, defaults are filled in, empty properties are dropped, and custom
+    # properties come last.
+    assert action.revoked is False
+    assert list(action.keys()) == [
+        "type",
+        "spec_version",
+        "id",
+        "created",
+        "modified",
+        "name",
+        "revoked",
+        "x_custom",
+    ]
+    assert "name" in action
+    assert "asset_refs" not in action
+    assert action.get("asset_refs", []) == []
+    with pytest.raises(AttributeError):
+        action.asset_refs
+    with pytest.raises(KeyError):
+        action["description"]
+    with pytest.raises(AttributeError):
+        action.nonexistent
+
+
+def test_generic_record():
+    identity = attack_flow.records.make_record(
+        {
+            "type": "identity",
+            "id": "identity--bbe39bd7-9c12-41de-b5c0-dcd3fb98b360",
+            "name": "Someone",
+            "identity_class": "individual",
+            "created": "2022-08-02T19:34:35.143Z",
+        }
+    )
+    assert type(identity) is attack_flow.records.Record
+    assert identity.name == "Someone"
+    assert isinstance(identity.created, datetime)
+    assert list(identity.keys()) == [
+        "type",
+        "spec_version",
+        "id",
+        "created",
+        "name",
+        "identity_class",
+        "revoked",
+    ]
+    with pytest.raises(AttributeError):
+        identity.contact_information
+
+    unknown = attack_flow.records.make_record({"type": "x-unknown", "b": 1, "a": 2})
+    assert list(unknown.keys()) == ["a", "b", "type"]
+
+
+def test_record_bundle():
+    bundle = attack_flow.records.load_bundle(SCHEMA_DIR / "attack-flow-example.json")
+    flow = attack_flow.model.get_flow_object(bundle)
+    assert isinstance(flow, attack_flow.records.AttackFlow)
+    author = bundle.get_obj(flow.created_by_ref)[0]
+    assert author.id == flow.created_by_ref
+    with pytest.raises(KeyError):
+        bundle.get_obj("identity--00000000-0000-4000-8000-000000000000")
+    assert bundle.get("objects") is bundle.objects
+    assert bundle["type"] == "bundle"
+
+
+def test_copy_and_pickle():
+    bundle = attack_flow.records.load_bundle(SCHEMA_DIR / "attack-flow-example.json")
+    for restored in (copy.deepcopy(bundle), pickle.loads(pickle.dumps(bundle))):
+        for original, record in zip(bundle.objects, restored.objects):
+            assert type(record) is type(original)
+            assert record.items() == original.items()
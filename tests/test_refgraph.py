@@ -0,0 +1,70 @@
+import attack_flow.graph
+from attack_flow.refgraph import ReferenceGraph
+from .fixtures import get_flow_bundle
+
+FLOW = "attack-flow--7cabcb58-6930-47b9-b15c-3be2f3a5fce1"
+EXTENSION = "extension-definition--fb9c968a-745b-4ade-9b25-c324172197f4"
+CREATOR = "identity--d673f8cb-c168-42da-8ed4-0cb26725f86c"
+
+
+def test_from_bundle():
+    flow_bundle = get_flow_bundle()
+    graph = ReferenceGraph.from_bundle(flow_bundle)
+    graph.remove_extension_nodes()
+    nx_graph = attack_flow.graph.bundle_to_networkx(flow_bundle)
+
+    assert len(graph) == len(nx_graph.nodes)
+    for node in nx_graph.nodes:
+        assert node in graph
+    assert "relationship--5286c903-9afc-4e29-ab42-644976d3aae7" not in graph
+    assert graph.get_attrs(FLOW)["type"] == "attack-flow"
+    assert graph.nodes_with_prefix("attack-flow--") == [FLOW]
+
+
+def test_analyze():
+    graph = ReferenceGraph()
+    graph.add_node(FLOW, {"type": "attack-flow"})
+    graph.add_node("attack-action--1", {"type": "attack-action"})
+    graph.add_node("attack-action--2", {"type": "attack-action"})
+    graph.add_node("attack-action--3", {"type": "attack-action"})
+    graph.add_edge(FLOW, "attack-action--1")
+    # Edges are undirected for connectivity.
+    graph.add_edge("attack-action--2", "attack-action--1")
+    graph.add_edge("attack-action--3", "attack-asset--4")
+    graph.add_edge("attack-action--1", "attack-condition--5")
+
+    disconnected, dangling = graph.analyze(("attack-flow",), ("attack-condition",))
+    assert disconnected == ["attack-action--3", "attack-asset--4"]
+    assert dangling == ["attack-condition--5"]
+    assert graph.get_attrs("attack-condition--5") == {}
+
+
+def test_analyze_order():
+    """Defined nodes come before undefined nodes, even if referenced first."""
+    graph = ReferenceGraph()
+    graph.add_edge("attack-action--1", "attack-action--2")
+    graph.add_node("attack-action--3", {"type": "attack-action"})
+    graph.add_node("attack-action--1", {"type": "attack-action"})
+    disconnected, dangling = graph.analyze(("attack-flow",), ("attack-action",))
+    assert disconnected == ["attack-action--3", "attack-action--1", "attack-action--2"]
+    assert dangling == ["attack-action--2"]
+
+
+def test_remove_extension_nodes():
+    graph = ReferenceGraph()
+    graph.add_node(EXTENSION, {"type": "extension-definition"})
+    graph.add_node(CREATOR, {"type": "identity"})
+    graph.add_node("identity--2", {"type": "identity"})
+    graph.add_node(FLOW, {"type": "attack-flow"})
+    graph.add_edge(EXTENSION, CREATOR)
+    graph.add_edge(CREATOR, CREATOR)
+    graph.add_edge(EXTENSION, "identity--2")
+    graph.add_edge("identity--2", FLOW)
+    graph.remove_extension_nodes()
+
+    assert EXTENSION not in graph
+    assert CREATOR not in graph
+    # This identity has another successor, so it stays.
+    assert "identity--2" in graph
+    assert len(graph) == 2
+    assert graph.analyze(("attack-flow",), ()) == ([], [])
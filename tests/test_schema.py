@@ -6,10 +6,14 @@ from tempfile import NamedTemporaryFile
 import pytest
 
 from attack_flow.schema import (
+    get_schema_fingerprint,
+    get_schema_store,
     get_validator_for_object,
     resolve_url_to_local,
     SCHEMA_DIR,
     validate_doc,
+    validate_json,
+    validate_stream,
     ValidationResult,
 )
 
@@ -92,6 +96,14 @@ def temporary_json_file(json_obj):
         yield Path(flow_file.name)
 
 
+def assert_stream_matches(flow_path, result):
+    """
+    Check that streaming validation gives the same messages as ``result``.
+    """
+    stream_result = validate_stream(flow_path)
+    assert [str(m) for m in stream_result.messages] == [str(m) for m in result.messages]
+
+
 @contextmanager
 def temporary_flow_file(flow_json):
     """
@@ -122,6 +134,41 @@ def test_validate_doc():
     assert len(result.messages) == 0
 
 
+def test_validate_stream():
+    example_path = SCHEMA_DIR / "attack-flow-example.json"
+    result = validate_doc(example_path, streaming=True)
+    assert result.success
+    assert len(result.messages) == 0
+
+
+def test_validate_stream_bundle_id():
+    """Bundle properties are checked before the bundle's objects."""
+    bundle = {
+        "type": "bundle",
+        "id": "bundle-1",
+        "objects": [EXTENSION_DEFINITION, EXTENSION_CREATOR],
+    }
+    with temporary_json_file(bundle) as path:
+        result = validate_doc(path)
+        assert_stream_matches(path, result)
+    assert str(result.messages[-1]) == (
+        "[error] Unable to parse this flow as STIX 2.1: "
+        "Invalid value for Bundle 'id': must start with 'bundle--'."
+    )
+
+
+def test_validate_json():
+    """Validating a decoded document gives the same result as validating the file."""
+    example_path = SCHEMA_DIR / "attack-flow-example.json"
+    with example_path.open() as example_file:
+        flow_json = json.load(example_file)
+    snapshot = json.dumps(flow_json, sort_keys=True)
+    result = validate_json(flow_json)
+    assert result.success
+    assert len(result.messages) == 0
+    assert json.dumps(flow_json, sort_keys=True) == snapshot
+
+
 def test_dangling_reference():
     flow_json = [
         {
@@ -146,6 +193,7 @@ def test_dangling_reference():
 
     with temporary_flow_file(flow_json) as flow_path:
         result = validate_doc(flow_path)
+        assert_stream_matches(flow_path, result)
         assert result.success
         assert len(result.messages) == 1
         assert (
@@ -208,6 +256,7 @@ def test_two_flow_objects():
 
     with temporary_flow_file(flow_json) as flow_path:
         result = validate_doc(flow_path)
+        assert_stream_matches(flow_path, result)
         assert not result.success
         assert len(result.messages) == 1
         assert (
@@ -226,6 +275,21 @@ def test_resolve_url_to_local():
         resolve_url_to_local("https://company.example/bogus/path.json")
 
 
+def test_resolve_url_to_local_is_cached():
+    url = "http://raw.githubusercontent.com/oasis-open/cti-stix2-json-schemas/stix2.1/schemas/common/core.json"
+    assert resolve_url_to_local(url) is resolve_url_to_local(url)
+
+
+def test_schema_store():
+    store = get_schema_store()
+    core_url = "http://raw.githubusercontent.com/oasis-open/cti-stix2-json-schemas/stix2.1/schemas/common/core.json"
+    assert store[core_url] is resolve_url_to_local(core_url)
+    assert (
+        "https://center-for-threat-informed-defense.github.io/attack-flow/schema/attack-flow-schema-2.0.0.json"
+        in store
+    )
+
+
 def test_top_level_bundle():
     """This test has an attack-flow object at the top level, which is not allowed."""
     json_obj = {
@@ -234,6 +298,7 @@ def test_top_level_bundle():
     }
     with temporary_json_file(json_obj) as path:
         result = validate_doc(path)
+        assert_stream_matches(path, result)
         assert not result.success
         assert len(result.messages) == 5
         assert (
@@ -313,6 +378,8 @@ def test_cannot_validate_unknown_type():
     with temporary_flow_file(flow_json) as flow_path:
         with pytest.raises(Exception):
             result = validate_doc(flow_path)
+        with pytest.raises(Exception):
+            validate_stream(flow_path)
 
 
 def test_invalid_ref():
@@ -340,6 +407,7 @@ def test_invalid_ref():
 
     with temporary_flow_file(flow_json) as flow_path:
         result = validate_doc(flow_path)
+        assert_stream_matches(flow_path, result)
         assert not result.success
         assert len(result.messages) == 2
         assert (
@@ -375,6 +443,7 @@ def test_missing_required_property():
 
     with temporary_flow_file(flow_json) as flow_path:
         result = validate_doc(flow_path)
+        assert_stream_matches(flow_path, result)
         assert not result.success
         assert len(result.messages) == 1
         assert (
@@ -416,6 +485,7 @@ def test_missing_af_extension():
 
     with temporary_flow_file(flow_json) as flow_path:
         result = validate_doc(flow_path)
+        assert_stream_matches(flow_path, result)
         assert not result.success
         assert len(result.messages) == 1
         assert (
@@ -475,6 +545,7 @@ def test_a_node_is_not_connected_to_the_main_graph():
 
     with temporary_flow_file(flow_json) as flow_path:
         result = validate_doc(flow_path)
+        assert_stream_matches(flow_path, result)
         assert result.success
         assert len(result.messages) == 1
         assert (
@@ -519,6 +590,7 @@ def test_best_practices():
 
     with temporary_flow_file(flow_json) as flow_path:
         result = validate_doc(flow_path)
+        assert_stream_matches(flow_path, result)
         assert result.success
         assert not result.strict_success
         assert len(result.messages) == 1
@@ -526,3 +598,21 @@ def test_best_practices():
             str(result.messages[0])
             == "[warning] The ``attack-flow`` object should have a description."
         )
+
+
+def test_validation_result_to_dict():
+    r = ValidationResult()
+    r.add_warning("My warning")
+    r.add_exc("My error", ValueError("my exc"))
+    data = json.loads(json.dumps(r.to_dict()))
+    r2 = ValidationResult.from_dict(data)
+    assert [str(m) for m in r2.messages] == ["[warning] My warning", "[error] My error"]
+    assert r2.messages[0].exc is None
+    assert str(r2.messages[1].exc) == "my exc"
+    assert r2.success == r.success
+
+
+def test_schema_fingerprint():
+    fingerprint = get_schema_fingerprint()
+    assert len(fingerprint) == 64
+    assert get_schema_fingerprint() == fingerprint
@@ -0,0 +1,117 @@
+import copy
+import json
+
+import jsonschema
+import pytest
+
+from attack_flow.schema import (
+    ATTACK_FLOW_SDOS,
+    SCHEMA_DIR,
+    get_validator_for_object,
+    validate_doc,
+)
+from attack_flow.schema_compiler import CompiledValidator, UnsupportedSchema
+
+from .test_schema import temporary_flow_file
+
+
+def _error_signature(error):
+    return (
+        str(error),
+        list(error.path),
+        list(error.schema_path),
+        error.validator,
+        error.instance,
+        [_error_signature(e) for e in error.context],
+    )
+
+
+def _example_objects():
+    with (SCHEMA_DIR / "attack-flow-example.json").open() as example_file:
+        example_json = json.load(example_file)
+    # One object of each Attack Flow type.
+    objects = {o["type"]: o for o in example_json["objects"]}
+    return [objects[t] for t in ATTACK_FLOW_SDOS]
+
+
+def _mutations(obj):
+    yield obj
+    for key in obj:
+        mutated = copy.deepcopy(obj)
+        del mutated[key]
+        yield mutated
+        for value in (None, "x", ["x"]):
+            mutated = copy.deepcopy(obj)
+            mutated[key] = value
+            yield mutated
+    mutated = copy.deepcopy(obj)
+    mutated["x_unknown"] = "foo"
+    yield mutated
+
+
+def test_compiled_matches_generic():
+    generic = get_validator_for_object("attack-action")
+    compiled = get_validator_for_object("attack-action", compiled=True)
+    assert isinstance(compiled, CompiledValidator)
+
+    for obj in _example_objects():
+        for instance in _mutations(obj):
+            expected = [_error_signature(e) for e in generic.iter_errors(instance)]
+            actual = [_error_signature(e) for e in compiled.iter_errors(instance)]
+            assert actual == expected
+            assert compiled.is_valid(instance) == (not expected)
+
+
+def test_compiled_validator_is_shared():
+    validators = {get_validator_for_object(t, compiled=True) for t in ATTACK_FLOW_SDOS}
+    assert len(validators) == 1
+
+
+def test_compiled_not_used_for_stix_types():
+    validator = get_validator_for_object("identity", compiled=True)
+    assert isinstance(validator, jsonschema.Draft202012Validator)
+
+
+def test_unsupported_keyword():
+    resolver = jsonschema.validators.RefResolver(base_uri="", referrer=True)
+    with pytest.raises(UnsupportedSchema):
+        CompiledValidator({"prefixItems": [{"type": "string"}]}, resolver)
+
+
+def test_validate_doc_compiled_comment_message():
+    flow_json = [
+        {
+            "type": "attack-flow",
+            "spec_version": "2.1",
+            "id": "attack-flow--e9ec3a4b-f787-4e81-a3d9-4cfe017ebc2f",
+            "created": "2022-08-02T19:34:35.143Z",
+            "modified": "2022-08-02T19:34:35.143Z",
+            "name": "Example Flow",
+            "description": "My flow description.",
+            "scope": "incident",
+            "start_refs": ["attack-action--168a4027-1572-492b-a80b-8eb01954afb3"],
+            "extensions": {
+                "extension-definition--fb9c968a-745b-4ade-9b25-c324172197f4": {
+                    "extension_type": "new-sdo"
+                }
+            },
+        },
+        {
+            "type": "attack-action",
+            "spec_version": "2.1",
+            "id": "attack-action--168a4027-1572-492b-a80b-8eb01954afb3",
+            "created": "2022-08-02T19:34:35.143Z",
+            "modified": "2022-08-02T19:34:35.143Z",
+            "name": "My Action",
+        },
+    ]
+
+    with temporary_flow_file(flow_json) as flow_path:
+        expected = [str(m) for m in validate_doc(flow_path).messages]
+        actual = [str(m) for m in validate_doc(flow_path, compiled=True).messages]
+    assert actual == expected
+    assert actual == [
+        "[error] Object id=attack-action--168a4027-1572-492b-a80b-8eb01954afb3: "
+        "Attack Flow SDOs must reference the extension definition. "
+        "(Detail: 'extensions' is a required property)"
+    ]
@@ -0,0 +1,240 @@
+import http.client
+import json
+import os
+from pathlib import Path
+import signal
+import socket
+import threading
+
+import pytest
+
+from attack_flow.schema import SCHEMA_DIR
+import attack_flow.server
+
+EXAMPLE_FLOW = SCHEMA_DIR / "attack-flow-example.json"
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path):
+        super().__init__("localhost")
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+@pytest.fixture(scope="module")
+def service():
+    matrix_svg = Path("tests/fixtures/matrix-base.svg").read_text()
+    service = attack_flow.server.AttackFlowService(
+        workers=1, matrix_svg=matrix_svg, max_pending=8
+    )
+    service.start()
+    yield service
+    service.close()
+
+
+def start_server(service, **kwargs):
+    server = attack_flow.server.make_server(service, **kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+@pytest.fixture
+def connection(service):
+    server = start_server(service)
+    host, port = server.server_address[:2]
+    connection = http.client.HTTPConnection(host, port)
+    yield connection
+    connection.close()
+    server.shutdown()
+    server.server_close()
+
+
+def request(connection, method, path, body=None):
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body)
+    connection.request(method, path, body)
+    response = connection.getresponse()
+    return response, response.read().decode("utf8")
+
+
+def test_validate(connection):
+    flow_json = json.loads(EXAMPLE_FLOW.read_text())
+    response, body = request(connection, "POST", "/validate", flow_json)
+    assert response.status == 200
+    assert response.getheader("Content-Type") == "application/json"
+    assert response.getheader("Server-Timing").startswith("total;dur=")
+    assert json.loads(body) == {"success": True, "messages": []}
+
+    # The connection is kept open between requests.
+    del flow_json["objects"][3]["name"]
+    response, body = request(connection, "POST", "/validate", flow_json)
+    assert response.status == 200
+    result = json.loads(body)
+    assert result["success"] is False
+    assert result["messages"][0]["type"] == "error"
+
+
+def test_convert(connection):
+    flow_text = EXAMPLE_FLOW.read_text()
+    response, body = request(connection, "POST", "/graphviz", flow_text)
+    assert response.status == 200
+    assert body.startswith("digraph {")
+
+    response, body = request(connection, "POST", "/mermaid", flow_text)
+    assert response.status == 200
+    assert body.startswith("graph TB")
+
+
+def test_matrix(connection):
+    flow_text = Path("tests/fixtures/matrix-flow.json").read_text()
+    response, body = request(connection, "POST", "/matrix", flow_text)
+    assert response.status == 200
+    assert response.getheader("Content-Type") == "image/svg+xml"
+    assert "attack-flow-overlay" in body
+
+
+def test_batch(connection):
+    flow_json = json.loads(EXAMPLE_FLOW.read_text())
+    batch = {
+        "requests": [
+            {"command": "validate", "flow": flow_json},
+            {"command": "mermaid", "flow": flow_json},
+            {"command": "graphviz", "flow": {"type": "bundle"}},
+        ]
+    }
+    response, body = request(connection, "POST", "/batch", batch)
+    assert response.status == 200
+    results = json.loads(body)["responses"]
+    assert [r["command"] for r in results] == ["validate", "mermaid", "graphviz"]
+    assert json.loads(results[0]["body"])["success"] is True
+    assert results[1]["status"] == 200
+    assert results[1]["body"].startswith("graph TB")
+    assert results[2]["status"] == 422
+    assert "error" in results[2]
+
+
+def test_errors(connection):
+    response, body = request(connection, "POST", "/validate", "not json")
+    assert response.status == 400
+    assert json.loads(body)["error"].startswith("invalid JSON")
+
+    response, body = request(connection, "POST", "/frobnicate", "{}")
+    assert response.status == 404
+
+    response, body = request(connection, "POST", "/batch", {"requests": [{}]})
+    assert response.status == 400
+
+    response, body = request(connection, "GET", "/nope")
+    assert response.status == 404
+
+    connection.putrequest("POST", "/validate")
+    connection.putheader("Content-Length", "many")
+    connection.endheaders()
+    response = connection.getresponse()
+    assert response.status == 400
+    assert json.loads(response.read())["error"] == "invalid Content-Length"
+
+    # A body that is too large is rejected without being read.
+    connection.putrequest("POST", "/validate")
+    connection.putheader("Content-Length", str(1 << 40))
+    connection.endheaders()
+    response = connection.getresponse()
+    assert response.status == 413
+    assert response.getheader("Connection") == "close"
+    assert "larger than" in json.loads(response.read())["error"]
+
+
+def test_health_and_metrics(connection):
+    response, body = request(connection, "GET", "/health")
+    assert response.status == 200
+    assert json.loads(body) == {"status": "ok"}
+
+    request(connection, "POST", "/validate", EXAMPLE_FLOW.read_text())
+    response, body = request(connection, "GET", "/metrics")
+    assert response.status == 200
+    metrics = json.loads(body)["validate"]
+    assert metrics["count"] >= 1
+    assert 0 < metrics["p50_ms"] <= metrics["max_ms"]
+
+
+def test_unix_socket(service, tmp_path):
+    socket_path = str(tmp_path / "af.sock")
+    server = start_server(service, socket_path=socket_path)
+    connection = UnixHTTPConnection(socket_path)
+    try:
+        response, body = request(
+            connection, "POST", "/validate", EXAMPLE_FLOW.read_text()
+        )
+        assert response.status == 200
+        assert json.loads(body)["success"] is True
+    finally:
+        connection.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_busy():
+    """Requests beyond the limit on pending requests are rejected."""
+    service = attack_flow.server.AttackFlowService(workers=1, max_pending=2)
+    try:
+        flow_json = json.loads(EXAMPLE_FLOW.read_text())
+        batch = json.dumps(
+            {"requests": [{"command": "validate", "flow": flow_json}] * 2}
+        )
+        # Another client holds one of the two reservations.
+        service._pending.acquire()
+        with pytest.raises(attack_flow.server.RequestError) as exc_info:
+            service.handle("batch", batch.encode("utf8"))
+        assert exc_info.value.status == 503
+        service._pending.release()
+        # The reservation was released, so the batch now succeeds.
+        service.handle("batch", batch.encode("utf8"))
+
+        # A batch that can never be accepted is rejected as too large.
+        batch = json.dumps(
+            {"requests": [{"command": "validate", "flow": flow_json}] * 3}
+        )
+        with pytest.raises(attack_flow.server.RequestError) as exc_info:
+            service.handle("batch", batch.encode("utf8"))
+        assert exc_info.value.status == 413
+        assert "at most 2" in str(exc_info.value)
+    finally:
+        service.close()
+
+
+def test_worker_dies():
+    """The pool is replaced when a worker process dies."""
+    service = attack_flow.server.AttackFlowService(workers=1)
+    try:
+        service.start()
+        pid = service._executor.submit(os.getpid).result()
+        os.kill(pid, signal.SIGKILL)
+        body = EXAMPLE_FLOW.read_bytes()
+        try:
+            service.handle("validate", body)
+        except attack_flow.server.RequestError as e:
+            # The request was sent to the broken pool before the death was noticed.
+            assert e.status == 503
+        content_type, response = service.handle("validate", body)
+        assert json.loads(response)["success"] is True
+        assert service._executor.submit(os.getpid).result() != pid
+    finally:
+        service.close()
+
+
+def test_latency_metrics():
+    metrics = attack_flow.server.LatencyMetrics(window=4)
+    for ms in (1, 2, 3, 4, 100):
+        metrics.record("validate", ms / 1000)
+    metrics.record("validate", 0.005, ok=False)
+    snapshot = metrics.snapshot()["validate"]
+    assert snapshot["count"] == 6
+    assert snapshot["errors"] == 1
+    assert snapshot["max_ms"] == pytest.approx(100)
+    # Only the last four requests are used for percentiles.
+    assert snapshot["p50_ms"] == pytest.approx(4)
+    assert snapshot["p99_ms"] == pytest.approx(100)
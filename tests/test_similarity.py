@@ -0,0 +1,165 @@
+import copy
+import os
+from pathlib import Path
+import runpy
+import shutil
+import sys
+from unittest.mock import patch
+
+import pytest
+
+import attack_flow.model
+from attack_flow.similarity import SimilarityIndex, flow_shingles
+from .fixtures import get_flow_bundle, get_tree_bundle
+
+CORPUS_PATHS = [
+    Path("corpus/Black Basta Ransomware.afb"),
+    Path("corpus/Marriott Breach.afb"),
+    Path("corpus/WhisperGate.afb"),
+]
+
+
+def _flow_json(techniques, edges):
+    """A flow with one action for each technique, and effect edges between them."""
+    objects = [
+        {"type": "attack-action", "id": f"attack-action--{i}", "technique_id": tid}
+        for i, tid in enumerate(techniques)
+    ]
+    for source, target in edges:
+        objects[source].setdefault("effect_refs", []).append(objects[target]["id"])
+    return {"type": "bundle", "objects": objects}
+
+
+def _chain(techniques):
+    return _flow_json(techniques, [(i, i + 1) for i in range(len(techniques) - 1)])
+
+
+def _techniques(count, prefix="T1"):
+    return [f"{prefix}{i:03}" for i in range(count)]
+
+
+def test_flow_shingles():
+    assert flow_shingles(get_flow_bundle()) == {
+        "T1",
+        "T3",
+        "T4",
+        "T1>T3",
+        "T1>T4",
+    }
+    assert flow_shingles(get_tree_bundle()) == {"T3", "T3>T3"}
+    chain = _chain(["T1", "T2", "T3", "T4"])
+    assert "T1>T2>T3" in flow_shingles(chain)
+    assert "T1>T2>T3>T4" not in flow_shingles(chain)
+    assert "T1>T2>T3>T4" in flow_shingles(chain, ngram=4)
+    assert flow_shingles({"type": "bundle", "objects": []}) == set()
+
+
+def test_signature_estimates_jaccard():
+    index = SimilarityIndex(num_perm=256, bands=64)
+    a = set(_techniques(100))
+    b = set(_techniques(60)) | set(_techniques(40, "T2"))
+    estimate = index._estimate(index.signature_of(a), index.signature_of(b))
+    assert estimate == pytest.approx(60 / 140, abs=0.1)
+    assert index.signature_of(a) == index.signature_of(sorted(a))
+    assert len(index.signature_of(a)) == 256
+
+
+def test_query():
+    index = SimilarityIndex()
+    base = _techniques(30)
+    index.add_flow("same", _chain(base))
+    index.add_flow("close", _chain(base[:27] + ["T9001", "T9002", "T9003"]))
+    index.add_flow("other", _chain(_techniques(30, "T5")))
+    index.add_flow("empty", {"type": "bundle", "objects": []})
+    assert len(index) == 4
+
+    results = index.query(_chain(base))
+    assert [name for name, _ in results] == ["same", "close"]
+    assert results[0][1] == 1.0
+    assert 0.5 < results[1][1] < 1.0
+    assert index.query(_chain(base), k=1) == results[:1]
+    assert index.similar_flows("same") == results[1:]
+    assert index.similar_flows("empty") == []
+
+    index.remove_flow("same")
+    assert [name for name, _ in index.query(_chain(base))] == ["close"]
+    with pytest.raises(KeyError):
+        index.remove_flow("same")
+
+    # Replacing a flow files it under its new bands.
+    index.add_flow("close", _chain(_techniques(30, "T5")))
+    assert index.query(_chain(base)) == []
+    assert [name for name, _ in index.similar_flows("other")] == ["close"]
+
+
+def test_finds_edited_corpus_flow():
+    index = SimilarityIndex()
+    for path in CORPUS_PATHS:
+        index.add_file(path)
+    bundle = attack_flow.model.load_attack_flow_bundle(CORPUS_PATHS[0])
+    objects = [copy.deepcopy(dict(obj)) for obj in bundle.objects]
+    actions = [obj for obj in objects if obj.get("technique_id")]
+    actions[0]["technique_id"] = "T9999"
+    results = index.query({"type": "bundle", "objects": objects}, k=1)
+    assert [name for name, _ in results] == [os.path.abspath(CORPUS_PATHS[0])]
+
+
+def test_save_and_load(tmp_path):
+    index = SimilarityIndex(num_perm=64, bands=16, seed=7)
+    index.add_flow("flow", get_flow_bundle())
+    index.add_flow("tree", get_tree_bundle())
+    index_path = tmp_path / "index.pickle"
+    index.save(index_path)
+
+    loaded = SimilarityIndex.load(index_path)
+    assert (loaded.num_perm, loaded.bands, loaded.seed) == (64, 16, 7)
+    assert list(loaded) == ["flow", "tree"]
+    assert loaded.query(get_flow_bundle()) == index.query(get_flow_bundle())
+    assert loaded.signature(get_tree_bundle()) == index.signature(get_tree_bundle())
+
+    index_path.write_bytes(b"\x80\x04N.")
+    with pytest.raises(ValueError):
+        SimilarityIndex.load(index_path)
+
+
+def test_invalid_parameters():
+    with pytest.raises(ValueError):
+        SimilarityIndex(num_perm=100, bands=32)
+    signature = SimilarityIndex(num_perm=64).signature_of(["T1"])
+    with pytest.raises(ValueError):
+        SimilarityIndex().add_signature("flow", signature)
+
+
+def test_sync_files(tmp_path):
+    paths = list()
+    for path in CORPUS_PATHS:
+        paths.append(tmp_path / path.name)
+        shutil.copy(path, paths[-1])
+
+    index = SimilarityIndex()
+    index.add_flow("fixture", get_flow_bundle())
+    assert index.sync_files(paths) == ([str(path) for path in paths], [])
+    assert index.sync_files(paths) == ([], [])
+    assert index.sync_files(paths[1:]) == ([], [str(paths[0])])
+    assert "fixture" in index
+    assert len(index) == 3
+
+
+@patch("sys.exit")
+def test_cli_similar(exit_mock, tmp_path, capsys):
+    index_path = tmp_path / "index.pickle"
+    sys.argv = ["af", "similar", str(index_path)] + [str(p) for p in CORPUS_PATHS]
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    exit_mock.assert_called_with(0)
+    assert capsys.readouterr().out == "3 flows (3 added, 0 removed)\n"
+
+    sys.argv = ["af", "similar", str(index_path), "--query", str(CORPUS_PATHS[1])]
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    exit_mock.assert_called_with(0)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == f"1.000 {os.path.abspath(CORPUS_PATHS[1])}"
+
+    index_path.write_bytes(b"\x80\x04N.")
+    runpy.run_module("attack_flow.cli", run_name="__main__")
+    exit_mock.assert_called_with(1)
+    assert "Not a similarity index" in capsys.readouterr().err
@@ -0,0 +1,94 @@
+import os
+import shutil
+import stat
+
+import pytest
+
+from attack_flow.schema import SCHEMA_DIR
+import attack_flow.storage
+
+
+def test_write_atomic(tmp_path):
+    path = tmp_path / "file.txt"
+    attack_flow.storage.write_atomic(path, lambda f: f.write(b"one"))
+    assert path.read_bytes() == b"one"
+
+    attack_flow.storage.write_atomic(path, lambda f: f.write(b"two"), mode=0o640)
+    assert path.read_bytes() == b"two"
+    assert stat.S_IMODE(path.stat().st_mode) == 0o640
+
+
+def test_write_atomic_failure(tmp_path):
+    """A failed write leaves the old file and no temporary file."""
+    path = tmp_path / "file.txt"
+    path.write_bytes(b"old")
+
+    def write(f):
+        f.write(b"new")
+        raise RuntimeError("interrupted")
+
+    with pytest.raises(RuntimeError):
+        attack_flow.storage.write_atomic(path, write)
+    assert path.read_bytes() == b"old"
+    assert os.listdir(tmp_path) == ["file.txt"]
+
+
+def test_save_and_load_state(tmp_path):
+    path = tmp_path / "state.pickle"
+    attack_flow.storage.save_state(path, {"format": 1, "values": [1, 2]})
+    assert attack_flow.storage.load_state(path, 1, "test") == {
+        "format": 1,
+        "values": [1, 2],
+    }
+    with pytest.raises(ValueError, match="Not a test in format 2"):
+        attack_flow.storage.load_state(path, 2, "test")
+
+
+class _Flows(attack_flow.storage.FileFlows):
+    def __init__(self):
+        self.sources = dict()
+
+    def add_flow(self, flow_name, flow_bundle, source=None):
+        self.sources[flow_name] = source
+
+    def remove_flow(self, flow_name):
+        del self.sources[flow_name]
+
+    def get_sources(self):
+        return dict(self.sources)
+
+
+def test_sync_files(tmp_path):
+    paths = [tmp_path / "a.json", tmp_path / "b.json"]
+    for path in paths:
+        shutil.copy(SCHEMA_DIR / "attack-flow-example.json", path)
+    names = [os.path.abspath(path) for path in paths]
+    flows = _Flows()
+    flows.add_flow("not a file", None)
+
+    assert flows.sync_files(paths) == (names, [])
+    assert flows.sync_files(paths) == ([], [])
+
+    with paths[0].open("a") as f:
+        f.write("\n")
+    assert flows.sync_files(paths[:1]) == (names[:1], names[1:])
+    assert sorted(flows.sources) == sorted(["not a file", names[0]])
+
+
+def test_update_and_remove_files(tmp_path):
+    paths = [tmp_path / "a.json", tmp_path / "b.json"]
+    for path in paths:
+        shutil.copy(SCHEMA_DIR / "attack-flow-example.json", path)
+    names = [os.path.abspath(path) for path in paths]
+    flows = _Flows()
+    flows.add_flow("not a file", None)
+
+    assert flows.update_files(paths[:1]) == names[:1]
+    assert flows.update_files(paths[1:]) == names[1:]
+    assert flows.update_files(paths) == []
+
+    paths[0].unlink()
+    assert flows.remove_files(paths[:1]) == names[:1]
+    assert flows.remove_files(paths[:1]) == []
+    assert flows.remove_files([tmp_path / "c.json"]) == []
+    assert sorted(flows.sources) == sorted(["not a file", names[1]])